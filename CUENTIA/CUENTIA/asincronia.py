@@ -0,0 +1,38 @@
+"""Código bloqueante (ORM, PIL, descargas) desde vistas y workers async.
+
+Las llamadas async del ORM de Django (aget, afirst...) y sync_to_async por
+defecto van todas al mismo hilo (thread_sensitive): es seguro, pero con miles
+de corrutinas esperando ese hilo se convierte en la cola. en_hilo() las lleva
+a un pool propio de ASYNC_DB_THREADS hilos: nunca hay más conexiones a la base
+de datos por proceso que hilos en el pool, haya las corrutinas que haya.
+
+Con ASYNC_DB_THREADS = 0 se usa el hilo de Django; así lo hacen las pruebas,
+que necesitan ver los datos dentro de la transacción de cada test.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+_bloqueo = threading.Lock()
+_pool = None
+
+
+def _hilos():
+    return getattr(settings, 'ASYNC_DB_THREADS', 8)
+
+
+def pool():
+    global _pool
+    with _bloqueo:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=_hilos(), thread_name_prefix='cuentia-async')
+        return _pool
+
+
+def en_hilo(funcion):
+    """Versión async de `funcion` que se ejecuta en el pool acotado"""
+    if not _hilos():
+        return sync_to_async(funcion)
+    return sync_to_async(funcion, thread_sensitive=False, executor=pool())
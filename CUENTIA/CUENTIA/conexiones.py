@@ -0,0 +1,164 @@
+"""Clientes HTTP salientes compartidos por el proceso.
+
+Cada destino tiene un httpx.Client con su pool de conexiones (HTTP_CLIENTS):
+
+- "openai": el transporte de OpenAIService. Las llamadas en vuelo están
+  limitadas por el planificador (OPENAI_MAX_IN_FLIGHT), así que se mantienen
+  vivas tantas conexiones como llamadas simultáneas puede haber y ninguna
+  llamada paga un handshake TLS nuevo.
+- "descargas": ilustraciones de DALL-E (stories/images.py), como mucho una
+  por hilo de worker.
+
+HTTP/2 es opcional (requiere el paquete h2, `pip install httpx[http2]`); si
+se pide sin tenerlo instalado se sigue con HTTP/1.1 y keep-alive.
+
+Los clientes se crean al primer uso y son por proceso: un worker hijo de
+run_generation_workers nunca hereda los sockets del padre. Los async
+(httpx.AsyncClient, para AsyncOpenAIService) son además por bucle de eventos,
+porque sus conexiones solo valen en el bucle que las abrió. Cada petición se
+cuenta en métricas ("http.<cliente>.peticiones") junto con las conexiones TCP
+y los handshakes TLS que ha abierto, de donde sale la tasa de reutilización
+que muestra la vista `metrics`.
+"""
+import asyncio
+import logging
+import os
+import threading
+import weakref
+
+import httpx
+from django.conf import settings
+
+from CUENTIA import metrics
+
+try:
+    import h2
+except ImportError:
+    h2 = None
+
+logger = logging.getLogger(__name__)
+
+DEFECTOS = {
+    'max_connections': 20,
+    'max_keepalive_connections': 10,
+    'keepalive_expiry': 30,
+    'http2': False,
+    'connect': 5,
+    'read': 60,
+}
+
+_bloqueo = threading.Lock()
+_clientes = {}
+# {bucle de eventos: {nombre: httpx.AsyncClient}}; desaparecen con su bucle
+_clientes_async = weakref.WeakKeyDictionary()
+
+
+def configuracion(nombre):
+    return {**DEFECTOS, **getattr(settings, 'HTTP_CLIENTS', {}).get(nombre, {})}
+
+
+def timeout(nombre, lectura=None):
+    """Timeout de una operación del cliente `nombre`: conexión del cliente y lectura propia"""
+    config = configuracion(nombre)
+    return httpx.Timeout(lectura if lectura is not None else config['read'], connect=config['connect'])
+
+
+def _registrar_evento(nombre, evento):
+    if evento == 'connection.connect_tcp.complete':
+        metrics.incrementar(f'http.{nombre}.conexiones')
+    elif evento == 'connection.start_tls.complete':
+        metrics.incrementar(f'http.{nombre}.tls')
+
+
+def _contar(nombre):
+    """Hook de petición: instala el trace de httpcore que cuenta conexiones y handshakes"""
+    def trace(evento, info):
+        _registrar_evento(nombre, evento)
+
+    def al_pedir(request):
+        metrics.incrementar(f'http.{nombre}.peticiones')
+        request.extensions['trace'] = trace
+
+    return al_pedir
+
+
+def _contar_async(nombre):
+    """Lo mismo para httpx.AsyncClient, que exige hook y trace async"""
+    async def trace(evento, info):
+        _registrar_evento(nombre, evento)
+
+    async def al_pedir(request):
+        metrics.incrementar(f'http.{nombre}.peticiones')
+        request.extensions['trace'] = trace
+
+    return al_pedir
+
+
+def _opciones(nombre):
+    config = configuracion(nombre)
+    http2 = bool(config['http2'])
+    if http2 and h2 is None:
+        logger.warning(f"HTTP/2 pedido para '{nombre}' pero falta el paquete h2: se usa HTTP/1.1")
+        http2 = False
+    return dict(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=config['max_connections'],
+            max_keepalive_connections=config['max_keepalive_connections'],
+            keepalive_expiry=config['keepalive_expiry'],
+        ),
+        timeout=timeout(nombre),
+        follow_redirects=True,
+    )
+
+
+def crear_cliente(nombre, **opciones):
+    """httpx.Client nuevo con la configuración de `nombre`; `opciones` se pasan a httpx (p. ej. verify)"""
+    return httpx.Client(event_hooks={'request': [_contar(nombre)]}, **_opciones(nombre), **opciones)
+
+
+def crear_cliente_async(nombre, **opciones):
+    return httpx.AsyncClient(event_hooks={'request': [_contar_async(nombre)]}, **_opciones(nombre), **opciones)
+
+
+def cliente(nombre):
+    """Cliente compartido de `nombre` para este proceso"""
+    clave = (nombre, os.getpid())
+    with _bloqueo:
+        if clave not in _clientes:
+            _clientes[clave] = crear_cliente(nombre)
+        return _clientes[clave]
+
+
+def cliente_async(nombre):
+    """Cliente async compartido de `nombre` para el bucle de eventos en curso"""
+    bucle = asyncio.get_running_loop()
+    with _bloqueo:
+        clientes = _clientes_async.setdefault(bucle, {})
+        if nombre not in clientes:
+            clientes[nombre] = crear_cliente_async(nombre)
+        return clientes[nombre]
+
+
+def cerrar():
+    """Cierra los clientes del proceso (pruebas y apagado); se recrean al volver a pedirlos"""
+    with _bloqueo:
+        clientes = [c for (_, pid), c in _clientes.items() if pid == os.getpid()]
+        _clientes.clear()
+    for abierto in clientes:
+        abierto.close()
+
+
+def reutilizacion():
+    """{cliente: {peticiones, conexiones, tls, ratio}} con ratio = peticiones sin conexión nueva"""
+    datos = {}
+    for clave, total in metrics.instantanea('http.').items():
+        _, nombre, tipo = clave.rsplit('.', 2)
+        datos.setdefault(nombre, {'peticiones': 0, 'conexiones': 0, 'tls': 0})[tipo] = total
+    for valores in datos.values():
+        peticiones = valores['peticiones']
+        valores['ratio'] = round(1 - valores['conexiones'] / peticiones, 4) if peticiones else None
+    return datos
+
+
+metrics.registrar_indicador('http', reutilizacion)
@@ -0,0 +1,82 @@
+"""Contadores de instrumentación del proceso.
+
+Cada worker lleva sus propios contadores en memoria (sin E/S en el camino de
+la petición); la vista `metrics` los muestra para el proceso que la atiende.
+Los nombres van con puntos, de lo general a lo concreto:
+"cache.ajax.aciertos", "cache.facetas.fallos"...
+
+Además de contadores, un módulo puede registrar un indicador: una función sin
+argumentos que devuelve su estado actual (p. ej. el circuito de OpenAI) y que
+se evalúa al pedir el resumen.
+"""
+import os
+import threading
+import time
+from collections import Counter
+
+_contadores = Counter()
+_indicadores = {}
+_bloqueo = threading.Lock()
+_inicio = time.time()
+
+
+def incrementar(nombre, cantidad=1):
+    with _bloqueo:
+        _contadores[nombre] += cantidad
+
+
+def valor(nombre):
+    with _bloqueo:
+        return _contadores[nombre]
+
+
+def instantanea(prefijo=''):
+    """Copia de los contadores cuyo nombre empieza por `prefijo`"""
+    with _bloqueo:
+        return {nombre: total for nombre, total in _contadores.items() if nombre.startswith(prefijo)}
+
+
+def registrar_indicador(nombre, funcion):
+    with _bloqueo:
+        _indicadores[nombre] = funcion
+
+
+def indicadores():
+    with _bloqueo:
+        funciones = dict(_indicadores)
+    estado = {}
+    for nombre, funcion in funciones.items():
+        try:
+            estado[nombre] = funcion()
+        except Exception as e:
+            estado[nombre] = {'error': str(e)}
+    return estado
+
+
+def reiniciar():
+    with _bloqueo:
+        _contadores.clear()
+
+
+def aciertos_cache():
+    """{espacio: {aciertos, fallos, agrupadas, ratio}} a partir de los contadores "cache.*" """
+    espacios = {}
+    for nombre, total in instantanea('cache.').items():
+        _, espacio, tipo = nombre.split('.', 2)
+        espacios.setdefault(espacio, {'aciertos': 0, 'fallos': 0, 'agrupadas': 0})[tipo] = total
+    for datos in espacios.values():
+        # Las peticiones agrupadas en un cálculo ajeno no tocan la base de datos: cuentan como acierto
+        servidas = datos['aciertos'] + datos['agrupadas']
+        total = servidas + datos['fallos']
+        datos['ratio'] = round(servidas / total, 4) if total else None
+    return espacios
+
+
+def resumen():
+    return {
+        'pid': os.getpid(),
+        'segundos_activo': round(time.time() - _inicio),
+        'cache': aciertos_cache(),
+        'indicadores': indicadores(),
+        'contadores': instantanea(),
+    }
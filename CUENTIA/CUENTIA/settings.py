@@ -76,6 +76,9 @@ if os.getenv('USE_SQLITE', 'False') == 'True':
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {
+                'timeout': 20,
+            },
         }
     }
 #---- CONFIGURACION DESACTIVADA DE LA BASE DE DATOS EN POSTGRESQL PARA PRODUCCION ----#
@@ -131,6 +134,148 @@ LOGIN_URL = '/user/login/'
 LOGIN_REDIRECT_URL = '/dashboard/'
 LOGOUT_REDIRECT_URL = '/'
 
+# ===== COLA DE GENERACIÓN DE CUENTOS =====
+# Los cuentos se generan en `python manage.py run_generation_workers`
+GENERATION_WORKERS = int(os.getenv('GENERATION_WORKERS', '4'))
+GENERATION_LEASE_SECONDS = 300
+GENERATION_HEARTBEAT_SECONDS = 60  # el worker renueva el lease mientras procesa; muy por debajo del lease
+GENERATION_MAX_ATTEMPTS = 3
+GENERATION_RETRY_DELAY = 5
+GENERATION_POLL_INTERVAL = 1.0
+GENERATION_MAX_PENDING = 200
+GENERATION_MAX_PENDING_PER_USER = 3
+GENERATION_ASYNC_TASKS = 500  # trabajos en vuelo por proceso con run_generation_workers --async-tareas
+
+# Hilos por proceso para el ORM y lo bloqueante desde vistas y workers async (CUENTIA/asincronia.py)
+ASYNC_DB_THREADS = int(os.getenv('ASYNC_DB_THREADS', '8'))
+
+# Presupuestos de OpenAI para toda la aplicación (stories/scheduler.py)
+OPENAI_REQUESTS_PER_MINUTE = int(os.getenv('OPENAI_REQUESTS_PER_MINUTE', '500'))
+OPENAI_TOKENS_PER_MINUTE = int(os.getenv('OPENAI_TOKENS_PER_MINUTE', '30000'))
+OPENAI_IMAGES_PER_MINUTE = int(os.getenv('OPENAI_IMAGES_PER_MINUTE', '5'))
+OPENAI_MAX_IN_FLIGHT = 8
+OPENAI_MAX_QUEUE = 50  # por clase de prioridad y tipo de llamada
+OPENAI_MAX_WAIT_INTERACTIVE = 60
+OPENAI_MAX_WAIT_BACKGROUND = 120
+
+# Timeouts, reintentos y circuito de las llamadas a OpenAI (stories/resilience.py)
+OPENAI_TIMEOUTS = {
+    'texto': {'connect': 5, 'read': 90},  # en streaming, silencio máximo entre fragmentos
+    'imagen': {'connect': 5, 'read': 120},
+}
+OPENAI_MAX_RETRIES = 2
+OPENAI_RETRY_BASE_DELAY = 0.5
+OPENAI_RETRY_MAX_DELAY = 8  # un Retry-After mayor no se espera: el trabajo vuelve a la cola
+OPENAI_BREAKER_FAILURES = 5
+OPENAI_BREAKER_RESET_SECONDS = 30
+
+# Caché de cuentos por contenido (stories/result_cache.py). En modo determinista (temperatura 0 y seed)
+# los cuentos iguales salen de la caché sin llamar a OpenAI; en cualquier modo sustituyen a la plantilla de respaldo
+STORY_RESULT_CACHE = os.getenv('STORY_RESULT_CACHE', 'True') == 'True'
+STORY_RESULT_CACHE_TTL = 7 * 24 * 3600
+OPENAI_DETERMINISTIC = os.getenv('OPENAI_DETERMINISTIC', 'False') == 'True'
+OPENAI_PRICE_PER_1K_TOKENS = 0.01  # USD aproximados de gpt-4o, para estimar el gasto ahorrado
+
+# Ilustraciones: se descargan una vez y se guardan en MEDIA_ROOT con sus variantes
+STORY_IMAGE_DOWNLOAD_TIMEOUT = 30
+STORY_IMAGE_MAX_BYTES = 20 * 1024 * 1024
+
+# Pools de conexiones salientes por proceso (CUENTIA/conexiones.py), a la medida de la concurrencia:
+# tantas conexiones vivas como llamadas a OpenAI en vuelo y como hilos de worker descargando
+HTTP_CLIENTS = {
+    'openai': {
+        'max_connections': OPENAI_MAX_IN_FLIGHT * 2,
+        'max_keepalive_connections': OPENAI_MAX_IN_FLIGHT,
+        'keepalive_expiry': 60,
+        'http2': os.getenv('OPENAI_HTTP2', 'False') == 'True',  # requiere httpx[http2]
+        'connect': 5,
+        'read': 120,
+    },
+    'descargas': {
+        'max_connections': GENERATION_WORKERS * 2,
+        'max_keepalive_connections': GENERATION_WORKERS,
+        'keepalive_expiry': 30,
+        'connect': 5,
+        'read': STORY_IMAGE_DOWNLOAD_TIMEOUT,
+    },
+}
+
+# Caché de PDFs de cuentos (LRU por tamaño total)
+STORY_PDF_CACHE_DIR = os.path.join(MEDIA_ROOT, 'pdf_cache')
+STORY_PDF_CACHE_MAX_BYTES = 500 * 1024 * 1024
+STORY_PDF_CACHE_RESCAN_WRITES = 100  # escrituras entre recorridos del directorio (ver stories/pdf_cache.py)
+
+# Renderizado de PDFs en procesos aparte (0 = en el hilo de la petición)
+PDF_RENDER_PROCESSES = int(os.getenv('PDF_RENDER_PROCESSES', '2'))
+PDF_RENDER_MAX_QUEUE = 8  # PDFs en vuelo por proceso web antes de responder 503
+PDF_RENDER_TIMEOUT = 30
+PDF_RENDER_RETRY_AFTER = 2
+
+# Texto en streaming y eventos SSE de progreso
+OPENAI_STREAMING = True
+STORY_STREAM_MAX_SECONDS = 120
+
+# Notificaciones de estado (long-poll /status/ y SSE /stream/)
+STORY_LONGPOLL_TIMEOUT = 25
+STORY_LONGPOLL_MAX_WAITERS = 200
+STORY_LONGPOLL_MAX_ASYNC_WAITERS = 10000  # vistas async (ASGI): una espera es una corrutina, no un hilo
+STORY_NOTIFICATIONS_CHECK_INTERVAL = 1.0
+STORY_NOTIFICATIONS_TTL = 3600
+STORY_STATUS_RETRY_MS = 1000
+STORY_STATUS_MAX_RETRY_MS = 10000
+
+# Latidos de tiempo de lectura: se acumulan por proceso y se vuelcan en lote
+READING_HEARTBEAT_FLUSH_SECONDS = 5
+READING_HEARTBEAT_MAX_BUFFER = 1000  # eventos acumulados que fuerzan un volcado inmediato
+READING_HEARTBEAT_MAX_EVENTS = 20  # eventos por petición
+READING_HEARTBEAT_MAX_SECONDS = 120  # tope de segundos que puede declarar un evento
+
+# ===== CACHÉ =====
+# Con REDIS_URL (requiere el paquete `redis`) la caché se comparte entre
+# procesos y servidores; sin ella, las notificaciones usan archivos locales
+# para que los workers de run_generation_workers lleguen a los procesos web.
+# `versiones` guarda los números de versión de library/cache_utils.py, que
+# también tienen que verse desde todos los procesos para invalidar.
+REDIS_URL = os.getenv('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        },
+        'notificaciones': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'notificaciones',
+        },
+        'versiones': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'versiones',
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+        'notificaciones': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.path.join(BASE_DIR, '.cache', 'notificaciones'),
+        },
+        'versiones': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.path.join(BASE_DIR, '.cache', 'versiones'),
+        },
+    }
+
+# Segundos que viven las facetas y demás datos por usuario de la biblioteca
+LIBRARY_CACHE_TTL = 600
+# Respuestas de los filtros AJAX (temas por perfil, títulos, búsqueda rápida)
+LIBRARY_AJAX_CACHE_TTL = 30
+# Vectores de "más como este" por usuario (library/recommendations.py)
+LIBRARY_RECOMMENDATIONS_DIR = os.path.join(BASE_DIR, '.cache', 'recomendaciones')
+
 # ===== CONFIGURACIÓN DE EMAIL MEJORADA =====
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = 'smtp.gmail.com'
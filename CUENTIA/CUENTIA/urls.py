@@ -16,6 +16,9 @@ urlpatterns = [
     # Dashboard principal (requiere autenticación)
     path('dashboard/', views.dashboard_view, name='dashboard'),
 
+    # Instrumentación del proceso (solo staff)
+    path('metrics/', views.metrics_view, name='metrics'),
+
     # Incluir URLs de las aplicaciones
     path('user/', include('user.urls')),
     path('stories/', include('stories.urls')),  # IMPORTANTE: stories debe estar antes que library
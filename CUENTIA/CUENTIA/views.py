@@ -1,8 +1,12 @@
 from django.shortcuts import render
-from django.contrib.auth.decorators import login_required
-from stories.models import Cuento, EstadisticaLectura
+from django.contrib.auth.decorators import login_required, user_passes_test
+from django.http import JsonResponse
+from stories.models import Cuento
 from user.models import Perfil
-from django.db.models import Count, Sum, Q
+from library.rollups import por_dia, totales
+from library.stats import hoy_local, inicio_de_mes
+from . import metrics
+from django.db.models import Count, Q
 from django.utils import timezone
 from datetime import timedelta, datetime
 import calendar
@@ -18,45 +22,25 @@ def landing_view(request):
 @login_required
 def dashboard_view(request):
     try:
-        cuentos_recientes = Cuento.objects.filter(
-            usuario=request.user
-        ).order_by('-fecha_creacion')[:6]
+        cuentos_recientes = Cuento.objects.by_user(request.user).cards().order_by('-fecha_creacion')[:6]
 
         perfiles_recientes = Perfil.objects.filter(
             usuario=request.user
         ).order_by('-id')[:6]
 
-        cuentos_populares = Cuento.objects.filter(
-            usuario=request.user,
-            estado='completado'
-        ).filter(
+        cuentos_populares = Cuento.objects.by_user(request.user).completed().cards().filter(
             Q(es_favorito=True) | Q(veces_leido__gt=0)
         ).order_by('-veces_leido', '-es_favorito')[:5]
 
         if not cuentos_populares.exists():
-            cuentos_populares = Cuento.objects.filter(
-                usuario=request.user,
-                estado='completado'
-            ).order_by('-fecha_creacion')[:3]
-        total_cuentos = Cuento.objects.filter(
-            usuario=request.user,
-            estado='completado',
-            en_biblioteca=True
-        ).count()
-
-        ahora = timezone.now()
-        inicio_mes = ahora.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        cuentos_este_mes = Cuento.objects.filter(
-            usuario=request.user,
-            fecha_creacion__gte=inicio_mes,
-            estado='completado',
-            en_biblioteca=True
-        ).count()
-        tiempo_total_segundos = EstadisticaLectura.objects.filter(
-            usuario=request.user
-        ).aggregate(
-            total=Sum('tiempo_lectura')
-        )['total'] or 0
+            cuentos_populares = Cuento.objects.by_user(request.user).completed().cards().order_by('-fecha_creacion')[:3]
+        # Contadores desde el resumen diario (DailyReadingRollup): unas pocas filas por día
+        hoy = hoy_local()
+        inicio_mes = inicio_de_mes(hoy)
+        total = totales(request.user)
+        total_cuentos = total['cuentos_creados']
+        tiempo_total_segundos = total['segundos_lectura']
+        cuentos_este_mes = totales(request.user, desde=inicio_mes)['cuentos_creados']
 
         if tiempo_total_segundos >= 3600:
             horas = tiempo_total_segundos // 3600
@@ -85,23 +69,14 @@ def dashboard_view(request):
         print(f"\n === CALCULANDO ACTIVIDAD MENSUAL SINCRONIZADA ===")
 
         actividad_semanal = []
+        dias = por_dia(request.user, desde=hoy - timedelta(days=34), hasta=hoy)
 
         for i in range(4, -1, -1):
-            dias_atras = i * 7
-            fin_semana = ahora - timedelta(days=dias_atras)
+            fin_semana = hoy - timedelta(days=i * 7)
             inicio_semana = fin_semana - timedelta(days=6)
-            cuentos_semana = Cuento.objects.filter(
-                usuario=request.user,
-                fecha_creacion__gte=inicio_semana.replace(hour=0, minute=0, second=0, microsecond=0),
-                fecha_creacion__lte=fin_semana.replace(hour=23, minute=59, second=59, microsecond=999999),
-                estado='completado',
-                en_biblioteca=True
-            ).count()
-            tiempo_semana_segundos = EstadisticaLectura.objects.filter(
-                usuario=request.user,
-                fecha_lectura__gte=inicio_semana.replace(hour=0, minute=0, second=0, microsecond=0),
-                fecha_lectura__lte=fin_semana.replace(hour=23, minute=59, second=59, microsecond=999999)
-            ).aggregate(total=Sum('tiempo_lectura'))['total'] or 0
+            semana = [dias.get(inicio_semana + timedelta(days=d), {}) for d in range(7)]
+            cuentos_semana = sum(dia.get('cuentos_creados') or 0 for dia in semana)
+            tiempo_semana_segundos = sum(dia.get('segundos_lectura') or 0 for dia in semana)
 
             tiempo_semana_minutos = tiempo_semana_segundos // 60
 
@@ -130,16 +105,11 @@ def dashboard_view(request):
         print(f" ALTURAS CALCULADAS:")
         for s in actividad_semanal:
             print(f"   {s['semana']}: {s['cuentos']} cuentos → {s['altura_barra']}% altura")
-        mes_anterior = inicio_mes - timedelta(days=1)
-        inicio_mes_anterior = mes_anterior.replace(day=1)
-
-        cuentos_mes_anterior = Cuento.objects.filter(
-            usuario=request.user,
-            fecha_creacion__gte=inicio_mes_anterior,
-            fecha_creacion__lt=inicio_mes,
-            estado='completado',
-            en_biblioteca=True
-        ).count()
+        cuentos_mes_anterior = totales(
+            request.user,
+            desde=inicio_de_mes(hoy, 1),
+            hasta=inicio_mes - timedelta(days=1)
+        )['cuentos_creados']
 
         cambio_porcentual = 0
         if cuentos_mes_anterior > 0:
@@ -215,3 +185,9 @@ def dashboard_view(request):
             'total_tiempo_5_semanas': 0,
         }
         return render(request, 'dashboard.html', context)
+
+
+@user_passes_test(lambda user: user.is_staff)
+def metrics_view(request):
+    """Contadores de instrumentación de este proceso (CUENTIA/metrics.py), solo para staff"""
+    return JsonResponse(metrics.resumen())
@@ -0,0 +1,129 @@
+"""Índice de títulos por usuario para el autocompletado de la biblioteca.
+
+Los títulos se normalizan (minúsculas, sin tildes ni espacios repetidos) y se
+indexa cada palabra junto con el resto del título en listas ordenadas:
+"El Dragón azul" aporta "el dragon azul" a la de títulos completos y
+"dragon azul" y "azul" a la de restos. Una búsqueda es un bisect al primer
+prefijo que coincide y un recorrido hacia delante hasta reunir `limite`
+títulos, sin tocar la base de datos.
+
+Las filas (id, título, perfil, tema) se guardan en caché con cache_utils y el
+índice construido se memoriza en el proceso para la versión vigente; las
+señales de library/models.py cambian la versión cuando se guarda o se borra un
+cuento del usuario.
+"""
+import threading
+import unicodedata
+from bisect import bisect_left
+from collections import OrderedDict
+
+from stories.models import Cuento
+from . import cache_utils
+
+ESPACIO = 'titulos'
+
+# Índices construidos por proceso: (usuario_id, versión) -> IndiceTitulos
+_MAX_INDICES = 256
+_indices = OrderedDict()
+_bloqueo = threading.Lock()
+
+
+def normalizar(texto):
+    """'  El Dragón  AZUL ' -> 'el dragon azul'"""
+    descompuesto = unicodedata.normalize('NFKD', texto or '')
+    sin_tildes = ''.join(c for c in descompuesto if not unicodedata.combining(c))
+    return ' '.join(sin_tildes.casefold().split())
+
+
+class IndiceTitulos:
+    """Dos listas ordenadas de claves: títulos completos y restos a partir de la 2ª palabra"""
+
+    def __init__(self, filas):
+        # filas: [(cuento_id, titulo, perfil_id, tema)]
+        self.filas = filas
+        completos, restos = [], []
+        for posicion, (_, titulo, _, _) in enumerate(filas):
+            palabras = normalizar(titulo).split()
+            completos.append((' '.join(palabras), posicion))
+            for inicio in range(1, len(palabras)):
+                restos.append((' '.join(palabras[inicio:]), posicion))
+        self.listas = []
+        for entradas in (completos, restos):
+            entradas.sort()
+            self.listas.append(([clave for clave, _ in entradas], [posicion for _, posicion in entradas]))
+
+    def __len__(self):
+        return len(self.filas)
+
+    def buscar(self, consulta, limite=10, perfil_id=None, tema=None):
+        """Filas cuyo título tiene alguna palabra que empieza por `consulta`.
+
+        Primero los títulos que empiezan por la consulta y después los que la
+        tienen en otra palabra, cada grupo en orden alfabético. Cada recorrido
+        se detiene en cuanto hay `limite` resultados.
+        """
+        prefijo = normalizar(consulta)
+        if not prefijo:
+            return []
+
+        encontradas = []
+        vistos = set()
+        for claves, posiciones in self.listas:
+            for indice in range(bisect_left(claves, prefijo), len(claves)):
+                if len(encontradas) >= limite or not claves[indice].startswith(prefijo):
+                    break
+                posicion = posiciones[indice]
+                if posicion in vistos:
+                    continue
+                _, _, perfil, tema_cuento = self.filas[posicion]
+                if perfil_id is not None and perfil != perfil_id:
+                    continue
+                if tema is not None and tema_cuento != tema:
+                    continue
+                vistos.add(posicion)
+                encontradas.append(posicion)
+
+        return [self.filas[posicion] for posicion in encontradas]
+
+
+def _calcular(usuario_id):
+    return list(
+        Cuento.objects.filter(usuario_id=usuario_id, estado='completado', en_biblioteca=True)
+        .order_by('-fecha_creacion')
+        .values_list('id', 'titulo', 'perfil_id', 'tema')
+    )
+
+
+def indice(usuario_id):
+    version = cache_utils.version(ESPACIO, usuario_id)
+    clave = (usuario_id, version)
+    if version is not None:
+        with _bloqueo:
+            if clave in _indices:
+                _indices.move_to_end(clave)
+                return _indices[clave]
+
+    nuevo = IndiceTitulos(cache_utils.obtener(ESPACIO, usuario_id, lambda: _calcular(usuario_id)))
+    if version is not None:
+        with _bloqueo:
+            _indices[clave] = nuevo
+            while len(_indices) > _MAX_INDICES:
+                _indices.popitem(last=False)
+    return nuevo
+
+
+def sugerencias(usuario, consulta, limite=10, perfil_id=None, tema=None):
+    """Títulos distintos para el desplegable de búsqueda"""
+    titulos = []
+    for _, titulo, _, _ in indice(usuario.id).buscar(consulta, limite * 2, perfil_id, tema):
+        if titulo not in titulos:
+            titulos.append(titulo)
+    return titulos[:limite]
+
+
+def buscar_ids(usuario, consulta, limite=10):
+    return [fila[0] for fila in indice(usuario.id).buscar(consulta, limite)]
+
+
+def invalidar(usuario_id):
+    cache_utils.invalidar(ESPACIO, usuario_id)
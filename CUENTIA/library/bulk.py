@@ -0,0 +1,146 @@
+"""Operaciones sobre muchos cuentos de la biblioteca en una sola petición.
+
+Cada acción es un UPDATE o DELETE sobre el conjunto de ids dentro de una
+transacción, en lugar de una petición (y varias consultas) por cuento. Los
+receptores por fila de library/models.py se silencian con en_lote(), y lo que
+mantienen se actualiza una vez por lote:
+
+- DailyReadingRollup: rollups.reconstruir() del usuario desde el día más
+  antiguo afectado.
+- Facetas e índice de títulos: una invalidación al hacer commit.
+- Índice de búsqueda: search.cuentos_modificados() / cuentos_eliminados().
+- Vectores de recomendaciones: lo mismo en library/recommendations.py, al
+  hacer commit porque viven en disco.
+
+Los borrados dejan su registro de auditoría en CuentoEliminado con un solo
+bulk_create.
+"""
+import logging
+
+from django.db import transaction
+from django.db.models import Min
+
+from stories.models import Cuento, EstadisticaLectura
+from user.models import Perfil
+from . import recommendations, rollups, search
+from .models import CuentoEliminado, LibraryManager, _invalidar_facetas, en_lote
+
+logger = logging.getLogger(__name__)
+
+MAXIMO_IDS = 500
+
+# Campos que necesita el registro de auditoría de un cuento borrado
+CAMPOS_AUDITORIA = ('id', 'usuario_id', 'perfil_id', 'titulo', 'personaje_principal', 'tema', 'contenido',
+                    'fecha_creacion')
+
+
+class OperacionInvalida(ValueError):
+    pass
+
+
+def _ids(valores):
+    if not isinstance(valores, list) or not valores:
+        raise OperacionInvalida("Se esperaba una lista de ids")
+    try:
+        ids = list(dict.fromkeys(int(valor) for valor in valores))
+    except (TypeError, ValueError):
+        raise OperacionInvalida("Los ids deben ser números")
+    if len(ids) > MAXIMO_IDS:
+        raise OperacionInvalida(f"Como máximo {MAXIMO_IDS} cuentos por operación")
+    return ids
+
+
+def _reconstruir_rollup(usuario_id, *momentos):
+    momentos = [momento for momento in momentos if momento]
+    if momentos:
+        rollups.reconstruir(usuario_id, desde=rollups.fecha_local(min(momentos)))
+
+
+def _favorito(valor):
+    def operacion(usuario, cuentos, ids, perfil, request):
+        cuentos.update(es_favorito=valor)
+    return operacion
+
+
+def _mover(usuario, cuentos, ids, perfil, request):
+    desde = cuentos.aggregate(desde=Min('fecha_creacion'))['desde']
+    cuentos.update(perfil=perfil)
+    _reconstruir_rollup(usuario.id, desde)
+    search.cuentos_modificados(ids)
+    _invalidar_facetas(usuario.id)
+
+
+def _agregar_a_biblioteca(usuario, cuentos, ids, perfil, request):
+    nuevos = cuentos.filter(en_biblioteca=False)
+    desde = nuevos.aggregate(desde=Min('fecha_creacion'))['desde']
+    nuevos_ids = list(nuevos.values_list('id', flat=True))
+    if not nuevos_ids:
+        return
+    Cuento.objects.filter(id__in=nuevos_ids).update(en_biblioteca=True)
+    _reconstruir_rollup(usuario.id, desde)
+    search.cuentos_modificados(nuevos_ids)
+    transaction.on_commit(lambda: recommendations.cuentos_modificados(usuario.id, nuevos_ids))
+    _invalidar_facetas(usuario.id)
+
+
+def _eliminar(usuario, cuentos, ids, perfil, request):
+    auditoria = [
+        LibraryManager.nuevo_cuento_eliminado(cuento, usuario, request, motivo='usuario')
+        for cuento in cuentos.only(*CAMPOS_AUDITORIA)
+    ]
+    CuentoEliminado.objects.bulk_create(auditoria, batch_size=MAXIMO_IDS)
+
+    lecturas = EstadisticaLectura.objects.filter(cuento_id__in=ids)
+    desde_lecturas = lecturas.aggregate(desde=Min('fecha_lectura'))['desde']
+    desde_cuentos = min((registro.fecha_creacion_original for registro in auditoria), default=None)
+    with en_lote():
+        lecturas.delete()
+        Cuento.objects.filter(id__in=ids).delete()
+
+    _reconstruir_rollup(usuario.id, desde_lecturas, desde_cuentos)
+    search.cuentos_eliminados(ids)
+    transaction.on_commit(lambda: recommendations.cuentos_eliminados(usuario.id, ids))
+    _invalidar_facetas(usuario.id)
+
+
+OPERACIONES = {
+    'favorite': _favorito(True),
+    'unfavorite': _favorito(False),
+    'delete': _eliminar,
+    'move': _mover,
+    'add_to_library': _agregar_a_biblioteca,
+}
+
+
+def aplicar(usuario, accion, ids, perfil_id=None, request=None):
+    """Aplica `accion` a los cuentos completados del usuario con esos ids.
+
+    Devuelve {'procesados': [...], 'no_encontrados': [...]}; los ids ajenos o de
+    cuentos sin completar cuentan como no encontrados, igual que el 404 de las
+    vistas de un solo cuento. OperacionInvalida si la petición no tiene sentido.
+    """
+    if accion not in OPERACIONES:
+        raise OperacionInvalida(f"Acción desconocida: {accion}")
+    ids = _ids(ids)
+
+    perfil = None
+    if accion == 'move':
+        try:
+            perfil = Perfil.objects.filter(id=int(perfil_id), usuario=usuario).first()
+        except (TypeError, ValueError):
+            perfil = None
+        if perfil is None:
+            raise OperacionInvalida("Perfil no encontrado")
+
+    with transaction.atomic():
+        cuentos = Cuento.objects.filter(usuario=usuario, estado='completado', id__in=ids)
+        procesados = list(cuentos.select_for_update().values_list('id', flat=True))
+        if procesados:
+            OPERACIONES[accion](usuario, Cuento.objects.filter(id__in=procesados), procesados, perfil, request)
+
+    encontrados = set(procesados)
+    logger.info(f"Operación en lote '{accion}' de {usuario.username}: {len(procesados)} cuentos")
+    return {
+        'procesados': [cuento_id for cuento_id in ids if cuento_id in encontrados],
+        'no_encontrados': [cuento_id for cuento_id in ids if cuento_id not in encontrados],
+    }
@@ -0,0 +1,152 @@
+"""Caché por usuario con claves versionadas.
+
+Cada usuario tiene un número de versión por espacio ('facetas', 'titulos'...)
+guardado en la caché `versiones`, que se comparte entre procesos (Redis o
+archivos). Los datos se guardan bajo una clave que incluye esa versión, así
+que invalidar es solo incrementar el número: las entradas viejas dejan de
+leerse y caducan solas. Si la versión se pierde (expulsión, reinicio) se
+recrea a partir del reloj y nunca coincide con una anterior.
+
+Dentro de un proceso, las peticiones simultáneas que fallan en la misma clave
+esperan al primer cálculo en lugar de repetirlo (single-flight). Aciertos,
+fallos y peticiones agrupadas se cuentan en CUENTIA/metrics.py por espacio.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import InvalidCacheBackendError
+
+from CUENTIA import metrics
+
+logger = logging.getLogger(__name__)
+
+# Respuestas de los endpoints AJAX de filtros (library/views.py)
+AJAX = 'ajax'
+
+# Cuánto espera una petición agrupada antes de calcular por su cuenta
+ESPERA_MAXIMA = 10
+
+
+class _Vuelo:
+    def __init__(self):
+        self.terminado = threading.Event()
+        self.valor = None
+        self.ok = False
+
+
+_vuelos = {}
+_bloqueo_vuelos = threading.Lock()
+
+
+def _cache_versiones():
+    try:
+        return caches['versiones']
+    except InvalidCacheBackendError:
+        return caches['default']
+
+
+def _cache_datos():
+    return caches['default']
+
+
+def _clave_version(espacio, usuario_id):
+    return f"cuentia:version:{espacio}:{usuario_id}"
+
+
+def version(espacio, usuario_id):
+    clave = _clave_version(espacio, usuario_id)
+    try:
+        actual = _cache_versiones().get(clave)
+        if actual is None:
+            actual = time.time_ns() // 1000
+            _cache_versiones().add(clave, actual, None)
+            actual = _cache_versiones().get(clave, actual)
+        return actual
+    except Exception as e:
+        logger.warning(f"No se pudo leer la versión de {espacio} del usuario {usuario_id}: {str(e)}")
+        return None
+
+
+def invalidar(espacio, usuario_id):
+    """Las próximas lecturas de `espacio` para este usuario recalcularán los datos"""
+    clave = _clave_version(espacio, usuario_id)
+    try:
+        _cache_versiones().incr(clave)
+    except ValueError:
+        # No había versión: cualquier valor nuevo del reloj sirve
+        _cache_versiones().set(clave, time.time_ns() // 1000, None)
+    except Exception as e:
+        logger.warning(f"No se pudo invalidar {espacio} del usuario {usuario_id}: {str(e)}")
+
+
+def _una_vez(clave, calcular):
+    """(valor, agrupada): si otro hilo ya está calculando `clave`, espera su resultado"""
+    with _bloqueo_vuelos:
+        vuelo = _vuelos.get(clave)
+        lider = vuelo is None
+        if lider:
+            vuelo = _vuelos[clave] = _Vuelo()
+
+    if not lider:
+        if vuelo.terminado.wait(ESPERA_MAXIMA) and vuelo.ok:
+            return vuelo.valor, True
+        # El cálculo falló o tarda demasiado: esta petición lo intenta por su cuenta
+        return calcular(), False
+
+    try:
+        vuelo.valor = calcular()
+        vuelo.ok = True
+        return vuelo.valor, False
+    finally:
+        with _bloqueo_vuelos:
+            _vuelos.pop(clave, None)
+        vuelo.terminado.set()
+
+
+def _sufijo(parametros):
+    """Parámetros normalizados -> trozo de clave corto y válido para cualquier backend"""
+    if parametros is None:
+        return ''
+    texto = json.dumps(parametros, sort_keys=True, default=str, ensure_ascii=False)
+    return ':' + hashlib.sha1(texto.encode()).hexdigest()[:20]
+
+
+def obtener(espacio, usuario_id, calcular, ttl=None, parametros=None):
+    """Valor cacheado de `calcular()` para la versión actual del usuario.
+
+    `parametros` (cualquier estructura serializable en JSON) distingue varias
+    entradas dentro del mismo espacio, p. ej. ('temas', perfil_id).
+    """
+    ttl = ttl if ttl is not None else getattr(settings, 'LIBRARY_CACHE_TTL', 600)
+    actual = version(espacio, usuario_id)
+    if actual is None:
+        metrics.incrementar(f"cache.{espacio}.fallos")
+        return calcular()
+
+    clave = f"cuentia:{espacio}:{usuario_id}:{actual}{_sufijo(parametros)}"
+    try:
+        valor = _cache_datos().get(clave)
+    except Exception as e:
+        logger.warning(f"No se pudo leer {clave} de la caché: {str(e)}")
+        valor = None
+
+    if valor is not None:
+        metrics.incrementar(f"cache.{espacio}.aciertos")
+        return valor
+
+    def calcular_y_guardar():
+        resultado = calcular()
+        try:
+            _cache_datos().set(clave, resultado, ttl)
+        except Exception as e:
+            logger.warning(f"No se pudo guardar {clave} en la caché: {str(e)}")
+        return resultado
+
+    valor, agrupada = _una_vez(clave, calcular_y_guardar)
+    metrics.incrementar(f"cache.{espacio}.{'agrupadas' if agrupada else 'fallos'}")
+    return valor
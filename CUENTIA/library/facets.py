@@ -0,0 +1,78 @@
+"""Facetas de la biblioteca: perfiles, temas y años con sus conteos.
+
+Se calculan con un único GROUP BY (perfil, tema, año local) sobre los cuentos
+completados en biblioteca, más la lista de perfiles, y se guardan en caché por
+usuario (library/cache_utils.py). Las señales de library/models.py invalidan la
+versión cuando cambia un cuento o un perfil del usuario.
+"""
+from django.db.models import Count
+from django.db.models.functions import ExtractYear
+
+from stories.models import Cuento
+from user.models import Perfil
+from . import cache_utils
+from .stats import ZONA_LOCAL
+
+ESPACIO = 'facetas'
+
+# Campos de Cuento cuyo cambio invalida las facetas
+CAMPOS_CUENTO = {'usuario', 'perfil', 'tema', 'titulo', 'estado', 'en_biblioteca', 'fecha_creacion'}
+
+
+def _calcular(usuario_id):
+    perfiles = list(
+        Perfil.objects.filter(usuario_id=usuario_id).order_by('nombre').values('id', 'nombre', 'edad')
+    )
+    grupos = [
+        (fila['perfil_id'], fila['tema'], fila['anio'], fila['total'])
+        for fila in Cuento.objects.filter(usuario_id=usuario_id, estado='completado', en_biblioteca=True)
+        .annotate(anio=ExtractYear('fecha_creacion', tzinfo=ZONA_LOCAL))
+        .values('perfil_id', 'tema', 'anio')
+        .annotate(total=Count('id'))
+        .order_by()
+    ]
+    return {'perfiles': perfiles, 'grupos': grupos}
+
+
+class Facetas:
+    """Vista de solo lectura sobre los datos cacheados"""
+
+    def __init__(self, datos):
+        self._perfiles = datos['perfiles']
+        self._grupos = datos['grupos']
+
+    def _filtrar(self, perfil_id=None, tema=None):
+        for grupo in self._grupos:
+            if perfil_id is not None and grupo[0] != perfil_id:
+                continue
+            if tema is not None and grupo[1] != tema:
+                continue
+            yield grupo
+
+    @property
+    def perfiles(self):
+        """Perfiles del usuario (dicts con id, nombre, edad y total de cuentos)"""
+        totales = {}
+        for perfil_id, _, _, total in self._grupos:
+            totales[perfil_id] = totales.get(perfil_id, 0) + total
+        return [dict(perfil, total=totales.get(perfil['id'], 0)) for perfil in self._perfiles]
+
+    def perfil(self, perfil_id):
+        return next((perfil for perfil in self._perfiles if perfil['id'] == perfil_id), None)
+
+    def temas(self, perfil_id=None):
+        return sorted({tema for _, tema, _, _ in self._filtrar(perfil_id)})
+
+    def anios(self, perfil_id=None):
+        return sorted({anio for _, _, anio, _ in self._filtrar(perfil_id) if anio}, reverse=True)
+
+    def total(self, perfil_id=None, tema=None):
+        return sum(grupo[3] for grupo in self._filtrar(perfil_id, tema))
+
+
+def facetas(usuario):
+    return Facetas(cache_utils.obtener(ESPACIO, usuario.id, lambda: _calcular(usuario.id)))
+
+
+def invalidar(usuario_id):
+    cache_utils.invalidar(ESPACIO, usuario_id)
@@ -0,0 +1,237 @@
+"""Ingesta por lotes de los latidos de tiempo de lectura.
+
+Cada lector abierto avisa cada 30 segundos de que sigue leyendo. En lugar de
+resolver cada aviso con varias consultas (cuento, perfil, estadística del día,
+save() de la estadística y de veces_leido), los eventos se acumulan en memoria
+por proceso con la clave (usuario, cuento, perfil, día local) y un hilo los
+vuelca cada READING_HEARTBEAT_FLUSH_SECONDS como incrementos F() y
+bulk_create, en una sola transacción que también actualiza DailyReadingRollup.
+
+Si el proceso muere se pierden como mucho los segundos del último intervalo.
+"""
+import atexit
+import logging
+import threading
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from stories.models import Cuento, EstadisticaLectura
+from user.models import Perfil
+from . import rollups
+from .stats import inicio_del_dia
+
+logger = logging.getLogger(__name__)
+
+_bloqueo = threading.Lock()
+# (usuario_id, cuento_id, perfil_id o None, fecha local) -> [segundos, sesiones nuevas]
+_pendientes = defaultdict(lambda: [0, 0])
+_eventos_pendientes = 0
+_hilo = None
+_parar = threading.Event()
+
+
+def _config(nombre, default):
+    return getattr(settings, nombre, default)
+
+
+def _entero(valor):
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+def normalizar(evento):
+    """(cuento_id, perfil_id, segundos, nueva_sesion) o None si el evento no es válido.
+
+    Formato compacto: {"c": cuento_id, "p": perfil_id, "s": segundos, "n": 1 si es el primer latido de la página}
+    """
+    if not isinstance(evento, dict):
+        return None
+    cuento_id = _entero(evento.get('c'))
+    segundos = _entero(evento.get('s'))
+    if not cuento_id or segundos is None or segundos <= 0:
+        return None
+    perfil_id = _entero(evento.get('p')) or None
+    # Un latido nunca puede cubrir más que el intervalo máximo entre envíos
+    segundos = min(segundos, _config('READING_HEARTBEAT_MAX_SECONDS', 120))
+    return cuento_id, perfil_id, segundos, bool(evento.get('n'))
+
+
+def registrar(usuario_id, eventos):
+    """Acumula los eventos en el buffer del proceso; no hace ninguna consulta"""
+    global _eventos_pendientes
+    fecha = rollups.fecha_local(timezone.now())
+    aceptados = 0
+
+    with _bloqueo:
+        for evento in eventos[:_config('READING_HEARTBEAT_MAX_EVENTS', 20)]:
+            datos = normalizar(evento)
+            if datos is None:
+                continue
+            cuento_id, perfil_id, segundos, nueva = datos
+            acumulado = _pendientes[(usuario_id, cuento_id, perfil_id, fecha)]
+            acumulado[0] += segundos
+            acumulado[1] += int(nueva)
+            aceptados += 1
+        _eventos_pendientes += aceptados
+        lleno = _eventos_pendientes >= _config('READING_HEARTBEAT_MAX_BUFFER', 1000)
+
+    _asegurar_hilo()
+    if lleno:
+        volcar()
+    return aceptados
+
+
+def pendientes():
+    with _bloqueo:
+        return len(_pendientes)
+
+
+def _tomar_lote():
+    global _pendientes, _eventos_pendientes
+    with _bloqueo:
+        lote, _pendientes = _pendientes, defaultdict(lambda: [0, 0])
+        _eventos_pendientes = 0
+    return lote
+
+
+def _devolver_lote(lote):
+    """Si el volcado falla los segundos vuelven al buffer para el siguiente intento"""
+    with _bloqueo:
+        for clave, (segundos, nuevas) in lote.items():
+            acumulado = _pendientes[clave]
+            acumulado[0] += segundos
+            acumulado[1] += nuevas
+
+
+def _validar(lote):
+    """Descarta cuentos ajenos; un perfil ausente o de otro usuario se sustituye por el del cuento"""
+    cuentos = {
+        cuento_id: (usuario_id, perfil_id)
+        for cuento_id, usuario_id, perfil_id in Cuento.objects.filter(
+            id__in={clave[1] for clave in lote}
+        ).values_list('id', 'usuario_id', 'perfil_id')
+    }
+    perfiles = dict(
+        Perfil.objects.filter(id__in={clave[2] for clave in lote if clave[2]}).values_list('id', 'usuario_id')
+    )
+
+    validos = defaultdict(lambda: [0, 0])
+    for (usuario_id, cuento_id, perfil_id, fecha), (segundos, nuevas) in lote.items():
+        dueno, perfil_cuento = cuentos.get(cuento_id, (None, None))
+        if dueno != usuario_id:
+            continue
+        if perfil_id is None or perfiles.get(perfil_id) != usuario_id:
+            perfil_id = perfil_cuento
+        acumulado = validos[(usuario_id, cuento_id, perfil_id, fecha)]
+        acumulado[0] += segundos
+        acumulado[1] += nuevas
+    return validos
+
+
+def _escribir(lote):
+    """Upsert de las estadísticas del lote con una consulta de lectura y escrituras F()"""
+    fechas = {clave[3] for clave in lote}
+    existentes = {}
+    for estadistica_id, usuario_id, cuento_id, perfil_id, fecha_lectura in EstadisticaLectura.objects.filter(
+        usuario_id__in={clave[0] for clave in lote},
+        cuento_id__in={clave[1] for clave in lote},
+        tipo_lectura='texto',
+        fecha_lectura__gte=inicio_del_dia(min(fechas)),
+        fecha_lectura__lt=inicio_del_dia(max(fechas) + timedelta(days=1)),
+    ).order_by('id').values_list('id', 'usuario_id', 'cuento_id', 'perfil_id', 'fecha_lectura'):
+        existentes.setdefault((usuario_id, cuento_id, perfil_id, rollups.fecha_local(fecha_lectura)), estadistica_id)
+
+    # Las filas nuevas llevan la fecha del volcado (fecha_lectura es auto_now_add)
+    hoy = rollups.fecha_local(timezone.now())
+    nuevas = []
+    por_dia = defaultdict(lambda: [0, 0])
+    veces_leido = defaultdict(int)
+
+    # Orden estable para que dos procesos no se bloqueen mutuamente
+    for clave in sorted(lote, key=lambda c: (c[0], c[1], c[2] or 0, c[3])):
+        usuario_id, cuento_id, perfil_id, fecha = clave
+        segundos, sesiones = lote[clave]
+        estadistica_id = existentes.get(clave)
+        if estadistica_id:
+            EstadisticaLectura.objects.filter(id=estadistica_id).update(tiempo_lectura=F('tiempo_lectura') + segundos)
+            por_dia[(usuario_id, perfil_id, fecha)][0] += segundos
+        else:
+            nuevas.append(EstadisticaLectura(
+                usuario_id=usuario_id, cuento_id=cuento_id, perfil_id=perfil_id,
+                tiempo_lectura=segundos, tipo_lectura='texto',
+            ))
+            por_dia[(usuario_id, perfil_id, hoy)][0] += segundos
+            por_dia[(usuario_id, perfil_id, hoy)][1] += 1
+        if sesiones:
+            veces_leido[cuento_id] += sesiones
+
+    if nuevas:
+        # bulk_create no emite señales: el rollup se actualiza justo debajo
+        EstadisticaLectura.objects.bulk_create(nuevas)
+
+    for cuento_id, veces in sorted(veces_leido.items()):
+        Cuento.objects.filter(id=cuento_id).update(veces_leido=F('veces_leido') + veces)
+
+    for (usuario_id, perfil_id, fecha), (segundos, filas_nuevas) in sorted(
+            por_dia.items(), key=lambda item: (item[0][0], item[0][1] or 0, item[0][2])):
+        rollups.tiempo_agregado(usuario_id, perfil_id, fecha, segundos, filas_nuevas)
+
+
+def volcar():
+    """Escribe en la base de datos todo lo acumulado; devuelve cuántas claves se escribieron"""
+    lote = _tomar_lote()
+    if not lote:
+        return 0
+
+    try:
+        validos = _validar(lote)
+        if validos:
+            with transaction.atomic():
+                _escribir(validos)
+    except Exception as e:
+        logger.error(f"Error volcando latidos de lectura ({len(lote)} claves): {str(e)}")
+        _devolver_lote(lote)
+        return 0
+
+    logger.debug(f"Latidos de lectura volcados: {len(validos)} claves")
+    return len(validos)
+
+
+def _bucle():
+    intervalo = _config('READING_HEARTBEAT_FLUSH_SECONDS', 5)
+    while not _parar.wait(intervalo):
+        try:
+            volcar()
+        finally:
+            close_old_connections()
+
+
+def _asegurar_hilo():
+    global _hilo
+    if _hilo is not None and _hilo.is_alive():
+        return
+    with _bloqueo:
+        if _hilo is None or not _hilo.is_alive():
+            _parar.clear()
+            _hilo = threading.Thread(target=_bucle, name='latidos-lectura', daemon=True)
+            _hilo.start()
+
+
+def detener():
+    """Para el hilo de volcado y escribe lo pendiente (apagado y benchmarks)"""
+    global _hilo
+    _parar.set()
+    if _hilo is not None:
+        _hilo.join(timeout=5)
+        _hilo = None
+    volcar()
+
+
+atexit.register(detener)
@@ -0,0 +1,49 @@
+import logging
+from datetime import date
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from library.rollups import reconstruir
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Recalcula DailyReadingRollup a partir de EstadisticaLectura y Cuento"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--usuario', help='Username o id de un único usuario')
+        parser.add_argument('--desde', help='Reconstruir solo desde esta fecha local (AAAA-MM-DD)')
+
+    def handle(self, *args, **options):
+        desde = None
+        if options['desde']:
+            try:
+                desde = date.fromisoformat(options['desde'])
+            except ValueError:
+                raise CommandError("--desde debe tener el formato AAAA-MM-DD")
+
+        usuarios = User.objects.order_by('id')
+        if options['usuario']:
+            filtro = Q(username=options['usuario'])
+            if options['usuario'].isdigit():
+                filtro |= Q(id=int(options['usuario']))
+            usuarios = usuarios.filter(filtro)
+            if not usuarios.exists():
+                raise CommandError(f"Usuario no encontrado: {options['usuario']}")
+
+        total_usuarios = total_filas = 0
+        # Un usuario por transacción: el resto sigue leyendo su rollup mientras tanto
+        for usuario_id in usuarios.values_list('id', flat=True).iterator():
+            filas = reconstruir(usuario_id, desde)
+            total_usuarios += 1
+            total_filas += filas
+            if filas:
+                self.stdout.write(f"  Usuario {usuario_id}: {filas} días")
+
+        logger.info(f"Rollups reconstruidos: {total_usuarios} usuarios, {total_filas} filas")
+        self.stdout.write(self.style.SUCCESS(
+            f"Listo: {total_filas} filas de resumen para {total_usuarios} usuarios"
+        ))
@@ -0,0 +1,35 @@
+import logging
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from library.recommendations import reconstruir, reconstruir_todos
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Reconstruye los vectores de recomendaciones \"más como este\" de la biblioteca"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--usuario', help='Username o id de un único usuario')
+        parser.add_argument('--lote', type=int, default=1000, help='Cuentos leídos por consulta')
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        if options['usuario']:
+            filtro = Q(username=options['usuario'])
+            if options['usuario'].isdigit():
+                filtro |= Q(id=int(options['usuario']))
+            usuario_id = User.objects.filter(filtro).values_list('id', flat=True).first()
+            if usuario_id is None:
+                raise CommandError(f"Usuario no encontrado: {options['usuario']}")
+            total = reconstruir(usuario_id, options['lote'])
+        else:
+            total = reconstruir_todos(options['lote'])
+        duracion = time.perf_counter() - inicio
+
+        logger.info(f"Vectores de recomendaciones reconstruidos: {total} cuentos en {duracion:.1f}s")
+        self.stdout.write(self.style.SUCCESS(f"Listo: {total} cuentos vectorizados en {duracion:.1f}s"))
@@ -0,0 +1,37 @@
+import logging
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from library.search import motor, reconstruir
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Reconstruye el índice de búsqueda de texto completo de la biblioteca"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--usuario', help='Username o id de un único usuario')
+        parser.add_argument('--lote', type=int, default=1000, help='Cuentos por lote de inserción')
+
+    def handle(self, *args, **options):
+        usuario_id = None
+        if options['usuario']:
+            filtro = Q(username=options['usuario'])
+            if options['usuario'].isdigit():
+                filtro |= Q(id=int(options['usuario']))
+            usuario_id = User.objects.filter(filtro).values_list('id', flat=True).first()
+            if usuario_id is None:
+                raise CommandError(f"Usuario no encontrado: {options['usuario']}")
+
+        inicio = time.perf_counter()
+        total = reconstruir(usuario_id, options['lote'])
+        duracion = time.perf_counter() - inicio
+
+        logger.info(f"Índice de búsqueda reconstruido ({motor().nombre}): {total} cuentos en {duracion:.1f}s")
+        self.stdout.write(self.style.SUCCESS(
+            f"Listo: {total} cuentos indexados con el motor {motor().nombre} en {duracion:.1f}s"
+        ))
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:58
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0004_initial'),
+        ('user', '0009_perfil_foto_perfil'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyReadingRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('segundos_lectura', models.PositiveIntegerField(default=0)),
+                ('sesiones', models.PositiveIntegerField(default=0)),
+                ('cuentos_leidos', models.PositiveIntegerField(default=0)),
+                ('cuentos_creados', models.PositiveIntegerField(default=0)),
+                ('lecturas_texto', models.PositiveIntegerField(default=0)),
+                ('lecturas_audio', models.PositiveIntegerField(default=0)),
+                ('lecturas_biblioteca', models.PositiveIntegerField(default=0)),
+                ('lecturas_descarga', models.PositiveIntegerField(default=0)),
+                ('perfil', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='user.perfil')),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Resumen diario de lectura',
+                'verbose_name_plural': 'Resúmenes diarios de lectura',
+                'db_table': 'library_daily_reading_rollup',
+                'indexes': [models.Index(fields=['usuario', 'fecha'], name='library_dai_usuario_69f488_idx')],
+                'constraints': [models.UniqueConstraint(fields=('usuario', 'perfil', 'fecha'), name='rollup_usuario_perfil_fecha'), models.UniqueConstraint(condition=models.Q(('perfil__isnull', True)), fields=('usuario', 'fecha'), name='rollup_usuario_sin_perfil_fecha')],
+            },
+        ),
+    ]
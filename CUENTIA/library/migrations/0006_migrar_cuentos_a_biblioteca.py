@@ -0,0 +1,55 @@
+# Migración de datos: sustituye a la "migración automática" que library_view
+# comprobaba en cada visita (tres COUNT por petición).
+
+from zoneinfo import ZoneInfo
+
+from django.db import migrations
+from django.db.models import Count, F
+from django.db.models.functions import TruncDate
+
+# Copia de library.stats.ZONA_LOCAL: las migraciones no importan código de la app
+ZONA_LOCAL = ZoneInfo('America/Guayaquil')
+
+
+def migrar_cuentos_a_biblioteca(apps, schema_editor):
+    """Usuarios con cuentos completados pero ninguno en biblioteca: se guardan todos"""
+    Cuento = apps.get_model('stories', 'Cuento')
+    DailyReadingRollup = apps.get_model('library', 'DailyReadingRollup')
+
+    usuarios_con_biblioteca = Cuento.objects.filter(
+        estado='completado', en_biblioteca=True
+    ).values('usuario_id')
+    pendientes = Cuento.objects.filter(
+        estado='completado', en_biblioteca=False
+    ).exclude(usuario_id__in=usuarios_con_biblioteca)
+
+    ids = list(pendientes.values_list('id', flat=True))
+    if not ids:
+        return
+
+    # Los modelos históricos no emiten las señales del rollup: se suman aquí
+    por_dia = (
+        Cuento.objects.filter(id__in=ids)
+        .annotate(dia=TruncDate('fecha_creacion', tzinfo=ZONA_LOCAL))
+        .values('usuario_id', 'perfil_id', 'dia')
+        .annotate(total=Count('id'))
+        .order_by()
+    )
+    for fila in por_dia:
+        filtro = {'usuario_id': fila['usuario_id'], 'perfil_id': fila['perfil_id'], 'fecha': fila['dia']}
+        if not DailyReadingRollup.objects.filter(**filtro).update(cuentos_creados=F('cuentos_creados') + fila['total']):
+            DailyReadingRollup.objects.create(cuentos_creados=fila['total'], **filtro)
+
+    Cuento.objects.filter(id__in=ids).update(en_biblioteca=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0005_daily_reading_rollup'),
+        ('stories', '0007_cuento_imagen_local'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrar_cuentos_a_biblioteca, migrations.RunPython.noop),
+    ]
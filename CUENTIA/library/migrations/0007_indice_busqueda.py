@@ -0,0 +1,72 @@
+# Índice de texto completo de library/search.py: FTS5 en SQLite y tsvector +
+# GIN en PostgreSQL. Se rellena con los cuentos que ya están en biblioteca.
+
+from django.db import migrations
+
+SQLITE_CREAR = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS library_cuento_fts USING fts5(
+        titulo, contenido, personaje_principal, moraleja, ambito,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    INSERT INTO library_cuento_fts (rowid, titulo, contenido, personaje_principal, moraleja, ambito)
+    SELECT id, titulo, contenido, personaje_principal, moraleja,
+           'u' || usuario_id || ' p' || COALESCE(perfil_id, 0)
+    FROM stories_cuento
+    WHERE estado = 'completado' AND en_biblioteca
+    """,
+]
+SQLITE_BORRAR = ["DROP TABLE IF EXISTS library_cuento_fts"]
+
+POSTGRES_CREAR = [
+    """
+    CREATE TABLE IF NOT EXISTS library_cuento_busqueda (
+        cuento_id bigint PRIMARY KEY REFERENCES stories_cuento (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,
+        usuario_id integer NOT NULL,
+        perfil_id bigint NULL,
+        configuracion regconfig NOT NULL,
+        documento tsvector NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS library_cuento_busqueda_documento ON library_cuento_busqueda USING GIN (documento)",
+    "CREATE INDEX IF NOT EXISTS library_cuento_busqueda_usuario ON library_cuento_busqueda (usuario_id, perfil_id)",
+    """
+    INSERT INTO library_cuento_busqueda (cuento_id, usuario_id, perfil_id, configuracion, documento)
+    SELECT c.id, c.usuario_id, c.perfil_id, cfg.cfg,
+           setweight(to_tsvector(cfg.cfg, c.titulo), 'A')
+           || setweight(to_tsvector(cfg.cfg, c.personaje_principal), 'B')
+           || setweight(to_tsvector(cfg.cfg, c.moraleja), 'C')
+           || setweight(to_tsvector(cfg.cfg, c.contenido), 'D')
+    FROM stories_cuento c
+    CROSS JOIN LATERAL (SELECT (CASE c.idioma
+        WHEN 'es' THEN 'spanish' WHEN 'en' THEN 'english'
+        WHEN 'de' THEN 'german' WHEN 'fr' THEN 'french'
+        ELSE 'simple' END)::regconfig AS cfg) cfg
+    WHERE c.estado = 'completado' AND c.en_biblioteca
+    """,
+]
+POSTGRES_BORRAR = ["DROP TABLE IF EXISTS library_cuento_busqueda"]
+
+
+def _ejecutar(sentencias_por_motor):
+    def operacion(apps, schema_editor):
+        for sentencia in sentencias_por_motor.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(sentencia)
+    return operacion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0006_migrar_cuentos_a_biblioteca'),
+        ('stories', '0008_cuento_idioma'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            _ejecutar({'sqlite': SQLITE_CREAR, 'postgresql': POSTGRES_CREAR}),
+            _ejecutar({'sqlite': SQLITE_BORRAR, 'postgresql': POSTGRES_BORRAR}),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# CuentoEliminado.contenido_preview pasa a CompressedTextField, igual que
+# Cuento.contenido en stories/migrations/0011.
+
+from django.db import migrations
+
+import stories.fields
+
+LOTE = 500
+
+
+def _copiar(origen, destino, apps):
+    CuentoEliminado = apps.get_model('library', 'CuentoEliminado')
+    ultimo_id = 0
+    while True:
+        eliminados = list(CuentoEliminado.objects.filter(id__gt=ultimo_id).order_by('id').only('id', origen)[:LOTE])
+        if not eliminados:
+            break
+        for eliminado in eliminados:
+            setattr(eliminado, destino, getattr(eliminado, origen))
+        CuentoEliminado.objects.bulk_update(eliminados, [destino])
+        ultimo_id = eliminados[-1].id
+
+
+def comprimir(apps, schema_editor):
+    _copiar('contenido_preview', 'contenido_preview_comprimido', apps)
+
+
+def descomprimir(apps, schema_editor):
+    _copiar('contenido_preview_comprimido', 'contenido_preview', apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0007_indice_busqueda'),
+        ('stories', '0011_cuento_contenido_comprimido'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cuentoeliminado',
+            name='contenido_preview_comprimido',
+            field=stories.fields.CompressedTextField(blank=True, null=True,
+                                                     help_text='Primeras 200 palabras del contenido'),
+        ),
+        migrations.RunPython(comprimir, descomprimir),
+        migrations.RemoveField(
+            model_name='cuentoeliminado',
+            name='contenido_preview',
+        ),
+        migrations.RenameField(
+            model_name='cuentoeliminado',
+            old_name='contenido_preview_comprimido',
+            new_name='contenido_preview',
+        ),
+    ]
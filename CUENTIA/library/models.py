@@ -1,47 +1,15 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
-from stories.models import Cuento
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from stories.fields import CompressedTextField
+from stories.models import Cuento, EstadisticaLectura
+from .querysets import LibraryQuerySet  # vive en querysets.py para que la use stories.models
 from user.models import Perfil
 from django.utils import timezone
 from datetime import timedelta
-
-
-class LibraryQuerySet(models.QuerySet):
-    def completed(self):
-        return self.filter(estado='completado')
-
-    def in_library(self):
-        return self.filter(en_biblioteca=True)
-
-    def by_user(self, user):
-        return self.filter(usuario=user)
-
-    def by_profile(self, profile_id):
-        if profile_id and profile_id != 'todos':
-            return self.filter(perfil_id=profile_id)
-        return self
-
-    def by_theme(self, theme):
-        if theme and theme != 'todos':
-            return self.filter(tema__icontains=theme)
-        return self
-
-    def search_title(self, title):
-        if title:
-            return self.filter(titulo__icontains=title)
-        return self
-
-    def order_by_date(self, order_by):
-        if order_by == 'semana_anterior':
-            date_limit = timezone.now() - timedelta(days=7)
-            return self.filter(fecha_creacion__gte=date_limit)
-        elif order_by == 'mes_anterior':
-            date_limit = timezone.now() - timedelta(days=30)
-            return self.filter(fecha_creacion__gte=date_limit)
-        elif order_by and order_by.isdigit():
-            year = int(order_by)
-            return self.filter(fecha_creacion__year=year)
-        return self
+from contextlib import contextmanager
+import threading
 
 
 # NUEVO MODELO: Sistema de auditoría para cuentos eliminados
@@ -52,7 +20,7 @@ class CuentoEliminado(models.Model):
     titulo = models.CharField(max_length=200, help_text="Título del cuento eliminado")
     personaje_principal = models.CharField(max_length=100, blank=True, null=True)
     tema = models.CharField(max_length=50, blank=True, null=True)
-    contenido_preview = models.TextField(blank=True, null=True, help_text="Primeras 200 palabras del contenido")
+    contenido_preview = CompressedTextField(blank=True, null=True, help_text="Primeras 200 palabras del contenido")
 
     # Información del usuario y perfil
     usuario = models.ForeignKey(User, on_delete=models.CASCADE, help_text="Usuario que eliminó el cuento")
@@ -117,16 +85,54 @@ class CuentoEliminado(models.Model):
         super().save(*args, **kwargs)
 
 
+
+class DailyReadingRollup(models.Model):
+    """Resumen diario de lectura por usuario, perfil y día local (America/Guayaquil).
+
+    Se mantiene de forma incremental en library/rollups.py cada vez que se
+    escribe una EstadisticaLectura o un cuento entra/sale de la biblioteca, y
+    se puede reconstruir con `manage.py rebuild_reading_rollups`.
+    """
+
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE)
+    # Al borrar un perfil sus lecturas pasan a "sin perfil": el rollup se reconstruye
+    perfil = models.ForeignKey(Perfil, on_delete=models.CASCADE, null=True, blank=True)
+    fecha = models.DateField()
+
+    segundos_lectura = models.PositiveIntegerField(default=0)
+    sesiones = models.PositiveIntegerField(default=0)
+    cuentos_leidos = models.PositiveIntegerField(default=0)  # cuentos distintos leídos ese día
+    cuentos_creados = models.PositiveIntegerField(default=0)  # completados y en biblioteca
+
+    lecturas_texto = models.PositiveIntegerField(default=0)
+    lecturas_audio = models.PositiveIntegerField(default=0)
+    lecturas_biblioteca = models.PositiveIntegerField(default=0)
+    lecturas_descarga = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = 'library_daily_reading_rollup'
+        verbose_name = 'Resumen diario de lectura'
+        verbose_name_plural = 'Resúmenes diarios de lectura'
+        constraints = [
+            models.UniqueConstraint(fields=['usuario', 'perfil', 'fecha'], name='rollup_usuario_perfil_fecha'),
+            # NULL no es igual a NULL en un índice único: fila "sin perfil" aparte
+            models.UniqueConstraint(fields=['usuario', 'fecha'], condition=models.Q(perfil__isnull=True),
+                                    name='rollup_usuario_sin_perfil_fecha'),
+        ]
+        indexes = [
+            models.Index(fields=['usuario', 'fecha']),
+        ]
+
+    def __str__(self):
+        return f"{self.usuario} - {self.perfil or 'Sin perfil'} - {self.fecha}"
+
+
 class LibraryManager:
 
     @staticmethod
     def get_library_stories(user):
         try:
-            return Cuento.objects.filter(
-                usuario=user,
-                estado='completado',
-                en_biblioteca=True
-            ).select_related('perfil').order_by('-fecha_creacion')
+            return Cuento.objects.biblioteca(user).cards().order_by('-fecha_creacion')
         except Exception as e:
             import logging
             logger = logging.getLogger(__name__)
@@ -167,11 +173,7 @@ class LibraryManager:
             filters = {}
 
         try:
-            queryset = Cuento.objects.filter(
-                usuario=user,
-                estado='completado',
-                en_biblioteca=True
-            ).select_related('perfil')
+            queryset = Cuento.objects.biblioteca(user).cards()
 
             profile_id = filters.get('perfil')
             if profile_id and profile_id != 'todos':
@@ -210,12 +212,7 @@ class LibraryManager:
             return Cuento.objects.none()
 
         try:
-            return Cuento.objects.filter(
-                usuario=user,
-                estado='completado',
-                en_biblioteca=True,
-                titulo__icontains=query
-            ).select_related('perfil')[:10]
+            return Cuento.objects.biblioteca(user).cards().filter(titulo__icontains=query)[:10]
         except Exception as e:
             import logging
             logger = logging.getLogger(__name__)
@@ -258,37 +255,43 @@ class LibraryManager:
                 'most_read_story': None,
             }
 
+    @staticmethod
+    def nuevo_cuento_eliminado(cuento, usuario, request=None, motivo='usuario'):
+        """Registro de auditoría sin guardar (library/bulk.py los inserta con bulk_create)"""
+        # Obtener información adicional del request si está disponible
+        ip_eliminacion = None
+        user_agent = None
+
+        if request:
+            # Obtener IP real considerando proxies
+            x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+            if x_forwarded_for:
+                ip_eliminacion = x_forwarded_for.split(',')[0].strip()
+            else:
+                ip_eliminacion = request.META.get('REMOTE_ADDR')
+
+            user_agent = request.META.get('HTTP_USER_AGENT', '')[:500]  # Limitar longitud
+
+        return CuentoEliminado(
+            cuento_id_original=cuento.id,
+            titulo=cuento.titulo,
+            personaje_principal=cuento.personaje_principal,
+            tema=cuento.tema,
+            contenido_preview=cuento.contenido[:500] if cuento.contenido else None,
+            usuario=usuario,
+            perfil_id=cuento.perfil_id,
+            fecha_creacion_original=cuento.fecha_creacion,
+            motivo_eliminacion=motivo,
+            ip_eliminacion=ip_eliminacion,
+            user_agent=user_agent
+        )
+
     @staticmethod
     def registrar_cuento_eliminado(cuento, usuario, request=None, motivo='usuario'):
         try:
-            # Obtener información adicional del request si está disponible
-            ip_eliminacion = None
-            user_agent = None
-
-            if request:
-                # Obtener IP real considerando proxies
-                x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-                if x_forwarded_for:
-                    ip_eliminacion = x_forwarded_for.split(',')[0].strip()
-                else:
-                    ip_eliminacion = request.META.get('REMOTE_ADDR')
-
-                user_agent = request.META.get('HTTP_USER_AGENT', '')[:500]  # Limitar longitud
-
             # Crear registro de eliminación
-            cuento_eliminado = CuentoEliminado.objects.create(
-                cuento_id_original=cuento.id,
-                titulo=cuento.titulo,
-                personaje_principal=cuento.personaje_principal,
-                tema=cuento.tema,
-                contenido_preview=cuento.contenido[:500] if cuento.contenido else None,
-                usuario=usuario,
-                perfil=cuento.perfil,
-                fecha_creacion_original=cuento.fecha_creacion,
-                motivo_eliminacion=motivo,
-                ip_eliminacion=ip_eliminacion,
-                user_agent=user_agent
-            )
+            cuento_eliminado = LibraryManager.nuevo_cuento_eliminado(cuento, usuario, request, motivo)
+            cuento_eliminado.save()
 
             import logging
             logger = logging.getLogger(__name__)
@@ -302,3 +305,171 @@ class LibraryManager:
             logger = logging.getLogger(__name__)
             logger.error(f"Error registrando cuento eliminado: {e}")
             return None
+
+
+# ===== Operaciones en lote (ver library/bulk.py) =====
+
+_lote = threading.local()
+
+
+@contextmanager
+def en_lote():
+    """Silencia los receptores post_delete de Cuento y EstadisticaLectura.
+
+    Quien lo usa se encarga de actualizar rollups, facetas e índices una sola vez
+    para todo el conjunto en lugar de una vez por fila.
+    """
+    _lote.activo = getattr(_lote, 'activo', 0) + 1
+    try:
+        yield
+    finally:
+        _lote.activo -= 1
+
+
+def _en_lote():
+    return getattr(_lote, 'activo', 0) > 0
+
+
+# ===== Mantenimiento de DailyReadingRollup (ver library/rollups.py) =====
+
+def _datos_anteriores(sender, instance, campos, update_fields):
+    """Valores guardados antes de este save(), o None si es un alta"""
+    if instance._state.adding or instance.pk is None:
+        return None
+    if update_fields is not None and not {campo.removesuffix('_id') for campo in campos} & set(update_fields):
+        # save(update_fields=['veces_leido']) y similares no tocan el rollup
+        return False
+    return sender.objects.filter(pk=instance.pk).values(*campos).first()
+
+
+@receiver(pre_save, sender=EstadisticaLectura)
+def recordar_lectura_anterior(sender, instance, raw=False, update_fields=None, **kwargs):
+    if not raw:
+        from .rollups import CAMPOS_LECTURA
+        instance._rollup_anterior = _datos_anteriores(sender, instance, CAMPOS_LECTURA, update_fields)
+
+
+@receiver(post_save, sender=EstadisticaLectura)
+def actualizar_rollup_lectura(sender, instance, raw=False, **kwargs):
+    anterior = getattr(instance, '_rollup_anterior', None)
+    if raw or anterior is False:
+        return
+    from .rollups import lectura_guardada
+    lectura_guardada(instance, anterior)
+
+
+@receiver(post_delete, sender=EstadisticaLectura)
+def descontar_rollup_lectura(sender, instance, **kwargs):
+    if _en_lote():
+        return
+    from .rollups import lectura_eliminada
+    lectura_eliminada(instance)
+
+
+@receiver(pre_save, sender=Cuento)
+def recordar_cuento_anterior(sender, instance, raw=False, update_fields=None, **kwargs):
+    if not raw:
+        from .rollups import CAMPOS_CUENTO
+        instance._rollup_anterior = _datos_anteriores(sender, instance, CAMPOS_CUENTO, update_fields)
+
+
+@receiver(post_save, sender=Cuento)
+def actualizar_rollup_cuento(sender, instance, raw=False, **kwargs):
+    anterior = getattr(instance, '_rollup_anterior', None)
+    if raw or anterior is False:
+        return
+    from .rollups import cuento_guardado
+    cuento_guardado(instance, anterior)
+
+
+@receiver(post_delete, sender=Cuento)
+def descontar_rollup_cuento(sender, instance, **kwargs):
+    if _en_lote():
+        return
+    from .rollups import cuento_eliminado
+    cuento_eliminado(instance)
+
+
+@receiver(post_delete, sender=Perfil)
+def reconstruir_rollup_perfil(sender, instance, **kwargs):
+    # Las lecturas y cuentos del perfil quedan sin perfil (SET_NULL) y sus filas del
+    # rollup se borran en cascada: se recalcula el usuario cuando termina el borrado
+    from .rollups import reconstruir
+    usuario_id = instance.usuario_id
+    transaction.on_commit(lambda: reconstruir(usuario_id))
+
+
+# ===== Invalidación de las facetas, del índice de títulos y de los filtros AJAX (library/facets.py, library/autocomplete.py) =====
+
+def _invalidar_facetas(usuario_id, titulos=True):
+    from . import autocomplete, cache_utils, facets
+
+    def _invalidar():
+        facets.invalidar(usuario_id)
+        # Las respuestas de los filtros AJAX salen de los mismos datos
+        cache_utils.invalidar(cache_utils.AJAX, usuario_id)
+        if titulos:
+            autocomplete.invalidar(usuario_id)
+
+    # Después del commit, para que el siguiente cálculo ya vea los cambios
+    transaction.on_commit(_invalidar)
+
+
+@receiver(post_save, sender=Cuento)
+def invalidar_facetas_cuento(sender, instance, raw=False, update_fields=None, **kwargs):
+    from .facets import CAMPOS_CUENTO
+    if raw or (update_fields is not None and not CAMPOS_CUENTO & set(update_fields)):
+        return
+    _invalidar_facetas(instance.usuario_id)
+
+
+@receiver(post_delete, sender=Cuento)
+def invalidar_facetas_cuento_eliminado(sender, instance, **kwargs):
+    if _en_lote():
+        return
+    _invalidar_facetas(instance.usuario_id)
+
+
+@receiver(post_save, sender=Perfil)
+@receiver(post_delete, sender=Perfil)
+def invalidar_facetas_perfil(sender, instance, raw=False, **kwargs):
+    if not raw:
+        _invalidar_facetas(instance.usuario_id, titulos=False)
+
+
+# ===== Índice de búsqueda de texto completo (ver library/search.py) =====
+
+@receiver(post_save, sender=Cuento)
+def indexar_cuento_busqueda(sender, instance, raw=False, update_fields=None, **kwargs):
+    from .search import CAMPOS_CUENTO, cuento_guardado
+    if raw or (update_fields is not None and not CAMPOS_CUENTO & set(update_fields)):
+        return
+    cuento_guardado(instance)
+
+
+@receiver(post_delete, sender=Cuento)
+def quitar_cuento_busqueda(sender, instance, **kwargs):
+    if _en_lote():
+        return
+    from .search import cuento_eliminado
+    cuento_eliminado(instance.id)
+
+
+# ===== Vectores de "más como este" (ver library/recommendations.py) =====
+
+@receiver(post_save, sender=Cuento)
+def actualizar_recomendaciones_cuento(sender, instance, raw=False, update_fields=None, **kwargs):
+    from .recommendations import CAMPOS_CUENTO, cuento_guardado
+    if raw or (update_fields is not None and not CAMPOS_CUENTO & set(update_fields)):
+        return
+    # El archivo no participa en la transacción: solo se toca si el cambio se confirma
+    transaction.on_commit(lambda: cuento_guardado(instance))
+
+
+@receiver(post_delete, sender=Cuento)
+def quitar_cuento_recomendaciones(sender, instance, **kwargs):
+    if _en_lote():
+        return
+    from .recommendations import cuento_eliminado
+    usuario_id, cuento_id = instance.usuario_id, instance.id
+    transaction.on_commit(lambda: cuento_eliminado(usuario_id, cuento_id))
@@ -0,0 +1,54 @@
+"""Paginación por cursor (keyset) para los listados de cuentos.
+
+En lugar de COUNT(*) + OFFSET, cada página pide las filas que siguen a la
+última mostrada en el orden (-fecha_creacion, -id):
+
+    WHERE fecha_creacion <= f AND (fecha_creacion < f OR id < i)
+    ORDER BY fecha_creacion DESC, id DESC LIMIT n + 1
+
+así la página 500 cuesta lo mismo que la primera. El cursor es opaco para el
+cliente: base64 de "fecha ISO|id" del último cuento de la página.
+"""
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+
+TAMANO_PAGINA = 12
+
+
+class CursorInvalido(ValueError):
+    pass
+
+
+def codificar_cursor(cuento):
+    valor = f"{cuento.fecha_creacion.isoformat()}|{cuento.id}"
+    return base64.urlsafe_b64encode(valor.encode()).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor):
+    """(fecha_creacion, id) o CursorInvalido"""
+    try:
+        relleno = '=' * (-len(cursor) % 4)
+        fecha, cuento_id = base64.urlsafe_b64decode(cursor + relleno).decode().split('|')
+        fecha = datetime.fromisoformat(fecha)
+        if fecha.tzinfo is None:
+            raise ValueError("fecha sin zona horaria")
+        return fecha, int(cuento_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise CursorInvalido(f"Cursor inválido: {cursor!r}") from e
+
+
+def pagina(queryset, cursor=None, tamano=TAMANO_PAGINA):
+    """(cuentos de la página, cursor de la siguiente o None)"""
+    queryset = queryset.order_by('-fecha_creacion', '-id')
+    if cursor:
+        fecha, cuento_id = decodificar_cursor(cursor)
+        # El <= inicial permite al índice saltar directamente a la posición del cursor
+        queryset = queryset.filter(fecha_creacion__lte=fecha).filter(
+            Q(fecha_creacion__lt=fecha) | Q(id__lt=cuento_id)
+        )
+
+    cuentos = list(queryset[:tamano + 1])
+    siguiente = codificar_cursor(cuentos[tamano - 1]) if len(cuentos) > tamano else None
+    return cuentos[:tamano], siguiente
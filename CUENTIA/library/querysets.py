@@ -0,0 +1,69 @@
+"""QuerySets de cuentos para los listados de la biblioteca.
+
+No importa modelos para que stories.models pueda usar CuentoQuerySet como
+manager de Cuento sin crear un ciclo de importaciones con library.models.
+"""
+from datetime import timedelta
+
+from django.db import models
+from django.utils import timezone
+
+# Lo que pinta una tarjeta (biblioteca, dashboard, búsquedas): nunca el texto completo
+CAMPOS_TARJETA = (
+    'id', 'usuario_id', 'perfil_id', 'titulo', 'personaje_principal', 'tema', 'estado',
+    'fecha_creacion', 'imagen_url', 'imagen_miniatura', 'es_favorito', 'veces_leido', 'en_biblioteca', 'vista_previa',
+    'perfil__id', 'perfil__nombre', 'perfil__edad',
+)
+LONGITUD_VISTA_PREVIA = 200
+
+
+class LibraryQuerySet(models.QuerySet):
+    def completed(self):
+        return self.filter(estado='completado')
+
+    def in_library(self):
+        return self.filter(en_biblioteca=True)
+
+    def by_user(self, user):
+        return self.filter(usuario=user)
+
+    def by_profile(self, profile_id):
+        if profile_id and profile_id != 'todos':
+            return self.filter(perfil_id=profile_id)
+        return self
+
+    def by_theme(self, theme):
+        if theme and theme != 'todos':
+            return self.filter(tema__icontains=theme)
+        return self
+
+    def search_title(self, title):
+        if title:
+            return self.filter(titulo__icontains=title)
+        return self
+
+    def order_by_date(self, order_by):
+        if order_by == 'semana_anterior':
+            date_limit = timezone.now() - timedelta(days=7)
+            return self.filter(fecha_creacion__gte=date_limit)
+        elif order_by == 'mes_anterior':
+            date_limit = timezone.now() - timedelta(days=30)
+            return self.filter(fecha_creacion__gte=date_limit)
+        elif order_by and order_by.isdigit():
+            year = int(order_by)
+            return self.filter(fecha_creacion__year=year)
+        return self
+
+
+class CuentoQuerySet(LibraryQuerySet):
+    def biblioteca(self, usuario):
+        """Cuentos completados y guardados en la biblioteca del usuario"""
+        return self.by_user(usuario).completed().in_library()
+
+    def cards(self):
+        """Proyección para tarjetas: sin contenido, moraleja ni imagen_prompt.
+
+        El inicio del texto viene de la columna `vista_previa`, que se rellena
+        al guardar: `contenido` está comprimido y no se puede recortar en SQL.
+        """
+        return self.select_related('perfil').only(*CAMPOS_TARJETA)
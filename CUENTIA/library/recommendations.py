@@ -0,0 +1,283 @@
+"""Recomendaciones "más como este" por similitud de texto.
+
+Cada cuento completado en biblioteca se resume en un vector de bolsa de
+palabras con hashing: las raíces de título y contenido (sin palabras vacías)
+se reparten en DIMENSIONES cubetas con crc32 y un signo, el recuento se suaviza
+con log(1 + tf) y el vector se normaliza, así que la similitud coseno es un
+producto escalar.
+
+Los vectores de cada usuario viven en un archivo de registros (id int64 +
+vector float32) bajo LIBRARY_RECOMMENDATIONS_DIR que se abre con numpy.memmap:
+una consulta es una multiplicación matriz-vector sobre el archivo mapeado y la
+base de datos solo se toca para cargar las tarjetas del resultado.
+
+El archivo se mantiene desde las señales de library/models.py: los cuentos
+nuevos se añaden al final, los editados se reescriben en su sitio y los que
+salen de la biblioteca se marcan con id 0 hasta que una compactación los quita.
+Si falta (usuario nuevo, cambio de VERSION o DIMENSIONES...) se construye en la
+primera consulta; `python manage.py rebuild_recommendations` los rehace todos.
+"""
+import logging
+import os
+import tempfile
+import threading
+import zlib
+from contextlib import contextmanager
+from functools import lru_cache
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+
+from stories.models import Cuento
+from .autocomplete import normalizar
+from .search import raiz, terminos
+
+try:
+    import fcntl
+except ImportError:  # Windows: solo se excluyen los hilos del mismo proceso
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Subir al cambiar cómo se calculan los vectores: los archivos anteriores se ignoran
+VERSION = 1
+DIMENSIONES = 512
+
+REGISTRO = np.dtype([('id', '<i8'), ('vector', '<f4', (DIMENSIONES,))])
+
+# Campos de Cuento que cambian el vector o si el cuento se recomienda
+CAMPOS_CUENTO = {'titulo', 'contenido', 'estado', 'en_biblioteca', 'idioma'}
+
+# Lo que hace falta leer para vectorizar un cuento
+CAMPOS_VECTOR = ('id', 'usuario_id', 'titulo', 'contenido', 'estado', 'en_biblioteca', 'idioma')
+
+SIMILITUD_MINIMA = 0.05
+
+# Compactar cuando los huecos de cuentos quitados pasan de esta fracción del archivo
+HUECOS_MAXIMOS = 0.25
+
+PALABRAS_VACIAS = frozenset(normalizar(palabra) for palabra in (
+    # es
+    'el la los las un una unos unas del al que y o pero con sin por para como más muy ya no sí se su sus le '
+    'les lo me te mi tu nos era eran fue fueron ser estar estaba estaban había hay este esta estos estas ese '
+    'esa eso aquel cuando donde mientras entonces también todo toda todos todas otro otra cada mucho mucha '
+    'muchos muchas entre hasta desde sobre tras él ella ellos ellas yo tú nosotros dijo '
+    # en
+    'the and but with without for from that this these those was were are was been have has had they them '
+    'their there then when where while into onto over under very also all each other said she his her him '
+    # de / fr
+    'der die das und mit ein eine nicht sich auch war les des une est dans avec pour pas qui sur elle'
+).split())
+
+_bloqueo = threading.Lock()
+
+# El vocabulario de los cuentos es pequeño: cada palabra se reduce una sola vez
+_raiz = lru_cache(maxsize=50000)(raiz)
+
+
+def vectorizar(texto, idioma='es'):
+    """Vector float32 normalizado de la bolsa de raíces de `texto`"""
+    raices = [
+        _raiz(termino, idioma) for termino in terminos(texto)
+        if len(termino) > 2 and not termino.isdigit() and termino not in PALABRAS_VACIAS
+    ]
+    if not raices:
+        return np.zeros(DIMENSIONES, dtype=np.float32)
+    huellas = np.fromiter((zlib.crc32(r.encode('utf-8')) for r in raices), dtype=np.uint32, count=len(raices))
+    # El bit alto da el signo: las colisiones se compensan en lugar de sumarse
+    signos = np.where(huellas & 0x80000000, -1.0, 1.0)
+    cuentas = np.bincount(huellas % DIMENSIONES, weights=signos, minlength=DIMENSIONES)
+    vector = (np.sign(cuentas) * np.log1p(np.abs(cuentas))).astype(np.float32)
+    norma = np.linalg.norm(vector)
+    return vector / norma if norma else vector
+
+
+def vector_de(cuento):
+    return vectorizar(f"{cuento.titulo}\n{cuento.contenido}", cuento.idioma or 'es')
+
+
+def _recomendable(cuento):
+    return cuento.estado == 'completado' and cuento.en_biblioteca
+
+
+def _directorio():
+    base = getattr(settings, 'LIBRARY_RECOMMENDATIONS_DIR',
+                   os.path.join(settings.BASE_DIR, '.cache', 'recomendaciones'))
+    return os.path.join(base, f"v{VERSION}-{DIMENSIONES}")
+
+
+def _ruta(usuario_id):
+    return os.path.join(_directorio(), f"{usuario_id}.vec")
+
+
+@contextmanager
+def _escribiendo(usuario_id):
+    """Un solo escritor por archivo: entre hilos siempre y entre procesos donde hay fcntl"""
+    os.makedirs(_directorio(), exist_ok=True)
+    ruta = _ruta(usuario_id)
+    with _bloqueo, open(f"{ruta}.lock", 'a') as cerrojo:
+        if fcntl:
+            fcntl.flock(cerrojo, fcntl.LOCK_EX)
+        yield ruta
+
+
+def _abrir(ruta, modo='r'):
+    """Registros del archivo mapeados en memoria, o None si no existe.
+
+    Solo se mapean registros completos: un lector nunca ve un alta a medio escribir.
+    """
+    try:
+        filas = os.path.getsize(ruta) // REGISTRO.itemsize
+    except FileNotFoundError:
+        return None
+    if not filas:
+        return np.zeros(0, dtype=REGISTRO)
+    return np.memmap(ruta, dtype=REGISTRO, mode=modo, shape=(filas,))
+
+
+def _escribir(ruta, registros):
+    """Reemplaza el archivo de forma atómica; los lectores siguen con el anterior mapeado"""
+    descriptor, temporal = tempfile.mkstemp(dir=os.path.dirname(ruta), suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'wb') as archivo:
+            archivo.write(np.ascontiguousarray(registros, dtype=REGISTRO).tobytes())
+        os.replace(temporal, ruta)
+    except Exception:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+
+
+def _registros(cuentos):
+    filas = [(cuento.id, vector_de(cuento)) for cuento in cuentos]
+    return np.array(filas, dtype=REGISTRO) if filas else np.zeros(0, dtype=REGISTRO)
+
+
+def _compactar_si_hace_falta(ruta):
+    registros = _abrir(ruta)
+    huecos = int(np.count_nonzero(registros['id'] == 0))
+    if huecos and huecos > HUECOS_MAXIMOS * len(registros):
+        _escribir(ruta, registros[registros['id'] != 0])
+
+
+def _actualizar(usuario_id, cuentos):
+    """Reescribe, añade o quita del archivo del usuario los vectores de `cuentos`"""
+    if not os.path.exists(_ruta(usuario_id)):
+        # Nunca se ha consultado: se construirá entero la primera vez que haga falta
+        return
+    with _escribiendo(usuario_id) as ruta:
+        registros = _abrir(ruta, 'r+')
+        if registros is None:
+            return
+        nuevos = []
+        for cuento in cuentos:
+            filas = np.flatnonzero(registros['id'] == cuento.id)
+            if not _recomendable(cuento):
+                registros[filas] = np.zeros(len(filas), dtype=REGISTRO)
+            elif filas.size:
+                registros['vector'][filas[0]] = vector_de(cuento)
+            else:
+                nuevos.append(cuento)
+        if isinstance(registros, np.memmap):
+            registros.flush()
+        del registros
+        if nuevos:
+            with open(ruta, 'ab') as archivo:
+                archivo.write(_registros(nuevos).tobytes())
+        _compactar_si_hace_falta(ruta)
+
+
+def _quitar(usuario_id, ids):
+    if not os.path.exists(_ruta(usuario_id)):
+        return
+    with _escribiendo(usuario_id) as ruta:
+        registros = _abrir(ruta, 'r+')
+        if registros is None or not len(registros):
+            return
+        filas = np.flatnonzero(np.isin(registros['id'], list(ids)))
+        if filas.size:
+            registros[filas] = np.zeros(len(filas), dtype=REGISTRO)
+            registros.flush()
+        del registros
+        _compactar_si_hace_falta(ruta)
+
+
+def reconstruir(usuario_id, lote=1000):
+    """Rehace el archivo de un usuario desde la base de datos; devuelve los cuentos incluidos"""
+    cuentos = Cuento.objects.filter(
+        usuario_id=usuario_id, estado='completado', en_biblioteca=True
+    ).only(*CAMPOS_VECTOR).order_by('id')
+    with _escribiendo(usuario_id) as ruta:
+        registros = _registros(cuentos.iterator(chunk_size=lote))
+        _escribir(ruta, registros)
+    return len(registros)
+
+
+def reconstruir_todos(lote=1000):
+    return sum(
+        reconstruir(usuario_id, lote)
+        for usuario_id in User.objects.order_by('id').values_list('id', flat=True)
+    )
+
+
+def similares(cuento, limite=6):
+    """[(cuento_id, similitud)] de los cuentos del mismo usuario más parecidos a `cuento`"""
+    registros = _abrir(_ruta(cuento.usuario_id))
+    if registros is None:
+        reconstruir(cuento.usuario_id)
+        registros = _abrir(_ruta(cuento.usuario_id))
+    if not len(registros) or limite <= 0:
+        return []
+
+    ids = registros['id']
+    fila = np.flatnonzero(ids == cuento.id)
+    # Un cuento que aún no está en la biblioteca (recién generado) se vectoriza al vuelo
+    consulta = registros['vector'][fila[0]] if fila.size else vector_de(cuento)
+    puntuaciones = registros['vector'] @ consulta
+    puntuaciones[(ids == cuento.id) | (ids == 0)] = -np.inf
+
+    limite = min(limite, len(puntuaciones))
+    mejores = np.argpartition(puntuaciones, -limite)[-limite:]
+    mejores = mejores[np.argsort(puntuaciones[mejores])[::-1]]
+    return [
+        (int(ids[posicion]), round(float(puntuaciones[posicion]), 4))
+        for posicion in mejores if puntuaciones[posicion] >= SIMILITUD_MINIMA
+    ]
+
+
+def recomendar(cuento, limite=6):
+    """Tarjetas de los cuentos de la biblioteca parecidos a `cuento`, de más a menos parecido"""
+    resultados = similares(cuento, limite)
+    por_id = Cuento.objects.filter(
+        id__in=[cuento_id for cuento_id, _ in resultados], usuario_id=cuento.usuario_id,
+        estado='completado', en_biblioteca=True,
+    ).cards().in_bulk()
+    return [
+        {'cuento': por_id[cuento_id], 'similitud': similitud}
+        for cuento_id, similitud in resultados if cuento_id in por_id
+    ]
+
+
+def cuento_guardado(cuento):
+    """Llamado al hacer commit de un save(); un fallo aquí no debe impedir guardar el cuento"""
+    try:
+        _actualizar(cuento.usuario_id, [cuento])
+    except Exception as e:
+        logger.error(f"Error actualizando las recomendaciones del cuento {cuento.id}: {str(e)}")
+
+
+def cuento_eliminado(usuario_id, cuento_id):
+    try:
+        _quitar(usuario_id, [cuento_id])
+    except Exception as e:
+        logger.error(f"Error quitando el cuento {cuento_id} de las recomendaciones: {str(e)}")
+
+
+def cuentos_modificados(usuario_id, ids):
+    """Actualiza un conjunto de cuentos de una vez (operaciones en lote de library/bulk.py)"""
+    _actualizar(usuario_id, Cuento.objects.filter(usuario_id=usuario_id, id__in=ids).only(*CAMPOS_VECTOR))
+
+
+def cuentos_eliminados(usuario_id, ids):
+    _quitar(usuario_id, ids)
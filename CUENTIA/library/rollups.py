@@ -0,0 +1,271 @@
+"""Mantenimiento y consulta de DailyReadingRollup.
+
+Cada EstadisticaLectura suma su tiempo, una sesión y su tipo a la fila
+(usuario, perfil, día local) correspondiente; cada cuento que queda completado
+y en biblioteca suma uno a `cuentos_creados` del día en que se creó. Los
+cambios se aplican con incrementos F() dentro de la misma transacción que la
+escritura original, así que las vistas de analítica solo leen unas pocas filas
+por día del rango pedido en lugar de recorrer todo el historial.
+
+`cuentos_leidos` (cuentos distintos) no se puede sumar: se recuenta con las
+lecturas de ese único día después de bloquear la fila.
+"""
+import logging
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Greatest, TruncDate
+from django.utils import timezone
+
+from stories.models import Cuento, EstadisticaLectura
+from .models import DailyReadingRollup
+from .stats import ZONA_LOCAL, hoy_local, inicio_del_dia
+
+logger = logging.getLogger(__name__)
+
+# tipo_lectura -> columna del rollup
+TIPOS = {
+    'texto': 'lecturas_texto',
+    'audio': 'lecturas_audio',
+    'biblioteca': 'lecturas_biblioteca',
+    'descarga': 'lecturas_descarga',
+}
+
+CAMPOS = ('segundos_lectura', 'sesiones', 'cuentos_leidos', 'cuentos_creados') + tuple(TIPOS.values())
+
+# Campos de Cuento y EstadisticaLectura que afectan al rollup
+CAMPOS_CUENTO = ('usuario_id', 'perfil_id', 'fecha_creacion', 'estado', 'en_biblioteca')
+CAMPOS_LECTURA = ('usuario_id', 'perfil_id', 'cuento_id', 'fecha_lectura', 'tiempo_lectura', 'tipo_lectura')
+
+
+def fecha_local(momento):
+    return timezone.localtime(momento, ZONA_LOCAL).date()
+
+
+def _filtro(usuario_id, perfil_id, fecha):
+    if perfil_id is None:
+        return {'usuario_id': usuario_id, 'perfil__isnull': True, 'fecha': fecha}
+    return {'usuario_id': usuario_id, 'perfil_id': perfil_id, 'fecha': fecha}
+
+
+def _incrementar(usuario_id, perfil_id, fecha, **deltas):
+    """Upsert de la fila del día sumando `deltas`; nunca deja contadores negativos"""
+    deltas = {campo: valor for campo, valor in deltas.items() if valor}
+    if not deltas:
+        return
+
+    filtro = _filtro(usuario_id, perfil_id, fecha)
+    cambios = {
+        campo: F(campo) + valor if valor > 0 else Greatest(F(campo) + valor, 0)
+        for campo, valor in deltas.items()
+    }
+    if DailyReadingRollup.objects.filter(**filtro).update(**cambios):
+        return
+
+    if all(valor < 0 for valor in deltas.values()):
+        # No hay fila que descontar: el rollup de ese día todavía no se ha construido
+        return
+
+    try:
+        with transaction.atomic():
+            DailyReadingRollup.objects.create(
+                usuario_id=usuario_id, perfil_id=perfil_id, fecha=fecha,
+                **{campo: max(valor, 0) for campo, valor in deltas.items()}
+            )
+    except IntegrityError:
+        # Otra petición creó la fila a la vez
+        DailyReadingRollup.objects.filter(**filtro).update(**cambios)
+
+
+def _recontar_cuentos_leidos(usuario_id, perfil_id, fecha):
+    """Cuentos distintos leídos ese día; va después de _incrementar, que bloquea la fila"""
+    lecturas = EstadisticaLectura.objects.filter(
+        usuario_id=usuario_id,
+        fecha_lectura__gte=inicio_del_dia(fecha),
+        fecha_lectura__lt=inicio_del_dia(fecha + timedelta(days=1)),
+    )
+    lecturas = lecturas.filter(perfil__isnull=True) if perfil_id is None else lecturas.filter(perfil_id=perfil_id)
+    distintos = lecturas.values('cuento_id').distinct().count()
+    DailyReadingRollup.objects.filter(**_filtro(usuario_id, perfil_id, fecha)).update(cuentos_leidos=distintos)
+
+
+# ===== Lecturas =====
+
+def _aporte_lectura(datos, signo):
+    aporte = {
+        'segundos_lectura': signo * (datos['tiempo_lectura'] or 0),
+        'sesiones': signo,
+    }
+    campo_tipo = TIPOS.get(datos['tipo_lectura'])
+    if campo_tipo:
+        aporte[campo_tipo] = signo
+    return aporte
+
+
+def _clave_lectura(datos):
+    return datos['usuario_id'], datos['perfil_id'], fecha_local(datos['fecha_lectura'])
+
+
+def datos_lectura(estadistica):
+    return {campo: getattr(estadistica, campo) for campo in CAMPOS_LECTURA}
+
+
+def lectura_guardada(estadistica, anterior=None):
+    """Aplica al rollup una EstadisticaLectura nueva o modificada (`anterior` = datos previos)"""
+    actual = datos_lectura(estadistica)
+    if anterior == actual:
+        return
+
+    with transaction.atomic():
+        clave = _clave_lectura(actual)
+        if anterior is None:
+            _incrementar(*clave, **_aporte_lectura(actual, 1))
+        elif _clave_lectura(anterior) == clave:
+            deltas = _aporte_lectura(actual, 1)
+            for campo, valor in _aporte_lectura(anterior, -1).items():
+                deltas[campo] = deltas.get(campo, 0) + valor
+            _incrementar(*clave, **deltas)
+        else:
+            clave_anterior = _clave_lectura(anterior)
+            _incrementar(*clave_anterior, **_aporte_lectura(anterior, -1))
+            _recontar_cuentos_leidos(*clave_anterior)
+            _incrementar(*clave, **_aporte_lectura(actual, 1))
+
+        if anterior is None or anterior['cuento_id'] != actual['cuento_id'] or _clave_lectura(anterior) != clave:
+            _recontar_cuentos_leidos(*clave)
+
+
+def lectura_eliminada(estadistica):
+    datos = datos_lectura(estadistica)
+    clave = _clave_lectura(datos)
+    with transaction.atomic():
+        _incrementar(*clave, **_aporte_lectura(datos, -1))
+        _recontar_cuentos_leidos(*clave)
+
+
+def tiempo_agregado(usuario_id, perfil_id, fecha, segundos, filas_nuevas=0):
+    """Para los latidos que se escriben con update()/bulk_create (library/heartbeats.py)"""
+    _incrementar(usuario_id, perfil_id, fecha, segundos_lectura=segundos,
+                 sesiones=filas_nuevas, lecturas_texto=filas_nuevas)
+    if filas_nuevas:
+        _recontar_cuentos_leidos(usuario_id, perfil_id, fecha)
+
+
+# ===== Cuentos creados =====
+
+def _cuento_cuenta(datos):
+    return datos['estado'] == 'completado' and bool(datos['en_biblioteca'])
+
+
+def datos_cuento(cuento):
+    return {campo: getattr(cuento, campo) for campo in CAMPOS_CUENTO}
+
+
+def cuento_guardado(cuento, anterior=None):
+    """Suma o resta el cuento en `cuentos_creados` si entró o salió de la biblioteca"""
+    actual = datos_cuento(cuento)
+    antes = anterior is not None and _cuento_cuenta(anterior)
+    ahora = _cuento_cuenta(actual)
+    if antes == ahora and (not ahora or anterior == actual):
+        return
+
+    with transaction.atomic():
+        if antes:
+            _incrementar(anterior['usuario_id'], anterior['perfil_id'],
+                         fecha_local(anterior['fecha_creacion']), cuentos_creados=-1)
+        if ahora:
+            _incrementar(actual['usuario_id'], actual['perfil_id'],
+                         fecha_local(actual['fecha_creacion']), cuentos_creados=1)
+
+
+def cuento_eliminado(cuento):
+    datos = datos_cuento(cuento)
+    if _cuento_cuenta(datos):
+        _incrementar(datos['usuario_id'], datos['perfil_id'],
+                     fecha_local(datos['fecha_creacion']), cuentos_creados=-1)
+
+
+# ===== Reconstrucción =====
+
+def _agregar_por_dia(queryset, campo_fecha, **agregados):
+    return (
+        queryset.annotate(_dia=TruncDate(campo_fecha, tzinfo=ZONA_LOCAL))
+        .values('perfil_id', '_dia')
+        .annotate(**agregados)
+        .order_by()
+    )
+
+
+def reconstruir(usuario_id, desde=None):
+    """Recalcula desde cero las filas de un usuario (opcionalmente desde una fecha local)"""
+    lecturas = EstadisticaLectura.objects.filter(usuario_id=usuario_id)
+    cuentos = Cuento.objects.filter(usuario_id=usuario_id, estado='completado', en_biblioteca=True)
+    existentes = DailyReadingRollup.objects.filter(usuario_id=usuario_id)
+    if desde:
+        lecturas = lecturas.filter(fecha_lectura__gte=inicio_del_dia(desde))
+        cuentos = cuentos.filter(fecha_creacion__gte=inicio_del_dia(desde))
+        existentes = existentes.filter(fecha__gte=desde)
+
+    filas = {}
+
+    def _fila(perfil_id, dia):
+        clave = (perfil_id, dia)
+        if clave not in filas:
+            filas[clave] = DailyReadingRollup(usuario_id=usuario_id, perfil_id=perfil_id, fecha=dia)
+        return filas[clave]
+
+    por_tipo = {campo: Count('id', filter=Q(tipo_lectura=tipo)) for tipo, campo in TIPOS.items()}
+    for datos in _agregar_por_dia(lecturas, 'fecha_lectura',
+                                  segundos_lectura=Sum('tiempo_lectura'),
+                                  sesiones=Count('id'),
+                                  cuentos_leidos=Count('cuento', distinct=True),
+                                  **por_tipo):
+        fila = _fila(datos['perfil_id'], datos['_dia'])
+        for campo in ('segundos_lectura', 'sesiones', 'cuentos_leidos', *TIPOS.values()):
+            setattr(fila, campo, max(datos[campo] or 0, 0))
+
+    for datos in _agregar_por_dia(cuentos, 'fecha_creacion', total=Count('id')):
+        _fila(datos['perfil_id'], datos['_dia']).cuentos_creados = datos['total']
+
+    with transaction.atomic():
+        existentes.delete()
+        DailyReadingRollup.objects.bulk_create(filas.values(), batch_size=500)
+
+    return len(filas)
+
+
+# ===== Consultas para las vistas =====
+
+def ultimos_dias(dias, hasta=None):
+    """(desde, hasta) de los últimos `dias` días locales, ambos incluidos"""
+    hasta = hasta or hoy_local()
+    return hasta - timedelta(days=dias - 1), hasta
+
+
+def resumenes(usuario, perfil=None, desde=None, hasta=None):
+    queryset = DailyReadingRollup.objects.filter(usuario=usuario)
+    if perfil:
+        queryset = queryset.filter(perfil=perfil)
+    if desde:
+        queryset = queryset.filter(fecha__gte=desde)
+    if hasta:
+        queryset = queryset.filter(fecha__lte=hasta)
+    return queryset
+
+
+def totales(usuario, perfil=None, desde=None, hasta=None):
+    """Suma de todos los contadores del rango con una sola consulta"""
+    datos = resumenes(usuario, perfil, desde, hasta).aggregate(**{campo: Sum(campo) for campo in CAMPOS})
+    return {campo: datos[campo] or 0 for campo in CAMPOS}
+
+
+def por_dia(usuario, perfil=None, desde=None, hasta=None):
+    """{fecha: {campo: valor}} sumando los perfiles de cada día"""
+    filas = (
+        resumenes(usuario, perfil, desde, hasta)
+        .values('fecha')
+        .annotate(**{campo: Sum(campo) for campo in CAMPOS})
+        .order_by()
+    )
+    return {fila.pop('fecha'): fila for fila in filas}
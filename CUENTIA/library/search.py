@@ -0,0 +1,369 @@
+"""Búsqueda de texto completo en los cuentos de la biblioteca.
+
+Indexa título, contenido, personaje principal y moraleja de los cuentos
+completados en biblioteca. El motor depende de la base de datos:
+
+- SQLite: tabla virtual FTS5 `library_cuento_fts` (tokenizador unicode61 sin
+  tildes). SQLite no trae lematizadores fuera del inglés, así que cada término
+  de la consulta se reduce a su raíz con `raiz()` según el idioma y se busca
+  como prefijo ("dragones" -> dragon*).
+- PostgreSQL: tabla `library_cuento_busqueda` con un tsvector por cuento
+  construido con la configuración del idioma del cuento (spanish, english...)
+  e índice GIN.
+- Cualquier otra: recorrido en Python de los cuentos del usuario (sin ranking real).
+
+Las tablas se crean en library/migrations/0007 y se mantienen desde las
+señales de library/models.py; `python manage.py rebuild_search_index` las
+rehace desde cero.
+"""
+import html
+import logging
+import re
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from stories.models import Cuento
+from .autocomplete import normalizar
+
+logger = logging.getLogger(__name__)
+
+# Campos de Cuento que cambian el documento indexado o su ámbito
+CAMPOS_CUENTO = {'usuario', 'perfil', 'titulo', 'contenido', 'personaje_principal', 'moraleja',
+                 'estado', 'en_biblioteca', 'idioma'}
+
+# Lo que leen los motores al indexar un cuento
+CAMPOS_INDICE = ('id', 'usuario_id', 'perfil_id', 'titulo', 'contenido', 'personaje_principal', 'moraleja',
+                 'estado', 'en_biblioteca', 'idioma')
+
+CONFIGURACIONES = {'es': 'spanish', 'en': 'english', 'de': 'german', 'fr': 'french'}
+
+# Sufijos flexivos más comunes por idioma, de más largo a más corto
+SUFIJOS = {
+    'es': ('amientos', 'imientos', 'amiento', 'imiento', 'aciones', 'uciones', 'ación', 'ución', 'mente',
+           'ces', 'es', 'as', 'os', 'a', 'o', 'e', 's'),
+    'en': ('ational', 'ations', 'ation', 'ness', 'ings', 'ing', 'ies', 'ied', 'ed', 'ly', 'es', 's'),
+    'de': ('ungen', 'heit', 'keit', 'ung', 'ern', 'en', 'er', 'es', 'em', 'e', 'n', 's'),
+    'fr': ('ements', 'ement', 'ations', 'ation', 'euses', 'euse', 'eux', 'es', 'e', 's', 'x'),
+}
+LONGITUD_MINIMA_RAIZ = 3
+# Los mismos sufijos sin tildes, como llegan las palabras a raiz()
+_SUFIJOS_NORMALIZADOS = {idioma: tuple(normalizar(s) for s in sufijos) for idioma, sufijos in SUFIJOS.items()}
+
+# Marcas internas del resaltado: se escapa el HTML y luego se cambian por <mark>
+_INICIO, _FIN = '\x02', '\x03'
+
+
+def raiz(palabra, idioma='es'):
+    """Raíz aproximada de una palabra ya normalizada (minúsculas y sin tildes)"""
+    for sufijo in _SUFIJOS_NORMALIZADOS.get(idioma, _SUFIJOS_NORMALIZADOS['es']):
+        if palabra.endswith(sufijo) and len(palabra) - len(sufijo) >= LONGITUD_MINIMA_RAIZ:
+            return palabra[:-len(sufijo)]
+    return palabra
+
+
+def terminos(consulta):
+    return re.findall(r'\w+', normalizar(consulta))
+
+
+def resaltar(texto):
+    """Escapa el fragmento devuelto por el motor y convierte las marcas en <mark>"""
+    return html.escape(texto or '').replace(_INICIO, '<mark>').replace(_FIN, '</mark>')
+
+
+def _coincide(palabra, patrones):
+    """Como en MotorFTS5: prefijo de la raíz, o palabra exacta si es corta"""
+    return any(palabra.startswith(patron) if prefijo else palabra == patron for patron, prefijo in patrones)
+
+
+def fragmento(texto, consulta, idioma='es', palabras=30):
+    """Trozo de `texto` alrededor de la primera coincidencia, resaltado.
+
+    Para los motores que no pueden generar el fragmento en SQL: `contenido`
+    está comprimido en la base de datos (stories/fields.py).
+    """
+    patrones = [(raiz(t, idioma), True) if len(t) > LONGITUD_MINIMA_RAIZ else (t, False) for t in terminos(consulta)]
+    tokens = (texto or '').split()
+    marcas = [_coincide(re.sub(r'^\W+|\W+$', '', normalizar(token)), patrones) for token in tokens]
+    primera = marcas.index(True) if True in marcas else 0
+    desde = max(0, primera - palabras // 3)
+    hasta = desde + palabras
+    trozo = ' '.join(
+        f"{_INICIO}{token}{_FIN}" if marca else token
+        for token, marca in zip(tokens[desde:hasta], marcas[desde:hasta])
+    )
+    return resaltar(('…' if desde else '') + trozo + ('…' if hasta < len(tokens) else ''))
+
+
+def _indexable(cuento):
+    return cuento.estado == 'completado' and cuento.en_biblioteca
+
+
+class Motor:
+    """Interfaz común de los motores de búsqueda"""
+
+    nombre = 'base'
+
+    def indexar(self, cuentos):
+        """Inserta o reemplaza los cuentos indexables y quita del índice el resto"""
+        raise NotImplementedError
+
+    def eliminar(self, ids):
+        raise NotImplementedError
+
+    def vaciar(self, usuario_id=None):
+        raise NotImplementedError
+
+    def buscar(self, usuario_id, consulta, idioma='es', perfil_id=None, limite=20):
+        """[(cuento_id, puntuación, fragmento resaltado)] ordenado por relevancia"""
+        raise NotImplementedError
+
+
+class MotorFTS5(Motor):
+    nombre = 'fts5'
+    tabla = 'library_cuento_fts'
+    # Pesos de bm25 por columna: titulo, contenido, personaje_principal, moraleja, ambito
+    pesos = (10.0, 1.0, 5.0, 2.0, 0.0)
+
+    @staticmethod
+    def _ambito(usuario_id, perfil_id):
+        return f"u{usuario_id} p{perfil_id or 0}"
+
+    def indexar(self, cuentos):
+        cuentos = list(cuentos)
+        with connection.cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {self.tabla} WHERE rowid = %s", [(c.id,) for c in cuentos])
+            cursor.executemany(
+                f"INSERT INTO {self.tabla} (rowid, titulo, contenido, personaje_principal, moraleja, ambito) "
+                f"VALUES (%s, %s, %s, %s, %s, %s)",
+                [
+                    (c.id, c.titulo, c.contenido, c.personaje_principal, c.moraleja,
+                     self._ambito(c.usuario_id, c.perfil_id))
+                    for c in cuentos if _indexable(c)
+                ]
+            )
+
+    def eliminar(self, ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {self.tabla} WHERE rowid = %s", [(i,) for i in ids])
+
+    def vaciar(self, usuario_id=None):
+        with connection.cursor() as cursor:
+            if usuario_id is None:
+                cursor.execute(f"DELETE FROM {self.tabla}")
+            else:
+                cursor.execute(f"DELETE FROM {self.tabla} WHERE {self.tabla} MATCH %s",
+                               [f'ambito:"u{usuario_id}"'])
+
+    def _expresion(self, usuario_id, consulta, idioma, perfil_id):
+        # Las palabras cortas ("de", "el") se buscan exactas: como prefijo coincidirían con casi todo
+        palabras = [
+            f'"{raiz(palabra, idioma)}"*' if len(palabra) > LONGITUD_MINIMA_RAIZ else f'"{palabra}"'
+            for palabra in terminos(consulta)
+        ]
+        if not palabras:
+            return None
+        ambito = f'ambito:"u{usuario_id}"'
+        if perfil_id:
+            ambito += f' AND ambito:"p{perfil_id}"'
+        return f"{ambito} AND {{titulo contenido personaje_principal moraleja}}: ({' AND '.join(palabras)})"
+
+    def buscar(self, usuario_id, consulta, idioma='es', perfil_id=None, limite=20):
+        expresion = self._expresion(usuario_id, consulta, idioma, perfil_id)
+        if expresion is None:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid, bm25({self.tabla}, {', '.join(str(p) for p in self.pesos)}) AS puntuacion, "
+                f"snippet({self.tabla}, 1, %s, %s, '…', 16) "
+                f"FROM {self.tabla} WHERE {self.tabla} MATCH %s ORDER BY puntuacion LIMIT %s",
+                [_INICIO, _FIN, expresion, limite]
+            )
+            # bm25 devuelve valores negativos: más bajo es más relevante
+            return [(fila[0], -fila[1], resaltar(fila[2])) for fila in cursor.fetchall()]
+
+
+class MotorPostgres(Motor):
+    nombre = 'postgres'
+    tabla = 'library_cuento_busqueda'
+
+    def indexar(self, cuentos):
+        cuentos = list(cuentos)
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.tabla} WHERE cuento_id = ANY(%s)", [[c.id for c in cuentos]])
+            cursor.executemany(
+                f"""
+                INSERT INTO {self.tabla} (cuento_id, usuario_id, perfil_id, configuracion, documento)
+                SELECT %(id)s, %(usuario)s, %(perfil)s, cfg,
+                       setweight(to_tsvector(cfg, %(titulo)s), 'A')
+                       || setweight(to_tsvector(cfg, %(personaje)s), 'B')
+                       || setweight(to_tsvector(cfg, %(moraleja)s), 'C')
+                       || setweight(to_tsvector(cfg, %(contenido)s), 'D')
+                FROM (SELECT %(configuracion)s::regconfig AS cfg) AS c
+                """,
+                [
+                    {'id': c.id, 'usuario': c.usuario_id, 'perfil': c.perfil_id,
+                     'configuracion': CONFIGURACIONES.get(c.idioma, 'simple'),
+                     'titulo': c.titulo, 'personaje': c.personaje_principal,
+                     'moraleja': c.moraleja, 'contenido': c.contenido}
+                    for c in cuentos if _indexable(c)
+                ]
+            )
+
+    def eliminar(self, ids):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.tabla} WHERE cuento_id = ANY(%s)", [list(ids)])
+
+    def vaciar(self, usuario_id=None):
+        with connection.cursor() as cursor:
+            if usuario_id is None:
+                cursor.execute(f"TRUNCATE {self.tabla}")
+            else:
+                cursor.execute(f"DELETE FROM {self.tabla} WHERE usuario_id = %s", [usuario_id])
+
+    def buscar(self, usuario_id, consulta, idioma='es', perfil_id=None, limite=20):
+        if not terminos(consulta):
+            return []
+        # La consulta se analiza con la configuración del idioma pedido y con
+        # 'simple', así sigue siendo una constante que puede usar el índice GIN
+        filtro_perfil = "AND b.perfil_id = %(perfil)s" if perfil_id else ""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT b.cuento_id, ts_rank_cd(b.documento, q.consulta) AS puntuacion
+                FROM {self.tabla} b,
+                     (SELECT websearch_to_tsquery(%(configuracion)s::regconfig, %(texto)s)
+                             || websearch_to_tsquery('simple', %(texto)s) AS consulta) q
+                WHERE b.usuario_id = %(usuario)s {filtro_perfil}
+                  AND b.documento @@ q.consulta
+                ORDER BY puntuacion DESC
+                LIMIT %(limite)s
+                """,
+                {'configuracion': CONFIGURACIONES.get(idioma, 'simple'),
+                 'texto': consulta, 'usuario': usuario_id, 'perfil': perfil_id, 'limite': limite}
+            )
+            filas = cursor.fetchall()
+        # ts_headline necesitaría el texto en claro: el fragmento se saca en Python
+        contenidos = dict(Cuento.objects.filter(id__in=[f[0] for f in filas]).values_list('id', 'contenido'))
+        return [(cuento_id, puntuacion, fragmento(contenidos.get(cuento_id), consulta, idioma))
+                for cuento_id, puntuacion in filas]
+
+
+class MotorLike(Motor):
+    """Sin índice: para bases de datos sin motor de texto completo soportado.
+
+    `contenido` está comprimido y no admite LIKE, así que se recorren en Python
+    los cuentos de la biblioteca del usuario, de los más recientes hacia atrás.
+    """
+
+    nombre = 'like'
+    lote = 200
+
+    def indexar(self, cuentos):
+        pass
+
+    def eliminar(self, ids):
+        pass
+
+    def vaciar(self, usuario_id=None):
+        pass
+
+    def buscar(self, usuario_id, consulta, idioma='es', perfil_id=None, limite=20):
+        palabras = terminos(consulta)
+        if not palabras:
+            return []
+        cuentos = Cuento.objects.filter(usuario_id=usuario_id, estado='completado', en_biblioteca=True)
+        if perfil_id:
+            cuentos = cuentos.filter(perfil_id=perfil_id)
+        cuentos = cuentos.only('id', 'titulo', 'contenido', 'personaje_principal', 'moraleja')
+
+        encontrados = []
+        for cuento in cuentos.order_by('-fecha_creacion', '-id').iterator(chunk_size=self.lote):
+            texto = normalizar(' '.join([cuento.titulo, cuento.personaje_principal, cuento.moraleja,
+                                         cuento.contenido or '']))
+            if all(palabra in texto for palabra in palabras):
+                encontrados.append((cuento.id, 0.0, fragmento(cuento.contenido, consulta, idioma)))
+                if len(encontrados) >= limite:
+                    break
+        return encontrados
+
+
+MOTORES = {
+    'fts5': MotorFTS5,
+    'postgres': MotorPostgres,
+    'like': MotorLike,
+}
+
+MOTOR_POR_BASE_DE_DATOS = {
+    'sqlite': 'fts5',
+    'postgresql': 'postgres',
+}
+
+
+def motor():
+    """Motor configurado en LIBRARY_SEARCH_ENGINE o el que corresponde a la base de datos"""
+    nombre = getattr(settings, 'LIBRARY_SEARCH_ENGINE', None) or MOTOR_POR_BASE_DE_DATOS.get(connection.vendor, 'like')
+    return MOTORES[nombre]()
+
+
+def buscar(usuario, consulta, idioma='es', perfil_id=None, limite=20):
+    """Cuentos del usuario que coinciden con `consulta`, con su puntuación y fragmento"""
+    resultados = motor().buscar(usuario.id, consulta, idioma, perfil_id, limite)
+    por_id = Cuento.objects.filter(
+        id__in=[fila[0] for fila in resultados], usuario=usuario
+    ).cards().in_bulk()
+    return [
+        {'cuento': por_id[cuento_id], 'puntuacion': puntuacion, 'fragmento': fragmento}
+        for cuento_id, puntuacion, fragmento in resultados if cuento_id in por_id
+    ]
+
+
+def cuento_guardado(cuento):
+    """Llamado desde post_save; un fallo del índice no debe impedir guardar el cuento"""
+    try:
+        with transaction.atomic():
+            motor().indexar([cuento])
+    except Exception as e:
+        logger.error(f"Error indexando el cuento {cuento.id} para búsqueda: {str(e)}")
+
+
+def cuento_eliminado(cuento_id):
+    try:
+        with transaction.atomic():
+            motor().eliminar([cuento_id])
+    except Exception as e:
+        logger.error(f"Error quitando el cuento {cuento_id} del índice de búsqueda: {str(e)}")
+
+
+def cuentos_modificados(ids):
+    """Reindexa un conjunto de cuentos de una vez (operaciones en lote de library/bulk.py)"""
+    with transaction.atomic():
+        motor().indexar(Cuento.objects.filter(id__in=ids).only(*CAMPOS_INDICE))
+
+
+def cuentos_eliminados(ids):
+    with transaction.atomic():
+        motor().eliminar(ids)
+
+
+def reconstruir(usuario_id=None, lote=1000):
+    """Rehace el índice (de un usuario o completo); devuelve los cuentos indexados"""
+    actual = motor()
+    cuentos = Cuento.objects.filter(estado='completado', en_biblioteca=True).only(*CAMPOS_INDICE).order_by('id')
+    if usuario_id is not None:
+        cuentos = cuentos.filter(usuario_id=usuario_id)
+
+    total = 0
+    with transaction.atomic():
+        actual.vaciar(usuario_id)
+        pendientes = []
+        for cuento in cuentos.iterator(chunk_size=lote):
+            pendientes.append(cuento)
+            if len(pendientes) >= lote:
+                actual.indexar(pendientes)
+                total += len(pendientes)
+                pendientes = []
+        if pendientes:
+            actual.indexar(pendientes)
+            total += len(pendientes)
+    return total
@@ -0,0 +1,88 @@
+"""Motor de agregación de estadísticas por día y por mes.
+
+Cada métrica se resuelve con un único GROUP BY sobre la fecha local
+(America/Guayaquil) y los huecos se rellenan con ceros en Python, así que el
+número de consultas no depende ni del rango ni del volumen de datos. Funciona
+igual en SQLite y en PostgreSQL. Los DateField, como `fecha` de
+DailyReadingRollup, ya están en día local y se agrupan tal cual.
+"""
+from datetime import datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+from django.db.models import Count, F
+from django.db.models.functions import TruncDate, TruncMonth
+from django.utils import timezone
+
+ZONA_LOCAL = ZoneInfo('America/Guayaquil')
+
+
+def hoy_local():
+    return timezone.localtime(timezone.now(), ZONA_LOCAL).date()
+
+
+def inicio_del_dia(dia):
+    """Medianoche local de `dia` como datetime aware"""
+    return datetime.combine(dia, time.min, tzinfo=ZONA_LOCAL)
+
+
+def inicio_de_mes(dia, meses_atras=0):
+    mes = dia.month - 1 - meses_atras
+    return dia.replace(year=dia.year + mes // 12, month=mes % 12 + 1, day=1)
+
+
+def dias_hasta(hasta, cantidad):
+    """Las `cantidad` fechas que terminan en `hasta`, en orden ascendente"""
+    return [hasta - timedelta(days=i) for i in range(cantidad - 1, -1, -1)]
+
+
+def meses_hasta(hasta, cantidad):
+    """Primer día de los `cantidad` meses que terminan en el de `hasta`"""
+    return [inicio_de_mes(hasta, i) for i in range(cantidad - 1, -1, -1)]
+
+
+def _como_fecha(cubeta):
+    # TruncMonth sobre un DateTimeField devuelve datetime; TruncDate devuelve date
+    if isinstance(cubeta, datetime):
+        if timezone.is_aware(cubeta):
+            cubeta = timezone.localtime(cubeta, ZONA_LOCAL)
+        return cubeta.date()
+    return cubeta
+
+
+def _es_fecha(queryset, campo_fecha):
+    """True si el campo es un DateField (ya guarda el día local, p. ej. los rollups)"""
+    return queryset.model._meta.get_field(campo_fecha).get_internal_type() == 'DateField'
+
+
+def agrupar(queryset, campo_fecha, truncado, desde, hasta, agregado=None):
+    """{fecha local: valor} con una sola consulta GROUP BY; `hasta` es exclusivo"""
+    if _es_fecha(queryset, campo_fecha):
+        cubeta = F(campo_fecha) if truncado is TruncDate else truncado(campo_fecha)
+    else:
+        desde, hasta = inicio_del_dia(desde), inicio_del_dia(hasta)
+        cubeta = truncado(campo_fecha, tzinfo=ZONA_LOCAL)
+
+    filas = (
+        queryset.filter(**{f'{campo_fecha}__gte': desde, f'{campo_fecha}__lt': hasta})
+        .annotate(_cubeta=cubeta)
+        .values('_cubeta')
+        .annotate(_valor=agregado or Count('id'))
+        .order_by()
+    )
+    return {_como_fecha(fila['_cubeta']): fila['_valor'] or 0 for fila in filas}
+
+
+def serie_diaria(queryset, campo_fecha, dias, agregado=None, hasta=None):
+    """[(fecha, valor)] de los últimos `dias` días locales, con ceros en los huecos"""
+    hasta = hasta or hoy_local()
+    fechas = dias_hasta(hasta, dias)
+    valores = agrupar(queryset, campo_fecha, TruncDate, fechas[0], hasta + timedelta(days=1), agregado)
+    return [(fecha, valores.get(fecha, 0)) for fecha in fechas]
+
+
+def serie_mensual(queryset, campo_fecha, meses, agregado=None, hasta=None):
+    """[(primer día del mes, valor)] de los últimos `meses` meses, con ceros en los huecos"""
+    hasta = hasta or hoy_local()
+    fechas = meses_hasta(hasta, meses)
+    valores = agrupar(queryset, campo_fecha, TruncMonth, fechas[0], hasta + timedelta(days=1), agregado)
+    return [(fecha, valores.get(fecha, 0)) for fecha in fechas]
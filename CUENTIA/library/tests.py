@@ -1,3 +1,1050 @@
-from django.test import TestCase
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import connection
+from django.db.models import Sum
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from CUENTIA import metrics
+from stories.fields import FORMATO_PLANO, FORMATO_ZLIB, descomprimir
+from stories.jobs import guardar_avance
+from stories.models import Cuento, EstadisticaLectura
+from user.models import Perfil
+from . import autocomplete, cache_utils, facets, heartbeats, recommendations, search
+from .pagination import CursorInvalido, decodificar_cursor, pagina
+from .models import CuentoEliminado, DailyReadingRollup, LibraryManager
+from .rollups import CAMPOS, reconstruir
+from .stats import ZONA_LOCAL, hoy_local, serie_diaria, serie_mensual
+
+
+def _local(dia, hora=12, minuto=0):
+    return datetime(dia.year, dia.month, dia.day, hora, minuto, tzinfo=ZONA_LOCAL)
+
+
+def _consultas(funcion):
+    """(número de consultas, resultado) de ejecutar `funcion`"""
+    with CaptureQueriesContext(connection) as contexto:
+        resultado = funcion()
+    return len(contexto.captured_queries), resultado
+
+
+class SeriesEstadisticasTests(TestCase):
+    """Las series de estadísticas se resuelven con un GROUP BY, sin importar el volumen"""
+
+    def setUp(self):
+        self.usuario = User.objects.create_user('lector', password='clave-segura-123')
+        self.hoy = hoy_local()
+
+    def _crear_cuentos(self, cantidad, dias=30):
+        cuentos = Cuento.objects.bulk_create([
+            Cuento(usuario=self.usuario, titulo=f'Cuento {i}', personaje_principal='Luna',
+                   tema='aventura', edad='4-6', longitud='corto', estado='completado',
+                   en_biblioteca=True)
+            for i in range(cantidad)
+        ])
+        # fecha_creacion es auto_now_add: se reparte con update() por cuento
+        for i, cuento in enumerate(Cuento.objects.filter(usuario=self.usuario).order_by('id')):
+            Cuento.objects.filter(id=cuento.id).update(
+                fecha_creacion=_local(self.hoy - timedelta(days=i % dias))
+            )
+        return cuentos
+
+    def _crear_lecturas(self, cantidad, dias=30):
+        cuento = Cuento.objects.create(usuario=self.usuario, titulo='Base', personaje_principal='Sol',
+                                       tema='amistad', edad='4-6', longitud='corto')
+        EstadisticaLectura.objects.bulk_create([
+            EstadisticaLectura(usuario=self.usuario, cuento=cuento, tiempo_lectura=60, tipo_lectura='texto')
+            for _ in range(cantidad)
+        ])
+        for i, estadistica in enumerate(EstadisticaLectura.objects.filter(usuario=self.usuario).order_by('id')):
+            EstadisticaLectura.objects.filter(id=estadistica.id).update(
+                fecha_lectura=_local(self.hoy - timedelta(days=i % dias))
+            )
+
+    def test_serie_diaria_una_consulta_en_cualquier_volumen(self):
+        cuentos = Cuento.objects.filter(usuario=self.usuario)
+
+        self._crear_cuentos(5)
+        pocas, serie = _consultas(lambda: serie_diaria(cuentos, 'fecha_creacion', 30))
+        self.assertEqual(len(serie), 30)
+        self.assertEqual(sum(valor for _, valor in serie), 5)
+
+        self._crear_cuentos(200)
+        muchas, serie = _consultas(lambda: serie_diaria(cuentos, 'fecha_creacion', 30))
+        self.assertEqual(sum(valor for _, valor in serie), 205)
+
+        self.assertEqual(pocas, 1)
+        self.assertEqual(muchas, pocas)
+
+    def test_serie_mensual_una_consulta(self):
+        self._crear_lecturas(90, dias=90)
+        estadisticas = EstadisticaLectura.objects.filter(usuario=self.usuario)
+
+        with self.assertNumQueries(1):
+            serie = serie_mensual(estadisticas, 'fecha_lectura', 12, agregado=Sum('tiempo_lectura'))
+
+        self.assertEqual(len(serie), 12)
+        self.assertEqual(serie[-1][0], self.hoy.replace(day=1))
+        self.assertEqual(sum(valor for _, valor in serie), 90 * 60)
+
+    def test_rellena_con_ceros_los_dias_sin_datos(self):
+        Cuento.objects.create(usuario=self.usuario, titulo='Único', personaje_principal='Luna',
+                              tema='aventura', edad='4-6', longitud='corto')
+        Cuento.objects.filter(usuario=self.usuario).update(fecha_creacion=_local(self.hoy - timedelta(days=3)))
+
+        serie = serie_diaria(Cuento.objects.filter(usuario=self.usuario), 'fecha_creacion', 7)
+
+        self.assertEqual([fecha for fecha, _ in serie], [self.hoy - timedelta(days=i) for i in range(6, -1, -1)])
+        self.assertEqual([valor for _, valor in serie], [0, 0, 0, 1, 0, 0, 0])
+
+    def test_agrupa_por_dia_local_y_no_por_utc(self):
+        ayer = self.hoy - timedelta(days=1)
+        Cuento.objects.create(usuario=self.usuario, titulo='Nocturno', personaje_principal='Búho',
+                              tema='misterio', edad='4-6', longitud='corto')
+        # 23:30 en Guayaquil ya es el día siguiente en UTC
+        Cuento.objects.filter(usuario=self.usuario).update(fecha_creacion=_local(ayer, 23, 30))
+
+        serie = dict(serie_diaria(Cuento.objects.filter(usuario=self.usuario), 'fecha_creacion', 7))
+
+        self.assertEqual(serie[ayer], 1)
+        self.assertEqual(serie[self.hoy], 0)
+
+    def test_get_profile_stats_numero_de_consultas_constante(self):
+        self.client.login(username='lector', password='clave-segura-123')
+        url = reverse('library:all_stats')
+
+        self._crear_cuentos(3)
+        self._crear_lecturas(3)
+        pocas, respuesta = _consultas(lambda: self.client.get(url, {'period': 'month'}))
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(len(respuesta.json()['activity_data']), 30)
+
+        self._crear_cuentos(150)
+        self._crear_lecturas(150)
+        muchas, respuesta = _consultas(lambda: self.client.get(url, {'period': 'month'}))
+        self.assertEqual(respuesta.status_code, 200)
+
+        self.assertEqual(muchas, pocas)
+
+
+class DailyReadingRollupTests(TestCase):
+    """El rollup incremental coincide siempre con una reconstrucción desde cero"""
+
+    def setUp(self):
+        self.usuario = User.objects.create_user('lectora', password='clave-segura-123')
+        self.perfil = Perfil.objects.create(usuario=self.usuario, nombre='Ana', edad=6)
+        self.hoy = hoy_local()
+
+    def _cuento(self, **campos):
+        datos = dict(usuario=self.usuario, perfil=self.perfil, titulo='Cuento', personaje_principal='Luna',
+                     tema='aventura', edad='4-6', longitud='corto', estado='completado', en_biblioteca=True)
+        datos.update(campos)
+        return Cuento.objects.create(**datos)
+
+    def _leer(self, cuento, tipo='texto', segundos=60, dias_atras=0):
+        lectura = EstadisticaLectura.objects.create(
+            usuario=self.usuario, cuento=cuento, perfil=cuento.perfil, tipo_lectura=tipo, tiempo_lectura=segundos
+        )
+        if dias_atras:
+            # fecha_lectura es auto_now_add: se mueve con un save() para que pase por el rollup
+            lectura.fecha_lectura = _local(self.hoy - timedelta(days=dias_atras))
+            lectura.save()
+        return lectura
+
+    def _filas(self):
+        return {
+            (fila['perfil_id'], fila['fecha']): {campo: fila[campo] for campo in CAMPOS}
+            for fila in DailyReadingRollup.objects.filter(usuario=self.usuario).values('perfil_id', 'fecha', *CAMPOS)
+            if any(fila[campo] for campo in CAMPOS)
+        }
+
+    def _comprobar_igual_a_reconstruccion(self):
+        incremental = self._filas()
+        reconstruir(self.usuario.id)
+        self.assertEqual(incremental, self._filas())
+
+    def test_lecturas_y_cuentos_se_suman_al_dia_local(self):
+        cuento = self._cuento()
+        otro = self._cuento(titulo='Otro')
+        self._leer(cuento, 'texto', 120)
+        self._leer(cuento, 'audio', 30)
+        self._leer(otro, 'descarga', 0)
+        self._leer(cuento, 'biblioteca', 10, dias_atras=1)
+
+        fila = DailyReadingRollup.objects.get(usuario=self.usuario, perfil=self.perfil, fecha=self.hoy)
+        self.assertEqual(fila.segundos_lectura, 150)
+        self.assertEqual(fila.sesiones, 3)
+        self.assertEqual(fila.cuentos_leidos, 2)
+        self.assertEqual(fila.cuentos_creados, 2)
+        self.assertEqual((fila.lecturas_texto, fila.lecturas_audio, fila.lecturas_descarga), (1, 1, 1))
+        self._comprobar_igual_a_reconstruccion()
+
+    def test_modificar_y_borrar_mantienen_el_rollup(self):
+        cuento = self._cuento()
+        lectura = self._leer(cuento, 'texto', 60)
+        self._leer(cuento, 'texto', 60, dias_atras=2)
+
+        lectura.tiempo_lectura += 45
+        lectura.save()
+        lectura.fecha_lectura = _local(self.hoy - timedelta(days=1))
+        lectura.save()
+        cuento.marcar_como_leido()  # update_fields sin campos del rollup
+        self._comprobar_igual_a_reconstruccion()
+
+        EstadisticaLectura.objects.filter(cuento=cuento).delete()
+        self._comprobar_igual_a_reconstruccion()
+
+        cuento.delete()
+        self.assertEqual(self._filas(), {})
+
+    def test_cuento_cuenta_al_entrar_en_biblioteca(self):
+        cuento = self._cuento(en_biblioteca=False)
+        self.assertEqual(self._filas(), {})
+
+        cuento.guardar_en_biblioteca()
+        self.assertEqual(self._filas()[(self.perfil.id, self.hoy)]['cuentos_creados'], 1)
+        self._comprobar_igual_a_reconstruccion()
+
+    def test_borrar_perfil_reconstruye_el_usuario(self):
+        cuento = self._cuento()
+        self._leer(cuento, 'texto', 90)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.perfil.delete()
+
+        self.assertEqual(self._filas()[(None, self.hoy)]['segundos_lectura'], 90)
+        self._comprobar_igual_a_reconstruccion()
+
+    def test_get_profile_stats_lee_el_rollup(self):
+        cuento = self._cuento()
+        for dias_atras in range(3):
+            self._leer(cuento, 'texto', 60, dias_atras=dias_atras)
+        self.client.login(username='lectora', password='clave-segura-123')
+        url = reverse('library:profile_stats', args=[self.perfil.id])
+
+        pocas, respuesta = _consultas(lambda: self.client.get(url, {'period': 'week'}))
+        datos = respuesta.json()
+        self.assertEqual(datos['total_stories'], 1)
+        self.assertEqual(sum(punto['seconds'] for punto in datos['reading_progress']), 180)
+
+        # Más historial fuera del rango no cambia el número de consultas
+        for dias_atras in range(30, 200):
+            self._leer(cuento, 'audio', 10, dias_atras=dias_atras)
+        muchas, _ = _consultas(lambda: self.client.get(url, {'period': 'week'}))
+        self.assertEqual(muchas, pocas)
+
+
+@override_settings(READING_HEARTBEAT_FLUSH_SECONDS=3600)
+class LatidosLecturaTests(TestCase):
+    """Los latidos se acumulan en memoria y se vuelcan en lote"""
+
+    def setUp(self):
+        heartbeats.detener()
+        self.usuario = User.objects.create_user('lector', password='clave-segura-123')
+        self.perfil = Perfil.objects.create(usuario=self.usuario, nombre='Leo', edad=7)
+        self.cuento = Cuento.objects.create(usuario=self.usuario, perfil=self.perfil, titulo='Cuento',
+                                            personaje_principal='Luna', tema='aventura', edad='4-6',
+                                            longitud='corto', estado='completado', en_biblioteca=True)
+
+    def tearDown(self):
+        heartbeats.detener()
+
+    def test_registrar_no_consulta_y_volcar_acumula(self):
+        with self.assertNumQueries(0):
+            heartbeats.registrar(self.usuario.id, [{'c': self.cuento.id, 's': 30, 'n': 1}])
+            heartbeats.registrar(self.usuario.id, [{'c': self.cuento.id, 's': 30}])
+        heartbeats.volcar()
+
+        heartbeats.registrar(self.usuario.id, [{'c': self.cuento.id, 's': 15, 'p': self.perfil.id}])
+        heartbeats.volcar()
+
+        estadistica = EstadisticaLectura.objects.get(cuento=self.cuento)
+        self.assertEqual(estadistica.tiempo_lectura, 75)
+        self.assertEqual(estadistica.perfil, self.perfil)
+        self.cuento.refresh_from_db()
+        self.assertEqual(self.cuento.veces_leido, 1)
+
+        fila = DailyReadingRollup.objects.get(usuario=self.usuario, perfil=self.perfil)
+        self.assertEqual((fila.segundos_lectura, fila.sesiones, fila.cuentos_leidos), (75, 1, 1))
+
+    def test_descarta_cuentos_ajenos_y_eventos_invalidos(self):
+        intruso = User.objects.create_user('intruso', password='clave-segura-123')
+        heartbeats.registrar(intruso.id, [{'c': self.cuento.id, 's': 30}, {'c': 'x'}, {'c': self.cuento.id, 's': -5}])
+        heartbeats.volcar()
+
+        self.assertFalse(EstadisticaLectura.objects.exists())
+        self.assertEqual(heartbeats.pendientes(), 0)
+
+    def test_endpoint_antiguo_pasa_por_el_buffer(self):
+        self.client.login(username='lector', password='clave-segura-123')
+        url = reverse('library:update_reading_time')
+        with self.assertNumQueries(2):
+            # Solo la sesión y el usuario; ni cuento, ni perfil, ni estadística por petición
+            respuesta = self.client.post(url, {'cuento_id': self.cuento.id, 'tiempo_lectura': 40},
+                                         content_type='application/json')
+        self.assertEqual(respuesta.json()['tiempo_lectura'], 40)
+        self.client.post(url, {'cuento_id': self.cuento.id, 'tiempo_lectura': 5}, content_type='application/json')
+        self.assertEqual(self.client.post(url, {'cuento_id': self.cuento.id}, content_type='application/json')
+                         .status_code, 400)
+        self.assertFalse(EstadisticaLectura.objects.exists())
+
+        heartbeats.volcar()
+        self.assertEqual(EstadisticaLectura.objects.get(cuento=self.cuento).tiempo_lectura, 45)
+        self.cuento.refresh_from_db()
+        self.assertEqual(self.cuento.veces_leido, 1)
+
+    def test_send_beacon_con_token_en_el_formulario(self):
+        cliente = Client(enforce_csrf_checks=True)
+        cliente.login(username='lector', password='clave-segura-123')
+        cliente.get(reverse('library:reading_tracker'))
+        token = cliente.cookies['csrftoken'].value
+
+        respuesta = cliente.post(reverse('library:reading_heartbeat'), {
+            'csrfmiddlewaretoken': token,
+            'eventos': '[{"c": %d, "s": 12}]' % self.cuento.id,
+        })
+        self.assertEqual(respuesta.status_code, 204)
+        heartbeats.volcar()
+        self.assertEqual(EstadisticaLectura.objects.get(cuento=self.cuento).tiempo_lectura, 12)
+
+
+CACHES_PRUEBAS = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'pruebas-datos'},
+    'versiones': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'pruebas-versiones'},
+}
+
+
+@override_settings(CACHES=CACHES_PRUEBAS)
+class PaginaBibliotecaTests(TestCase):
+    """La biblioteca hace las mismas consultas con 10 o con 10.000 cuentos"""
+
+    def setUp(self):
+        caches['default'].clear()
+        caches['versiones'].clear()
+        self.usuario = User.objects.create_user('biblio', password='clave-segura-123')
+        self.perfiles = [
+            Perfil.objects.create(usuario=self.usuario, nombre=nombre, edad=edad)
+            for nombre, edad in (('Ana', 5), ('Leo', 8))
+        ]
+        self.cliente = Client()
+        self.cliente.login(username='biblio', password='clave-segura-123')
+        self.creados = 0
+
+    def _crear_cuentos(self, hasta):
+        temas = ['aventura', 'fantasia', 'animales']
+        Cuento.objects.bulk_create([
+            Cuento(usuario=self.usuario, perfil=self.perfiles[i % 2], titulo=f'Cuento {i}',
+                   personaje_principal='Luna', tema=temas[i % 3], edad='4-6', longitud='corto',
+                   estado='completado', en_biblioteca=True)
+            for i in range(self.creados, hasta)
+        ], batch_size=1000)
+        self.creados = hasta
+        # bulk_create no emite señales
+        facets.invalidar(self.usuario.id)
+
+    def _consultas_pagina(self, **parametros):
+        with CaptureQueriesContext(connection) as contexto:
+            respuesta = self.cliente.get(reverse('library:library'), parametros)
+        self.assertEqual(respuesta.status_code, 200)
+        return len(contexto.captured_queries), respuesta
+
+    def test_consultas_constantes_con_cache_fria_y_caliente(self):
+        medidas = []
+        for total in (10, 1000, 10000):
+            self._crear_cuentos(total)
+            fria, respuesta = self._consultas_pagina()
+            self.assertEqual(respuesta.context['total_cuentos'], total)
+            caliente, _ = self._consultas_pagina(perfil=self.perfiles[0].id, tema='aventura')
+            medidas.append((fria, caliente))
+
+        self.assertEqual(len(set(medidas)), 1, medidas)
+        fria, caliente = medidas[0]
+        # Las facetas (perfiles + GROUP BY) solo se consultan con la caché fría
+        self.assertEqual(fria - caliente, 2)
+        self.assertLessEqual(caliente, 5)
+
+    def test_facetas_por_perfil_y_tema(self):
+        self._crear_cuentos(12)
+        _, respuesta = self._consultas_pagina(perfil=self.perfiles[1].id)
+        self.assertEqual(respuesta.context['perfil_seleccionado']['nombre'], 'Leo')
+        self.assertEqual(respuesta.context['total_cuentos'], 6)
+        self.assertEqual(respuesta.context['temas_disponibles'], ['animales', 'aventura', 'fantasia'])
+
+        _, respuesta = self._consultas_pagina(perfil=self.perfiles[1].id, tema='fantasia')
+        self.assertEqual(respuesta.context['total_cuentos'], 2)
+        self.assertEqual(len(respuesta.context['cuentos']), 2)
+
+    def test_guardar_un_cuento_invalida_las_facetas(self):
+        self._crear_cuentos(3)
+        self.assertEqual(facets.facetas(self.usuario).temas(), ['animales', 'aventura', 'fantasia'])
+
+        cuento = Cuento.objects.filter(usuario=self.usuario, tema='animales').get()
+        cuento.tema = 'misterio'
+        with self.captureOnCommitCallbacks(execute=True):
+            cuento.save()
+        self.assertEqual(facets.facetas(self.usuario).temas(), ['aventura', 'fantasia', 'misterio'])
+
+        # Cambios que no afectan a las facetas no invalidan
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            cuento.save(update_fields=['veces_leido'])
+        self.assertEqual(callbacks, [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Perfil.objects.create(usuario=self.usuario, nombre='Zoe', edad=4)
+        self.assertEqual([perfil['nombre'] for perfil in facets.facetas(self.usuario).perfiles], ['Ana', 'Leo', 'Zoe'])
+
+
+@override_settings(CACHES=CACHES_PRUEBAS)
+class AutocompletadoTitulosTests(TestCase):
+    """Las sugerencias salen del índice por usuario, sin consultas por tecla"""
+
+    def setUp(self):
+        caches['default'].clear()
+        caches['versiones'].clear()
+        self.usuario = User.objects.create_user('autor', password='clave-segura-123')
+        self.perfil = Perfil.objects.create(usuario=self.usuario, nombre='Ana', edad=5)
+        for titulo, tema in (('El Dragón Azul', 'fantasia'), ('Dragones del río', 'aventura'),
+                             ('La luna dormilona', 'fantasia'), ('Un búho sabio', 'animales')):
+            Cuento.objects.create(usuario=self.usuario, perfil=self.perfil, titulo=titulo, tema=tema,
+                                  personaje_principal='Luna', edad='4-6', longitud='corto',
+                                  estado='completado', en_biblioteca=True)
+
+    def test_normaliza_tildes_y_prioriza_el_inicio_del_titulo(self):
+        self.assertEqual(autocomplete.normalizar('  El Dragón  AZUL '), 'el dragon azul')
+        self.assertEqual(autocomplete.sugerencias(self.usuario, 'drag'), ['Dragones del río', 'El Dragón Azul'])
+        self.assertEqual(autocomplete.sugerencias(self.usuario, 'BUHO'), ['Un búho sabio'])
+        self.assertEqual(autocomplete.sugerencias(self.usuario, 'rio'), ['Dragones del río'])
+        self.assertEqual(autocomplete.sugerencias(self.usuario, 'drag', tema='fantasia'), ['El Dragón Azul'])
+
+    def test_sin_consultas_con_el_indice_caliente(self):
+        autocomplete.sugerencias(self.usuario, 'd')
+        with self.assertNumQueries(0):
+            for consulta in ('l', 'lu', 'lun', 'luna'):
+                self.assertEqual(autocomplete.sugerencias(self.usuario, consulta), ['La luna dormilona'])
+
+    def test_se_sincroniza_al_guardar_y_borrar(self):
+        self.assertEqual(autocomplete.sugerencias(self.usuario, 'dormi'), ['La luna dormilona'])
+        cuento = Cuento.objects.get(titulo='La luna dormilona')
+        cuento.titulo = 'La luna despierta'
+        with self.captureOnCommitCallbacks(execute=True):
+            cuento.save()
+        self.assertEqual(autocomplete.sugerencias(self.usuario, 'dormi'), [])
+        self.assertEqual(autocomplete.sugerencias(self.usuario, 'desp'), ['La luna despierta'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            cuento.delete()
+        self.assertEqual(autocomplete.sugerencias(self.usuario, 'luna'), [])
+
+    def test_vista_de_titulos(self):
+        cliente = Client()
+        cliente.login(username='autor', password='clave-segura-123')
+        respuesta = cliente.get(reverse('library:search_titles'), {'q': 'dra', 'profile_id': self.perfil.id})
+        self.assertEqual(respuesta.json()['titles'], ['Dragones del río', 'El Dragón Azul'])
+
+
+class BusquedaTextoCompletoTests(TestCase):
+    """El índice de texto completo sigue a los cuentos y busca por contenido"""
+
+    def setUp(self):
+        self.usuario = User.objects.create_user('madre', password='clave-segura-123')
+        self.perfiles = [Perfil.objects.create(usuario=self.usuario, nombre=nombre, edad=6) for nombre in ('Ana', 'Leo')]
+        self.dragon = self._cuento('La cueva', 'Había una vez un dragón que cuidaba un tesoro escondido.',
+                                   perfil=self.perfiles[0])
+        self.tortuga = self._cuento('El gran viaje', 'Una tortuga muy lenta cruzó el desierto.',
+                                    perfil=self.perfiles[1], moraleja='La paciencia siempre gana.')
+
+    def _cuento(self, titulo, contenido, usuario=None, **campos):
+        datos = dict(usuario=usuario or self.usuario, titulo=titulo, contenido=contenido,
+                     personaje_principal='Luna', tema='aventura', edad='4-6', longitud='corto',
+                     estado='completado', en_biblioteca=True)
+        datos.update(campos)
+        return Cuento.objects.create(**datos)
+
+    def _ids(self, consulta, **opciones):
+        return [resultado['cuento'].id for resultado in search.buscar(self.usuario, consulta, **opciones)]
+
+    def test_busca_por_contenido_y_moraleja_con_raices(self):
+        self.assertEqual(self._ids('dragones'), [self.dragon.id])
+        self.assertEqual(self._ids('TESORO dragon'), [self.dragon.id])
+        self.assertEqual(self._ids('paciencia'), [self.tortuga.id])
+        self.assertEqual(self._ids('unicornio'), [])
+
+        fragmento = search.buscar(self.usuario, 'tesoro')[0]['fragmento']
+        self.assertIn('<mark>tesoro</mark>', fragmento)
+
+    def test_ambito_de_usuario_y_perfil(self):
+        vecino = User.objects.create_user('vecino', password='clave-segura-123')
+        self._cuento('Otro dragón', 'Un dragón ajeno.', usuario=vecino)
+        self.assertEqual(self._ids('dragón'), [self.dragon.id])
+        self.assertEqual(self._ids('dragón', perfil_id=self.perfiles[1].id), [])
+
+    def test_sigue_los_cambios_del_cuento(self):
+        self.tortuga.contenido = 'Un dragón de papel voló sobre la ciudad.'
+        self.tortuga.save()
+        self.assertEqual(sorted(self._ids('dragón')), sorted([self.dragon.id, self.tortuga.id]))
+
+        self.dragon.en_biblioteca = False
+        self.dragon.save(update_fields=['en_biblioteca'])
+        self.assertEqual(self._ids('dragón'), [self.tortuga.id])
+
+        self.tortuga.delete()
+        self.assertEqual(self._ids('dragón'), [])
+
+        self.assertEqual(search.reconstruir(), 0)
+        self.dragon.en_biblioteca = True
+        self.dragon.save()
+        self.assertEqual(search.reconstruir(self.usuario.id), 1)
+        self.assertEqual(self._ids('dragón'), [self.dragon.id])
+
+    def test_vista_devuelve_resultados_con_fragmento(self):
+        cliente = Client()
+        cliente.login(username='madre', password='clave-segura-123')
+        respuesta = cliente.get(reverse('library:full_text_search'), {'q': 'desierto'})
+        datos = respuesta.json()
+        self.assertTrue(datos['success'])
+        self.assertEqual([r['id'] for r in datos['results']], [self.tortuga.id])
+        self.assertIn('<mark>desierto</mark>', datos['results'][0]['snippet'])
+
+
+@override_settings(CACHES=CACHES_PRUEBAS)
+class PaginacionCursorTests(TestCase):
+    """El scroll infinito recorre la biblioteca sin repetir ni saltarse cuentos"""
+
+    def setUp(self):
+        caches['default'].clear()
+        caches['versiones'].clear()
+        self.usuario = User.objects.create_user('scroll', password='clave-segura-123')
+        self.cliente = Client()
+        self.cliente.login(username='scroll', password='clave-segura-123')
+        Cuento.objects.bulk_create([
+            Cuento(usuario=self.usuario, titulo=f'Cuento {i}', personaje_principal='Luna', tema='aventura',
+                   edad='4-6', longitud='corto', estado='completado', en_biblioteca=True, es_favorito=i % 2 == 0)
+            for i in range(30)
+        ])
+        # Empates de fecha a propósito: el id decide el orden dentro de cada grupo
+        for indice, cuento_id in enumerate(Cuento.objects.order_by('id').values_list('id', flat=True)):
+            Cuento.objects.filter(id=cuento_id).update(fecha_creacion=_local(hoy_local(), 10, indice // 7))
+        facets.invalidar(self.usuario.id)
+
+    def _recorrer(self, **filtros):
+        respuesta = self.cliente.get(reverse('library:library'), filtros)
+        ids = [cuento.id for cuento in respuesta.context['cuentos']]
+        total = respuesta.context['total_cuentos']
+        siguiente = respuesta.context['siguiente_url']
+        while siguiente:
+            datos = self.cliente.get(siguiente).json()
+            self.assertTrue(datos['success'])
+            self.assertNotIn('total', datos)
+            ids += [int(i) for i in re.findall(r'btn-primary" data-cuento-id="(\d+)"', datos['html'])]
+            siguiente = datos['next_url']
+        return ids, total
+
+    def test_recorre_todas_las_paginas_en_orden(self):
+        ids, total = self._recorrer()
+        esperados = list(Cuento.objects.filter(usuario=self.usuario).order_by('-fecha_creacion', '-id')
+                         .values_list('id', flat=True))
+        self.assertEqual(total, 30)
+        self.assertEqual(ids, esperados)
+
+        ids, total = self._recorrer(ordenar_por='favoritos')
+        self.assertEqual(total, 15)
+        self.assertEqual(len(set(ids)), 15)
+
+    def test_primera_pagina_del_endpoint_incluye_total(self):
+        datos = self.cliente.get(reverse('library:cards'), {'ordenar_por': 'favoritos'}).json()
+        self.assertEqual((datos['total'], datos['count']), (15, 12))
+
+    def test_cursor_invalido(self):
+        with self.assertRaises(CursorInvalido):
+            decodificar_cursor('no-es-un-cursor')
+        respuesta = self.cliente.get(reverse('library:cards'), {'cursor': 'xx'})
+        self.assertEqual(respuesta.status_code, 400)
+
+    def test_consultas_por_pagina_constantes(self):
+        cuentos = Cuento.objects.filter(usuario=self.usuario)
+        _, siguiente = pagina(cuentos)
+        with self.assertNumQueries(1):
+            pagina(cuentos, siguiente)
+
+
+@override_settings(CACHES=CACHES_PRUEBAS)
+class ProyeccionTarjetasTests(TestCase):
+    """Los listados no cargan el texto completo de los cuentos"""
+
+    def setUp(self):
+        caches['default'].clear()
+        caches['versiones'].clear()
+        self.usuario = User.objects.create_user('tarjetas', password='clave-segura-123')
+        self.cliente = Client()
+        self.cliente.login(username='tarjetas', password='clave-segura-123')
+        perfil = Perfil.objects.create(usuario=self.usuario, nombre='Ana', edad=6)
+        Cuento.objects.bulk_create([
+            Cuento(usuario=self.usuario, perfil=perfil, titulo=f'Cuento {i}', personaje_principal='Luna',
+                   contenido='palabra ' * 2000, moraleja='Compartir es bonito.', imagen_prompt='Un bosque',
+                   tema='aventura', edad='4-6', longitud='largo', estado='completado', en_biblioteca=True)
+            for i in range(5)
+        ])
+
+    def test_cards_difiere_el_texto_completo(self):
+        cuentos, _ = pagina(Cuento.objects.biblioteca(self.usuario).cards())
+        self.assertEqual(len(cuentos), 5)
+        for cuento in cuentos:
+            self.assertTrue({'contenido', 'moraleja', 'imagen_prompt'} <= cuento.get_deferred_fields())
+            self.assertEqual(len(cuento.vista_previa), 200)
+
+    def test_biblioteca_no_consulta_el_contenido(self):
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.cliente.get(reverse('library:library'))
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertContains(respuesta, 'palabra palabra')
+        listados = [q['sql'] for q in consultas if 'FROM "stories_cuento"' in q['sql'] and 'LIMIT' in q['sql']]
+        self.assertTrue(listados)
+        for sql in listados:
+            columnas = sql.split(' FROM ')[0]
+            self.assertNotIn('"stories_cuento"."contenido"', columnas)
+            self.assertNotIn('"stories_cuento"."moraleja"', columnas)
+        # Sin consultas extra por tarjeta al pintar perfil, miniatura o vista previa
+        self.assertLess(len(consultas), 15)
+
+
+@override_settings(CACHES=CACHES_PRUEBAS)
+class PlanesConsultaTests(TestCase):
+    """Las consultas calientes sobre Cuento usan índices: ninguna recorre la tabla entera"""
+
+    @classmethod
+    def setUpTestData(cls):
+        usuarios = [User.objects.create_user(f'plan{n}', password='clave-segura-123') for n in range(4)]
+        cls.usuario = usuarios[0]
+        temas = [tema for tema, _ in Cuento.TEMA_CHOICES]
+        cuentos = []
+        for usuario in usuarios:
+            perfiles = [Perfil.objects.create(usuario=usuario, nombre=f'Perfil {n}', edad=5 + n) for n in range(3)]
+            for i in range(400):
+                cuentos.append(Cuento(
+                    usuario=usuario, perfil=perfiles[i % 3], titulo=f'Cuento {i}', personaje_principal='Luna',
+                    tema=temas[i % len(temas)], edad='4-6', longitud='corto', veces_leido=i % 7,
+                    estado='completado' if i % 10 else 'error', en_biblioteca=i % 4 != 0, es_favorito=i % 9 == 0,
+                ))
+        Cuento.objects.bulk_create(cuentos)
+        cls.perfil = Perfil.objects.filter(usuario=cls.usuario).first()
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        caches['default'].clear()
+        caches['versiones'].clear()
+        self.cliente = Client()
+        self.cliente.login(username='plan0', password='clave-segura-123')
+
+    def _recorridos_secuenciales(self, sql):
+        """Pasos del plan que leen stories_cuento completa"""
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # Con enable_seqscan desactivado solo hay Seq Scan si ningún índice sirve
+                cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute(f"{connection.ops.explain_query_prefix()} {sql}")
+            plan = [str(fila[-1]) for fila in cursor.fetchall()]
+        if connection.vendor == 'postgresql':
+            return [paso for paso in plan if 'Seq Scan on stories_cuento' in paso]
+        # SQLite: "SEARCH" busca por índice; "SCAN" sin índice, o recorriendo uno entero, lee toda la tabla
+        return [paso for paso in plan if re.match(r'SCAN (stories_cuento|U\d+)\b', paso)]
+
+    def _comprobar(self, consultas):
+        revisadas = 0
+        for consulta in consultas:
+            sql = consulta['sql']
+            if not sql.startswith('SELECT') or '"stories_cuento"' not in sql:
+                continue
+            revisadas += 1
+            with self.subTest(sql=sql):
+                self.assertEqual(self._recorridos_secuenciales(sql), [])
+        self.assertTrue(revisadas)
+
+    def _comprobar_vista(self, url, parametros=None):
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.cliente.get(url, parametros or {})
+        self._comprobar(consultas.captured_queries)
+        return respuesta
+
+    def test_pagina_de_biblioteca(self):
+        url = reverse('library:library')
+        for filtros in ({}, {'perfil': self.perfil.id}, {'tema': 'aventura'}, {'ordenar_por': 'favoritos'},
+                        {'ordenar_por': 'semana'}, {'titulo': 'Cuento 1'}, {'perfil': self.perfil.id, 'tema': 'humor'}):
+            with self.subTest(filtros=filtros):
+                respuesta = self._comprobar_vista(url, filtros)
+                siguiente = respuesta.context['siguiente_url']
+                if siguiente:
+                    self._comprobar_vista(siguiente)
+
+    def test_filtro_por_perfil_estadisticas_y_dashboard(self):
+        self._comprobar_vista(reverse('library:filter_by_profile', args=[self.perfil.id]))
+        self._comprobar_vista(reverse('library:statistics'))
+        self._comprobar_vista(reverse('dashboard'))
+
+    def test_library_manager(self):
+        with CaptureQueriesContext(connection) as consultas:
+            list(LibraryManager.get_library_stories(self.usuario)[:12])
+            list(LibraryManager.get_user_themes(self.usuario))
+            list(LibraryManager.get_user_years(self.usuario))
+            list(LibraryManager.filter_library_stories(self.usuario, {'perfil': self.perfil.id})[:12])
+            list(LibraryManager.filter_library_stories(self.usuario, {'ordenar_por': 'mes_anterior'})[:12])
+            list(LibraryManager.search_stories_ajax(self.usuario, 'Cuento'))
+            LibraryManager.get_library_statistics(self.usuario)
+        self._comprobar(consultas.captured_queries)
+
+
+class ContenidoComprimidoTests(TestCase):
+    """Cuento.contenido se guarda comprimido y se lee como texto"""
+
+    def setUp(self):
+        self.usuario = User.objects.create_user('compresion', password='clave-segura-123')
+        self.texto = 'Había una vez un dragón que soñaba con volar sobre el río. ' * 40
+
+    def _crear(self, contenido, **campos):
+        return Cuento.objects.create(
+            usuario=self.usuario, titulo='El dragón', personaje_principal='Luna', contenido=contenido,
+            tema='aventura', edad='4-6', longitud='corto', **{'estado': 'completado', 'en_biblioteca': True, **campos})
+
+    def _columna(self, cuento_id):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT contenido FROM stories_cuento WHERE id = %s", [cuento_id])
+            return bytes(cursor.fetchone()[0])
+
+    def test_ida_y_vuelta(self):
+        cuento = self._crear(self.texto)
+        guardado = self._columna(cuento.id)
+        self.assertEqual(guardado[0], FORMATO_ZLIB)
+        self.assertLess(len(guardado), len(self.texto.encode()) / 5)
+        self.assertEqual(Cuento.objects.get(id=cuento.id).contenido, self.texto)
+        self.assertEqual(Cuento.objects.values_list('contenido', flat=True).get(id=cuento.id), self.texto)
+
+        corto = self._crear('Fin.')
+        self.assertEqual(self._columna(corto.id), bytes([FORMATO_PLANO]) + b'Fin.')
+        self.assertEqual(Cuento.objects.get(id=corto.id).contenido, 'Fin.')
+        with self.assertRaises(ValueError):
+            descomprimir(b'\x07basura')
+
+    def test_vista_previa_sigue_al_contenido(self):
+        cuento = self._crear('')
+        self.assertEqual(cuento.vista_previa, '')
+        cuento.contenido = self.texto
+        cuento.save(update_fields=['contenido'])
+        self.assertEqual(Cuento.objects.get(id=cuento.id).vista_previa, self.texto[:200])
+
+        generando = self._crear('', estado='generando')
+        guardar_avance(generando.id)('El dragón', ['Primer párrafo.', 'Segundo párrafo.'])
+        self.assertEqual(Cuento.objects.get(id=generando.id).vista_previa, 'Primer párrafo.\n\nSegundo párrafo.')
+
+    @override_settings(LIBRARY_SEARCH_ENGINE='like')
+    def test_busqueda_sin_indice_lee_el_texto_descomprimido(self):
+        cuento = self._crear(self.texto)
+        resultados = search.buscar(self.usuario, 'Dragon rio')
+        self.assertEqual([r['cuento'].id for r in resultados], [cuento.id])
+        self.assertIn('<mark>dragón</mark>', resultados[0]['fragmento'])
+        self.assertEqual(search.buscar(self.usuario, 'unicornio'), [])
+
+
+@override_settings(CACHES=CACHES_PRUEBAS)
+class OperacionesEnLoteTests(TestCase):
+    """Las operaciones en lote dejan rollups, facetas, auditoría e índice como N operaciones sueltas"""
+
+    def setUp(self):
+        caches['default'].clear()
+        caches['versiones'].clear()
+        self.usuario = User.objects.create_user('limpieza', password='clave-segura-123')
+        self.otro = User.objects.create_user('vecina', password='clave-segura-123')
+        self.client.login(username='limpieza', password='clave-segura-123')
+        self.ana = Perfil.objects.create(usuario=self.usuario, nombre='Ana', edad=6)
+        self.leo = Perfil.objects.create(usuario=self.usuario, nombre='Leo', edad=8)
+        self.hoy = hoy_local()
+        self.cuentos = [self._cuento(f'Dragón {i}', dias_atras=i) for i in range(6)]
+        for cuento in self.cuentos[:3]:
+            EstadisticaLectura.objects.create(usuario=self.usuario, cuento=cuento, perfil=self.ana,
+                                              tipo_lectura='texto', tiempo_lectura=60)
+        self.ajeno = Cuento.objects.create(
+            usuario=self.otro, titulo='Ajeno', personaje_principal='Luna', tema='aventura', edad='4-6',
+            longitud='corto', estado='completado', en_biblioteca=True)
+
+    def _cuento(self, titulo, dias_atras=0, **campos):
+        cuento = Cuento.objects.create(
+            usuario=self.usuario, perfil=self.ana, titulo=titulo, personaje_principal='Luna',
+            contenido=f'{titulo} vuela sobre el bosque. ' * 20, tema='aventura', edad='4-6', longitud='corto',
+            **{'estado': 'completado', 'en_biblioteca': True, **campos})
+        if dias_atras:
+            cuento.fecha_creacion = _local(self.hoy - timedelta(days=dias_atras))
+            cuento.save()
+        return cuento
+
+    def _accion(self, accion, ids, **datos):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('library:bulk_action'), {'action': accion, 'ids': ids, **datos},
+                                    content_type='application/json')
+
+    def _filas(self):
+        return {
+            (fila['perfil_id'], fila['fecha']): {campo: fila[campo] for campo in CAMPOS}
+            for fila in DailyReadingRollup.objects.filter(usuario=self.usuario).values('perfil_id', 'fecha', *CAMPOS)
+            if any(fila[campo] for campo in CAMPOS)
+        }
+
+    def _comprobar_rollup(self):
+        incremental = self._filas()
+        reconstruir(self.usuario.id)
+        self.assertEqual(incremental, self._filas())
+
+    def test_favoritos_ignora_cuentos_ajenos(self):
+        ids = [c.id for c in self.cuentos[:4]]
+        datos = self._accion('favorite', ids + [self.ajeno.id]).json()
+        self.assertEqual((datos['processed'], datos['not_found']), (ids, [self.ajeno.id]))
+        self.assertEqual(Cuento.objects.filter(es_favorito=True).count(), 4)
+
+        self._accion('unfavorite', ids[:2])
+        self.assertEqual(set(Cuento.objects.filter(es_favorito=True).values_list('id', flat=True)), set(ids[2:]))
+
+    def test_borrar_audita_y_mantiene_derivados(self):
+        facets.facetas(self.usuario).total()
+        ids = [c.id for c in self.cuentos[:4]]
+        respuesta = self._accion('delete', ids)
+        self.assertEqual(respuesta.json()['processed'], ids)
+
+        self.assertFalse(Cuento.objects.filter(id__in=ids).exists())
+        self.assertFalse(EstadisticaLectura.objects.filter(cuento_id__in=ids).exists())
+        auditoria = CuentoEliminado.objects.filter(usuario=self.usuario)
+        self.assertEqual(sorted(auditoria.values_list('cuento_id_original', flat=True)), ids)
+        self.assertTrue(auditoria.first().contenido_preview.startswith('Dragón'))
+        self.assertEqual(facets.facetas(self.usuario).total(), 2)
+        self.assertEqual({r['cuento'].id for r in search.buscar(self.usuario, 'bosque')},
+                         {c.id for c in self.cuentos[4:]})
+        self._comprobar_rollup()
+
+    def test_mover_y_pasar_a_biblioteca(self):
+        fuera = self._cuento('Fuera', dias_atras=9, en_biblioteca=False)
+        ids = [c.id for c in self.cuentos[1:4]]
+        self._accion('move', ids, profile_id=self.leo.id)
+        self.assertEqual(Cuento.objects.filter(perfil=self.leo).count(), 3)
+        self.assertEqual(facets.facetas(self.usuario).total(self.leo.id), 3)
+        self._comprobar_rollup()
+
+        self._accion('add_to_library', [fuera.id, self.cuentos[0].id])
+        self.assertTrue(Cuento.objects.get(id=fuera.id).en_biblioteca)
+        self.assertEqual(facets.facetas(self.usuario).total(), 7)
+        self.assertIn(fuera.id, [r['cuento'].id for r in search.buscar(self.usuario, 'fuera')])
+        self._comprobar_rollup()
+
+    def test_peticiones_invalidas(self):
+        ids = [self.cuentos[0].id]
+        ajeno = Perfil.objects.create(usuario=self.otro, nombre='Ajeno', edad=5)
+        for datos in ({'action': 'borrar_todo', 'ids': ids}, {'action': 'delete', 'ids': []},
+                      {'action': 'delete', 'ids': ['uno']}, {'action': 'move', 'ids': ids, 'profile_id': ajeno.id}):
+            with self.subTest(datos=datos):
+                respuesta = self.client.post(reverse('library:bulk_action'), datos, content_type='application/json')
+                self.assertEqual(respuesta.status_code, 400)
+        self.assertEqual(Cuento.objects.get(id=ids[0]).perfil_id, self.ana.id)
+
+    def test_consultas_no_crecen_con_el_lote(self):
+        pocos = [c.id for c in self.cuentos[:2]]
+        muchos = [self._cuento(f'Extra {i}').id for i in range(20)]
+        for accion in ('favorite', 'move', 'delete'):
+            with self.subTest(accion=accion):
+                datos = {'profile_id': self.leo.id} if accion == 'move' else {}
+                n_pocos, _ = _consultas(lambda: self._accion(accion, pocos, **datos))
+                n_muchos, _ = _consultas(lambda: self._accion(accion, muchos, **datos))
+                self.assertLessEqual(n_muchos, n_pocos)
+
+
+@override_settings(CACHES=CACHES_PRUEBAS)
+class CacheFiltrosAjaxTests(TestCase):
+    """Los filtros AJAX se sirven de caché por usuario, se invalidan al cambiar cuentos y agrupan peticiones"""
+
+    def setUp(self):
+        caches['default'].clear()
+        caches['versiones'].clear()
+        metrics.reiniciar()
+        self.usuario = User.objects.create_user('filtros', password='clave-segura-123', is_staff=True)
+        self.client.login(username='filtros', password='clave-segura-123')
+        self.perfil = Perfil.objects.create(usuario=self.usuario, nombre='Ana', edad=6)
+        for titulo, tema in (('El Dragón Azul', 'aventura'), ('La tortuga sabia', 'naturaleza')):
+            Cuento.objects.create(usuario=self.usuario, perfil=self.perfil, titulo=titulo, personaje_principal='Luna',
+                                  tema=tema, edad='4-6', longitud='corto', estado='completado', en_biblioteca=True)
+
+    def _consultas_cuento(self, url, parametros):
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get(url, parametros)
+        return [q for q in consultas if 'stories_cuento' in q['sql']], respuesta.json()
+
+    def test_segunda_peticion_no_consulta_la_base_de_datos(self):
+        url = reverse('library:themes_by_profile')
+        primera, datos = self._consultas_cuento(url, {'profile_id': self.perfil.id})
+        self.assertTrue(primera)
+        self.assertEqual(datos['temas'], ['aventura', 'naturaleza'])
+        segunda, datos = self._consultas_cuento(url, {'profile_id': str(self.perfil.id)})
+        self.assertEqual(segunda, [])
+        self.assertEqual(datos['temas'], ['aventura', 'naturaleza'])
+
+        # La consulta normalizada comparte entrada: mayúsculas, tildes y espacios no cuentan
+        url = reverse('library:search_stories')
+        self._consultas_cuento(url, {'q': 'Dragón'})
+        repetida, datos = self._consultas_cuento(url, {'q': '  dragon '})
+        self.assertEqual(repetida, [])
+        self.assertEqual([s['title'] for s in datos['stories']], ['El Dragón Azul'])
+        self.assertEqual(metrics.aciertos_cache()['ajax']['aciertos'], 2)
+
+    def test_cambios_en_cuentos_invalidan(self):
+        url = reverse('library:search_titles')
+        self.assertEqual(self.client.get(url, {'q': 'dra'}).json()['titles'], ['El Dragón Azul'])
+        with self.captureOnCommitCallbacks(execute=True):
+            Cuento.objects.create(usuario=self.usuario, perfil=self.perfil, titulo='Dragones de papel',
+                                  personaje_principal='Leo', tema='humor', edad='4-6', longitud='corto',
+                                  estado='completado', en_biblioteca=True)
+        self.assertEqual(self.client.get(url, {'q': 'dra'}).json()['titles'], ['Dragones de papel', 'El Dragón Azul'])
+
+    def test_peticiones_simultaneas_comparten_calculo(self):
+        calculos = []
+        empezado = threading.Event()
+
+        def calcular():
+            calculos.append(1)
+            empezado.set()
+            time.sleep(0.2)
+            return ['aventura']
+
+        resultados = []
+        hilos = [threading.Thread(target=lambda: resultados.append(
+            cache_utils.obtener(cache_utils.AJAX, self.usuario.id, calcular, parametros=('themes', None))))
+            for _ in range(5)]
+        hilos[0].start()
+        empezado.wait(1)
+        for hilo in hilos[1:]:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        self.assertEqual(len(calculos), 1)
+        self.assertEqual(resultados, [['aventura']] * 5)
+        self.assertEqual(metrics.aciertos_cache()['ajax'], {'aciertos': 0, 'fallos': 1, 'agrupadas': 4, 'ratio': 0.8})
+
+    def test_vista_de_metricas_solo_para_staff(self):
+        self.client.get(reverse('library:themes_by_profile'))
+        self.client.get(reverse('library:themes_by_profile'))
+        datos = self.client.get(reverse('metrics')).json()
+        self.assertEqual(datos['cache']['ajax']['ratio'], 0.5)
+
+        User.objects.create_user('visita', password='clave-segura-123')
+        self.client.login(username='visita', password='clave-segura-123')
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 302)
+
+
+@override_settings(CACHES=CACHES_PRUEBAS)
+class RecomendacionesTests(TestCase):
+    """Los vectores de "más como este" se mantienen al guardar y responden por similitud"""
+
+    TEXTOS = {
+        'dragon': 'El dragón del volcán guardaba un tesoro. El dragón escupía fuego y el caballero buscaba el tesoro.',
+        'dragones': 'Dos dragones vivían en el volcán. Los dragones cuidaban su tesoro de fuego.',
+        'mar': 'La ballena nadaba en el mar profundo con los delfines y las medusas de colores.',
+        'jardin': 'La abuela regaba las flores del jardín y las mariposas volaban entre las rosas.',
+    }
+
+    def setUp(self):
+        caches['default'].clear()
+        caches['versiones'].clear()
+        self.directorio = tempfile.mkdtemp(prefix='cuentia-recomendaciones-')
+        self.addCleanup(shutil.rmtree, self.directorio, ignore_errors=True)
+        ajustes = override_settings(LIBRARY_RECOMMENDATIONS_DIR=self.directorio)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+        self.usuario = User.objects.create_user('parecidos', password='clave-segura-123')
+        self.client.login(username='parecidos', password='clave-segura-123')
+        self.cuentos = {clave: self._crear(clave.capitalize(), texto) for clave, texto in self.TEXTOS.items()}
+
+    def _crear(self, titulo, contenido, **campos):
+        return Cuento.objects.create(**{
+            'usuario': self.usuario, 'titulo': titulo, 'personaje_principal': 'Luna', 'contenido': contenido,
+            'tema': 'aventura', 'edad': '4-6', 'longitud': 'corto', 'estado': 'completado', 'en_biblioteca': True,
+            **campos,
+        })
+
+    def _ids_parecidos(self, clave):
+        return [cuento_id for cuento_id, _ in recommendations.similares(self.cuentos[clave])]
+
+    def _filas(self):
+        return os.path.getsize(recommendations._ruta(self.usuario.id)) // recommendations.REGISTRO.itemsize
+
+    def test_ordena_por_similitud_y_excluye_el_propio(self):
+        parecidos = self._ids_parecidos('dragon')
+        self.assertEqual(parecidos[0], self.cuentos['dragones'].id)
+        self.assertNotIn(self.cuentos['dragon'].id, parecidos)
+        self.assertNotIn(self.cuentos['mar'].id, parecidos[:1])
+
+        # Un cuento recién generado, aún fuera de la biblioteca, se vectoriza al vuelo
+        nuevo = self._crear('Nuevo', 'Un dragón pequeño soñaba con un volcán y un tesoro.', en_biblioteca=False)
+        self.assertIn(self.cuentos['dragon'].id, [cuento_id for cuento_id, _ in recommendations.similares(nuevo)][:2])
+
+    def test_se_actualiza_al_guardar_sin_reconstruir(self):
+        recommendations.similares(self.cuentos['mar'])
+        self.assertEqual(self._filas(), 4)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            orca = self._crear('Orca', 'La orca y la ballena nadaban en el mar con los delfines.')
+        self.assertEqual(self._filas(), 5)
+        self.assertEqual(self._ids_parecidos('mar')[0], orca.id)
+
+        # Editar el contenido reescribe el vector en su sitio
+        jardin = self.cuentos['jardin']
+        jardin.contenido = 'La ballena y los delfines jugaban en el mar azul con las medusas.'
+        with self.captureOnCommitCallbacks(execute=True):
+            jardin.save(update_fields=['contenido'])
+        self.assertEqual(self._filas(), 5)
+        self.assertIn(jardin.id, self._ids_parecidos('mar')[:2])
+
+        # Sacarlo de la biblioteca lo deja fuera; leerlo no toca el archivo
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            Cuento.objects.get(id=orca.id).marcar_como_leido()
+        self.assertEqual(callbacks, [])
+        orca.en_biblioteca = False
+        with self.captureOnCommitCallbacks(execute=True):
+            orca.save()
+        self.assertNotIn(orca.id, self._ids_parecidos('mar'))
+
+    def test_borrados_se_compactan(self):
+        recommendations.similares(self.cuentos['mar'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cuentos['dragones'].delete()
+        # 1 hueco de 4 no pasa del 25%: se queda marcado
+        self.assertEqual(self._filas(), 4)
+        self.assertNotIn(self.cuentos['dragones'].id, self._ids_parecidos('dragon'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('library:bulk_action'), {
+                'action': 'delete', 'ids': [self.cuentos['jardin'].id],
+            }, content_type='application/json')
+        self.assertTrue(response.json()['success'])
+        self.assertEqual(self._filas(), 2)
+
+    def test_vistas(self):
+        response = self.client.get(reverse('library:similar_stories', args=[self.cuentos['dragon'].id]))
+        datos = response.json()
+        self.assertTrue(datos['success'])
+        self.assertEqual(datos['stories'][0]['title'], 'Dragones')
+        self.assertNotIn('content', datos['stories'][0])
+
+        response = self.client.get(reverse('library:library'), {'similar': self.cuentos['dragon'].id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cuentos'][0].id, self.cuentos['dragones'].id)
+        self.assertContains(response, 'Cuentos parecidos a')
+
+        ajeno = User.objects.create_user('ajeno', password='clave-segura-123')
+        cuento_ajeno = Cuento.objects.create(usuario=ajeno, titulo='Ajeno', personaje_principal='Leo',
+                                             tema='aventura', edad='4-6', longitud='corto', estado='completado')
+        response = self.client.get(reverse('library:similar_stories', args=[cuento_ajeno.id]))
+        self.assertEqual(response.status_code, 404)
@@ -12,6 +12,7 @@ urlpatterns = [
     path('delete/<int:story_id>/', views.delete_story, name='delete_story'),
     path('download/<int:story_id>/', views.download_library_story, name='download_story'),
     path('search/', views.search_stories_ajax, name='search_stories'),
+    path('search/full-text/', views.full_text_search, name='full_text_search'),
     path('profile/<int:profile_id>/', views.filter_by_profile, name='filter_by_profile'),
     path('view/<int:story_id>/', views.view_library_story, name='view_story'),
     path('statistics/', views.library_statistics, name='statistics'),
@@ -23,10 +24,14 @@ urlpatterns = [
     path('reading-tracker/stats/', views.get_profile_stats, name='all_stats'),
     path('reading-tracker/export/', views.export_reading_report, name='export_report'),
     path('reading-tracker/update-time/', views.update_reading_time, name='update_reading_time'),
+    path('reading-tracker/heartbeat/', views.reading_heartbeat, name='reading_heartbeat'),
 
     # NUEVAS RUTAS AJAX PARA FILTROS DINÁMICOS
     path('ajax/themes-by-profile/', views.get_themes_by_profile, name='themes_by_profile'),
     path('ajax/search-titles/', views.search_titles_ajax, name='search_titles'),
+    path('ajax/cards/', views.library_cards_ajax, name='cards'),
+    path('ajax/bulk/', views.library_bulk_action, name='bulk_action'),
+    path('ajax/similar/<int:story_id>/', views.similar_stories, name='similar_stories'),
 
 ]
 
@@ -15,11 +15,16 @@ from reportlab.graphics import renderPDF
 from io import BytesIO
 import logging
 import pytz
-from stories.models import Cuento, EstadisticaLectura
+from stories.models import Cuento
+from stories.rendering import RenderSaturado, renderizar_reporte
 from user.models import Perfil
+from .rollups import CAMPOS as CAMPOS_ROLLUP, resumenes, totales, ultimos_dias
+from .stats import inicio_del_dia, serie_diaria, serie_mensual
 
 logger = logging.getLogger(__name__)
 
+DIAS_PERIODO = {'week': 7, 'month': 30, 'year': 365}
+
 
 def get_ecuador_time():
     try:
@@ -90,44 +95,28 @@ def get_reading_statistics(user, perfil=None, time_period='week'):
     try:
         start_date, end_date = get_time_range_ecuador(time_period)
 
-        print(f"Calculando estadísticas para período: {time_period}")
-        print(f"Rango de fechas: {start_date} - {end_date}")
+        logger.debug(f"Estadísticas de {time_period}: {start_date} - {end_date}, perfil {perfil}")
 
-        # Filtros base con manejo de errores
-        sessions_filter = Q(usuario=user)
-        stories_filter = Q(usuario=user, estado='completado', en_biblioteca=True)
+        # Totales desde el resumen diario (DailyReadingRollup); los temas siguen saliendo de Cuento
+        dias_periodo = DIAS_PERIODO.get(time_period)
+        desde = ultimos_dias(dias_periodo)[0] if dias_periodo else None
 
+        stories_filter = Q(usuario=user, estado='completado', en_biblioteca=True)
         if perfil:
-            sessions_filter &= Q(perfil=perfil)
             stories_filter &= Q(perfil=perfil)
-            print(f"Filtrando por perfil: {perfil.nombre}")
-
-        if start_date:
-            sessions_filter &= Q(fecha_lectura__gte=start_date)
-            stories_filter &= Q(fecha_creacion__gte=start_date)
+        if desde:
+            stories_filter &= Q(fecha_creacion__gte=inicio_del_dia(desde))
 
-        # Obtener datos con manejo de errores
         try:
-            sessions = EstadisticaLectura.objects.filter(sessions_filter)
+            resumen = totales(user, perfil, desde)
             stories = Cuento.objects.filter(stories_filter)
         except Exception as e:
             logger.error(f"Error querying database: {e}")
-            sessions = EstadisticaLectura.objects.none()
+            resumen = dict.fromkeys(CAMPOS_ROLLUP, 0)
             stories = Cuento.objects.none()
 
-        print(f"Cuentos encontrados: {stories.count()}")
-        print(f"Sesiones de lectura: {sessions.count()}")
-
-        total_stories = stories.count()
-
-        # Calcular tiempo total con manejo de errores
-        try:
-            total_reading_time_seconds = sessions.aggregate(
-                total=Sum('tiempo_lectura')
-            )['total'] or 0
-        except Exception as e:
-            logger.error(f"Error calculating reading time: {e}")
-            total_reading_time_seconds = 0
+        total_stories = resumen['cuentos_creados']
+        total_reading_time_seconds = resumen['segundos_lectura']
 
         # Formatear tiempo de manera segura
         try:
@@ -191,20 +180,10 @@ def get_reading_statistics(user, perfil=None, time_period='week'):
         time_change = 0
 
         try:
-            if start_date:
-                period_duration = end_date - start_date
-                prev_start = start_date - period_duration
-                prev_sessions_filter = Q(usuario=user, fecha_lectura__gte=prev_start, fecha_lectura__lt=start_date)
-                prev_stories_filter = Q(usuario=user, estado='completado', en_biblioteca=True,
-                                        fecha_creacion__gte=prev_start, fecha_creacion__lt=start_date)
-
-                if perfil:
-                    prev_sessions_filter &= Q(perfil=perfil)
-                    prev_stories_filter &= Q(perfil=perfil)
-
-                prev_sessions = EstadisticaLectura.objects.filter(prev_sessions_filter)
-                prev_stories_count = Cuento.objects.filter(prev_stories_filter).count()
-                prev_time = prev_sessions.aggregate(total=Sum('tiempo_lectura'))['total'] or 0
+            if desde:
+                anterior = totales(user, perfil, desde - timedelta(days=dias_periodo), desde - timedelta(days=1))
+                prev_stories_count = anterior['cuentos_creados']
+                prev_time = anterior['segundos_lectura']
 
                 if prev_stories_count > 0:
                     stories_change = ((total_stories - prev_stories_count) / prev_stories_count) * 100
@@ -218,12 +197,8 @@ def get_reading_statistics(user, perfil=None, time_period='week'):
         except Exception as e:
             logger.error(f"Error calculating changes: {e}")
 
-        # Promedio de sesión con manejo de errores
-        try:
-            average_session_time = sessions.aggregate(avg=Avg('tiempo_lectura'))['avg'] or 0
-        except Exception as e:
-            logger.error(f"Error calculating average session time: {e}")
-            average_session_time = 0
+        # Promedio de sesión
+        average_session_time = total_reading_time_seconds / resumen['sesiones'] if resumen['sesiones'] else 0
 
         result = {
             'total_stories': total_stories,
@@ -240,7 +215,7 @@ def get_reading_statistics(user, perfil=None, time_period='week'):
             'theme_distribution': list(theme_counts[:10])
         }
 
-        print(f"Estadísticas calculadas: {result}")
+        logger.debug(f"Estadísticas calculadas: {result}")
         return result
 
     except Exception as e:
@@ -266,14 +241,8 @@ def get_chart_data(user, perfil=None, time_period='week'):
     try:
         start_date, end_date = get_time_range_ecuador(time_period)
 
-        print(f"Generando datos de gráficas para período: {time_period}")
-
-        base_filter = Q(usuario=user)
-        if perfil:
-            base_filter &= Q(perfil=perfil)
-            print(f"Filtrando gráficas por perfil: {perfil.nombre}")
-        if start_date:
-            base_filter &= Q(fecha_lectura__gte=start_date)
+        # Series desde el resumen diario (DailyReadingRollup)
+        diarios = resumenes(user, perfil)
 
         activity_data = []
 
@@ -285,76 +254,25 @@ def get_chart_data(user, perfil=None, time_period='week'):
         else:  # year
             days_range = 12  # Para año usamos meses
 
-        # Generar datos de actividad con manejo de errores
+        # Generar datos de actividad: cuentos distintos leídos por día (sumados por mes en el año)
         try:
-            if time_period == 'year':
-                # Para año, usar meses - CORREGIDO
-                ecuador_now = get_ecuador_time()
-                months_data = {}
-
-                for i in range(12):
-                    try:
-                        current_date = ecuador_now.date()
-                        # Calcular fecha del mes
-                        if i == 0:
-                            month_date = current_date
-                        else:
-                            # Restar meses de manera segura
-                            year = current_date.year
-                            month = current_date.month - i
-
-                            while month <= 0:
-                                month += 12
-                                year -= 1
-
-                            month_date = date(year, month, 1)
-
-                        month_key = month_date.strftime('%Y-%m')
-                        months_data[month_key] = {
-                            'month': month_date.strftime('%b'),
-                            'date': month_date.strftime('%Y-%m-%d'),
-                            'stories': 0
-                        }
-                    except Exception as e:
-                        logger.error(f"Error processing month {i}: {e}")
-                        continue
-
-                # Obtener conteos por mes con manejo de errores
-                try:
-                    month_counts = EstadisticaLectura.objects.filter(base_filter).extra(
-                        select={'month': "to_char(fecha_lectura, 'YYYY-MM')"}
-                    ).values('month').annotate(count=Count('cuento', distinct=True))
-
-                    for item in month_counts:
-                        if item['month'] in months_data:
-                            months_data[item['month']]['stories'] = item['count']
-                except Exception as e:
-                    logger.error(f"Error getting month counts: {e}")
-
-                activity_data = list(months_data.values())
-                activity_data.reverse()
+            cuentos_distintos = Sum('cuentos_leidos')
 
+            if time_period == 'year':
+                for month_date, count in serie_mensual(diarios, 'fecha', 12, agregado=cuentos_distintos):
+                    activity_data.append({
+                        'month': month_date.strftime('%b'),
+                        'date': month_date.strftime('%Y-%m-%d'),
+                        'stories': count
+                    })
             else:
-                # Para semana/mes, usar días - CORREGIDO
-                ecuador_now = get_ecuador_time()
-                for i in range(min(days_range, 30)):  # Limitar a 30 días máximo
-                    try:
-                        current_date = ecuador_now.date()
-                        day = current_date - timedelta(days=i)
-                        day_filter = base_filter & Q(fecha_lectura__date=day)
-
-                        day_count = EstadisticaLectura.objects.filter(day_filter).values('cuento').distinct().count()
-
-                        activity_data.append({
-                            'day': day.strftime('%a') if time_period == 'week' else day.day,
-                            'date': day.strftime('%Y-%m-%d'),
-                            'stories': day_count
-                        })
-                    except Exception as e:
-                        logger.error(f"Error processing day {i}: {e}")
-                        continue
-
-                activity_data.reverse()
+                for day, count in serie_diaria(diarios, 'fecha', min(days_range, 30),
+                                               agregado=cuentos_distintos):
+                    activity_data.append({
+                        'day': day.strftime('%a') if time_period == 'week' else day.day,
+                        'date': day.strftime('%Y-%m-%d'),
+                        'stories': count
+                    })
 
         except Exception as e:
             logger.error(f"Error generating activity data: {e}")
@@ -401,73 +319,19 @@ def get_chart_data(user, perfil=None, time_period='week'):
         # Progreso de lectura con manejo de errores
         reading_progress = []
         try:
-            if time_period in ['week', 'month']:
-                ecuador_now = get_ecuador_time()
-                for i in range(min(days_range, 30)):
-                    try:
-                        current_date = ecuador_now.date()
-                        day = current_date - timedelta(days=i)
-                        day_filter = base_filter & Q(fecha_lectura__date=day)
-
-                        day_seconds = EstadisticaLectura.objects.filter(day_filter).aggregate(
-                            total=Sum('tiempo_lectura')
-                        )['total'] or 0
-                        day_minutes = day_seconds // 60
-
-                        reading_progress.append({
-                            'date': day.strftime('%Y-%m-%d'),
-                            'minutes': day_minutes,
-                            'seconds': day_seconds
-                        })
-                    except Exception as e:
-                        logger.error(f"Error processing reading progress day {i}: {e}")
-                        continue
+            tiempo_total = Sum('segundos_lectura')
 
-                reading_progress.reverse()
-            else:  # year - CORREGIDO
-                ecuador_now = get_ecuador_time()
-                for i in range(12):
-                    try:
-                        current_date = ecuador_now.date()
-
-                        # Calcular mes de manera segura
-                        year = current_date.year
-                        month = current_date.month - i
-
-                        while month <= 0:
-                            month += 12
-                            year -= 1
-
-                        month_date = date(year, month, 1)
-
-                        # Calcular fin del mes
-                        if i == 0:
-                            month_end = ecuador_now.date()
-                        else:
-                            if month == 12:
-                                next_month = date(year + 1, 1, 1)
-                            else:
-                                next_month = date(year, month + 1, 1)
-                            month_end = next_month - timedelta(days=1)
-
-                        month_filter = base_filter & Q(fecha_lectura__date__gte=month_date) & Q(
-                            fecha_lectura__date__lte=month_end)
-
-                        month_seconds = EstadisticaLectura.objects.filter(month_filter).aggregate(
-                            total=Sum('tiempo_lectura')
-                        )['total'] or 0
-                        month_minutes = month_seconds // 60
-
-                        reading_progress.append({
-                            'date': month_date.strftime('%Y-%m-%d'),
-                            'minutes': month_minutes,
-                            'seconds': month_seconds
-                        })
-                    except Exception as e:
-                        logger.error(f"Error processing reading progress month {i}: {e}")
-                        continue
+            if time_period in ['week', 'month']:
+                serie = serie_diaria(diarios, 'fecha', min(days_range, 30), agregado=tiempo_total)
+            else:  # year
+                serie = serie_mensual(diarios, 'fecha', 12, agregado=tiempo_total)
 
-                reading_progress.reverse()
+            for fecha, seconds in serie:
+                reading_progress.append({
+                    'date': fecha.strftime('%Y-%m-%d'),
+                    'minutes': seconds // 60,
+                    'seconds': seconds
+                })
 
         except Exception as e:
             logger.error(f"Error generating reading progress: {e}")
@@ -478,10 +342,8 @@ def get_chart_data(user, perfil=None, time_period='week'):
             'reading_progress': reading_progress
         }
 
-        print(f"Datos de gráficas generados:")
-        print(f"  - Actividad: {len(activity_data)} puntos")
-        print(f"  - Temas: {len(theme_distribution)} categorías")
-        print(f"  - Progreso: {len(reading_progress)} puntos")
+        logger.debug(f"Gráficas de {time_period}: {len(activity_data)} puntos de actividad, "
+                     f"{len(theme_distribution)} temas, {len(reading_progress)} puntos de progreso")
 
         return result
 
@@ -533,10 +395,13 @@ def generate_library_report(user, perfil=None, time_period='month', format_type=
         if format_type == 'json':
             return report_data
         elif format_type == 'pdf':
-            return generate_pdf_report(report_data, user, perfil, time_period)
+            # ReportLab corre en el pool de procesos (stories/rendering.py)
+            return renderizar_reporte(report_data, user, perfil, time_period)
         else:
             raise ValueError(f"Formato {format_type} no soportado")
 
+    except RenderSaturado:
+        raise
     except Exception as e:
         logger.error(f"Critical error in generate_library_report: {e}")
         raise Exception(f"Error generando reporte: {str(e)}")
@@ -1,25 +1,35 @@
 from django.shortcuts import render, get_object_or_404, redirect
+from django.template.loader import render_to_string
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse, HttpResponse
 from django.views.decorators.http import require_POST, require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib import messages
 from django.utils import timezone
-from django.core.paginator import Paginator
+from django.db import transaction
+from django.conf import settings
 from datetime import timedelta
 import json
 import logging
 
 # Import models
 from stories.models import Cuento, EstadisticaLectura
-from user.models import Perfil
+from user.models import Perfil, UserSettings
 from .models import LibraryManager, CuentoEliminado
+from . import autocomplete, bulk, cache_utils, heartbeats, recommendations, search
+from .facets import facetas
+from .pagination import CursorInvalido, pagina
+from .rollups import resumenes, totales, ultimos_dias
+from .stats import inicio_del_dia, serie_diaria, serie_mensual
 
 # Import utilities with error handling
 try:
-    from stories.utils import generar_pdf_cuento
+    from stories.pdf_cache import respuesta_pdf
 except ImportError:
-    generar_pdf_cuento = None
+    respuesta_pdf = None
+
+from stories.rendering import RenderSaturado, respuesta_saturado
 
 try:
     from .utils import get_reading_statistics, get_chart_data, generate_library_report
@@ -105,6 +115,9 @@ def export_reading_report(request):
                 print(f"ÉXITO: Reporte PDF exportado")
                 return response
 
+            except RenderSaturado as e:
+                logger.warning(str(e))
+                return respuesta_saturado(e)
             except Exception as e:
                 logger.error(f"Error generating PDF: {str(e)}")
                 print(f"ERROR PDF: {str(e)}")
@@ -187,135 +200,134 @@ def export_reading_report(request):
 
 
 # Mantener todas las demás vistas existentes...
-@login_required
-def library_view(request):
-    try:
-        print("Library view called")
+def _filtrar_biblioteca(request, facetas_usuario):
+    """Queryset de la biblioteca con los filtros de la URL (compartido por la página y el scroll)"""
+    # Get filters from URL - CORREGIDO
+    filtros_actuales = {
+        'perfil_id': request.GET.get('perfil', ''),  # Cambiar 'perfil' por 'perfil_id'
+        'tema': request.GET.get('tema', ''),
+        'titulo': request.GET.get('titulo', ''),
+        'ordenar_por': request.GET.get('ordenar_por', 'fecha'),
+    }
+
+    # SOLO mostrar cuentos guardados en biblioteca (proyección de tarjeta, sin el texto completo)
+    cuentos = Cuento.objects.biblioteca(request.user).cards()
+
+    # Aplicar filtros adicionales
+    perfil_seleccionado = None
+    if filtros_actuales.get('perfil_id') and filtros_actuales['perfil_id'] != 'todos':
+        try:
+            perfil_seleccionado = facetas_usuario.perfil(int(filtros_actuales['perfil_id']))
+        except ValueError:
+            pass
+        if perfil_seleccionado:
+            cuentos = cuentos.filter(perfil_id=perfil_seleccionado['id'])
 
-        perfiles = Perfil.objects.filter(usuario=request.user).order_by('nombre')
-        print(f"Found {perfiles.count()} profiles")
-
-        # Get filters from URL - CORREGIDO
-        filtros_actuales = {
-            'perfil_id': request.GET.get('perfil', ''),  # Cambiar 'perfil' por 'perfil_id'
-            'tema': request.GET.get('tema', ''),
-            'titulo': request.GET.get('titulo', ''),
-            'ordenar_por': request.GET.get('ordenar_por', 'fecha'),
-        }
+    tema = None
+    if filtros_actuales.get('tema') and filtros_actuales['tema'] != 'todos':
+        tema = filtros_actuales['tema']
+        cuentos = cuentos.filter(tema=tema)
 
-        print(f"Filtros actuales: {filtros_actuales}")
+    if filtros_actuales.get('titulo'):
+        cuentos = cuentos.filter(titulo__icontains=filtros_actuales['titulo'])
 
-        # SOLO mostrar cuentos guardados en biblioteca
-        cuentos = Cuento.objects.filter(
-            usuario=request.user,
-            estado='completado',
-            en_biblioteca=True
-        ).select_related('perfil')
+    # Todas las opciones ordenan por fecha: la paginación por cursor añade el id
+    ordenar_por = filtros_actuales.get('ordenar_por', 'fecha')
+    dias = {'dia': 1, 'semana': 7, 'mes': 30, 'año': 365}.get(ordenar_por)
+    if dias:
+        cuentos = cuentos.filter(fecha_creacion__gte=timezone.now() - timedelta(days=dias))
+    elif ordenar_por == 'favoritos':
+        # CORREGIDO: Filtrar solo cuentos marcados como favoritos
+        cuentos = cuentos.filter(es_favorito=True)
 
-        # Aplicar filtros adicionales
-        perfil_seleccionado = None
-        if filtros_actuales.get('perfil_id') and filtros_actuales['perfil_id'] != 'todos':
-            try:
-                perfil_id = int(filtros_actuales['perfil_id'])
-                perfil_seleccionado = Perfil.objects.get(id=perfil_id, usuario=request.user)
-                cuentos = cuentos.filter(perfil_id=perfil_id)
-                print(f"Filtrado por perfil: {perfil_seleccionado.nombre}")
-            except (ValueError, Perfil.DoesNotExist):
-                print("Perfil no válido")
-
-        if filtros_actuales.get('tema') and filtros_actuales['tema'] != 'todos':
-            cuentos = cuentos.filter(tema=filtros_actuales['tema'])
-            print(f"Filtrado por tema: {filtros_actuales['tema']}")
-
-        if filtros_actuales.get('titulo'):
-            cuentos = cuentos.filter(titulo__icontains=filtros_actuales['titulo'])
-            print(f"Filtrado por título: {filtros_actuales['titulo']}")
-
-        # Ordenar y filtrar
-        ordenar_por = filtros_actuales.get('ordenar_por', 'fecha')
-        if ordenar_por == 'fecha':
-            cuentos = cuentos.order_by('-fecha_creacion')
-        elif ordenar_por == 'dia':
-            fecha_limite = timezone.now() - timedelta(days=1)
-            cuentos = cuentos.filter(fecha_creacion__gte=fecha_limite).order_by('-fecha_creacion')
-        elif ordenar_por == 'semana':
-            fecha_limite = timezone.now() - timedelta(days=7)
-            cuentos = cuentos.filter(fecha_creacion__gte=fecha_limite).order_by('-fecha_creacion')
-        elif ordenar_por == 'mes':
-            fecha_limite = timezone.now() - timedelta(days=30)
-            cuentos = cuentos.filter(fecha_creacion__gte=fecha_limite).order_by('-fecha_creacion')
-        elif ordenar_por == 'año':
-            fecha_limite = timezone.now() - timedelta(days=365)
-            cuentos = cuentos.filter(fecha_creacion__gte=fecha_limite).order_by('-fecha_creacion')
-        elif ordenar_por == 'favoritos':
-            # CORREGIDO: Filtrar solo cuentos marcados como favoritos
-            cuentos = cuentos.filter(es_favorito=True).order_by('-fecha_creacion')
-            print(f" Filtrando solo favoritos: {cuentos.count()} cuentos encontrados")
-        else:
-            cuentos = cuentos.order_by('-fecha_creacion')
+    perfil_id = perfil_seleccionado['id'] if perfil_seleccionado else None
+    return {
+        'cuentos': cuentos,
+        'filtros_actuales': filtros_actuales,
+        'perfil_seleccionado': perfil_seleccionado,
+        'perfil_id': perfil_id,
+        'tema': tema,
+        # Si solo se filtra por perfil/tema el total ya está en las facetas y se ahorra el COUNT
+        'total_en_facetas': not filtros_actuales.get('titulo') and not dias and ordenar_por != 'favoritos',
+    }
 
-        print(f"Found {cuentos.count()} stories after filters")
 
-        # Si hay perfil seleccionado, obtener solo temas de ese perfil
-        if perfil_seleccionado:
-            temas_disponibles = Cuento.objects.filter(
-                usuario=request.user,
-                estado='completado',
-                en_biblioteca=True,
-                perfil=perfil_seleccionado
-            ).values_list('tema', flat=True).distinct().order_by('tema')
-        else:
-            temas_disponibles = Cuento.objects.filter(
-                usuario=request.user,
-                estado='completado',
-                en_biblioteca=True
-            ).values_list('tema', flat=True).distinct().order_by('tema')
+def _total_biblioteca(datos, facetas_usuario):
+    if datos['total_en_facetas']:
+        return facetas_usuario.total(datos['perfil_id'], datos['tema'])
+    return datos['cuentos'].count()
 
-        print(f"Temas disponibles: {list(temas_disponibles)}")
 
-        # Migración automática si es necesario
-        total_cuentos_usuario = Cuento.objects.filter(usuario=request.user).count()
-        cuentos_completados = Cuento.objects.filter(usuario=request.user, estado='completado').count()
-        cuentos_en_biblioteca = Cuento.objects.filter(usuario=request.user, estado='completado',
-                                                      en_biblioteca=True).count()
+def _con_cursor(request, cursor):
+    """Query string con los filtros actuales y el cursor de la página siguiente"""
+    parametros = request.GET.copy()
+    parametros.pop('csrfmiddlewaretoken', None)
+    parametros['cursor'] = cursor
+    return parametros.urlencode()
+
+
+def _url_tarjetas(request, cursor):
+    if not cursor:
+        return ''
+    return f"{reverse('library:cards')}?{_con_cursor(request, cursor)}"
 
-        if cuentos_completados > 0 and cuentos_en_biblioteca == 0:
-            print("Migrando cuentos existentes a biblioteca...")
-            migrated = Cuento.objects.filter(
-                usuario=request.user,
-                estado='completado',
-                en_biblioteca=False
-            ).update(en_biblioteca=True)
-            print(f"{migrated} cuentos migrados automáticamente")
-
-        # Pagination
-        paginator = Paginator(cuentos, 12)
-        page_number = request.GET.get('page')
-        page_obj = paginator.get_page(page_number)
-
-        # Get available titles for autocomplete
-        all_titles = list(Cuento.objects.filter(
-            usuario=request.user,
-            estado='completado',
-            en_biblioteca=True
-        ).values_list('titulo', flat=True))
+
+LIMITE_PARECIDOS = 12
+
+
+def _cuento_de_referencia(request, story_id):
+    """Cuento completado del usuario para buscar parecidos, o None"""
+    try:
+        story_id = int(story_id)
+    except (TypeError, ValueError):
+        return None
+    return Cuento.objects.filter(
+        id=story_id, usuario=request.user, estado='completado'
+    ).only(*recommendations.CAMPOS_VECTOR).first()
+
+
+@login_required
+def library_view(request):
+    try:
+        # Perfiles, temas y conteos salen de las facetas cacheadas (library/facets.py)
+        facetas_usuario = facetas(request.user)
+        datos = _filtrar_biblioteca(request, facetas_usuario)
+        logger.debug(f"Filtros de la biblioteca: {datos['filtros_actuales']}")
+
+        # ?similar=<id>: "más como este" en lugar del listado (library/recommendations.py)
+        similar_a = _cuento_de_referencia(request, request.GET.get('similar'))
+        if similar_a:
+            cuentos = [r['cuento'] for r in recommendations.recomendar(similar_a, LIMITE_PARECIDOS)]
+            siguiente = None
+            total_cuentos = len(cuentos)
+        else:
+            # Paginación por cursor (library/pagination.py); ?cursor= sirve también sin JavaScript
+            try:
+                cuentos, siguiente = pagina(datos['cuentos'], request.GET.get('cursor'))
+            except CursorInvalido:
+                cuentos, siguiente = pagina(datos['cuentos'])
+
+            total_cuentos = _total_biblioteca(datos, facetas_usuario)
+
+        # Si hay perfil seleccionado, obtener solo temas de ese perfil
+        temas_disponibles = facetas_usuario.temas(datos['perfil_id'])
 
         context = {
-            'cuentos': page_obj,
-            'perfiles': perfiles,
+            'cuentos': cuentos,
+            'perfiles': facetas_usuario.perfiles,
             'temas_disponibles': temas_disponibles,
-            'filtros_actuales': filtros_actuales,
-            'perfil_seleccionado': perfil_seleccionado,
-            'total_cuentos': cuentos.count(),
-            'titulos_disponibles': json.dumps(all_titles),
+            'filtros_actuales': datos['filtros_actuales'],
+            'perfil_seleccionado': datos['perfil_seleccionado'],
+            'total_cuentos': total_cuentos,
+            'siguiente_pagina': f"?{_con_cursor(request, siguiente)}" if siguiente else '',
+            'siguiente_url': _url_tarjetas(request, siguiente),
+            'similar_a': similar_a,
         }
 
-        print("Rendering library template")
-        logger.info(f"Library loaded for {request.user.username}: {cuentos.count()} stories")
+        logger.info(f"Library loaded for {request.user.username}: {total_cuentos} stories")
         return render(request, 'library/library.html', context)
 
     except Exception as e:
-        print(f"Error in library_view: {str(e)}")
         logger.error(f"Error in library_view: {str(e)}")
         messages.error(request, 'Error al cargar la biblioteca.')
         return redirect('dashboard')
@@ -333,26 +345,11 @@ def reading_tracker_view(request):
         # USAR SOLO ESTADÍSTICAS BÁSICAS PARA EVITAR ERROR DE PIPE
         # Calcular estadísticas directamente desde la base de datos
         from django.db import models
-        from datetime import timedelta
 
-        # Obtener cuentos del usuario en biblioteca
-        total_cuentos = Cuento.objects.filter(
-            usuario=request.user,
-            estado='completado',
-            en_biblioteca=True
-        ).count()
-
-        # Obtener estadísticas de lectura de la última semana
-        fecha_limite = timezone.now() - timedelta(days=7)
-        estadisticas_semana = EstadisticaLectura.objects.filter(
-            usuario=request.user,
-            fecha_lectura__gte=fecha_limite
-        )
-
-        # Calcular tiempo total de lectura
-        tiempo_total_segundos = estadisticas_semana.aggregate(
-            total=models.Sum('tiempo_lectura')
-        )['total'] or 0
+        # Totales desde el resumen diario: el coste depende de los días, no del historial
+        total_cuentos = totales(request.user)['cuentos_creados']
+        semana = totales(request.user, desde=ultimos_dias(7)[0])
+        tiempo_total_segundos = semana['segundos_lectura']
 
         # Formatear tiempo
         if tiempo_total_segundos >= 3600:
@@ -366,12 +363,7 @@ def reading_tracker_view(request):
             tiempo_formateado = f"{tiempo_total_segundos}s"
 
         # Calcular cuentos por semana
-        cuentos_semana = Cuento.objects.filter(
-            usuario=request.user,
-            estado='completado',
-            en_biblioteca=True,
-            fecha_creacion__gte=fecha_limite
-        ).count()
+        cuentos_semana = semana['cuentos_creados']
 
         # Obtener tema favorito
         tema_counts = Cuento.objects.filter(
@@ -433,12 +425,8 @@ def reading_tracker_view(request):
 def get_profile_stats(request, profile_id=None):
     """API para obtener estadísticas de un perfil específico - VERSIÓN FINAL CORREGIDA"""
     try:
-        print(f"\n === GET_PROFILE_STATS DEBUG ===")
-        print(f"Usuario logueado: {request.user.username}")
-        print(f"Profile ID: {profile_id}")
-
         period = request.GET.get('period', 'week')
-        print(f"Período: {period}")
+        logger.debug(f"Estadísticas de {request.user.username}: perfil {profile_id}, período {period}")
 
         # CALCULAR ESTADÍSTICAS MANUALMENTE (más confiable)
         from django.db import models
@@ -452,46 +440,29 @@ def get_profile_stats(request, profile_id=None):
             'en_biblioteca': True
         }
 
-        stats_filter = {'usuario': request.user}
-
         # Filtrar por perfil si se especifica
         perfil_obj = None
         if profile_id and profile_id != 'all':
             try:
                 perfil_obj = get_object_or_404(Perfil, id=profile_id, usuario=request.user)
                 cuentos_filter['perfil'] = perfil_obj
-                stats_filter['perfil'] = perfil_obj
-                print(f"Filtrando por perfil: {perfil_obj.nombre}")
             except:
-                print(f"Perfil {profile_id} no encontrado")
+                logger.debug(f"Perfil {profile_id} no encontrado")
 
         # Filtrar por período
-        fecha_limite = None
-        if period == 'week':
-            fecha_limite = timezone.now() - timedelta(days=7)
-        elif period == 'month':
-            fecha_limite = timezone.now() - timedelta(days=30)
-        elif period == 'year':
-            fecha_limite = timezone.now() - timedelta(days=365)
-
-        if fecha_limite:
-            stats_filter['fecha_lectura__gte'] = fecha_limite
+        dias_periodo = {'week': 7, 'month': 30, 'year': 365}.get(period)
+        desde = ultimos_dias(dias_periodo)[0] if dias_periodo else None
+        if desde:
             # Para cuentos usamos fecha_creacion
-            cuentos_filter['fecha_creacion__gte'] = fecha_limite
-
-        print(f"Fecha límite: {fecha_limite}")
+            cuentos_filter['fecha_creacion__gte'] = inicio_del_dia(desde)
 
-        # OBTENER DATOS
+        # OBTENER DATOS: totales y series salen del resumen diario (DailyReadingRollup)
         cuentos = Cuento.objects.filter(**cuentos_filter)
-        estadisticas = EstadisticaLectura.objects.filter(**stats_filter)
+        resumen = totales(request.user, perfil_obj, desde)
+        diarios = resumenes(request.user, perfil_obj)
 
-        total_cuentos = cuentos.count()
-        total_tiempo_segundos = estadisticas.aggregate(
-            total=models.Sum('tiempo_lectura')
-        )['total'] or 0
-
-        print(f"Cuentos encontrados: {total_cuentos}")
-        print(f"Tiempo total: {total_tiempo_segundos} segundos")
+        total_cuentos = resumen['cuentos_creados']
+        total_tiempo_segundos = resumen['segundos_lectura']
 
         # Formatear tiempo
         if total_tiempo_segundos >= 3600:
@@ -525,76 +496,27 @@ def get_profile_stats(request, profile_id=None):
             tema_favorito = tema_counts[0]['tema'].title()
             temas_explorados = len(tema_counts)
 
-        print(f"Tema favorito: {tema_favorito}")
-        print(f"Temas explorados: {temas_explorados}")
-
         # DATOS PARA GRÁFICAS - USAR FECHA DE CREACIÓN DE CUENTOS EN LUGAR DE ESTADÍSTICAS
 
-        # 1. Actividad de lectura (últimos días) - CORREGIDO USANDO CUENTOS
+        # 1. Actividad de lectura: un GROUP BY por día (o mes) local
         activity_data = []
-        days_range = 7 if period == 'week' else (30 if period == 'month' else 365)
+        days_range = 7 if period == 'week' else 30
 
         if period == 'year':
             # Para año, usar meses
-            for i in range(12):
-                fecha = timezone.now().date() - timedelta(days=30 * i)
-                month_start = fecha.replace(day=1)
-                if i == 0:
-                    month_end = timezone.now().date()
-                else:
-                    next_month = month_start.replace(
-                        month=month_start.month + 1) if month_start.month < 12 else month_start.replace(
-                        year=month_start.year + 1, month=1)
-                    month_end = next_month - timedelta(days=1)
-
-                # USAR FECHA DE CREACIÓN DE CUENTOS
-                count = cuentos.filter(
-                    fecha_creacion__date__gte=month_start,
-                    fecha_creacion__date__lte=month_end
-                ).count()
-
+            for mes, count in serie_mensual(diarios, 'fecha', 12, agregado=models.Sum('cuentos_creados')):
                 activity_data.append({
-                    'date': fecha.strftime('%Y-%m-%d'),
+                    'date': mes.strftime('%Y-%m-%d'),
                     'stories': count
                 })
-            activity_data.reverse()
         else:
             # Para semana/mes, usar días - USAR FECHA DE CREACIÓN DE CUENTOS
-            # Obtener la fecha actual en la zona horaria local
-            ahora_local = timezone.localtime(timezone.now())
-            hoy_local = ahora_local.date()
-            print(f"Fecha actual local: {hoy_local}")
-            print(f"Hora actual local: {ahora_local}")
-
-            for i in range(min(days_range, 30)):
-                fecha_objetivo = hoy_local - timedelta(days=i)
-                print(f"Procesando fecha: {fecha_objetivo}")
-
-                # CONTAR CUENTOS CREADOS EN ESA FECHA (usando fecha_creacion)
-                count = 0
-                cuentos_del_dia = []
-
-                for cuento in cuentos:
-                    # Convertir fecha_creacion a fecha local
-                    fecha_creacion_local = timezone.localtime(cuento.fecha_creacion).date()
-                    print(
-                        f"Cuento '{cuento.titulo}' creado: {cuento.fecha_creacion} -> local: {fecha_creacion_local}")
-
-                    if fecha_creacion_local == fecha_objetivo:
-                        count += 1
-                        cuentos_del_dia.append(cuento.titulo)
-
-                print(f"Cuentos para {fecha_objetivo}: {count}")
-                if cuentos_del_dia:
-                    print(f"Títulos: {cuentos_del_dia}")
-
+            for dia, count in serie_diaria(diarios, 'fecha', days_range, agregado=models.Sum('cuentos_creados')):
                 activity_data.append({
-                    'date': fecha_objetivo.strftime('%Y-%m-%d'),
+                    'date': dia.strftime('%Y-%m-%d'),
                     'stories': count
                 })
 
-            activity_data.reverse()
-
         # 2. Distribución por temas
         theme_distribution = []
         for tema_data in tema_counts:
@@ -606,27 +528,14 @@ def get_profile_stats(request, profile_id=None):
 
         # 3. Progreso de lectura (tiempo por día) - MANTENER CON ESTADÍSTICAS
         reading_progress = []
-        ahora_local = timezone.localtime(timezone.now())
-        hoy_local = ahora_local.date()
-
-        for i in range(min(days_range, 30)):
-            fecha_objetivo = hoy_local - timedelta(days=i)
-
-            # Calcular tiempo total para esa fecha usando estadísticas
-            tiempo_total = 0
-            for stat in estadisticas:
-                fecha_stat = timezone.localtime(stat.fecha_lectura).date()
-                if fecha_stat == fecha_objetivo:
-                    tiempo_total += stat.tiempo_lectura or 0
-
+        for dia, tiempo_total in serie_diaria(diarios, 'fecha', days_range,
+                                              agregado=models.Sum('segundos_lectura')):
             reading_progress.append({
-                'date': fecha_objetivo.strftime('%Y-%m-%d'),
+                'date': dia.strftime('%Y-%m-%d'),
                 'minutes': tiempo_total // 60,
                 'seconds': tiempo_total
             })
 
-        reading_progress.reverse()
-
         # RESPUESTA FINAL
         response_data = {
             'total_stories': total_cuentos,
@@ -641,26 +550,12 @@ def get_profile_stats(request, profile_id=None):
             'reading_progress': reading_progress
         }
 
-        print(f"Enviando respuesta:")
-        print(f"  - Total cuentos: {response_data['total_stories']}")
-        print(f"  - Tiempo total: {response_data['total_reading_time']}")
-        print(f"  - Tema favorito: {response_data['favorite_theme']}")
-        print(f"  - Actividad: {len(activity_data)} puntos")
-        print(f"  - Temas: {len(theme_distribution)} categorías")
-
-        # Debug de activity_data
-        print(f"Activity data:")
-        for item in activity_data:
-            print(f"  {item['date']}: {item['stories']} cuentos")
-
-        print(f"=== FIN DEBUG ===\n")
+        logger.debug(f"Estadísticas desde {desde}: {total_cuentos} cuentos, {total_tiempo_segundos}s de lectura")
 
         return JsonResponse(response_data)
 
     except Exception as e:
-        print(f"ERROR: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.error(f"Error obteniendo estadísticas del perfil {profile_id}: {str(e)}", exc_info=True)
 
         return JsonResponse({
             'error': 'Error al obtener estadísticas',
@@ -688,12 +583,13 @@ def view_library_story(request, story_id):
             story.marcar_como_leido()
 
         # Register reading statistic from library with profile
-        EstadisticaLectura.objects.create(
-            usuario=request.user,
-            cuento=story,
-            perfil=story.perfil,
-            tipo_lectura='biblioteca'
-        )
+        with transaction.atomic():
+            EstadisticaLectura.objects.create(
+                usuario=request.user,
+                cuento=story,
+                perfil=story.perfil,
+                tipo_lectura='biblioteca'
+            )
 
         logger.info(f"Story viewed from library: {story.titulo} by {request.user.username}")
 
@@ -708,92 +604,91 @@ def view_library_story(request, story_id):
 
 @login_required
 def update_reading_time(request):
+    """Endpoint antiguo de tiempo de lectura, para clientes que aún no usan reading_heartbeat.
+
+    El tiempo recibido entra como un latido más en el buffer de library/heartbeats.py, sin
+    consultas ni bloqueos por petición; las sesiones de 10 segundos o más cuentan como lectura.
+    """
     if request.method != 'POST':
         return JsonResponse({'error': 'Método no permitido'}, status=405)
 
     try:
         data = json.loads(request.body)
         cuento_id = data.get('cuento_id')
-        tiempo_lectura = data.get('tiempo_lectura', 0)  # en segundos
-        profile_id = data.get('profile_id')  # ID del perfil específico
+        tiempo_lectura = int(data.get('tiempo_lectura', 0))  # en segundos
+    except (AttributeError, TypeError, ValueError):
+        return JsonResponse({'error': 'Datos incompletos'}, status=400)
 
-        if not cuento_id or tiempo_lectura <= 0:
-            return JsonResponse({'error': 'Datos incompletos'}, status=400)
+    if not cuento_id or tiempo_lectura <= 0:
+        return JsonResponse({'error': 'Datos incompletos'}, status=400)
 
-        cuento = get_object_or_404(Cuento, id=cuento_id, usuario=request.user)
+    # El perfil y el dueño del cuento se validan al volcar el lote, igual que en reading_heartbeat
+    evento = {'c': cuento_id, 'p': data.get('profile_id'), 's': tiempo_lectura, 'n': int(tiempo_lectura >= 10)}
+    if not heartbeats.registrar(request.user.id, [evento]):
+        return JsonResponse({'error': 'Datos incompletos'}, status=400)
 
-        # Obtener el perfil correcto
-        perfil = None
-        if profile_id and profile_id != 'all':
-            try:
-                perfil = Perfil.objects.get(id=profile_id, usuario=request.user)
-            except Perfil.DoesNotExist:
-                pass
+    return JsonResponse({
+        'success': True,
+        'message': 'Tiempo de lectura registrado',
+        'tiempo_lectura': tiempo_lectura,
+    })
 
-        # Si no se proporciona perfil, usar el del cuento
-        if not perfil and cuento.perfil:
-            perfil = cuento.perfil
 
-        # Buscar estadística existente para hoy y este perfil
-        hoy = timezone.now().date()
-        estadistica = EstadisticaLectura.objects.filter(
-            usuario=request.user,
-            cuento=cuento,
-            perfil=perfil,  # Incluir perfil en la búsqueda
-            fecha_lectura__date=hoy
-        ).first()
-
-        if estadistica:
-            # Actualizar estadística existente (acumular tiempo)
-            estadistica.tiempo_lectura += tiempo_lectura
-            estadistica.save()
-            tiempo_total = estadistica.tiempo_lectura
-        else:
-            # Crear nueva estadística
-            estadistica = EstadisticaLectura.objects.create(
-                usuario=request.user,
-                cuento=cuento,
-                perfil=perfil,  # Incluir perfil
-                tiempo_lectura=tiempo_lectura,
-                tipo_lectura='texto',
-                fecha_lectura=timezone.now()
-            )
-            tiempo_total = tiempo_lectura
-
-        # Incrementar contador de veces leído
-        if hasattr(cuento, 'veces_leido'):
-            # Solo incrementar si es una nueva sesión (más de 10 segundos)
-            if tiempo_lectura >= 10:
-                cuento.veces_leido += 1
-                cuento.save(update_fields=['veces_leido'])
-
-        # Formatear tiempo para respuesta
-        total_hours = tiempo_total // 3600
-        total_minutes = (tiempo_total % 3600) // 60
-        total_seconds = tiempo_total % 60
-
-        if total_hours > 0:
-            tiempo_formateado = f"{total_hours}h {total_minutes}m {total_seconds}s"
-        elif total_minutes > 0:
-            tiempo_formateado = f"{total_minutes}m {total_seconds}s"
+@login_required
+@require_POST
+def reading_heartbeat(request):
+    """Latidos de lectura en lote: fetch cada 30 s o sendBeacon al salir (ver library/heartbeats.py).
+
+    Acepta JSON {"eventos": [...]} o un formulario con el campo `eventos` (sendBeacon no puede
+    enviar la cabecera X-CSRFToken, así que el token va en el propio formulario).
+    """
+    try:
+        if request.content_type == 'application/json':
+            datos = json.loads(request.body or b'{}')
+            eventos = datos.get('eventos') if isinstance(datos, dict) else datos
         else:
-            tiempo_formateado = f"{total_seconds}s"
+            eventos = json.loads(request.POST.get('eventos', '[]'))
+    except ValueError:
+        return JsonResponse({'error': 'JSON inválido'}, status=400)
 
-        return JsonResponse({
-            'success': True,
-            'message': 'Tiempo de lectura actualizado',
-            'tiempo_lectura': tiempo_lectura,
-            'tiempo_total': tiempo_total,
-            'tiempo_formateado': tiempo_formateado,
-            'perfil_nombre': perfil.nombre if perfil else 'Sin perfil'
-        })
+    if not isinstance(eventos, list):
+        return JsonResponse({'error': 'Se esperaba una lista de eventos'}, status=400)
+
+    heartbeats.registrar(request.user.id, eventos)
+    return HttpResponse(status=204)
 
+
+@login_required
+@require_POST
+def library_bulk_action(request):
+    """Favorito, borrado, cambio de perfil o paso a biblioteca de muchos cuentos a la vez (library/bulk.py).
+
+    JSON {"action": "favorite" | "unfavorite" | "delete" | "move" | "add_to_library",
+          "ids": [...], "profile_id": ...}; profile_id solo para "move".
+    """
+    try:
+        datos = json.loads(request.body or b'{}')
+        if not isinstance(datos, dict):
+            raise ValueError
+    except ValueError:
+        return JsonResponse({'success': False, 'message': 'JSON inválido'}, status=400)
+
+    try:
+        resultado = bulk.aplicar(request.user, datos.get('action'), datos.get('ids'),
+                                 perfil_id=datos.get('profile_id'), request=request)
+    except bulk.OperacionInvalida as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
     except Exception as e:
-        logger.error(f"Error updating reading time: {str(e)}")
-        return JsonResponse({
-            'error': 'Error al actualizar tiempo de lectura',
-            'message': str(e)
-        }, status=500)
+        logger.error(f"Error in bulk library action: {str(e)}")
+        return JsonResponse({'success': False, 'message': 'Error al actualizar los cuentos'}, status=500)
+
+    procesados = len(resultado['procesados'])
+    return JsonResponse({
+        'success': True,
+        'processed': resultado['procesados'],
+        'not_found': resultado['no_encontrados'],
+        'message': f'{procesados} cuento{"s" if procesados != 1 else ""} actualizado{"s" if procesados != 1 else ""}',
+    })
 
 
 # Resto de las vistas existentes sin cambios...
@@ -868,23 +763,24 @@ def download_library_story(request, story_id):
         )
 
         logger.info(f"Descargando PDF desde biblioteca: {story.titulo}")
-        pdf_buffer = generar_pdf_cuento(story)
-        response = HttpResponse(pdf_buffer.getvalue(), content_type='application/pdf')
-        filename = f"CuentIA_{story.titulo.replace(' ', '_').replace('/', '_')}.pdf"
-        response['Content-Disposition'] = f'attachment; filename="{filename}"'
-        response['Content-Length'] = len(pdf_buffer.getvalue())
-
-        # Register download statistic with profile
-        EstadisticaLectura.objects.create(
-            usuario=request.user,
-            cuento=story,
-            perfil=story.perfil,
-            tipo_lectura='descarga'
-        )
+        response = respuesta_pdf(request, story)
+
+        # Register download statistic with profile (a 304 revalidation is not a download)
+        if response.status_code == 200:
+            with transaction.atomic():
+                EstadisticaLectura.objects.create(
+                    usuario=request.user,
+                    cuento=story,
+                    perfil=story.perfil,
+                    tipo_lectura='descarga'
+                )
 
         logger.info(f"PDF descargado desde biblioteca: {story.titulo}")
         return response
 
+    except RenderSaturado as e:
+        logger.warning(str(e))
+        return respuesta_saturado(e)
     except Exception as e:
         logger.error(f"Error generating PDF from library: {str(e)}")
         messages.error(request, 'Error al generar el PDF.')
@@ -898,13 +794,11 @@ def search_stories_ajax(request):
     if len(query) < 2:
         return JsonResponse({'stories': []})
 
-    try:
-        stories = Cuento.objects.filter(
-            usuario=request.user,
-            estado='completado',
-            en_biblioteca=True,
-            titulo__icontains=query
-        ).select_related('perfil')[:10]
+    def calcular():
+        # Los ids salen del índice de títulos; solo se consultan los 10 cuentos a mostrar
+        ids = autocomplete.buscar_ids(request.user, query, 10)
+        por_id = Cuento.objects.filter(id__in=ids, usuario=request.user).cards().in_bulk()
+        stories = [por_id[cuento_id] for cuento_id in ids if cuento_id in por_id]
 
         results = []
         for story in stories:
@@ -917,48 +811,156 @@ def search_stories_ajax(request):
                 'date': story.fecha_creacion.strftime('%d/%m/%Y'),
                 'times_read': getattr(story, 'veces_leido', 0),
             })
+        return results
 
+    try:
+        results = _ajax_cacheado(request, 'stories', calcular, autocomplete.normalizar(query))
         return JsonResponse({'stories': results})
     except Exception as e:
         logger.error(f"Error in AJAX search: {str(e)}")
         return JsonResponse({'stories': [], 'error': 'Error en la búsqueda'})
 
 
+@login_required
+def library_cards_ajax(request):
+    """Siguiente página de tarjetas para el scroll infinito y los cambios de filtro"""
+    try:
+        facetas_usuario = facetas(request.user)
+        datos = _filtrar_biblioteca(request, facetas_usuario)
+        cursor = request.GET.get('cursor')
+        try:
+            cuentos, siguiente = pagina(datos['cuentos'], cursor)
+        except CursorInvalido:
+            return JsonResponse({'success': False, 'error': 'Cursor inválido'}, status=400)
+
+        respuesta = {
+            'success': True,
+            'html': render_to_string('library/_tarjetas.html', {'cuentos': cuentos}, request=request),
+            'count': len(cuentos),
+            'next_cursor': siguiente,
+            'next_url': _url_tarjetas(request, siguiente),
+        }
+        if not cursor:
+            # Primera página tras cambiar filtros: el cliente actualiza la cabecera
+            respuesta['total'] = _total_biblioteca(datos, facetas_usuario)
+            respuesta['perfil'] = datos['perfil_seleccionado']['nombre'] if datos['perfil_seleccionado'] else None
+        return JsonResponse(respuesta)
+    except Exception as e:
+        logger.error(f"Error loading library cards: {str(e)}")
+        return JsonResponse({'success': False, 'error': 'Error al cargar los cuentos'}, status=500)
+
+
+@login_required
+def full_text_search(request):
+    """Busca en título, contenido, personaje y moraleja (library/search.py)"""
+    query = request.GET.get('q', '').strip()
+    profile_id = request.GET.get('profile_id')
+
+    if len(query) < 2:
+        return JsonResponse({'success': True, 'results': []})
+
+    try:
+        perfil_id = None
+        if profile_id and profile_id != 'todos':
+            try:
+                perfil_id = int(profile_id)
+            except ValueError:
+                return JsonResponse({'success': True, 'results': []})
+
+        try:
+            limite = min(int(request.GET.get('limit', 20)), 50)
+        except ValueError:
+            limite = 20
+
+        resultados = search.buscar(request.user, query, UserSettings.idioma_de(request.user), perfil_id, limite)
+
+        results = []
+        for resultado in resultados:
+            story = resultado['cuento']
+            results.append({
+                'id': story.id,
+                'title': story.titulo,
+                'character': story.personaje_principal,
+                'theme': story.get_tema_display(),
+                'profile': story.perfil.nombre if story.perfil else 'Sin perfil',
+                'date': story.fecha_creacion.strftime('%d/%m/%Y'),
+                'snippet': resultado['fragmento'],
+                'score': round(resultado['puntuacion'], 4),
+                'url': reverse('library:view_story', args=[story.id]),
+            })
+
+        return JsonResponse({'success': True, 'results': results})
+    except Exception as e:
+        logger.error(f"Error in full text search: {str(e)}")
+        return JsonResponse({'success': False, 'results': [], 'error': 'Error en la búsqueda'})
+
+
+@login_required
+def similar_stories(request, story_id):
+    """Cuentos de la biblioteca parecidos a uno dado (library/recommendations.py)"""
+    cuento = _cuento_de_referencia(request, story_id)
+    if cuento is None:
+        return JsonResponse({'success': False, 'stories': [], 'error': 'Cuento no encontrado'}, status=404)
+
+    try:
+        try:
+            limite = min(int(request.GET.get('limit', 6)), LIMITE_PARECIDOS)
+        except ValueError:
+            limite = 6
+
+        stories = []
+        for resultado in recommendations.recomendar(cuento, limite):
+            story = resultado['cuento']
+            stories.append({
+                'id': story.id,
+                'title': story.titulo,
+                'character': story.personaje_principal,
+                'theme': story.get_tema_display(),
+                'profile': story.perfil.nombre if story.perfil else 'Sin perfil',
+                'preview': story.vista_previa,
+                'thumbnail': story.url_miniatura,
+                'score': resultado['similitud'],
+                'url': reverse('library:view_story', args=[story.id]),
+            })
+
+        return JsonResponse({
+            'success': True,
+            'stories': stories,
+            'more_url': f"{reverse('library:library')}?similar={cuento.id}",
+        })
+    except Exception as e:
+        logger.error(f"Error in similar stories: {str(e)}")
+        return JsonResponse({'success': False, 'stories': [], 'error': 'Error al buscar cuentos parecidos'})
+
+
 @login_required
 def filter_by_profile(request, profile_id):
     try:
         profile = get_object_or_404(Perfil, id=profile_id, usuario=request.user)
 
-        stories = Cuento.objects.filter(
-            usuario=request.user,
-            perfil=profile,
-            estado='completado',
-            en_biblioteca=True
-        ).order_by('-fecha_creacion')
+        stories = Cuento.objects.biblioteca(request.user).cards().filter(perfil=profile)
 
-        if not stories.exists():
+        facetas_usuario = facetas(request.user)
+        total = facetas_usuario.total(profile.id)
+        if not total:
             messages.info(request, f'El perfil "{profile.nombre}" no tiene cuentos guardados en la biblioteca.')
 
-        paginator = Paginator(stories, 12)
-        page_number = request.GET.get('page')
-        page_obj = paginator.get_page(page_number)
+        try:
+            cuentos, siguiente = pagina(stories, request.GET.get('cursor'))
+        except CursorInvalido:
+            cuentos, siguiente = pagina(stories)
+
 
         context = {
-            'cuentos': page_obj,
+            'cuentos': cuentos,
             'perfil_seleccionado': profile,
-            'perfiles': Perfil.objects.filter(usuario=request.user),
-            'temas_disponibles': Cuento.objects.filter(
-                usuario=request.user,
-                estado='completado',
-                en_biblioteca=True
-            ).values_list('tema', flat=True).distinct().order_by('tema'),
-            'years': [date.year for date in Cuento.objects.filter(
-                usuario=request.user,
-                estado='completado',
-                en_biblioteca=True
-            ).dates('fecha_creacion', 'year', order='DESC')],
-            'filtros_actuales': {'perfil': str(profile_id)},
-            'total_cuentos': stories.count(),
+            'perfiles': facetas_usuario.perfiles,
+            'temas_disponibles': facetas_usuario.temas(),
+            'years': facetas_usuario.anios(),
+            'filtros_actuales': {'perfil_id': str(profile_id)},
+            'total_cuentos': total,
+            'siguiente_pagina': f"?cursor={siguiente}" if siguiente else '',
+            'siguiente_url': f"{reverse('library:cards')}?perfil={profile.id}&cursor={siguiente}" if siguiente else '',
         }
 
         return render(request, 'library/library.html', context)
@@ -973,11 +975,7 @@ def filter_by_profile(request, profile_id):
 def library_statistics(request):
     try:
         statistics = LibraryManager.get_library_statistics(request.user)
-        popular_stories = Cuento.objects.filter(
-            usuario=request.user,
-            estado='completado',
-            en_biblioteca=True
-        ).order_by('-veces_leido')[:5] if hasattr(Cuento, 'veces_leido') else []
+        popular_stories = Cuento.objects.biblioteca(request.user).cards().order_by('-veces_leido')[:5]
 
         recent_activity = EstadisticaLectura.objects.filter(
             usuario=request.user
@@ -1034,30 +1032,45 @@ def toggle_library_favorite(request, story_id):
         })
 
 
+def _ajax_cacheado(request, endpoint, calcular, *parametros):
+    """Resultado de un filtro AJAX cacheado por usuario, endpoint y parámetros ya normalizados.
+
+    TTL corto (LIBRARY_AJAX_CACHE_TTL) y se invalida con las facetas cuando cambia
+    un cuento o un perfil del usuario (library/models.py). Las peticiones iguales
+    simultáneas comparten un único cálculo (cache_utils.obtener).
+    """
+    return cache_utils.obtener(
+        cache_utils.AJAX, request.user.id, calcular,
+        ttl=getattr(settings, 'LIBRARY_AJAX_CACHE_TTL', 30), parametros=(endpoint, *parametros),
+    )
+
+
+def _perfil_de_filtro(valor):
+    """'todos', '' o basura -> None; '12' -> 12"""
+    if not valor or valor == 'todos':
+        return None
+    try:
+        return int(valor)
+    except ValueError:
+        return None
+
+
 # filtros de busqueda
 @login_required
 def get_themes_by_profile(request):
-    profile_id = request.GET.get('profile_id')
+    profile_id = _perfil_de_filtro(request.GET.get('profile_id'))
 
-    try:
-        if profile_id and profile_id != 'todos':
+    def calcular():
+        temas = Cuento.objects.biblioteca(request.user)
+        if profile_id:
             # Obtener temas solo del perfil seleccionado
-            temas = Cuento.objects.filter(
-                usuario=request.user,
-                estado='completado',
-                en_biblioteca=True,
-                perfil_id=profile_id
-            ).values_list('tema', flat=True).distinct().order_by('tema')
-        else:
-            # Obtener todos los temas del usuario
-            temas = Cuento.objects.filter(
-                usuario=request.user,
-                estado='completado',
-                en_biblioteca=True
-            ).values_list('tema', flat=True).distinct().order_by('tema')
-
+            temas = temas.filter(perfil_id=profile_id)
+        temas = temas.values_list('tema', flat=True).distinct().order_by('tema')
         # Filtrar temas vacíos o None
-        temas_filtrados = [tema for tema in temas if tema and tema.strip()]
+        return [tema for tema in temas if tema and tema.strip()]
+
+    try:
+        temas_filtrados = _ajax_cacheado(request, 'themes', calcular, profile_id)
 
         return JsonResponse({
             'success': True,
@@ -1082,23 +1095,20 @@ def search_titles_ajax(request):
         return JsonResponse({'titles': []})
 
     try:
-        # Construir queryset base
-        queryset = Cuento.objects.filter(
-            usuario=request.user,
-            estado='completado',
-            en_biblioteca=True,
-            titulo__icontains=query
-        )
-
-        # Aplicar filtros adicionales si están presentes
+        perfil_id = None
         if profile_id and profile_id != 'todos':
-            queryset = queryset.filter(perfil_id=profile_id)
+            try:
+                perfil_id = int(profile_id)
+            except ValueError:
+                return JsonResponse({'success': True, 'titles': []})
 
-        if theme and theme != 'todos':
-            queryset = queryset.filter(tema=theme)
+        tema = theme if theme and theme != 'todos' else None
 
-        # Obtener títulos únicos
-        titles = list(queryset.values_list('titulo', flat=True).distinct()[:10])
+        # Índice en memoria por usuario (library/autocomplete.py): sin consultas por tecla
+        titles = _ajax_cacheado(
+            request, 'titles', lambda: autocomplete.sugerencias(request.user, query, 10, perfil_id, tema),
+            autocomplete.normalizar(query), perfil_id, tema,
+        )
 
         return JsonResponse({
             'success': True,
@@ -14,7 +14,8 @@ window.audioControl = {
 // NUEVA: Variable para controlar filtros dinámicos
 window.filtrosControl = {
   searchTimeout: null,
-  isFiltering: false
+  isFiltering: false,
+  cargando: false
 }
 
 // ===================================
@@ -50,6 +51,9 @@ function initializeBiblioteca() {
   // Configurar modal de forma directa
   setupModalDirecto()
 
+  // Cargar más cuentos al llegar al final de la lista
+  setupScrollInfinito()
+
   console.log("✅ Biblioteca inicializada correctamente")
 }
 
@@ -78,7 +82,15 @@ function setupFilters() {
     temaSelector.addEventListener("change", function () {
       console.log("🎨 Tema seleccionado:", this.value)
       // Auto-submit después de cambio de tema
-      setTimeout(() => filtrosForm.submit(), 100)
+      setTimeout(() => aplicarFiltros(filtrosForm), 100)
+    })
+  }
+
+  // Enter u otros envíos del formulario también cargan sin recargar la página
+  if (filtrosForm) {
+    filtrosForm.addEventListener("submit", (e) => {
+      e.preventDefault()
+      aplicarFiltros(filtrosForm)
     })
   }
 
@@ -92,11 +104,101 @@ function setupFilters() {
   otherFilterSelects.forEach((select) => {
     select.addEventListener("change", function () {
       console.log("🔄 Filtro cambiado:", this.name, this.value)
-      filtrosForm.submit()
+      aplicarFiltros(filtrosForm)
     })
   })
 }
 
+// ===================================
+// CARGA INCREMENTAL (paginación por cursor)
+// ===================================
+function setupScrollInfinito() {
+  const sentinel = document.getElementById("biblioteca-sentinel")
+  if (!sentinel || !("IntersectionObserver" in window)) return
+
+  const observer = new IntersectionObserver((entradas) => {
+    if (entradas.some((entrada) => entrada.isIntersecting)) {
+      cargarTarjetas(sentinel.dataset.nextUrl, false)
+    }
+  }, { rootMargin: "400px" })
+  observer.observe(sentinel)
+
+  // Con JavaScript el botón carga en la misma página en lugar de navegar
+  document.getElementById("cargar-mas")?.addEventListener("click", (e) => {
+    e.preventDefault()
+    cargarTarjetas(sentinel.dataset.nextUrl, false)
+  })
+}
+
+// Sustituye al envío del formulario: pide la primera página con los filtros nuevos
+function aplicarFiltros(filtrosForm) {
+  const params = new URLSearchParams(new FormData(filtrosForm))
+  params.delete("csrfmiddlewaretoken")
+  window.history.replaceState(null, "", `${window.location.pathname}?${params}`)
+  cargarTarjetas(`/library/ajax/cards/?${params}`, true)
+}
+
+async function cargarTarjetas(url, reemplazar) {
+  const grid = document.getElementById("biblioteca-grid")
+  const sentinel = document.getElementById("biblioteca-sentinel")
+  if (!url || !grid || !sentinel) return
+  if (window.filtrosControl.cargando && !reemplazar) return
+  window.filtrosControl.cargando = true
+
+  try {
+    const response = await fetch(url, { headers: { "X-Requested-With": "XMLHttpRequest" } })
+    if (!response.ok) {
+      throw new Error(`HTTP ${response.status}`)
+    }
+    const data = await response.json()
+    if (!data.success) {
+      throw new Error(data.error || "Error al cargar los cuentos")
+    }
+
+    // Los botones de las tarjetas nuevas se configuran antes de insertarlas
+    const nuevas = document.createElement("div")
+    nuevas.innerHTML = data.html
+    setupAudioButtons(nuevas)
+    setupDownloadButtons(nuevas)
+    setupOtherButtons(nuevas)
+
+    if (reemplazar) {
+      grid.innerHTML = ""
+      window.scrollTo({ top: grid.offsetTop - 200, behavior: "smooth" })
+    }
+    grid.append(...nuevas.children)
+
+    if (data.total !== undefined) {
+      actualizarCabeceraResultados(data.total, data.perfil)
+    }
+    grid.hidden = grid.children.length === 0
+    document.getElementById("biblioteca-vacia").hidden = grid.children.length > 0
+
+    sentinel.dataset.nextUrl = data.next_url || ""
+    sentinel.hidden = !data.next_url
+  } catch (error) {
+    console.error("❌ Error cargando cuentos:", error)
+    showMessage("❌ Error al cargar los cuentos", "error")
+  } finally {
+    window.filtrosControl.cargando = false
+    window.filtrosControl.isFiltering = false
+  }
+}
+
+function actualizarCabeceraResultados(total, perfil) {
+  const cabecera = document.getElementById("resultados-total")
+  if (cabecera) {
+    cabecera.dataset.total = total
+    cabecera.textContent = `Resultados: ${total} cuento${total === 1 ? "" : "s"}`
+  }
+  const infoPerfil = document.getElementById("resultados-perfil")
+  if (infoPerfil) {
+    infoPerfil.hidden = !perfil
+    const nombre = infoPerfil.querySelector("strong")
+    if (nombre) nombre.textContent = perfil || ""
+  }
+}
+
 // NUEVA FUNCIÓN: Actualizar temas por perfil de forma dinámica - MEJORADA
 async function actualizarTemasPorPerfilDinamico(perfilId) {
   const temaSelector = document.getElementById("tema")
@@ -162,7 +264,7 @@ async function actualizarTemasPorPerfilDinamico(perfilId) {
       // Auto-submit después de actualizar temas
       setTimeout(() => {
         console.log("🔄 Auto-submit después de actualizar temas")
-        filtrosForm.submit()
+        aplicarFiltros(filtrosForm)
       }, 300)
 
     } else {
@@ -224,7 +326,7 @@ function setupTitleAutocomplete(tituloInput, filtrosForm) {
       window.filtrosControl.searchTimeout = setTimeout(() => {
         if (!window.filtrosControl.isFiltering) {
           console.log("🔄 Auto-submit para limpiar filtro")
-          filtrosForm.submit()
+          aplicarFiltros(filtrosForm)
         }
       }, 500)
       return
@@ -272,7 +374,7 @@ function setupTitleAutocomplete(tituloInput, filtrosForm) {
             if (!window.filtrosControl.isFiltering) {
               console.log("🔍 Auto-submit por búsqueda sin sugerencias:", query)
               window.filtrosControl.isFiltering = true
-              filtrosForm.submit()
+              aplicarFiltros(filtrosForm)
             }
           }, 800)
         }
@@ -335,7 +437,7 @@ function setupTitleAutocomplete(tituloInput, filtrosForm) {
     hideAutocomplete()
     window.filtrosControl.isFiltering = true
     console.log("🎯 Sugerencia seleccionada:", title)
-    filtrosForm.submit()
+    aplicarFiltros(filtrosForm)
   }
 
   // Limpiar selección
@@ -378,7 +480,7 @@ function setupTitleAutocomplete(tituloInput, filtrosForm) {
         hideAutocomplete()
         window.filtrosControl.isFiltering = true
         console.log("🔍 Enter presionado - búsqueda directa:", tituloInput.value)
-        filtrosForm.submit()
+        aplicarFiltros(filtrosForm)
       }
     } else if (e.key === 'Escape') {
       hideAutocomplete()
@@ -407,7 +509,7 @@ function setupTitleAutocomplete(tituloInput, filtrosForm) {
       if (!window.filtrosControl.isFiltering && this.value.trim().length >= 2) {
         console.log("🔍 Auto-submit por búsqueda en tiempo real:", this.value)
         window.filtrosControl.isFiltering = true
-        filtrosForm.submit()
+        aplicarFiltros(filtrosForm)
       }
       window.filtrosControl.isFiltering = false
     }, 1200) // 1.2 segundos de delay para auto-submit
@@ -418,11 +520,11 @@ function setupTitleAutocomplete(tituloInput, filtrosForm) {
 // ===================================
 
 // NUEVA FUNCIONALIDAD: CONFIGURAR BOTONES DE DESCARGA
-function setupDownloadButtons() {
+function setupDownloadButtons(raiz = document) {
   console.log("📄 Configurando botones de descarga...")
 
   // Buscar todos los enlaces de descarga
-  document.querySelectorAll('a[href*="/descargar/"], .download-btn, [data-action="download"]').forEach((element) => {
+  raiz.querySelectorAll('a[href*="/descargar/"], .download-btn, [data-action="download"]').forEach((element) => {
     element.addEventListener("click", function (e) {
       e.preventDefault()
       e.stopPropagation()
@@ -536,18 +638,18 @@ function setupModalDirecto() {
 }
 
 // CONFIGURACIÓN DE BOTONES DE AUDIO - ULTRA SIMPLE
-function setupAudioButtons() {
+function setupAudioButtons(raiz = document) {
   console.log("🎵 Configurando botones de audio...")
 
   // REMOVER TODOS LOS EVENT LISTENERS PREVIOS
-  document.querySelectorAll(".play-story").forEach((btn) => {
+  raiz.querySelectorAll(".play-story").forEach((btn) => {
     // Clonar el botón para remover todos los event listeners
     const newBtn = btn.cloneNode(true)
     btn.parentNode.replaceChild(newBtn, btn)
   })
 
   // AGREGAR NUEVOS EVENT LISTENERS - UNO POR UNO
-  document.querySelectorAll(".play-story").forEach((btn) => {
+  raiz.querySelectorAll(".play-story").forEach((btn) => {
     btn.addEventListener("click", handleAudioClick, { once: false })
   })
 
@@ -714,9 +816,9 @@ function resetAudioState() {
 }
 
 // CONFIGURACIÓN DE OTROS BOTONES
-function setupOtherButtons() {
+function setupOtherButtons(raiz = document) {
   // Favoritos
-  document.querySelectorAll(".favorite-btn").forEach((btn) => {
+  raiz.querySelectorAll(".favorite-btn").forEach((btn) => {
     btn.addEventListener("click", function (e) {
       e.preventDefault()
       e.stopPropagation()
@@ -726,7 +828,7 @@ function setupOtherButtons() {
   })
 
   // Eliminar
-  document.querySelectorAll(".delete-story").forEach((btn) => {
+  raiz.querySelectorAll(".delete-story").forEach((btn) => {
     btn.addEventListener("click", function (e) {
       e.preventDefault()
       e.stopPropagation()
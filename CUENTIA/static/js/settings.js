@@ -346,6 +346,33 @@ document.addEventListener("DOMContentLoaded", () => {
       })
   })
 
+  // Reutilizar cuentos idénticos
+  const reutilizarCuentos = document.getElementById("reutilizar-cuentos")
+  reutilizarCuentos.addEventListener("change", function () {
+    fetch("/user/update-preferences/", {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+        "X-CSRFToken": getCookie("csrftoken"),
+      },
+      body: JSON.stringify({
+        reutilizar_cuentos: this.checked,
+      }),
+    })
+      .then((response) => response.json())
+      .then((data) => {
+        if (data.status === "success") {
+          showMessage(
+            this.checked ? "Se reutilizarán los cuentos idénticos" : "Cada cuento se escribirá de nuevo",
+            "success",
+          )
+        }
+      })
+      .catch((error) => {
+        console.error("❌ Error:", error)
+      })
+  })
+
   // Language selection
   const languageSelect = document.getElementById("language-select")
   languageSelect.addEventListener("change", function () {
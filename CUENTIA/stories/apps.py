@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class CuentosConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'stories'
+
+    def ready(self):
+        # Registra las comprobaciones de arranque (stories/checks.py)
+        from . import checks
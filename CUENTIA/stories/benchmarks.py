@@ -0,0 +1,976 @@
+"""Escenarios de rendimiento para `python manage.py bench_stories`.
+
+Todos se ejecutan contra una base de datos temporal y con un cliente de OpenAI
+simulado, así que no tocan datos reales ni consumen cuota de la API.
+"""
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connections
+from django.db.models import Sum
+
+from . import notifications
+from .models import Cuento, EstadisticaLectura, TrabajoGeneracion
+
+
+@contextmanager
+def base_de_datos_temporal():
+    """Crea una base de datos desechable (en archivo para que la compartan los hilos)"""
+    conexion = connections['default']
+    directorio = None
+    if conexion.vendor == 'sqlite':
+        directorio = tempfile.mkdtemp(prefix='cuentia-bench-')
+        conexion.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(directorio, 'bench.sqlite3')
+
+    nombre_original = conexion.settings_dict['NAME']
+    conexion.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    notifications.reiniciar()
+    try:
+        yield
+    finally:
+        notifications.reiniciar()
+        connections.close_all()
+        conexion.creation.destroy_test_db(nombre_original, verbosity=0)
+        if directorio:
+            shutil.rmtree(directorio, ignore_errors=True)
+
+
+class ServicioSimulado:
+    """Sustituto de OpenAIService con latencias configurables"""
+
+    def __init__(self, latencia_texto=0.5, latencia_imagen=0.3):
+        self.latencia_texto = latencia_texto
+        self.latencia_imagen = latencia_imagen
+        self.llamadas = 0
+
+    def generar_texto(self, datos_formulario, user=None, al_avanzar=None):
+        self.llamadas += 1
+        personaje = datos_formulario.get('personaje_principal', 'Luna')
+        titulo = f"La aventura de {personaje}"
+        parrafos = [f"Párrafo {i} de la aventura de {personaje}." for i in range(1, 7)]
+
+        if al_avanzar:
+            # Los párrafos llegan repartidos a lo largo de la latencia del texto
+            for indice in range(1, len(parrafos) + 1):
+                time.sleep(self.latencia_texto / len(parrafos))
+                al_avanzar(titulo, parrafos[:indice])
+        else:
+            time.sleep(self.latencia_texto)
+
+        return titulo, "\n\n".join(parrafos), "Ser valiente es ayudar a los demás."
+
+    def generar_imagen(self, titulo, contenido, tema, user=None):
+        self.llamadas += 1
+        time.sleep(self.latencia_imagen)
+        return "/static/images/cuento-placeholder.png", "Imagen simulada"
+
+    def generar_cuento_completo(self, datos_formulario, user=None, al_avanzar=None):
+        titulo, contenido, moraleja = self.generar_texto(datos_formulario, user, al_avanzar)
+        return (titulo, contenido, moraleja) + self.generar_imagen(titulo, contenido, '')
+
+
+class ServicioSecuencial(ServicioSimulado):
+    """Reproduce el pipeline anterior: el texto solo se entrega cuando la imagen también está lista"""
+
+    def generar_texto(self, datos_formulario, user=None, al_avanzar=None):
+        resultado = super().generar_texto(datos_formulario, user)
+        time.sleep(self.latencia_imagen)
+        return resultado
+
+    def generar_imagen(self, titulo, contenido, tema, user=None):
+        return "/static/images/cuento-placeholder.png", "Imagen simulada"
+
+
+class ServicioSimuladoAsync(ServicioSimulado):
+    """ServicioSimulado con la interfaz de AsyncOpenAIService: las latencias no ocupan el hilo"""
+
+    async def generar_texto(self, datos_formulario, user=None, al_avanzar=None):
+        self.llamadas += 1
+        await asyncio.sleep(self.latencia_texto)
+        personaje = datos_formulario.get('personaje_principal', 'Luna')
+        parrafos = [f"Párrafo {i} de la aventura de {personaje}." for i in range(1, 7)]
+        return f"La aventura de {personaje}", "\n\n".join(parrafos), "Ser valiente es ayudar a los demás."
+
+    async def generar_imagen(self, titulo, contenido, tema, user=None):
+        self.llamadas += 1
+        await asyncio.sleep(self.latencia_imagen)
+        return "/static/images/cuento-placeholder.png", "Imagen simulada"
+
+
+def crear_usuario_bench(nombre='bench'):
+    return User.objects.create_user(username=nombre, password='bench-password')
+
+
+def crear_cuentos_generando(usuario, total):
+    datos = {
+        'titulo': '',
+        'personaje_principal': 'Luna',
+        'tema': 'aventura',
+        'edad': '6-8',
+        'longitud': 'corto',
+    }
+    cuentos = Cuento.objects.bulk_create([
+        Cuento(usuario=usuario, titulo='Cuento Mágico', personaje_principal='Luna',
+               tema='aventura', edad='6-8', longitud='corto', estado='generando')
+        for _ in range(total)
+    ])
+    return cuentos, datos
+
+
+def bench_cola(salida, opciones):
+    """Throughput de la cola de generación con distintos tamaños de pool"""
+    from .jobs import PoolWorkers, encolar_generacion
+
+    total = opciones['trabajos']
+    latencia = opciones['latencia']
+
+    for hilos in opciones['hilos']:
+        with base_de_datos_temporal():
+            usuario = crear_usuario_bench()
+            cuentos, datos = crear_cuentos_generando(usuario, total)
+            for cuento in Cuento.objects.filter(usuario=usuario):
+                encolar_generacion(cuento, datos)
+
+            servicio = ServicioSimulado(latencia_texto=latencia * 0.6, latencia_imagen=latencia * 0.4)
+            pool = PoolWorkers(hilos, servicio=servicio, intervalo=0.05)
+
+            inicio = time.perf_counter()
+            pool.iniciar()
+            while TrabajoGeneracion.objects.filter(estado__in=['pendiente', 'en_proceso']).exists():
+                time.sleep(0.05)
+            duracion = time.perf_counter() - inicio
+            pool.parar()
+
+            completados = Cuento.objects.filter(usuario=usuario, estado='completado').count()
+            salida(
+                f"hilos={hilos:>3}  trabajos={completados}/{total}  "
+                f"tiempo={duracion:6.2f}s  throughput={completados / duracion:6.2f} cuentos/s"
+            )
+
+
+def bench_streaming(salida, opciones):
+    """Tiempo hasta el primer párrafo visible con y sin streaming"""
+    from .jobs import encolar_generacion, procesar_trabajo, reclamar_trabajo
+    import threading
+
+    latencia = opciones['latencia']
+    for modo in ('completo', 'streaming'):
+        with base_de_datos_temporal():
+            usuario = crear_usuario_bench()
+            cuentos, datos = crear_cuentos_generando(usuario, 1)
+            cuento = Cuento.objects.get(usuario=usuario)
+            encolar_generacion(cuento, datos)
+
+            servicio = ServicioSimulado(latencia_texto=latencia, latencia_imagen=latencia / 2)
+            if modo == 'completo':
+                original = servicio.generar_texto
+                servicio.generar_texto = (
+                    lambda datos, user=None, al_avanzar=None: original(datos, user=user)
+                )
+
+            trabajo = reclamar_trabajo('bench')
+            inicio = time.perf_counter()
+            hilo = threading.Thread(target=procesar_trabajo, args=(trabajo, servicio))
+            hilo.start()
+
+            primer_parrafo = None
+            while hilo.is_alive():
+                if primer_parrafo is None and Cuento.objects.filter(id=cuento.id).exclude(contenido='').exists():
+                    primer_parrafo = time.perf_counter() - inicio
+                time.sleep(0.01)
+            hilo.join()
+            total = time.perf_counter() - inicio
+            primer_parrafo = primer_parrafo if primer_parrafo is not None else total
+
+            salida(f"{modo:>10}: primer párrafo={primer_parrafo:6.2f}s  cuento completo={total:6.2f}s")
+
+
+def bench_compresion(salida, opciones):
+    """Cuento.contenido comprimido: espacio ahorrado y coste de comprimir/descomprimir por cuento"""
+    import random
+
+    from .fields import comprimir, descomprimir
+    from .services import OpenAIService
+
+    # Corpus con la prosa de los cuentos de respaldo de OpenAIService: cada cuento
+    # junta párrafos de varios temas de su idioma hasta tener 400-900 palabras
+    aleatorio = random.Random(17)
+    servicio = OpenAIService()
+    temas = ['aventura', 'fantasia', 'amistad', 'familia', 'naturaleza', 'ciencia', 'animales']
+    nombres = ['Luna', 'Mateo', 'Sofía', 'Leo', 'Valentina', 'Hugo', 'Emma', 'Martín']
+    parrafos = {}
+    for idioma in ('es', 'en', 'de', 'fr'):
+        for tema in temas:
+            _, contenido, _, _, _ = servicio._generar_cuento_fallback({'personaje_principal': '{p}', 'tema': tema}, idioma)
+            parrafos.setdefault(idioma, []).extend(p.strip() for p in contenido.split('\n\n') if p.strip())
+
+    def cuento_de_ejemplo():
+        idioma = aleatorio.choices(['es', 'en', 'de', 'fr'], [70, 20, 5, 5])[0]
+        objetivo = aleatorio.randint(400, 900)
+        elegidos, palabras = [], 0
+        while palabras < objetivo:
+            parrafo = aleatorio.choice(parrafos[idioma]).replace('{p}', aleatorio.choice(nombres))
+            elegidos.append(parrafo)
+            palabras += len(parrafo.split())
+        return '\n\n'.join(elegidos)
+
+    total = max(opciones['trabajos'], 500)
+    corpus = [cuento_de_ejemplo() for _ in range(total)]
+    original = sum(len(texto.encode('utf-8')) for texto in corpus)
+    salida(f"corpus: {total} cuentos, {original / total / 1024:.1f} KiB de media")
+
+    for nivel in (1, 6, 9):
+        inicio = time.perf_counter()
+        comprimidos = [comprimir(texto, nivel) for texto in corpus]
+        codificar = (time.perf_counter() - inicio) / total
+        inicio = time.perf_counter()
+        for datos in comprimidos:
+            descomprimir(datos)
+        decodificar = (time.perf_counter() - inicio) / total
+        guardado = sum(len(datos) for datos in comprimidos)
+        salida(
+            f"zlib nivel {nivel}: {guardado / total / 1024:5.2f} KiB/cuento  ahorro={1 - guardado / original:6.1%}  "
+            f"comprimir={codificar * 1e6:6.1f} µs  descomprimir={decodificar * 1e6:6.1f} µs"
+        )
+
+    with base_de_datos_temporal():
+        from django.db import connection
+
+        usuario = crear_usuario_bench()
+        for desde in range(0, total, 1000):
+            Cuento.objects.bulk_create([
+                Cuento(usuario=usuario, titulo=f'Cuento {i}', personaje_principal='Luna', contenido=corpus[i],
+                       tema='aventura', edad='6-8', longitud='largo', estado='completado', en_biblioteca=True)
+                for i in range(desde, min(desde + 1000, total))
+            ])
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT SUM(LENGTH(contenido)) FROM stories_cuento")
+            columna = cursor.fetchone()[0]
+        ids = list(Cuento.objects.values_list('id', flat=True))
+        inicio = time.perf_counter()
+        for cuento_id in ids:
+            Cuento.objects.only('contenido').get(id=cuento_id).contenido
+        lectura = (time.perf_counter() - inicio) / len(ids)
+        salida(
+            f"columna contenido: {original / 1024 / 1024:.1f} MiB de texto -> {columna / 1024 / 1024:.1f} MiB  "
+            f"lectura de un cuento={lectura * 1000:.2f} ms"
+        )
+
+
+def bench_imagen(salida, opciones):
+    """Latencia percibida: cuándo se puede leer el cuento y cuándo aparece la imagen"""
+    from .jobs import PoolWorkers, encolar_generacion
+
+    # La imagen HD de DALL-E suele tardar bastante más que el texto
+    latencia_texto = opciones['latencia']
+    latencia_imagen = opciones['latencia'] * 2
+    total = opciones['trabajos']
+    hilos = max(opciones['hilos'])
+
+    for modo, clase in (('secuencial', ServicioSecuencial), ('dos fases', ServicioSimulado)):
+        with base_de_datos_temporal():
+            usuario = crear_usuario_bench()
+            cuentos, datos = crear_cuentos_generando(usuario, total)
+            for cuento in Cuento.objects.filter(usuario=usuario):
+                encolar_generacion(cuento, datos)
+
+            pool = PoolWorkers(hilos, servicio=clase(latencia_texto, latencia_imagen), intervalo=0.02)
+            inicio = time.perf_counter()
+            pool.iniciar()
+
+            legibles, con_imagen = {}, {}
+            while len(con_imagen) < total:
+                ahora = time.perf_counter() - inicio
+                for cuento_id, estado, imagen_estado in Cuento.objects.filter(usuario=usuario).values_list(
+                        'id', 'estado', 'imagen_estado'):
+                    if estado == 'completado':
+                        legibles.setdefault(cuento_id, ahora)
+                        # En el pipeline secuencial la imagen llegaba junto con el texto
+                        if imagen_estado != 'pendiente' or clase is ServicioSecuencial:
+                            con_imagen.setdefault(cuento_id, ahora)
+                time.sleep(0.01)
+            pool.parar()
+
+            media_texto = sum(legibles.values()) / total
+            media_imagen = sum(con_imagen.values()) / total
+            salida(
+                f"{modo:>10}: cuento legible={media_texto:6.2f}s  imagen visible={media_imagen:6.2f}s  "
+                f"(media de {total} cuentos, {hilos} hilos)"
+            )
+
+
+def _cuento_pdf_bench():
+    """Cuento largo con ilustración para medir solo el coste de ReportLab"""
+    from io import BytesIO
+
+    from django.utils import timezone
+    from PIL import Image as PILImage
+
+    from .rendering import ArchivoEnMemoria, CuentoPDF
+
+    buffer = BytesIO()
+    PILImage.effect_noise((1024, 1024), 64).convert('RGB').save(buffer, format='JPEG', quality=90)
+    parrafo = "Luna caminó por el bosque encantado buscando la estrella perdida. " * 8
+    return CuentoPDF(
+        id=0, titulo='La estrella perdida', personaje_principal='Luna', tema='aventura',
+        edad='6-8', longitud='largo', contenido="\n\n".join([parrafo] * 12),
+        moraleja='Ser valiente es ayudar a los demás.', fecha_creacion=timezone.now(),
+        tiempo_lectura_estimado=300, tema_display='Aventura',
+        imagen_impresion=ArchivoEnMemoria('bench.jpg', buffer.getvalue()),
+    )
+
+
+def bench_pdf(salida, opciones):
+    """Descargas de PDF concurrentes que soporta cada tamaño de pool"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    from django.test import override_settings
+
+    from . import rendering
+
+    cuento_pdf = _cuento_pdf_bench()
+    total = opciones['trabajos']
+
+    def descargar(_):
+        inicio = time.perf_counter()
+        try:
+            rendering._ejecutar(rendering._renderizar_cuento, cuento_pdf)
+            return time.perf_counter() - inicio
+        except rendering.RenderSaturado:
+            return None
+
+    for procesos in opciones['procesos']:
+        with override_settings(PDF_RENDER_PROCESSES=procesos):
+            rendering.cerrar_pool()
+            # Calentar: los procesos 'spawn' tardan en importar Django
+            with ThreadPoolExecutor(max(procesos, 1)) as clientes:
+                list(clientes.map(descargar, range(max(procesos, 1))))
+
+            for concurrencia in opciones['hilos']:
+                inicio = time.perf_counter()
+                with ThreadPoolExecutor(concurrencia) as clientes:
+                    resultados = list(clientes.map(descargar, range(total)))
+                duracion = time.perf_counter() - inicio
+
+                latencias = sorted(r for r in resultados if r is not None)
+                rechazadas = len(resultados) - len(latencias)
+                p95 = latencias[int(len(latencias) * 0.95) - 1] if latencias else 0
+                salida(
+                    f"procesos={procesos}  concurrencia={concurrencia:>3}  "
+                    f"ok={len(latencias):>3}  503={rechazadas:>3}  "
+                    f"throughput={len(latencias) / duracion:6.2f} pdf/s  p95={p95 * 1000:7.0f} ms"
+                )
+            rendering.cerrar_pool()
+
+
+def bench_latidos(salida, opciones):
+    """Latidos de tiempo de lectura con la ingesta por lotes (library/heartbeats.py)"""
+    import json
+    from concurrent.futures import ThreadPoolExecutor
+
+    from django.db import close_old_connections, connection
+    from django.test import RequestFactory
+    from django.test.utils import CaptureQueriesContext
+
+    from library import heartbeats
+    from library.views import reading_heartbeat
+
+    fabrica = RequestFactory()
+    por_lector = opciones['trabajos']
+
+    def por_lotes(usuario, cuento):
+        peticion = fabrica.post('/library/reading-tracker/heartbeat/', content_type='application/json',
+                                data=json.dumps({'eventos': [{'c': cuento.id, 's': 30}]}))
+        peticion.user = usuario
+        return reading_heartbeat(peticion).status_code == 204
+
+    def lector(ruta, usuario, cuento):
+        try:
+            return sum(1 for _ in range(por_lector) if ruta(usuario, cuento))
+        except Exception:
+            return 0
+        finally:
+            close_old_connections()
+
+    for nombre, ruta in (('lotes', por_lotes),):
+        for hilos in opciones['hilos']:
+            with base_de_datos_temporal():
+                lectores = []
+                for indice in range(hilos):
+                    usuario = crear_usuario_bench(f'lector{indice}')
+                    lectores.append((usuario, Cuento.objects.create(
+                        usuario=usuario, titulo='Cuento', personaje_principal='Luna', tema='aventura',
+                        edad='6-8', longitud='corto', estado='completado', en_biblioteca=True,
+                    )))
+
+                # Consultas por latido medidas aparte en el hilo principal
+                with CaptureQueriesContext(connection) as consultas:
+                    for _ in range(10):
+                        ruta(*lectores[0])
+                    heartbeats.volcar()
+
+                inicio = time.perf_counter()
+                with ThreadPoolExecutor(hilos) as pool:
+                    aceptados = sum(pool.map(lambda par: lector(ruta, *par), lectores))
+                heartbeats.detener()
+                duracion = time.perf_counter() - inicio
+
+                segundos = EstadisticaLectura.objects.aggregate(total=Sum('tiempo_lectura'))['total'] or 0
+                salida(
+                    f"{nombre:<8} lectores={hilos:>3}  latidos={aceptados}/{hilos * por_lector}  "
+                    f"consultas/latido={len(consultas) / 10:5.1f}  "
+                    f"throughput={aceptados / duracion:8.1f} latidos/s  "
+                    f"segundos guardados={segundos - 300}"
+                )
+
+
+def bench_autocompletado(salida, opciones):
+    """Autocompletado de títulos: titulo__icontains frente al índice de prefijos por usuario"""
+    import random
+
+    from library import autocomplete
+
+    palabras = ['dragón', 'luna', 'bosque', 'estrella', 'río', 'castillo', 'búho', 'mar', 'nube', 'árbol',
+                'valiente', 'mágico', 'perdido', 'dorado', 'secreto', 'pequeño', 'gigante', 'azul']
+    consultas = ['d', 'dr', 'dra', 'drag', 'la lu', 'bu', 'ar', 'castillo m', 'sec', 'zz']
+    aleatorio = random.Random(7)
+
+    with base_de_datos_temporal():
+        usuario = crear_usuario_bench()
+        Cuento.objects.bulk_create([
+            Cuento(usuario=usuario, titulo=f"El {' '.join(aleatorio.sample(palabras, 3))} {i}",
+                   personaje_principal='Luna', tema='aventura', edad='6-8', longitud='corto',
+                   estado='completado', en_biblioteca=True)
+            for i in range(opciones['trabajos'])
+        ], batch_size=1000)
+
+        def icontains(consulta):
+            return list(Cuento.objects.filter(
+                usuario=usuario, estado='completado', en_biblioteca=True, titulo__icontains=consulta
+            ).values_list('titulo', flat=True).distinct()[:10])
+
+        def indice(consulta):
+            return autocomplete.sugerencias(usuario, consulta, 10)
+
+        inicio = time.perf_counter()
+        autocomplete.indice(usuario.id)
+        salida(f"índice construido: {opciones['trabajos']} títulos en {(time.perf_counter() - inicio) * 1000:.1f} ms")
+
+        repeticiones = 50
+        for nombre, ruta in (('icontains', icontains), ('indice', indice)):
+            inicio = time.perf_counter()
+            for _ in range(repeticiones):
+                for consulta in consultas:
+                    ruta(consulta)
+            duracion = time.perf_counter() - inicio
+            salida(
+                f"{nombre:<10} títulos={opciones['trabajos']:>6}  "
+                f"latencia media={duracion / (repeticiones * len(consultas)) * 1e6:9.1f} µs/tecla"
+            )
+
+
+def bench_busqueda(salida, opciones):
+    """Búsqueda de texto completo: LIKE sobre los cuatro campos frente al motor de library/search.py"""
+    import random
+
+    from library import search
+
+    # Vocabulario con frecuencias de Zipf como en un texto real: unas pocas palabras
+    # muy comunes y miles de palabras raras. Las de la consulta ocupan rangos fijos.
+    aleatorio = random.Random(11)
+    silabas = 'ba be bi bo bu ca co cu da de di do fa fe fi la le li lo lu ma me mi mo na ne ni no pa pe'.split()
+    vocabulario = sorted({''.join(aleatorio.sample(silabas, 3)) for _ in range(30000)})
+    aleatorio.shuffle(vocabulario)
+    for rango, palabra in ((5, 'luna'), (40, 'dragón'), (41, 'dragones'), (60, 'valientes'), (300, 'tesoro'),
+                           (301, 'perdido'), (2000, 'tortuga'), (8000, 'abuela'), (9000, 'jardín')):
+        vocabulario.insert(rango, palabra)
+    pesos = [1 / rango for rango in range(1, len(vocabulario) + 1)]
+    consultas = ['dragón', 'dragones valientes', 'tesoro perdido', 'tortuga', 'abuela jardín', 'unicornio']
+    total = opciones['trabajos']
+
+    def texto(palabras):
+        return ' '.join(aleatorio.choices(vocabulario, pesos, k=palabras)).capitalize() + '.'
+
+    with base_de_datos_temporal():
+        # Un lector intensivo con el 10% del corpus y el resto repartido entre 100 usuarios
+        intensivo = crear_usuario_bench('intensivo')
+        otros = [crear_usuario_bench(f'otro{indice}') for indice in range(100)]
+
+        inicio = time.perf_counter()
+        for desde in range(0, total, 5000):
+            Cuento.objects.bulk_create([
+                Cuento(usuario=intensivo if i % 10 == 0 else otros[i % 100], titulo=texto(4),
+                       personaje_principal=texto(1), contenido=texto(150),
+                       moraleja=texto(10), tema='aventura', edad='6-8', longitud='corto',
+                       estado='completado', en_biblioteca=True)
+                for i in range(desde, min(desde + 5000, total))
+            ])
+        salida(f"corpus: {total} cuentos en {time.perf_counter() - inicio:.1f}s")
+
+        # bulk_create no emite señales: el índice se construye de una vez
+        inicio = time.perf_counter()
+        search.reconstruir(lote=5000)
+        salida(f"índice {search.motor().nombre}: construido en {time.perf_counter() - inicio:.1f}s")
+
+        repeticiones = 5
+        for nombre, motor in (('like', search.MotorLike()), (search.motor().nombre, search.motor())):
+            inicio = time.perf_counter()
+            encontrados = 0
+            for _ in range(repeticiones):
+                for consulta in consultas:
+                    encontrados += len(motor.buscar(intensivo.id, consulta, 'es', None, 20))
+            duracion = time.perf_counter() - inicio
+            salida(
+                f"{nombre:<9} cuentos={total:>8}  del usuario={total // 10:>7}  "
+                f"latencia media={duracion / (repeticiones * len(consultas)) * 1000:8.2f} ms/consulta  "
+                f"resultados={encontrados // repeticiones}"
+            )
+
+
+def bench_lote(salida, opciones):
+    """Limpieza de la biblioteca: N peticiones de un cuento frente a una operación en lote"""
+    import contextlib
+    import io
+    import json
+
+    from django.db import connection
+    from django.test import RequestFactory
+
+    from library.rollups import reconstruir
+    from library.views import delete_story, library_bulk_action, toggle_library_favorite
+
+    fabrica = RequestFactory()
+
+    def sueltas(usuario, accion, ids):
+        vista, url = {'favorite': (toggle_library_favorite, '/library/favorite/'),
+                      'delete': (delete_story, '/library/delete/')}[accion]
+        for cuento_id in ids:
+            peticion = fabrica.post(f'{url}{cuento_id}/')
+            peticion.user = usuario
+            vista(peticion, cuento_id)
+
+    def en_lote(usuario, accion, ids):
+        peticion = fabrica.post('/library/ajax/bulk/', content_type='application/json',
+                                data=json.dumps({'action': accion, 'ids': ids}))
+        peticion.user = usuario
+        library_bulk_action(peticion)
+
+    for total in sorted({50, max(opciones['trabajos'], 50), 500}):
+        for accion in ('favorite', 'delete'):
+            for nombre, ruta in (('sueltas', sueltas), ('lote', en_lote)):
+                with base_de_datos_temporal():
+                    usuario = crear_usuario_bench()
+                    cuentos = Cuento.objects.bulk_create([
+                        Cuento(usuario=usuario, titulo=f'Cuento {i}', personaje_principal='Luna',
+                               contenido='Había una vez un dragón que soñaba con volar. ' * 80, tema='aventura',
+                               edad='6-8', longitud='corto', estado='completado', en_biblioteca=True)
+                        for i in range(total)
+                    ])
+                    EstadisticaLectura.objects.bulk_create([
+                        EstadisticaLectura(usuario=usuario, cuento=cuento, tipo_lectura='texto', tiempo_lectura=60)
+                        for cuento in cuentos
+                    ])
+                    reconstruir(usuario.id)
+                    ids = [cuento.id for cuento in cuentos]
+
+                    # Las vistas de un cuento imprimen trazas por cada llamada; las consultas se
+                    # cuentan con un wrapper porque CaptureQueriesContext se queda en 9000
+                    consultas = []
+
+                    def contar(ejecutar, sql, parametros, muchos, contexto):
+                        consultas.append(sql)
+                        return ejecutar(sql, parametros, muchos, contexto)
+
+                    with contextlib.redirect_stdout(io.StringIO()), connection.execute_wrapper(contar):
+                        inicio = time.perf_counter()
+                        ruta(usuario, accion, ids)
+                        duracion = time.perf_counter() - inicio
+                    salida(
+                        f"{accion:<8} {nombre:<8} cuentos={total:>4}  consultas={len(consultas):>5}  "
+                        f"tiempo={duracion * 1000:8.1f} ms"
+                    )
+
+
+def bench_paginas(salida, opciones):
+    """Listado de biblioteca: Paginator (COUNT + OFFSET) frente a la paginación por cursor"""
+    from django.core.paginator import Paginator
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    from library.pagination import TAMANO_PAGINA, codificar_cursor, pagina
+
+    paginas = (1, 100, 500)
+    total = max(opciones['trabajos'], TAMANO_PAGINA * max(paginas))
+
+    with base_de_datos_temporal():
+        usuario = crear_usuario_bench()
+        for desde in range(0, total, 5000):
+            Cuento.objects.bulk_create([
+                Cuento(usuario=usuario, titulo=f'Cuento {i}', personaje_principal='Luna', contenido='Había una vez...',
+                       tema='aventura', edad='6-8', longitud='corto', estado='completado', en_biblioteca=True)
+                for i in range(desde, min(desde + 5000, total))
+            ])
+        cuentos = Cuento.objects.filter(usuario=usuario, estado='completado', en_biblioteca=True)
+
+        # Cursor de cada página: el último cuento de la página anterior
+        cursores = {1: None}
+        for numero in paginas[1:]:
+            anterior = cuentos.order_by('-fecha_creacion', '-id')[(numero - 1) * TAMANO_PAGINA - 1]
+            cursores[numero] = codificar_cursor(anterior)
+
+        def offset(numero):
+            return list(Paginator(cuentos.order_by('-fecha_creacion', '-id'), TAMANO_PAGINA).page(numero))
+
+        def cursor(numero):
+            return pagina(cuentos, cursores[numero])[0]
+
+        repeticiones = 20
+        for nombre, ruta in (('offset', offset), ('cursor', cursor)):
+            for numero in paginas:
+                assert [c.id for c in ruta(numero)] == [c.id for c in offset(numero)]
+                with CaptureQueriesContext(connection) as consultas:
+                    ruta(numero)
+                inicio = time.perf_counter()
+                for _ in range(repeticiones):
+                    ruta(numero)
+                duracion = (time.perf_counter() - inicio) / repeticiones
+                salida(
+                    f"{nombre:<7} cuentos={total:>7}  página={numero:>4}  consultas={len(consultas)}  "
+                    f"latencia={duracion * 1000:8.2f} ms"
+                )
+
+
+def bench_tarjetas(salida, opciones):
+    """Página de la biblioteca: filas completas frente a la proyección .cards()"""
+    import tracemalloc
+
+    from django.db import connection
+
+    from library.pagination import TAMANO_PAGINA, pagina
+
+    total = max(opciones['trabajos'], 1000)
+    parrafo = 'Había una vez un pequeño dragón que no sabía volar y cada noche miraba las estrellas. '
+    contenido = parrafo * 60  # ~5 KB, lo habitual en un cuento "largo"
+
+    with base_de_datos_temporal():
+        usuario = crear_usuario_bench()
+        Cuento.objects.bulk_create([
+            Cuento(usuario=usuario, titulo=f'Cuento {i}', personaje_principal='Luna', contenido=contenido,
+                   moraleja='Lo importante es intentarlo. ' * 10, imagen_prompt='Ilustración infantil. ' * 20,
+                   tema='aventura', edad='6-8', longitud='largo', estado='completado', en_biblioteca=True)
+            for i in range(total)
+        ])
+        completos = Cuento.objects.biblioteca(usuario).select_related('perfil')
+        tarjetas = Cuento.objects.biblioteca(usuario).cards()
+
+        def bytes_por_pagina(queryset):
+            sql, parametros = queryset.order_by('-fecha_creacion', '-id')[:TAMANO_PAGINA].query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute(sql, parametros)
+                return sum(len(str(valor).encode()) for fila in cursor.fetchall() for valor in fila if valor is not None)
+
+        repeticiones = 50
+        for nombre, queryset in (('completo', completos), ('cards', tarjetas)):
+            tracemalloc.start()
+            pagina(queryset)
+            _, pico = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            inicio = time.perf_counter()
+            for _ in range(repeticiones):
+                pagina(queryset)
+            duracion = (time.perf_counter() - inicio) / repeticiones
+            salida(
+                f"{nombre:<9} cuentos/página={TAMANO_PAGINA}  bytes={bytes_por_pagina(queryset):>7}  "
+                f"memoria_pico={pico / 1024:7.1f} KiB  latencia={duracion * 1000:6.2f} ms"
+            )
+
+
+def bench_recomendaciones(salida, opciones):
+    """"Más como este" sobre 100k cuentos: vectorizar, consultar el archivo mapeado y actualizarlo"""
+    import random
+    from types import SimpleNamespace
+
+    import numpy as np
+    from django.test.utils import override_settings
+
+    from library import recommendations
+
+    aleatorio = random.Random(5)
+    silabas = 'ba be bi bo bu ca co cu da de di do fa fe fi la le li lo lu ma me mi mo na ne ni no pa pe'.split()
+    vocabulario = sorted({''.join(aleatorio.sample(silabas, 3)) for _ in range(20000)})
+    pesos = [1 / rango for rango in range(1, len(vocabulario) + 1)]
+    total = max(opciones['trabajos'], 100_000)
+
+    def cuento(cuento_id, palabras=400):
+        texto = ' '.join(aleatorio.choices(vocabulario, pesos, k=palabras))
+        return SimpleNamespace(id=cuento_id, usuario_id=1, titulo=f'Cuento {cuento_id}', contenido=texto,
+                               idioma='es', estado='completado', en_biblioteca=True)
+
+    # Vectorizar cuesta lo mismo en el alta incremental que en una reconstrucción
+    muestra = [cuento(i + 1) for i in range(2000)]
+    inicio = time.perf_counter()
+    vectores = np.stack([recommendations.vector_de(c) for c in muestra])
+    vectorizar = (time.perf_counter() - inicio) / len(muestra)
+    salida(f"vectorizar: {vectorizar * 1000:.2f} ms/cuento de 400 palabras ({recommendations.DIMENSIONES} dimensiones)")
+
+    directorio = tempfile.mkdtemp(prefix='cuentia-bench-')
+    try:
+        with override_settings(LIBRARY_RECOMMENDATIONS_DIR=directorio):
+            registros = np.zeros(total, dtype=recommendations.REGISTRO)
+            registros['id'] = np.arange(1, total + 1)
+            registros['vector'] = vectores[np.arange(total) % len(vectores)]
+            os.makedirs(recommendations._directorio(), exist_ok=True)
+            ruta = recommendations._ruta(1)
+            recommendations._escribir(ruta, registros)
+            del registros
+            salida(f"archivo: {total} cuentos, {os.path.getsize(ruta) / 1024 / 1024:.0f} MiB")
+
+            consultas = [SimpleNamespace(id=aleatorio.randint(1, total), usuario_id=1) for _ in range(50)]
+            inicio = time.perf_counter()
+            recommendations.similares(consultas[0])
+            salida(f"primera consulta (abrir y mapear): {(time.perf_counter() - inicio) * 1000:.1f} ms")
+
+            inicio = time.perf_counter()
+            for consulta in consultas:
+                recommendations.similares(consulta)
+            salida(f"consulta \"más como este\": {(time.perf_counter() - inicio) / len(consultas) * 1000:.1f} ms")
+            salida(f"sin índice (vectorizar la biblioteca en cada consulta): ~{vectorizar * total:.0f} s")
+
+            nuevos = [cuento(total + i + 1) for i in range(20)]
+            inicio = time.perf_counter()
+            for nuevo in nuevos:
+                recommendations.cuento_guardado(nuevo)
+            salida(f"alta incremental: {(time.perf_counter() - inicio) / len(nuevos) * 1000:.1f} ms/cuento")
+
+            editados = [cuento(aleatorio.randint(1, total)) for _ in range(20)]
+            inicio = time.perf_counter()
+            for editado in editados:
+                recommendations.cuento_guardado(editado)
+            salida(f"edición en su sitio: {(time.perf_counter() - inicio) / len(editados) * 1000:.1f} ms/cuento")
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+def bench_planificador(salida, opciones):
+    """Una familia encola 30 cuentos y otras 9 piden uno: espera de las demás con FIFO y con cola justa"""
+    from .scheduler import Planificador, RelojFalso, TOKENS_CUENTO
+
+    duracion_llamada = 20
+
+    def simular(justa):
+        reloj = RelojFalso()
+        # 35000 tokens/minuto: unos 10 cuentos por minuto, 4 llamadas en vuelo
+        planificador = Planificador(tokens_por_minuto=35000, max_en_vuelo=4, max_cola=100,
+                                    espera_maxima={'interactiva': 3600}, reloj=reloj)
+        llegadas = [(0, 'intensiva')] * 30 + [(segundo, f'familia{segundo}') for segundo in range(1, 10)]
+        turnos, esperando, en_vuelo = [], [], []
+        while len(turnos) < len(llegadas) or esperando or en_vuelo:
+            ahora = reloj.ahora()
+            for llegada, usuario in llegadas[len(turnos):]:
+                if llegada > ahora:
+                    break
+                # Sin cola justa todas las peticiones son del mismo "usuario": orden de llegada
+                turno = planificador.solicitar(usuario if justa else 'todos', tokens=TOKENS_CUENTO)
+                turnos.append((usuario, turno))
+                esperando.append(turno)
+            for fin, turno in [(fin, turno) for fin, turno in en_vuelo if fin <= ahora]:
+                planificador.liberar(turno)
+                en_vuelo.remove((fin, turno))
+            planificador.repartir()
+            for turno in [turno for turno in esperando if turno.concedido]:
+                esperando.remove(turno)
+                en_vuelo.append((ahora + duracion_llamada, turno))
+            reloj.avanzar(1)
+        esperas = [turno.espera for usuario, turno in turnos if usuario != 'intensiva']
+        intensiva = [turno.espera for usuario, turno in turnos if usuario == 'intensiva']
+        return sum(esperas) / len(esperas), max(esperas), max(intensiva), reloj.ahora()
+
+    for nombre, justa in (('fifo', False), ('cola justa', True)):
+        media, peor, intensiva, total = simular(justa)
+        salida(
+            f"{nombre:<10} otras familias: espera media={media:6.1f}s  peor={peor:6.1f}s  "
+            f"| intensiva peor={intensiva:6.1f}s  | todo servido en {total:.0f}s"
+        )
+
+
+@contextmanager
+def servidor_tls(latencia=0.0):
+    """Servidor HTTPS local con un certificado autofirmado; devuelve (url, ruta del certificado)"""
+    import ssl
+    import subprocess
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Respuesta(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive
+        disable_nagle_algorithm = True  # cabeceras y cuerpo van en escrituras separadas
+
+        def do_GET(self):
+            time.sleep(latencia)
+            cuerpo = b'{"ok": true}'
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+
+        def log_message(self, *args):
+            pass
+
+    directorio = tempfile.mkdtemp(prefix='bench-tls-')
+    certificado, clave = os.path.join(directorio, 'cert.pem'), os.path.join(directorio, 'clave.pem')
+    subprocess.run(
+        ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1', '-subj', '/CN=127.0.0.1',
+         '-addext', 'subjectAltName=IP:127.0.0.1', '-keyout', clave, '-out', certificado],
+        check=True, capture_output=True,
+    )
+    contexto = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    contexto.load_cert_chain(certificado, clave)
+    servidor = ThreadingHTTPServer(('127.0.0.1', 0), Respuesta)
+    servidor.daemon_threads = True
+    servidor.socket = contexto.wrap_socket(servidor.socket, server_side=True)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    try:
+        yield f"https://127.0.0.1:{servidor.server_port}/", certificado
+    finally:
+        servidor.shutdown()
+        servidor.server_close()
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+def bench_conexiones(salida, opciones):
+    """Peticiones HTTPS con un cliente nuevo por petición (como requests.get) frente al pool compartido"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    from CUENTIA import conexiones, metrics
+
+    total = opciones['trabajos'] * 5
+    latencia = opciones['latencia'] / 50  # servidor rápido: se mide sobre todo el coste de conectar
+
+    with servidor_tls(latencia) as (url, certificado):
+        for hilos in opciones['hilos']:
+            for modo in ('sin pool', 'pool'):
+                metrics.reiniciar()
+                nombre = f"bench-{modo.replace(' ', '-')}"
+                compartido = conexiones.crear_cliente(nombre, verify=certificado)
+
+                def pedir(_):
+                    if modo == 'pool':
+                        return compartido.get(url).status_code
+                    with conexiones.crear_cliente(nombre, verify=certificado) as nuevo:
+                        return nuevo.get(url).status_code
+
+                inicio = time.perf_counter()
+                with ThreadPoolExecutor(hilos) as pool:
+                    list(pool.map(pedir, range(total)))
+                segundos = time.perf_counter() - inicio
+                compartido.close()
+
+                datos = conexiones.reutilizacion()[nombre]
+                salida(
+                    f"{modo:>8} {hilos:>2} hilos: {total / segundos:7.0f} pet/s  "
+                    f"{segundos / total * 1000 * hilos:6.2f} ms/petición  "
+                    f"handshakes TLS={datos['tls']:>4}  reutilización={datos['ratio']:.0%}"
+                )
+
+
+def bench_asgi(salida, opciones):
+    """Generaciones en vuelo por worker: hilos (WSGI) frente a corrutinas (ASGI).
+
+    1. Workers de generación: pool de hilos frente a WorkerAsync, con OpenAI simulado.
+    2. Long-polls de /status/ esperando al worker: un servidor WSGI con un hilo por
+       petición frente a un bucle de eventos ASGI con las vistas async.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    from django.test import AsyncClient, Client, override_settings
+    from django.urls import reverse
+
+    from .jobs import PoolWorkers, WorkerAsync, encolar_generacion
+
+    total = opciones['trabajos'] * 5
+    hilos = max(opciones['hilos'])
+    latencia = opciones['latencia']
+
+    # SQLite admite un solo escritor: más hilos en el pool async solo añaden "database is locked"
+    hilos_bd = 1 if connections['default'].vendor == 'sqlite' else None
+    for modo in ('wsgi', 'asgi'):
+        with base_de_datos_temporal(), override_settings(ASYNC_DB_THREADS=hilos_bd or settings.ASYNC_DB_THREADS):
+            usuario = crear_usuario_bench()
+            crear_cuentos_generando(usuario, total)
+            for cuento in Cuento.objects.filter(usuario=usuario):
+                encolar_generacion(cuento, {'personaje_principal': 'Luna'})
+
+            if modo == 'wsgi':
+                pool = PoolWorkers(hilos, servicio=ServicioSimulado(latencia, latencia), intervalo=0.02)
+            else:
+                pool = WorkerAsync(total, servicio=ServicioSimuladoAsync(latencia, latencia), intervalo=0.02)
+            inicio = time.perf_counter()
+            pool.iniciar()
+            while TrabajoGeneracion.objects.filter(estado__in=['pendiente', 'en_proceso']).exists():
+                time.sleep(0.05)
+            duracion = time.perf_counter() - inicio
+            pool.parar()
+
+            por_worker = 'hilos' if modo == 'wsgi' else 'tareas'
+            salida(
+                f"workers {modo}: {total} cuentos (texto + imagen, {latencia}s cada llamada) en {duracion:6.2f}s  "
+                f"= {total / duracion:7.1f} cuentos/s  con {hilos if modo == 'wsgi' else total} {por_worker}"
+            )
+
+    peticiones = total * 2
+    espera = 1
+    for modo in ('wsgi', 'asgi'):
+        with base_de_datos_temporal(), override_settings(ALLOWED_HOSTS=['testserver']):
+            usuario = crear_usuario_bench()
+            cuentos, _ = crear_cuentos_generando(usuario, peticiones)
+            for cuento in cuentos:
+                notifications.publicar(cuento.id, 'generando', usuario_id=usuario.id)
+            urls = [reverse('stories:check_status', args=[cuento.id]) for cuento in cuentos]
+            parametros = {'version': 1, 'timeout': espera}
+
+            inicio = time.perf_counter()
+            if modo == 'wsgi':
+                cliente = Client()
+                cliente.force_login(usuario)
+                with ThreadPoolExecutor(hilos) as pool:
+                    list(pool.map(lambda url: cliente.get(url, parametros), urls))
+            else:
+                async def long_polls():
+                    cliente = AsyncClient()
+                    await cliente.aforce_login(usuario)
+                    await asyncio.gather(*(cliente.get(url, parametros) for url in urls))
+                asyncio.run(long_polls())
+            duracion = time.perf_counter() - inicio
+
+            salida(
+                f"long-poll {modo}: {peticiones} esperas de {espera}s en {duracion:6.2f}s  "
+                f"= {peticiones * espera / duracion:7.1f} esperas simultáneas "
+                f"({f'{hilos} hilos' if modo == 'wsgi' else '1 bucle de eventos'})"
+            )
+
+
+ESCENARIOS = {
+    'asgi': bench_asgi,
+    'autocompletado': bench_autocompletado,
+    'busqueda': bench_busqueda,
+    'cola': bench_cola,
+    'compresion': bench_compresion,
+    'conexiones': bench_conexiones,
+    'imagen': bench_imagen,
+    'latidos': bench_latidos,
+    'lote': bench_lote,
+    'paginas': bench_paginas,
+    'pdf': bench_pdf,
+    'planificador': bench_planificador,
+    'recomendaciones': bench_recomendaciones,
+    'streaming': bench_streaming,
+    'tarjetas': bench_tarjetas,
+}
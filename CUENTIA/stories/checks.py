@@ -0,0 +1,59 @@
+"""Comprobaciones de arranque (`manage.py check` y al iniciar cualquier comando).
+
+Los presupuestos de espera, timeouts y reintentos de OpenAI (stories/scheduler.py
+y stories/resilience.py) deciden cuánto puede durar un trabajo de la cola; el
+lease (GENERATION_LEASE_SECONDS) decide cuándo otro worker puede quitárselo.
+El latido de los workers renueva el lease mientras trabajan, así que basta con
+que lata con margen; sin latido, el peor caso tiene que caber en el lease.
+"""
+from django.conf import settings
+from django.core.checks import Error, Warning, register
+
+from .resilience import TIMEOUTS
+
+
+def _config(nombre, default):
+    return getattr(settings, nombre, default)
+
+
+def duracion_maxima(operacion):
+    """Segundos que puede tardar un trabajo de `operacion` ('texto' o 'imagen') en el peor caso"""
+    timeouts = {**TIMEOUTS[operacion], **_config('OPENAI_TIMEOUTS', {}).get(operacion, {})}
+    reintentos = _config('OPENAI_MAX_RETRIES', 2)
+    espera_turno = max(_config('OPENAI_MAX_WAIT_INTERACTIVE', 60), _config('OPENAI_MAX_WAIT_BACKGROUND', 120))
+    segundos = (espera_turno
+                + (reintentos + 1) * (timeouts['connect'] + timeouts['read'])
+                + reintentos * _config('OPENAI_RETRY_MAX_DELAY', 8))
+    if operacion == 'imagen':
+        segundos += _config('STORY_IMAGE_DOWNLOAD_TIMEOUT', 30)
+    return segundos
+
+
+@register()
+def comprobar_lease(app_configs, **kwargs):
+    lease = _config('GENERATION_LEASE_SECONDS', 300)
+    latido = _config('GENERATION_HEARTBEAT_SECONDS', 60)
+    errores = []
+
+    if latido:
+        if latido > lease / 2:
+            errores.append(Warning(
+                f"GENERATION_HEARTBEAT_SECONDS ({latido}) es más de la mitad de GENERATION_LEASE_SECONDS "
+                f"({lease}): un latido perdido basta para que otro worker repita el trabajo.",
+                hint="Baja el latido o sube el lease.",
+                id='stories.W001',
+            ))
+        return errores
+
+    # Sin latido el lease tiene que cubrir el trabajo entero (en streaming el timeout de
+    # lectura es por fragmento, así que ni siquiera esto es una cota estricta)
+    for operacion in ('texto', 'imagen'):
+        peor_caso = duracion_maxima(operacion)
+        if peor_caso >= lease:
+            errores.append(Error(
+                f"Un trabajo de {operacion} puede durar {peor_caso}s y GENERATION_LEASE_SECONDS es {lease}: "
+                f"otro worker lo reclamaría a mitad y pagaría la llamada a OpenAI otra vez.",
+                hint="Activa GENERATION_HEARTBEAT_SECONDS o sube GENERATION_LEASE_SECONDS.",
+                id='stories.E001',
+            ))
+    return errores
@@ -0,0 +1,116 @@
+"""Campos de modelo propios de los cuentos.
+
+CompressedTextField guarda el texto comprimido en una columna binaria y lo
+devuelve como str al leerlo de la base de datos. El primer byte indica el
+formato para poder cambiar de algoritmo sin reescribir las filas antiguas:
+
+    0x00  texto UTF-8 sin comprimir (textos cortos, donde zlib no ahorra)
+    0x01  UTF-8 comprimido con zlib
+"""
+import zlib
+
+from django import forms
+from django.db import models
+
+FORMATO_PLANO = 0
+FORMATO_ZLIB = 1
+
+NIVEL_ZLIB = 6
+# Por debajo de este tamaño la cabecera de zlib se come lo que se ahorra
+MINIMO_COMPRIMIR = 128
+
+
+def comprimir(texto, nivel=NIVEL_ZLIB):
+    datos = texto.encode('utf-8')
+    if len(datos) >= MINIMO_COMPRIMIR:
+        comprimidos = zlib.compress(datos, nivel)
+        if len(comprimidos) < len(datos):
+            return bytes([FORMATO_ZLIB]) + comprimidos
+    return bytes([FORMATO_PLANO]) + datos
+
+
+def descomprimir(datos):
+    datos = bytes(datos)
+    if not datos:
+        return ''
+    formato, cuerpo = datos[0], datos[1:]
+    if formato == FORMATO_ZLIB:
+        return zlib.decompress(cuerpo).decode('utf-8')
+    if formato == FORMATO_PLANO:
+        return cuerpo.decode('utf-8')
+    raise ValueError(f"Formato de texto comprimido desconocido: {formato}")
+
+
+class CompressedTextField(models.BinaryField):
+    """TextField que se guarda comprimido.
+
+    En Python el valor es siempre str. No admite búsquedas en SQL (icontains,
+    Substr...): lo que haga falta filtrar o listar debe vivir en otra columna.
+    """
+
+    description = "Texto comprimido"
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('editable', True)
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs.pop('editable', None)
+        if not self.editable:
+            kwargs['editable'] = False
+        return name, path, args, kwargs
+
+    def get_default(self):
+        default = super().get_default()
+        return '' if default == b'' else default
+
+    def from_db_value(self, value, expression, connection):
+        if value is None or isinstance(value, str):
+            return value
+        return descomprimir(value)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, str):
+            return value
+        return descomprimir(value)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if isinstance(value, str):
+            value = comprimir(value)
+        return super().get_db_prep_value(value, connection, prepared)
+
+    def value_to_string(self, obj):
+        return self.value_from_object(obj) or ''
+
+    def formfield(self, **kwargs):
+        return models.Field.formfield(self, **{'form_class': forms.CharField, 'widget': forms.Textarea, **kwargs})
+
+
+class VistaPreviaField(models.CharField):
+    """Primeros `max_length` caracteres de otro campo, recalculados al guardar.
+
+    Sirve para listar sin leer (ni descomprimir) el texto completo. Se rellena
+    en save() y bulk_create(); QuerySet.update() debe pasarlo a mano.
+    """
+
+    def __init__(self, origen, *args, **kwargs):
+        self.origen = origen
+        kwargs.setdefault('max_length', 200)
+        kwargs.setdefault('blank', True)
+        kwargs.setdefault('default', '')
+        kwargs.setdefault('editable', False)
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs['origen'] = self.origen
+        return name, path, args, kwargs
+
+    def recortar(self, texto):
+        return (texto or '')[:self.max_length]
+
+    def pre_save(self, model_instance, add):
+        if self.origen not in model_instance.get_deferred_fields():
+            setattr(model_instance, self.attname, self.recortar(getattr(model_instance, self.origen)))
+        return super().pre_save(model_instance, add)
@@ -0,0 +1,129 @@
+"""Ingesta de las ilustraciones de los cuentos.
+
+Las URLs de DALL-E caducan, así que la imagen se descarga una sola vez al
+generarse, se guarda en MEDIA_ROOT y se precalculan sus variantes:
+
+- miniatura: tarjetas de biblioteca y dashboard (WebP)
+- lectura: página del cuento (WebP)
+- impresion: PDFs (JPEG a resolución de impresión)
+
+A partir de ahí ni las páginas ni los PDFs vuelven a tocar la red.
+"""
+import logging
+from io import BytesIO
+
+import httpx
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image as PILImage
+
+from CUENTIA import conexiones
+
+logger = logging.getLogger(__name__)
+
+VARIANTES = {
+    'miniatura': {'lado': 400, 'formato': 'WEBP', 'extension': 'webp', 'calidad': 80},
+    'lectura': {'lado': 768, 'formato': 'WEBP', 'extension': 'webp', 'calidad': 85},
+    # 5 x 4 pulgadas en el PDF a 300 ppp
+    'impresion': {'lado': 1500, 'formato': 'JPEG', 'extension': 'jpg', 'calidad': 90},
+}
+
+CAMPOS_VARIANTES = {
+    'miniatura': 'imagen_miniatura',
+    'lectura': 'imagen_lectura',
+    'impresion': 'imagen_impresion',
+}
+
+
+class ErrorImagen(Exception):
+    """La imagen no se pudo descargar o procesar"""
+
+
+def es_remota(url):
+    return bool(url) and url.startswith(('http://', 'https://'))
+
+
+def descargar_imagen(url):
+    """Descarga la imagen original respetando un tamaño máximo"""
+    timeout = getattr(settings, 'STORY_IMAGE_DOWNLOAD_TIMEOUT', 30)
+    maximo = getattr(settings, 'STORY_IMAGE_MAX_BYTES', 20 * 1024 * 1024)
+
+    try:
+        with conexiones.cliente('descargas').stream(
+                'GET', url, timeout=conexiones.timeout('descargas', timeout)) as response:
+            response.raise_for_status()
+            buffer = BytesIO()
+            for bloque in response.iter_bytes(64 * 1024):
+                buffer.write(bloque)
+                if buffer.tell() > maximo:
+                    raise ErrorImagen(f"La imagen supera {maximo} bytes")
+            return buffer.getvalue()
+    except httpx.HTTPError as e:
+        raise ErrorImagen(f"No se pudo descargar la imagen: {str(e)}") from e
+
+
+def generar_variante(original, lado, formato, calidad, **_):
+    """Redimensiona sin agrandar y devuelve los bytes codificados"""
+    with PILImage.open(BytesIO(original)) as imagen:
+        imagen.load()
+        if formato == 'JPEG' and imagen.mode not in ('RGB', 'L'):
+            imagen = imagen.convert('RGB')
+        elif imagen.mode not in ('RGB', 'RGBA', 'L'):
+            imagen = imagen.convert('RGBA')
+
+        imagen.thumbnail((lado, lado), PILImage.LANCZOS)
+        salida = BytesIO()
+        imagen.save(salida, format=formato, quality=calidad, optimize=True)
+        return salida.getvalue()
+
+
+def generar_variantes(original):
+    """Todas las variantes de VARIANTES a partir de los bytes originales"""
+    try:
+        return {nombre: generar_variante(original, **config) for nombre, config in VARIANTES.items()}
+    except (OSError, ValueError) as e:
+        raise ErrorImagen(f"No se pudo procesar la imagen: {str(e)}") from e
+
+
+def _extension_original(original):
+    with PILImage.open(BytesIO(original)) as imagen:
+        return (imagen.format or 'png').lower().replace('jpeg', 'jpg')
+
+
+def guardar_imagen_cuento(cuento, original, guardar=True):
+    """Escribe el original y sus variantes en el almacenamiento de media"""
+    variantes = generar_variantes(original)
+
+    campos = ['imagen_archivo']
+    cuento.imagen_archivo.delete(save=False)
+    cuento.imagen_archivo.save(f"{cuento.id}-original.{_extension_original(original)}",
+                               ContentFile(original), save=False)
+
+    for nombre, contenido in variantes.items():
+        campo = getattr(cuento, CAMPOS_VARIANTES[nombre])
+        campo.delete(save=False)
+        campo.save(f"{cuento.id}-{nombre}.{VARIANTES[nombre]['extension']}", ContentFile(contenido), save=False)
+        campos.append(CAMPOS_VARIANTES[nombre])
+
+    if guardar:
+        cuento.save(update_fields=campos)
+    return cuento
+
+
+def regenerar_variantes(cuento):
+    """Vuelve a calcular las variantes desde el original ya guardado"""
+    with cuento.imagen_archivo.open('rb') as archivo:
+        original = archivo.read()
+    return guardar_imagen_cuento(cuento, original)
+
+
+def ingerir_imagen(cuento, url=None):
+    """Descarga la ilustración del cuento y guarda original y variantes"""
+    url = url or cuento.imagen_url
+    if not es_remota(url):
+        return False
+
+    original = descargar_imagen(url)
+    guardar_imagen_cuento(cuento, original)
+    logger.info(f"Imagen del cuento {cuento.id} guardada localmente ({len(original)} bytes)")
+    return True
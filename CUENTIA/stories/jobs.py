@@ -0,0 +1,670 @@
+import asyncio
+import hashlib
+import itertools
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from CUENTIA.asincronia import en_hilo
+from . import images, notifications, scheduler
+from .models import Cuento, TrabajoGeneracion
+from .resilience import CircuitoAbierto
+from .scheduler import PlanificadorSaturado
+
+logger = logging.getLogger(__name__)
+
+
+def _config(nombre, default):
+    return getattr(settings, nombre, default)
+
+
+class TrabajoPerdido(Exception):
+    """Otro worker reclamó el trabajo (el lease venció): este deja de procesarlo sin escribir nada"""
+
+    def __init__(self, trabajo):
+        super().__init__(f"El trabajo {trabajo.id} ya no es de {trabajo.worker}")
+        self.trabajo = trabajo
+
+
+def _condicion_reclamable(ahora):
+    """Trabajos pendientes ya disponibles o en proceso con el lease vencido"""
+    return (
+        Q(estado='pendiente', disponible_desde__lte=ahora) |
+        Q(estado='en_proceso', lease_hasta__lt=ahora)
+    ) & Q(intentos__lt=F('max_intentos'))
+
+
+def trabajos_en_cola(**filtros):
+    """Número de trabajos que todavía no han terminado"""
+    return TrabajoGeneracion.objects.filter(estado__in=['pendiente', 'en_proceso'], **filtros).count()
+
+
+def cola_saturada():
+    return trabajos_en_cola() >= _config('GENERATION_MAX_PENDING', 200)
+
+
+def comprobar_admision(usuario_id):
+    """PlanificadorSaturado si no conviene aceptar otro cuento de este usuario ahora.
+
+    Es la contrapresión del planificador de OpenAI (stories/scheduler.py) en la
+    puerta: un cuento que no va a tener presupuesto dentro de la espera
+    interactiva no se encola, y una familia no puede acaparar la cola.
+    """
+    if cola_saturada():
+        raise PlanificadorSaturado(_config('GENERATION_RETRY_DELAY', 5) * 12, 'cola llena')
+    if trabajos_en_cola(usuario_id=usuario_id, tipo='texto') >= _config('GENERATION_MAX_PENDING_PER_USER', 3):
+        raise PlanificadorSaturado(_config('GENERATION_RETRY_DELAY', 5) * 12, 'usuario')
+    espera = scheduler.espera_estimada(trabajos_en_cola(tipo='texto'))
+    if espera > _config('OPENAI_MAX_WAIT_INTERACTIVE', 60):
+        raise PlanificadorSaturado(round(espera), 'presupuesto')
+
+
+def huella_idempotencia(clave, datos_formulario, perfil_id=None):
+    """Clave del formulario + lo enviado: volver atrás y cambiar los datos no devuelve el cuento anterior"""
+    if not clave:
+        return None
+    texto = json.dumps([clave, perfil_id or None, datos_formulario], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(texto.encode()).hexdigest()
+
+
+def trabajo_idempotente(usuario_id, huella):
+    """Trabajo de texto ya creado por un envío anterior con la misma huella, o None"""
+    if not huella:
+        return None
+    return TrabajoGeneracion.objects.filter(
+        usuario_id=usuario_id, clave_idempotencia=huella).select_related('cuento').first()
+
+
+def encolar_generacion(cuento, datos_formulario, clave_idempotencia=None):
+    """Registra el trabajo de generación; los workers lo recogerán de la base de datos.
+
+    Con `clave_idempotencia` (huella_idempotencia()) un segundo envío
+    simultáneo del mismo formulario choca con la restricción única y lanza
+    IntegrityError: quien llama deshace su cuento y devuelve el trabajo que ya existe.
+    """
+    trabajo = TrabajoGeneracion.objects.create(
+        cuento=cuento,
+        usuario_id=cuento.usuario_id,
+        datos_formulario=datos_formulario,
+        max_intentos=_config('GENERATION_MAX_ATTEMPTS', 3),
+        clave_idempotencia=clave_idempotencia,
+    )
+    transaction.on_commit(lambda: notifications.publicar(
+        cuento.id, 'generando', usuario_id=cuento.usuario_id, titulo='', parrafos=[]))
+    logger.info(f"Trabajo {trabajo.id} encolado para el cuento {cuento.id}")
+    return trabajo
+
+
+def encolar_imagen(cuento):
+    """Segunda fase: la ilustración se genera aparte cuando el texto ya es legible"""
+    trabajo = TrabajoGeneracion.objects.create(
+        cuento=cuento,
+        usuario_id=cuento.usuario_id,
+        tipo='imagen',
+        datos_formulario={'tema': cuento.tema},
+        max_intentos=_config('GENERATION_MAX_ATTEMPTS', 3),
+    )
+    logger.info(f"Trabajo de imagen {trabajo.id} encolado para el cuento {cuento.id}")
+    return trabajo
+
+
+def encolar_huerfanos():
+    """Crea trabajos para cuentos atascados en 'generando' o sin imagen que no tienen ninguno activo"""
+    activos = ['pendiente', 'en_proceso']
+    huerfanos = Cuento.objects.filter(estado='generando').exclude(trabajos__estado__in=activos)
+    sin_imagen = Cuento.objects.filter(estado='completado', imagen_estado='pendiente').exclude(
+        id__in=TrabajoGeneracion.objects.filter(tipo='imagen', estado__in=activos).values('cuento_id')
+    )
+    total = 0
+    for cuento in sin_imagen:
+        encolar_imagen(cuento)
+        total += 1
+    for cuento in huerfanos:
+        encolar_generacion(cuento, {
+            'titulo': cuento.titulo,
+            'personaje_principal': cuento.personaje_principal,
+            'tema': cuento.tema,
+            'edad': cuento.edad,
+            'longitud': cuento.longitud,
+        })
+        total += 1
+    if total:
+        logger.warning(f"{total} cuentos huérfanos devueltos a la cola")
+    return total
+
+
+def marcar_agotados():
+    """Da por fallidos los trabajos con lease vencido que ya no tienen intentos"""
+    ahora = timezone.now()
+    agotados = TrabajoGeneracion.objects.filter(
+        Q(estado='en_proceso', lease_hasta__lt=ahora) | Q(estado='pendiente'),
+        intentos__gte=F('max_intentos'),
+    )
+    trabajos = list(agotados.values_list('cuento_id', 'usuario_id', 'tipo'))
+    if not trabajos:
+        return 0
+
+    total = agotados.update(estado='fallido', ultimo_error='Intentos agotados', fecha_actualizacion=ahora)
+    for cuento_id, usuario_id, tipo in trabajos:
+        _marcar_fallo_cuento(cuento_id, usuario_id, tipo)
+    logger.error(f"{total} trabajos de generación agotaron sus intentos")
+    return total
+
+
+def reclamar_trabajo(worker_id, lease_segundos=None):
+    """Toma el siguiente trabajo disponible con un UPDATE condicional (compare-and-swap)"""
+    lease_segundos = lease_segundos or _config('GENERATION_LEASE_SECONDS', 300)
+    ahora = timezone.now()
+    candidatos = list(
+        TrabajoGeneracion.objects.filter(_condicion_reclamable(ahora))
+        .order_by('disponible_desde', 'id')
+        .values_list('id', flat=True)[:10]
+    )
+
+    for trabajo_id in candidatos:
+        actualizados = TrabajoGeneracion.objects.filter(
+            _condicion_reclamable(ahora), id=trabajo_id
+        ).update(
+            estado='en_proceso',
+            worker=worker_id,
+            lease_hasta=ahora + timedelta(seconds=lease_segundos),
+            intentos=F('intentos') + 1,
+            fecha_actualizacion=ahora,
+        )
+        if actualizados:
+            return TrabajoGeneracion.objects.select_related('cuento', 'usuario').get(id=trabajo_id)
+
+    return None
+
+
+def renovar_lease(trabajo, lease_segundos=None):
+    """Alarga el lease si este worker sigue siendo el dueño; False si otro lo reclamó"""
+    lease_segundos = lease_segundos or _config('GENERATION_LEASE_SECONDS', 300)
+    return TrabajoGeneracion.objects.filter(
+        id=trabajo.id, worker=trabajo.worker, estado='en_proceso'
+    ).update(lease_hasta=timezone.now() + timedelta(seconds=lease_segundos)) == 1
+
+
+def _comprobar_dueno(trabajo):
+    """Renueva el lease antes de escribir en el cuento; TrabajoPerdido si ya no es nuestro"""
+    if not renovar_lease(trabajo):
+        raise TrabajoPerdido(trabajo)
+
+
+def intervalo_latido():
+    return _config('GENERATION_HEARTBEAT_SECONDS', 60)
+
+
+class Latido:
+    """Renueva el lease cada GENERATION_HEARTBEAT_SECONDS mientras un worker de hilos procesa el trabajo.
+
+    Una llamada a OpenAI con sus reintentos y la espera de turno puede durar
+    más que el lease; sin renovarlo, reclamar_trabajo() se lo daría a otro
+    worker, que pagaría la misma llamada otra vez. El latido va en su propio
+    hilo porque la llamada bloquea el del worker; si la renovación falla marca
+    `perdido` y el worker lo comprueba antes de cada escritura (comprobar()).
+    """
+
+    def __init__(self, trabajo, intervalo=None):
+        self.trabajo = trabajo
+        self.intervalo = intervalo or intervalo_latido()
+        self.perdido = threading.Event()
+        self._parar = threading.Event()
+        self._hilo = None
+
+    def _latir(self):
+        conectado = False
+        try:
+            while not self._parar.wait(self.intervalo):
+                conectado = True
+                try:
+                    vivo = renovar_lease(self.trabajo)
+                except Exception as e:
+                    logger.warning(f"No se pudo renovar el lease del trabajo {self.trabajo.id}: {str(e)}")
+                    continue
+                if not vivo:
+                    logger.warning(f"Trabajo {self.trabajo.id} reclamado por otro worker: se abandona")
+                    self.perdido.set()
+                    return
+        finally:
+            if conectado:
+                connections.close_all()
+
+    def comprobar(self):
+        if self.perdido.is_set():
+            raise TrabajoPerdido(self.trabajo)
+
+    def __enter__(self):
+        if self.intervalo:
+            self._hilo = threading.Thread(target=self._latir, name=f"latido-{self.trabajo.id}", daemon=True)
+            self._hilo.start()
+        return self
+
+    def __exit__(self, *excepcion):
+        self._parar.set()
+        if self._hilo:
+            self._hilo.join()
+
+
+def _finalizar(trabajo, **campos):
+    """Cierra el trabajo solo si este worker sigue siendo su dueño"""
+    campos['fecha_actualizacion'] = timezone.now()
+    return TrabajoGeneracion.objects.filter(
+        id=trabajo.id, worker=trabajo.worker, estado='en_proceso'
+    ).update(**campos) == 1
+
+
+def guardar_avance(cuento_id, usuario_id=None):
+    """Persiste y publica título y párrafos parciales mientras el texto llega en streaming"""
+    def al_avanzar(titulo, parrafos):
+        contenido = "\n\n".join(parrafos)
+        # update() no pasa por save(): la vista previa se calcula aquí
+        campos = {'contenido': contenido, 'vista_previa': Cuento._meta.get_field('vista_previa').recortar(contenido)}
+        if titulo:
+            campos['titulo'] = titulo
+        if Cuento.objects.filter(id=cuento_id, estado='generando').update(**campos):
+            notifications.publicar(cuento_id, 'generando', usuario_id=usuario_id,
+                                   titulo=titulo, parrafos=list(parrafos))
+    return al_avanzar
+
+
+def _marcar_fallo_cuento(cuento_id, usuario_id, tipo):
+    """Sin imagen el cuento sigue siendo legible; sin texto queda en error"""
+    if tipo == 'imagen':
+        Cuento.objects.filter(id=cuento_id, imagen_estado='pendiente').update(imagen_estado='error')
+        notifications.publicar(cuento_id, 'completado', usuario_id=usuario_id, imagen_estado='error')
+    elif Cuento.objects.filter(id=cuento_id, estado='generando').update(estado='error'):
+        notifications.publicar(cuento_id, 'error', usuario_id=usuario_id)
+
+
+def _avance_vigilado(trabajo, latido):
+    """guardar_avance() que deja de escribir cuando el trabajo ya es de otro worker"""
+    guardar = guardar_avance(trabajo.cuento_id, trabajo.usuario_id)
+
+    def al_avanzar(titulo, parrafos):
+        if not latido.perdido.is_set():
+            guardar(titulo, parrafos)
+    return al_avanzar
+
+
+def _procesar_texto(trabajo, servicio, latido):
+    titulo, contenido, moraleja = servicio.generar_texto(
+        trabajo.datos_formulario, user=trabajo.usuario, al_avanzar=_avance_vigilado(trabajo, latido))
+    latido.comprobar()
+    _guardar_texto(trabajo, titulo, contenido, moraleja)
+
+
+def _guardar_texto(trabajo, titulo, contenido, moraleja):
+    cuento = trabajo.cuento
+    cuento.titulo = titulo
+    cuento.contenido = contenido
+    cuento.moraleja = moraleja
+    cuento.imagen_url = None
+    cuento.imagen_prompt = ''
+    cuento.imagen_estado = 'pendiente'
+    cuento.estado = 'completado'
+
+    # Calcular tiempo estimado de lectura
+    palabras = len(contenido.split())
+    cuento.tiempo_lectura_estimado = max(60, (palabras / 200) * 60)
+
+    # El cuento ya se puede leer; la ilustración llega después. Cerrar el trabajo va primero:
+    # si otro worker lo reclamó, este no toca el cuento
+    with transaction.atomic():
+        if not _finalizar(trabajo, estado='completado', lease_hasta=None, ultimo_error=''):
+            raise TrabajoPerdido(trabajo)
+        cuento.save()
+        encolar_imagen(cuento)
+
+    notifications.publicar(
+        cuento.id, 'completado', usuario_id=cuento.usuario_id, titulo=titulo,
+        parrafos=[p.strip() for p in contenido.split('\n\n') if p.strip()],
+        imagen_estado='pendiente', imagen_url=None,
+    )
+    logger.info(f"Cuento generado exitosamente: {titulo}")
+
+
+def _falta_generar_imagen(cuento):
+    # Si en un intento anterior solo falló la descarga, se reutiliza la imagen ya generada
+    return not (images.es_remota(cuento.imagen_url) and not cuento.imagen_archivo)
+
+
+def _guardar_url_imagen(trabajo, imagen_url, imagen_prompt):
+    cuento = trabajo.cuento
+    with transaction.atomic():
+        _comprobar_dueno(trabajo)
+        Cuento.objects.filter(id=cuento.id).update(imagen_url=imagen_url, imagen_prompt=imagen_prompt)
+    cuento.imagen_url, cuento.imagen_prompt = imagen_url, imagen_prompt
+
+
+def _procesar_imagen(trabajo, servicio, latido):
+    cuento = trabajo.cuento
+    if _falta_generar_imagen(cuento):
+        imagen = servicio.generar_imagen(cuento.titulo, cuento.contenido, cuento.tema, user=trabajo.usuario)
+        latido.comprobar()
+        _guardar_url_imagen(trabajo, *imagen)
+    _terminar_imagen(trabajo)
+
+
+def _terminar_imagen(trabajo):
+    cuento = trabajo.cuento
+    # La URL de OpenAI caduca: se guarda una copia local con sus variantes. La descarga
+    # empieza con el lease recién renovado y solo la marca como lista quien sigue siendo dueño
+    _comprobar_dueno(trabajo)
+    images.ingerir_imagen(cuento)
+
+    with transaction.atomic():
+        if not _finalizar(trabajo, estado='completado', lease_hasta=None, ultimo_error=''):
+            raise TrabajoPerdido(trabajo)
+        Cuento.objects.filter(id=cuento.id).update(imagen_estado='lista')
+
+    notifications.publicar(
+        cuento.id, 'completado', usuario_id=cuento.usuario_id,
+        imagen_estado='lista', imagen_url=cuento.url_imagen_lectura,
+    )
+    logger.info(f"Imagen del cuento {cuento.id} lista")
+
+
+def procesar_trabajo(trabajo, servicio=None):
+    """Ejecuta un trabajo ya reclamado (texto o imagen) y actualiza el cuento"""
+    if servicio is None:
+        from .services import openai_service
+        servicio = openai_service
+
+    try:
+        logger.info(f"Iniciando {trabajo.tipo} del cuento ID: {trabajo.cuento_id} (intento {trabajo.intentos})")
+        with Latido(trabajo) as latido:
+            if trabajo.tipo == 'imagen':
+                _procesar_imagen(trabajo, servicio, latido)
+            else:
+                _procesar_texto(trabajo, servicio, latido)
+        return True
+
+    except TrabajoPerdido as e:
+        # El trabajo es de otro worker: ni se aplaza ni cuenta como fallo
+        logger.warning(str(e))
+        return False
+
+    except (PlanificadorSaturado, CircuitoAbierto) as e:
+        _aplazar(trabajo, e)
+        return False
+
+    except Exception as e:
+        _registrar_fallo(trabajo, e)
+        return False
+
+
+def _aplazar(trabajo, error):
+    # Falta de presupuesto u OpenAI caído, no un fallo de este trabajo: vuelve a la cola sin gastar el intento
+    logger.warning(f"{trabajo.tipo} del cuento {trabajo.cuento_id} aplazado {error.retry_after}s: {str(error)}")
+    _finalizar(
+        trabajo,
+        estado='pendiente',
+        lease_hasta=None,
+        intentos=F('intentos') - 1,
+        disponible_desde=timezone.now() + timedelta(seconds=error.retry_after),
+        ultimo_error=str(error)[:2000],
+    )
+
+
+def _registrar_fallo(trabajo, error):
+    logger.error(f"Error en {trabajo.tipo} del cuento {trabajo.cuento_id} (trabajo {trabajo.id}): {str(error)}")
+
+    if trabajo.intentos >= trabajo.max_intentos:
+        if _finalizar(trabajo, estado='fallido', lease_hasta=None, ultimo_error=str(error)[:2000]):
+            _marcar_fallo_cuento(trabajo.cuento_id, trabajo.usuario_id, trabajo.tipo)
+    else:
+        # Reintento con espera exponencial
+        espera = _config('GENERATION_RETRY_DELAY', 5) * (2 ** (trabajo.intentos - 1))
+        _finalizar(
+            trabajo,
+            estado='pendiente',
+            lease_hasta=None,
+            disponible_desde=timezone.now() + timedelta(seconds=espera),
+            ultimo_error=str(error)[:2000],
+        )
+
+
+# ===== Worker async =====
+#
+# Un hilo con un bucle de eventos lleva hasta GENERATION_ASYNC_TASKS trabajos a
+# la vez: cada uno es una corrutina que espera turno y respuesta de OpenAI sin
+# ocupar un hilo (AsyncOpenAIService). Las partes bloqueantes (ORM, descarga y
+# variantes de la imagen) van al pool acotado de CUENTIA.asincronia, así que
+# las conexiones a la base de datos no crecen con los trabajos en vuelo.
+
+async def _procesar_texto_async(trabajo, servicio):
+    titulo, contenido, moraleja = await servicio.generar_texto(
+        trabajo.datos_formulario, user=trabajo.usuario,
+        al_avanzar=en_hilo(guardar_avance(trabajo.cuento_id, trabajo.usuario_id)))
+    await en_hilo(_guardar_texto)(trabajo, titulo, contenido, moraleja)
+
+
+async def _procesar_imagen_async(trabajo, servicio):
+    cuento = trabajo.cuento
+    if _falta_generar_imagen(cuento):
+        imagen_url, imagen_prompt = await servicio.generar_imagen(
+            cuento.titulo, cuento.contenido, cuento.tema, user=trabajo.usuario)
+        await en_hilo(_guardar_url_imagen)(trabajo, imagen_url, imagen_prompt)
+    await en_hilo(_terminar_imagen)(trabajo)
+
+
+async def _con_latido(trabajo, corrutina, intervalo=None):
+    """Espera `corrutina` renovando el lease; si otro worker reclama el trabajo la cancela (TrabajoPerdido)"""
+    intervalo = intervalo or intervalo_latido()
+    tarea = asyncio.ensure_future(corrutina)
+    perdido = asyncio.Event()
+
+    async def latir():
+        while True:
+            await asyncio.sleep(intervalo)
+            try:
+                vivo = await en_hilo(renovar_lease)(trabajo)
+            except Exception as e:
+                logger.warning(f"No se pudo renovar el lease del trabajo {trabajo.id}: {str(e)}")
+                continue
+            if not vivo:
+                perdido.set()
+                tarea.cancel()
+                return
+
+    latido = asyncio.create_task(latir()) if intervalo else None
+    try:
+        return await tarea
+    except asyncio.CancelledError:
+        if perdido.is_set():
+            raise TrabajoPerdido(trabajo)
+        raise
+    finally:
+        if latido:
+            latido.cancel()
+
+
+async def procesar_trabajo_async(trabajo, servicio=None):
+    """procesar_trabajo() con un servicio async (AsyncOpenAIService)"""
+    if servicio is None:
+        from .services import async_openai_service
+        servicio = async_openai_service
+
+    try:
+        logger.info(f"Iniciando {trabajo.tipo} del cuento ID: {trabajo.cuento_id} (intento {trabajo.intentos})")
+        procesar = _procesar_imagen_async if trabajo.tipo == 'imagen' else _procesar_texto_async
+        await _con_latido(trabajo, procesar(trabajo, servicio))
+        return True
+
+    except TrabajoPerdido as e:
+        logger.warning(str(e))
+        return False
+
+    except (PlanificadorSaturado, CircuitoAbierto) as e:
+        await en_hilo(_aplazar)(trabajo, e)
+        return False
+
+    except Exception as e:
+        await en_hilo(_registrar_fallo)(trabajo, e)
+        return False
+
+
+async def bucle_async(detener, tareas=None, servicio=None, intervalo=None, max_trabajos=None):
+    """Reclama trabajos mientras haya hueco y procesa cada uno en su propia tarea"""
+    tareas = tareas or _config('GENERATION_ASYNC_TASKS', 500)
+    intervalo = intervalo if intervalo is not None else _config('GENERATION_POLL_INTERVAL', 1.0)
+    huecos = asyncio.Semaphore(tareas)
+    en_curso = set()
+    secuencia = itertools.count()
+    procesados = 0
+
+    def terminada(tarea):
+        en_curso.discard(tarea)
+        huecos.release()
+
+    while not detener.is_set():
+        await huecos.acquire()
+        try:
+            trabajo = await en_hilo(reclamar_trabajo)(nombre_worker(f"async{next(secuencia)}"))
+        except Exception as e:
+            logger.error(f"[async] Error reclamando trabajo: {str(e)}")
+            trabajo = None
+
+        if trabajo is None:
+            huecos.release()
+            await asyncio.sleep(intervalo)
+            continue
+
+        tarea = asyncio.create_task(procesar_trabajo_async(trabajo, servicio))
+        en_curso.add(tarea)
+        tarea.add_done_callback(terminada)
+        procesados += 1
+        if max_trabajos and procesados >= max_trabajos:
+            break
+
+    if en_curso:
+        await asyncio.gather(*en_curso)
+    return procesados
+
+
+class WorkerAsync:
+    """Alternativa a PoolWorkers: un hilo con un bucle de eventos y muchos trabajos en vuelo"""
+
+    def __init__(self, tareas, servicio=None, intervalo=None):
+        self.tareas = tareas
+        self.servicio = servicio
+        self.intervalo = intervalo
+        self.detener = threading.Event()
+        self._threads = []
+
+    def _ejecutar(self):
+        asyncio.run(bucle_async(self.detener, self.tareas, self.servicio, self.intervalo))
+        connections.close_all()
+
+    def iniciar(self):
+        thread = threading.Thread(target=self._ejecutar, name="generation-worker-async")
+        thread.start()
+        self._threads.append(thread)
+
+    def esperar(self, timeout=None):
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def parar(self):
+        self.detener.set()
+        self.esperar()
+
+
+def bucle_worker(worker_id, detener, servicio=None, intervalo=None, max_trabajos=None):
+    """Ciclo de un worker: reclama, procesa y duerme cuando la cola está vacía"""
+    intervalo = intervalo if intervalo is not None else _config('GENERATION_POLL_INTERVAL', 1.0)
+    procesados = 0
+
+    while not detener.is_set():
+        close_old_connections()
+        try:
+            trabajo = reclamar_trabajo(worker_id)
+        except Exception as e:
+            logger.error(f"[{worker_id}] Error reclamando trabajo: {str(e)}")
+            trabajo = None
+
+        if trabajo is None:
+            detener.wait(intervalo)
+            continue
+
+        procesar_trabajo(trabajo, servicio=servicio)
+        procesados += 1
+        if max_trabajos and procesados >= max_trabajos:
+            break
+
+    connections.close_all()
+    return procesados
+
+
+def nombre_worker(indice):
+    return f"{socket.gethostname()}:{os.getpid()}:{indice}"
+
+
+class PoolWorkers:
+    """Conjunto de hilos worker dentro de un proceso"""
+
+    def __init__(self, hilos, servicio=None, intervalo=None):
+        self.hilos = hilos
+        self.servicio = servicio
+        self.intervalo = intervalo
+        self.detener = threading.Event()
+        self._threads = []
+
+    def iniciar(self):
+        for indice in range(self.hilos):
+            thread = threading.Thread(
+                target=bucle_worker,
+                args=(nombre_worker(indice), self.detener, self.servicio, self.intervalo),
+                name=f"generation-worker-{indice}",
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def esperar(self, timeout=None):
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def parar(self):
+        self.detener.set()
+        self.esperar()
+
+
+def registrar_estado_planificador():
+    logger.info(f"Planificador OpenAI ({os.getpid()}): {scheduler.planificador().estado()}")
+
+
+def crear_pool(hilos, intervalo=None, tareas_async=0):
+    """WorkerAsync si se piden tareas async; si no, el pool de hilos de siempre"""
+    if tareas_async:
+        return WorkerAsync(tareas_async, intervalo=intervalo)
+    return PoolWorkers(hilos, intervalo=intervalo)
+
+
+def proceso_worker(hilos, intervalo=None, procesos=1, tareas_async=0):
+    """Punto de entrada de un proceso hijo de run_generation_workers"""
+    import django
+    django.setup()
+
+    # Los presupuestos de OpenAI son globales: cada proceso usa su parte
+    scheduler.usar_fraccion(1 / max(1, procesos))
+    pool = crear_pool(hilos, intervalo, tareas_async)
+    pool.iniciar()
+    try:
+        segundos = 0
+        while any(t.is_alive() for t in pool._threads):
+            time.sleep(1)
+            segundos += 1
+            if segundos % 30 == 0:
+                registrar_estado_planificador()
+    except KeyboardInterrupt:
+        pool.parar()
@@ -0,0 +1,81 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.db.models import Q
+
+from stories import images
+from stories.models import Cuento
+
+logger = logging.getLogger(__name__)
+
+
+def _procesar(cuento_id, regenerar):
+    """Descarga (o regenera) las imágenes de un cuento en un hilo del pool"""
+    close_old_connections()
+    try:
+        cuento = Cuento.objects.get(id=cuento_id)
+        if regenerar and cuento.imagen_archivo:
+            images.regenerar_variantes(cuento)
+        else:
+            images.ingerir_imagen(cuento)
+        return cuento_id, None
+    except Exception as e:
+        return cuento_id, str(e)
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = "Guarda localmente las ilustraciones de cuentos existentes y genera sus variantes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=50, help='Cuentos por lote')
+        parser.add_argument('--hilos', type=int, default=8, help='Descargas en paralelo')
+        parser.add_argument(
+            '--regenerar', action='store_true',
+            help='Recalcular también las variantes de cuentos que ya tienen la imagen original'
+        )
+
+    def handle(self, *args, **options):
+        lote = max(1, options['lote'])
+        regenerar = options['regenerar']
+
+        pendientes = Cuento.objects.filter(imagen_url__startswith='http', imagen_archivo='')
+        if regenerar:
+            pendientes = Cuento.objects.filter(
+                Q(imagen_url__startswith='http', imagen_archivo='') | ~Q(imagen_archivo='')
+            )
+
+        total = pendientes.count()
+        self.stdout.write(f"Cuentos a procesar: {total}")
+
+        procesados = errores = 0
+        ultimo_id = 0
+        with ThreadPoolExecutor(max_workers=max(1, options['hilos'])) as pool:
+            while True:
+                # Lotes por id para no cargar toda la tabla en memoria
+                ids = list(
+                    pendientes.filter(id__gt=ultimo_id).order_by('id').values_list('id', flat=True)[:lote]
+                )
+                if not ids:
+                    break
+                ultimo_id = ids[-1]
+
+                for cuento_id, error in pool.map(lambda cid: _procesar(cid, regenerar), ids):
+                    procesados += 1
+                    if error:
+                        errores += 1
+                        logger.warning(f"Cuento {cuento_id}: {error}")
+                        self.stderr.write(f"  ✗ Cuento {cuento_id}: {error}")
+
+                self.stdout.write(f"  {procesados}/{total} procesados ({errores} errores)")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Listo: {procesados - errores} cuentos con imagen local, {errores} errores"
+        ))
+        if errores:
+            self.stdout.write(
+                "Las URLs de OpenAI caducan: los cuentos con error seguirán usando imagen_url."
+            )
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from stories.benchmarks import ESCENARIOS
+
+
+class Command(BaseCommand):
+    help = "Ejecuta benchmarks del módulo de cuentos sobre una base de datos temporal"
+
+    def add_arguments(self, parser):
+        parser.add_argument('escenario', choices=sorted(ESCENARIOS.keys()))
+        parser.add_argument('--trabajos', type=int, default=40, help='Cuentos a generar')
+        parser.add_argument('--hilos', type=int, nargs='+', default=[1, 4, 8], help='Tamaños de pool')
+        parser.add_argument('--latencia', type=float, default=0.5, help='Latencia simulada de OpenAI (s)')
+        parser.add_argument('--procesos', type=int, nargs='+', default=[0, 1, 2, 4],
+                            help='Tamaños del pool de renderizado de PDFs (0 = en línea)')
+
+    def handle(self, *args, **options):
+        escenario = ESCENARIOS.get(options['escenario'])
+        if escenario is None:
+            raise CommandError(f"Escenario desconocido: {options['escenario']}")
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f"Benchmark: {options['escenario']}"))
+        escenario(self.stdout.write, options)
@@ -0,0 +1,96 @@
+import logging
+import multiprocessing
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from stories.jobs import (crear_pool, encolar_huerfanos, marcar_agotados, proceso_worker,
+                         registrar_estado_planificador)
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Ejecuta los workers que procesan la cola de generación de cuentos"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hilos', type=int, default=getattr(settings, 'GENERATION_WORKERS', 4),
+            help='Hilos worker por proceso'
+        )
+        parser.add_argument(
+            '--procesos', type=int, default=1,
+            help='Número de procesos worker'
+        )
+        parser.add_argument(
+            '--intervalo', type=float, default=getattr(settings, 'GENERATION_POLL_INTERVAL', 1.0),
+            help='Segundos de espera cuando la cola está vacía'
+        )
+        parser.add_argument(
+            '--async-tareas', type=int, default=0,
+            help='Trabajos en vuelo por proceso con el worker async (AsyncOpenAIService); 0 = hilos'
+        )
+        parser.add_argument(
+            '--sin-huerfanos', action='store_true',
+            help='No reencolar cuentos atascados en estado "generando"'
+        )
+
+    def handle(self, *args, **options):
+        hilos = max(1, options['hilos'])
+        procesos = max(1, options['procesos'])
+        intervalo = options['intervalo']
+        tareas_async = max(0, options['async_tareas'])
+
+        if not options['sin_huerfanos']:
+            reencolados = encolar_huerfanos()
+            self.stdout.write(f"Cuentos huérfanos reencolados: {reencolados}")
+
+        por_proceso = f"{tareas_async} tarea(s) async" if tareas_async else f"{hilos} hilo(s)"
+        self.stdout.write(self.style.SUCCESS(
+            f"Iniciando {procesos} proceso(s) x {por_proceso} de generación"
+        ))
+
+        if procesos == 1:
+            self._ejecutar_en_proceso(hilos, intervalo, tareas_async)
+        else:
+            self._ejecutar_multiproceso(procesos, hilos, intervalo, tareas_async)
+
+    def _ejecutar_en_proceso(self, hilos, intervalo, tareas_async):
+        pool = crear_pool(hilos, intervalo, tareas_async)
+        signal.signal(signal.SIGTERM, lambda *_: pool.detener.set())
+        pool.iniciar()
+        try:
+            while not pool.detener.is_set():
+                marcar_agotados()
+                registrar_estado_planificador()
+                pool.detener.wait(30)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stdout.write("Deteniendo workers...")
+            pool.parar()
+
+    def _ejecutar_multiproceso(self, procesos, hilos, intervalo, tareas_async):
+        # Los hijos abren sus propias conexiones
+        connections.close_all()
+        hijos = []
+        for _ in range(procesos):
+            proceso = multiprocessing.Process(target=proceso_worker, args=(hilos, intervalo, procesos, tareas_async))
+            proceso.start()
+            hijos.append(proceso)
+
+        try:
+            while any(p.is_alive() for p in hijos):
+                marcar_agotados()
+                time.sleep(30)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stdout.write("Deteniendo procesos worker...")
+            for proceso in hijos:
+                proceso.terminate()
+            for proceso in hijos:
+                proceso.join()
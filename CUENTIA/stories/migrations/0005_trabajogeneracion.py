@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:39
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0004_alter_cuento_imagen_url'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrabajoGeneracion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('datos_formulario', models.JSONField(default=dict)),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('en_proceso', 'En proceso'), ('completado', 'Completado'), ('fallido', 'Fallido')], default='pendiente', max_length=20)),
+                ('intentos', models.PositiveIntegerField(default=0)),
+                ('max_intentos', models.PositiveIntegerField(default=3)),
+                ('worker', models.CharField(blank=True, max_length=100)),
+                ('lease_hasta', models.DateTimeField(blank=True, null=True)),
+                ('disponible_desde', models.DateTimeField(default=django.utils.timezone.now)),
+                ('ultimo_error', models.TextField(blank=True)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('fecha_actualizacion', models.DateTimeField(auto_now=True)),
+                ('cuento', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trabajos', to='stories.cuento')),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Trabajo de Generación',
+                'verbose_name_plural': 'Trabajos de Generación',
+                'ordering': ['disponible_desde', 'id'],
+                'indexes': [models.Index(fields=['estado', 'disponible_desde'], name='stories_tra_estado_9f37e3_idx'), models.Index(fields=['estado', 'lease_hasta'], name='stories_tra_estado_2e5f8e_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0005_trabajogeneracion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cuento',
+            name='imagen_estado',
+            field=models.CharField(choices=[('pendiente', 'Pendiente'), ('lista', 'Lista'), ('error', 'Error')], default='lista', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='trabajogeneracion',
+            name='tipo',
+            field=models.CharField(choices=[('texto', 'Texto'), ('imagen', 'Imagen')], default='texto', max_length=20),
+        ),
+    ]
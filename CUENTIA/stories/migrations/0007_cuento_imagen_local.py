@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0006_cuento_imagen_estado_trabajo_tipo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cuento',
+            name='imagen_archivo',
+            field=models.ImageField(blank=True, upload_to='cuentos/'),
+        ),
+        migrations.AddField(
+            model_name='cuento',
+            name='imagen_impresion',
+            field=models.ImageField(blank=True, upload_to='cuentos/'),
+        ),
+        migrations.AddField(
+            model_name='cuento',
+            name='imagen_lectura',
+            field=models.ImageField(blank=True, upload_to='cuentos/'),
+        ),
+        migrations.AddField(
+            model_name='cuento',
+            name='imagen_miniatura',
+            field=models.ImageField(blank=True, upload_to='cuentos/'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0007_cuento_imagen_local'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cuento',
+            name='idioma',
+            field=models.CharField(default='es', max_length=2),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:20
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0008_cuento_idioma'),
+        ('user', '0009_perfil_foto_perfil'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cuento',
+            index=models.Index(fields=['usuario', '-fecha_creacion', '-id'], name='cuento_usuario_fecha_id_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:26
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0009_cuento_indice_paginacion'),
+        ('user', '0009_perfil_foto_perfil'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cuento',
+            index=models.Index(condition=models.Q(('en_biblioteca', True), ('estado', 'completado')), fields=['usuario', '-fecha_creacion', '-id'], name='cuento_biblio_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cuento',
+            index=models.Index(condition=models.Q(('en_biblioteca', True), ('estado', 'completado')), fields=['usuario', 'perfil', '-fecha_creacion', '-id'], name='cuento_biblio_perfil_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cuento',
+            index=models.Index(condition=models.Q(('en_biblioteca', True), ('estado', 'completado')), fields=['usuario', 'tema', '-fecha_creacion', '-id'], name='cuento_biblio_tema_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cuento',
+            index=models.Index(condition=models.Q(('en_biblioteca', True), ('estado', 'completado'), ('es_favorito', True)), fields=['usuario', '-fecha_creacion', '-id'], name='cuento_biblio_favoritos_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cuento',
+            index=models.Index(fields=['usuario', 'estado', '-veces_leido'], name='cuento_usuario_leidos_idx'),
+        ),
+    ]
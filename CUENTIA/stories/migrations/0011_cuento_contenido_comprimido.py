@@ -0,0 +1,66 @@
+# Cuento.contenido pasa a CompressedTextField (stories/fields.py). El texto se
+# copia comprimido a una columna nueva por lotes y después sustituye a la
+# antigua; de paso se rellena vista_previa para las tarjetas.
+
+from django.db import migrations
+
+import stories.fields
+
+LOTE = 500
+
+
+def _copiar(origen, destino, apps):
+    Cuento = apps.get_model('stories', 'Cuento')
+    ultimo_id = 0
+    while True:
+        cuentos = list(Cuento.objects.filter(id__gt=ultimo_id).order_by('id').only('id', origen)[:LOTE])
+        if not cuentos:
+            break
+        for cuento in cuentos:
+            texto = getattr(cuento, origen) or ''
+            setattr(cuento, destino, texto)
+            cuento.vista_previa = texto[:200]
+        Cuento.objects.bulk_update(cuentos, [destino, 'vista_previa'])
+        ultimo_id = cuentos[-1].id
+
+
+def comprimir(apps, schema_editor):
+    _copiar('contenido', 'contenido_comprimido', apps)
+
+
+def descomprimir(apps, schema_editor):
+    _copiar('contenido_comprimido', 'contenido', apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0010_cuento_indices_biblioteca'),
+        # El índice de búsqueda se rellena con SQL sobre contenido: tiene que leerlo sin comprimir
+        ('library', '0007_indice_busqueda'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cuento',
+            name='vista_previa',
+            field=stories.fields.VistaPreviaField(default='', blank=True, editable=False, max_length=200,
+                                                  origen='contenido'),
+        ),
+        migrations.AddField(
+            model_name='cuento',
+            name='contenido_comprimido',
+            field=stories.fields.CompressedTextField(blank=True, default=''),
+            preserve_default=False,
+        ),
+        migrations.RunPython(comprimir, descomprimir),
+        migrations.RemoveField(
+            model_name='cuento',
+            name='contenido',
+        ),
+        migrations.RenameField(
+            model_name='cuento',
+            old_name='contenido_comprimido',
+            new_name='contenido',
+        ),
+    ]
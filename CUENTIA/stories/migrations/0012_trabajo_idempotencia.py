@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:17
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0011_cuento_contenido_comprimido'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trabajogeneracion',
+            name='clave_idempotencia',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='trabajogeneracion',
+            constraint=models.UniqueConstraint(fields=('usuario', 'clave_idempotencia'), name='trabajo_idempotencia_unica'),
+        ),
+    ]
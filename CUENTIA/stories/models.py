@@ -2,6 +2,11 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
 from user.models import Perfil
+from library.querysets import LONGITUD_VISTA_PREVIA, CuentoQuerySet
+from .fields import CompressedTextField, VistaPreviaField
+
+# Condición de los índices parciales: lo que library.querysets llama biblioteca()
+EN_BIBLIOTECA = models.Q(estado='completado', en_biblioteca=True)
 
 class Cuento(models.Model):
     TEMA_CHOICES = [
@@ -23,6 +28,12 @@ class Cuento(models.Model):
         ('error', 'Error'),
     ]
 
+    IMAGEN_ESTADO_CHOICES = [
+        ('pendiente', 'Pendiente'),
+        ('lista', 'Lista'),
+        ('error', 'Error'),
+    ]
+
     usuario = models.ForeignKey(User, on_delete=models.CASCADE)
     perfil = models.ForeignKey(Perfil, on_delete=models.SET_NULL, null=True, blank=True)
     titulo = models.TextField()
@@ -30,20 +41,51 @@ class Cuento(models.Model):
     tema = models.CharField(max_length=50, choices=TEMA_CHOICES)
     edad = models.CharField(max_length=20)
     longitud = models.CharField(max_length=20)
-    contenido = models.TextField(blank=True)
+    contenido = CompressedTextField(blank=True)  # comprimido en la base de datos (stories/fields.py)
+    # Inicio del contenido para las tarjetas: los listados no leen ni descomprimen el texto completo
+    vista_previa = VistaPreviaField('contenido', max_length=LONGITUD_VISTA_PREVIA)
     moraleja = models.TextField(blank=True)
     imagen_url = models.TextField(blank=True, null=True)
     imagen_prompt = models.TextField(blank=True)
+    imagen_estado = models.CharField(max_length=20, choices=IMAGEN_ESTADO_CHOICES, default='lista')
+    # Copia local de la ilustración y sus variantes (ver stories/images.py)
+    imagen_archivo = models.ImageField(upload_to='cuentos/', blank=True)
+    imagen_miniatura = models.ImageField(upload_to='cuentos/', blank=True)
+    imagen_lectura = models.ImageField(upload_to='cuentos/', blank=True)
+    imagen_impresion = models.ImageField(upload_to='cuentos/', blank=True)
     estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default='generando')
     fecha_creacion = models.DateTimeField(auto_now_add=True)
     tiempo_lectura_estimado = models.IntegerField(default=300)  # en segundos
     veces_leido = models.IntegerField(default=0)
     es_favorito = models.BooleanField(default=False)
     en_biblioteca = models.BooleanField(default=False)  # NUEVO CAMPO
+    idioma = models.CharField(max_length=2, default='es')  # UserSettings.language al generarlo
+
+    objects = CuentoQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'contenido' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'vista_previa'}
+        super().save(*args, **kwargs)
 
     def get_tema_display(self):
         return dict(self.TEMA_CHOICES).get(self.tema, self.tema)
 
+    @property
+    def url_miniatura(self):
+        """Imagen para tarjetas de biblioteca y dashboard"""
+        if self.imagen_miniatura:
+            return self.imagen_miniatura.url
+        return self.imagen_url
+
+    @property
+    def url_imagen_lectura(self):
+        """Imagen para la página de lectura del cuento"""
+        if self.imagen_lectura:
+            return self.imagen_lectura.url
+        return self.imagen_url
+
     def marcar_como_leido(self):
         self.veces_leido += 1
         self.save(update_fields=['veces_leido'])
@@ -63,6 +105,22 @@ class Cuento(models.Model):
 
     class Meta:
         ordering = ['-fecha_creacion']
+        indexes = [
+            # Orden de la paginación por cursor (library/pagination.py) y cuentos recientes del dashboard
+            models.Index(fields=['usuario', '-fecha_creacion', '-id'], name='cuento_usuario_fecha_id_idx'),
+            # Los listados de la biblioteca filtran siempre por EN_BIBLIOTECA: los índices
+            # parciales solo guardan esos cuentos y sirven para el filtro y el orden a la vez
+            models.Index(fields=['usuario', '-fecha_creacion', '-id'], condition=EN_BIBLIOTECA,
+                         name='cuento_biblio_fecha_idx'),
+            models.Index(fields=['usuario', 'perfil', '-fecha_creacion', '-id'], condition=EN_BIBLIOTECA,
+                         name='cuento_biblio_perfil_idx'),
+            models.Index(fields=['usuario', 'tema', '-fecha_creacion', '-id'], condition=EN_BIBLIOTECA,
+                         name='cuento_biblio_tema_idx'),
+            models.Index(fields=['usuario', '-fecha_creacion', '-id'], condition=EN_BIBLIOTECA & models.Q(es_favorito=True),
+                         name='cuento_biblio_favoritos_idx'),
+            # Más leídos: estadísticas de la biblioteca y populares del dashboard
+            models.Index(fields=['usuario', 'estado', '-veces_leido'], name='cuento_usuario_leidos_idx'),
+        ]
 
 
 class EstadisticaLectura(models.Model):
@@ -91,3 +149,49 @@ class EstadisticaLectura(models.Model):
     def __str__(self):
         perfil_name = self.perfil.nombre if self.perfil else "Sin perfil"
         return f"{self.cuento.titulo} - {perfil_name} - {self.tiempo_lectura}s"
+
+
+class TrabajoGeneracion(models.Model):
+    """Trabajo persistente de la cola de generación de cuentos"""
+    ESTADO_CHOICES = [
+        ('pendiente', 'Pendiente'),
+        ('en_proceso', 'En proceso'),
+        ('completado', 'Completado'),
+        ('fallido', 'Fallido'),
+    ]
+
+    TIPO_CHOICES = [
+        ('texto', 'Texto'),
+        ('imagen', 'Imagen'),
+    ]
+
+    cuento = models.ForeignKey(Cuento, on_delete=models.CASCADE, related_name='trabajos')
+    tipo = models.CharField(max_length=20, choices=TIPO_CHOICES, default='texto')
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE)
+    datos_formulario = models.JSONField(default=dict)
+    estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default='pendiente')
+    intentos = models.PositiveIntegerField(default=0)
+    max_intentos = models.PositiveIntegerField(default=3)
+    worker = models.CharField(max_length=100, blank=True)
+    lease_hasta = models.DateTimeField(null=True, blank=True)
+    disponible_desde = models.DateTimeField(default=timezone.now)
+    ultimo_error = models.TextField(blank=True)
+    # Huella de la clave de idempotencia del formulario y sus datos: un reenvío devuelve este trabajo
+    clave_idempotencia = models.CharField(max_length=64, null=True, blank=True)
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Trabajo de Generación"
+        verbose_name_plural = "Trabajos de Generación"
+        ordering = ['disponible_desde', 'id']
+        indexes = [
+            models.Index(fields=['estado', 'disponible_desde']),
+            models.Index(fields=['estado', 'lease_hasta']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['usuario', 'clave_idempotencia'], name='trabajo_idempotencia_unica'),
+        ]
+
+    def __str__(self):
+        return f"Trabajo {self.id} ({self.tipo}) - Cuento {self.cuento_id} ({self.estado})"
@@ -0,0 +1,245 @@
+"""Registro de notificaciones del estado de los cuentos en generación.
+
+Los workers publican cada cambio (avance, completado, error) y las vistas de
+long-poll/SSE esperan sobre una Condition del proceso, así que despiertan en
+cuanto hay novedades sin consultar la base de datos. El último estado también
+se copia en la caché `notificaciones` para que un worker que corre en otro
+proceso pueda avisar a los servidores web.
+
+Las vistas async esperan con esperar_cambio_async(): cada una es un
+asyncio.Event que publicar() activa desde cualquier hilo, así que miles de
+esperas no ocupan ningún hilo y tienen su propio límite
+(STORY_LONGPOLL_MAX_ASYNC_WAITERS). En el bucle de eventos no se hace E/S ni
+se toma la Condition: la caché compartida (Redis o archivos) se lee en el
+pool de CUENTIA.asincronia, y las esperas async tienen su propio candado, que
+nadie sostiene mientras lee o escribe la caché.
+"""
+import asyncio
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import InvalidCacheBackendError
+
+from CUENTIA.asincronia import en_hilo
+
+logger = logging.getLogger(__name__)
+
+ESTADOS_FINALES = ('completado', 'error')
+
+_condicion = threading.Condition()
+_estados = {}
+_esperando = 0
+# (bucle, asyncio.Event) de cada espera async en curso
+_esperas_async = set()
+_bloqueo_async = threading.Lock()
+
+
+def _cache():
+    try:
+        return caches['notificaciones']
+    except InvalidCacheBackendError:
+        return caches['default']
+
+
+def _clave(cuento_id):
+    return f"cuentia:estado-cuento:{cuento_id}"
+
+
+def _ttl():
+    return getattr(settings, 'STORY_NOTIFICATIONS_TTL', 3600)
+
+
+def _purgar(ahora):
+    """Olvida los estados antiguos para que el registro no crezca sin límite"""
+    vencidos = [cid for cid, datos in _estados.items() if ahora - datos['_publicado'] > _ttl()]
+    for cuento_id in vencidos:
+        del _estados[cuento_id]
+
+
+def _mas_reciente(*estados):
+    estados = [e for e in estados if e]
+    if not estados:
+        return None
+    return max(estados, key=lambda e: e['version'])
+
+
+def _leer_remoto(cuento_id):
+    try:
+        return _cache().get(_clave(cuento_id))
+    except Exception as e:
+        logger.warning(f"No se pudo leer el estado del cuento {cuento_id} de la caché: {str(e)}")
+        return None
+
+
+def estado_actual(cuento_id):
+    """Último estado conocido, del registro local o de la caché compartida"""
+    return _mas_reciente(_estados.get(cuento_id), _leer_remoto(cuento_id))
+
+
+async def estado_actual_async(cuento_id):
+    """estado_actual() sin bloquear el bucle de eventos: la caché se lee en el pool acotado"""
+    remoto = await en_hilo(_leer_remoto)(cuento_id)
+    return _mas_reciente(_estados.get(cuento_id), remoto)
+
+
+def _despertar_async():
+    with _bloqueo_async:
+        esperas = list(_esperas_async)
+    for bucle, evento in esperas:
+        try:
+            bucle.call_soon_threadsafe(evento.set)
+        except RuntimeError:
+            pass  # el bucle se cerró mientras tanto
+
+
+def publicar(cuento_id, estado, usuario_id=None, **datos):
+    """Registra un nuevo estado del cuento y despierta a quien lo esté esperando"""
+    # La caché se lee fuera de la Condition; dentro del proceso manda el registro local
+    remoto = _leer_remoto(cuento_id)
+    with _condicion:
+        anterior = _mas_reciente(_estados.get(cuento_id), remoto) or {}
+        nuevo = {'titulo': '', 'parrafos': []}
+        nuevo.update((k, v) for k, v in anterior.items() if not k.startswith('_'))
+        nuevo.update(datos)
+        nuevo['usuario_id'] = usuario_id or anterior.get('usuario_id')
+        nuevo['estado'] = estado
+        nuevo['version'] = anterior.get('version', 0) + 1
+
+        ahora = time.monotonic()
+        _purgar(ahora)
+        _estados[cuento_id] = dict(nuevo, _publicado=ahora)
+        _condicion.notify_all()
+    _despertar_async()
+
+    try:
+        _cache().set(_clave(cuento_id), nuevo, _ttl())
+    except Exception as e:
+        logger.warning(f"No se pudo publicar el estado del cuento {cuento_id} en la caché: {str(e)}")
+    return nuevo
+
+
+def sembrar(cuento_id, estado, usuario_id, titulo='', contenido='', **datos):
+    """Estado inicial (versión 0) a partir de la fila del cuento, sin notificar"""
+    return dict(
+        datos,
+        estado=estado,
+        titulo=titulo,
+        parrafos=[p.strip() for p in (contenido or '').split('\n\n') if p.strip()],
+        usuario_id=usuario_id,
+        version=0,
+    )
+
+
+def es_definitivo(estado):
+    """True cuando ya no se va a publicar nada más del cuento (texto e imagen terminados)"""
+    if estado['estado'] == 'error':
+        return True
+    return estado['estado'] == 'completado' and estado.get('imagen_estado', 'lista') != 'pendiente'
+
+
+def esperar_cambio(cuento_id, version=0, timeout=None):
+    """Bloquea hasta que haya un estado más nuevo que `version` o venza el timeout.
+
+    Devuelve el estado más reciente (o None si nadie ha publicado nada).
+    """
+    global _esperando
+    timeout = timeout if timeout is not None else getattr(settings, 'STORY_LONGPOLL_TIMEOUT', 25)
+    tramo = getattr(settings, 'STORY_NOTIFICATIONS_CHECK_INTERVAL', 1.0)
+    limite = time.monotonic() + timeout
+
+    with _condicion:
+        _esperando += 1
+    try:
+        while True:
+            estado = estado_actual(cuento_id)
+            if estado and estado['version'] > version:
+                return estado
+
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                return estado
+
+            # Cada tramo se revisa la caché por si publicó un worker de otro proceso
+            with _condicion:
+                local = _estados.get(cuento_id)
+                if not (local and local['version'] > version):
+                    _condicion.wait(min(tramo, restante))
+    finally:
+        with _condicion:
+            _esperando -= 1
+
+
+async def esperar_cambio_async(cuento_id, version=0, timeout=None):
+    """esperar_cambio() para vistas async: espera en el bucle de eventos en lugar de bloquear un hilo"""
+    timeout = timeout if timeout is not None else getattr(settings, 'STORY_LONGPOLL_TIMEOUT', 25)
+    tramo = getattr(settings, 'STORY_NOTIFICATIONS_CHECK_INTERVAL', 1.0)
+    limite = time.monotonic() + timeout
+    bucle, evento = espera = (asyncio.get_running_loop(), asyncio.Event())
+
+    with _bloqueo_async:
+        _esperas_async.add(espera)
+    try:
+        estado = await estado_actual_async(cuento_id)
+        while True:
+            if estado and estado['version'] > version:
+                return estado
+
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                return estado
+
+            # Se limpia antes de mirar el registro: una publicación entre medias no se pierde
+            evento.clear()
+            estado = _mas_reciente(_estados.get(cuento_id), estado)
+            if estado and estado['version'] > version:
+                return estado
+
+            try:
+                await asyncio.wait_for(evento.wait(), min(tramo, restante))
+                # Publicó este proceso: basta el registro local
+                estado = _mas_reciente(_estados.get(cuento_id), estado)
+            except asyncio.TimeoutError:
+                # Cada tramo se revisa la caché por si publicó un worker de otro proceso
+                estado = _mas_reciente(await estado_actual_async(cuento_id), estado)
+    finally:
+        with _bloqueo_async:
+            _esperas_async.discard(espera)
+
+
+def reiniciar():
+    """Vacía el registro local y la caché compartida (benchmarks)"""
+    with _condicion:
+        _estados.clear()
+    _cache().clear()
+
+
+def peticiones_esperando():
+    return _esperando + len(_esperas_async)
+
+
+def _carga():
+    """Fracción ocupada del límite de esperas, síncronas o async, la que esté más llena"""
+    limite = getattr(settings, 'STORY_LONGPOLL_MAX_WAITERS', 200)
+    limite_async = getattr(settings, 'STORY_LONGPOLL_MAX_ASYNC_WAITERS', 10000)
+    return max(_esperando / max(limite, 1), len(_esperas_async) / max(limite_async, 1))
+
+
+def intervalo_reintento():
+    """Milisegundos que el cliente debe esperar antes de volver a preguntar.
+
+    Crece con el número de peticiones bloqueadas en este proceso para repartir
+    la carga cuando hay muchos cuentos generándose a la vez.
+    """
+    base = getattr(settings, 'STORY_STATUS_RETRY_MS', 1000)
+    maximo = getattr(settings, 'STORY_STATUS_MAX_RETRY_MS', 10000)
+    return int(min(maximo, base + (maximo - base) * _carga()))
+
+
+def admite_espera(asincrona=False):
+    """False cuando ya hay demasiadas peticiones esperando en este proceso"""
+    if asincrona:
+        return len(_esperas_async) < getattr(settings, 'STORY_LONGPOLL_MAX_ASYNC_WAITERS', 10000)
+    return _esperando < getattr(settings, 'STORY_LONGPOLL_MAX_WAITERS', 200)
@@ -0,0 +1,197 @@
+"""Caché en disco de los PDFs de los cuentos.
+
+Cada PDF se guarda con el nombre de un hash de todo lo que aparece en el
+documento (título, contenido, moraleja, imagen...) más LAYOUT_VERSION. Si el
+cuento cambia, cambia el hash y se genera un archivo nuevo; los antiguos se
+eliminan por antigüedad de uso cuando la caché supera su tamaño máximo.
+
+Recorrer el directorio cuesta un stat por archivo, así que no se hace en cada
+escritura: cada proceso lleva un total estimado (un recorrido inicial más lo
+que va escribiendo) y solo recorre y recorta cuando el total pasa del límite
+o cada STORY_PDF_CACHE_RESCAN_WRITES escrituras, para enterarse también de lo
+que escriben los demás procesos.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+from django.conf import settings
+from django.http import FileResponse
+from django.utils.cache import get_conditional_response
+
+from .rendering import renderizar_pdf_cuento
+
+logger = logging.getLogger(__name__)
+
+# Subir al cambiar el diseño de generar_pdf_cuento para invalidar todo
+LAYOUT_VERSION = 1
+
+_bloqueo = threading.Lock()
+# {directorio: [bytes estimados, escrituras desde el último recorrido]}
+_totales = {}
+
+
+def _directorio():
+    return getattr(settings, 'STORY_PDF_CACHE_DIR', os.path.join(settings.MEDIA_ROOT, 'pdf_cache'))
+
+
+def _tamano_imagen(cuento):
+    try:
+        return cuento.imagen_impresion.size if cuento.imagen_impresion else 0
+    except OSError:
+        return 0
+
+
+def huella_pdf(cuento):
+    """Hash de contenido del PDF; sirve también como ETag"""
+    datos = [
+        LAYOUT_VERSION,
+        cuento.titulo,
+        cuento.contenido,
+        cuento.moraleja,
+        cuento.personaje_principal,
+        cuento.tema,
+        cuento.edad,
+        cuento.longitud,
+        cuento.tiempo_lectura_estimado,
+        cuento.fecha_creacion.isoformat() if cuento.fecha_creacion else '',
+        cuento.imagen_impresion.name if cuento.imagen_impresion else '',
+        _tamano_imagen(cuento),
+    ]
+    return hashlib.sha256(json.dumps(datos, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def _ruta(huella):
+    return os.path.join(_directorio(), huella[:2], f"{huella}.pdf")
+
+
+def _escribir(ruta, contenido):
+    """Escritura atómica: otro proceso nunca ve un PDF a medias"""
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    descriptor, temporal = tempfile.mkstemp(dir=os.path.dirname(ruta), suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'wb') as archivo:
+            archivo.write(contenido)
+        os.replace(temporal, ruta)
+    except Exception:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+
+
+def _maximo():
+    return getattr(settings, 'STORY_PDF_CACHE_MAX_BYTES', 500 * 1024 * 1024)
+
+
+def recortar_cache(maximo=None):
+    """Elimina los PDFs usados hace más tiempo hasta volver por debajo del límite"""
+    maximo = maximo if maximo is not None else _maximo()
+    directorio = _directorio()
+    archivos = []
+    total = 0
+    for raiz, _, nombres in os.walk(directorio):
+        for nombre in nombres:
+            if not nombre.endswith('.pdf'):
+                continue
+            ruta = os.path.join(raiz, nombre)
+            try:
+                info = os.stat(ruta)
+            except FileNotFoundError:
+                continue
+            archivos.append((info.st_mtime, info.st_size, ruta))
+            total += info.st_size
+
+    if total <= maximo:
+        _anotar_total(directorio, total)
+        return 0
+
+    # Se deja margen para no recortar en cada escritura
+    objetivo = int(maximo * 0.9)
+    eliminados = 0
+    for _, tamano, ruta in sorted(archivos):
+        if total <= objetivo:
+            break
+        try:
+            os.remove(ruta)
+            total -= tamano
+            eliminados += 1
+        except FileNotFoundError:
+            pass
+    _anotar_total(directorio, total)
+    logger.info(f"Caché de PDFs recortada: {eliminados} archivos eliminados")
+    return eliminados
+
+
+def _anotar_total(directorio, total):
+    with _bloqueo:
+        _totales[directorio] = [total, 0]
+
+
+def _sumar_escritura(tamano):
+    """Suma un PDF nuevo al total estimado y recorta solo cuando hace falta"""
+    directorio = _directorio()
+    with _bloqueo:
+        estimado = _totales.get(directorio)
+        if estimado is not None:
+            estimado[0] += tamano
+            estimado[1] += 1
+        recorrer = (estimado is None or estimado[0] > _maximo()
+                    or estimado[1] >= getattr(settings, 'STORY_PDF_CACHE_RESCAN_WRITES', 100))
+    if recorrer:
+        recortar_cache()
+
+
+def obtener_pdf(cuento, huella=None):
+    """Ruta del PDF en caché, generándolo solo si no existe"""
+    huella = huella or huella_pdf(cuento)
+    ruta = _ruta(huella)
+
+    if os.path.exists(ruta):
+        # La fecha de modificación marca el último uso (LRU)
+        try:
+            os.utime(ruta)
+        except FileNotFoundError:
+            pass
+        else:
+            return ruta
+
+    contenido = renderizar_pdf_cuento(cuento)
+    if not contenido:
+        raise Exception("PDF content is empty")
+    _escribir(ruta, contenido)
+    logger.info(f"PDF del cuento {cuento.id} guardado en caché ({len(contenido)} bytes)")
+    _sumar_escritura(len(contenido))
+    return ruta
+
+
+def nombre_archivo_pdf(cuento):
+    """Nombre de archivo seguro (sin caracteres especiales)"""
+    titulo_limpio = cuento.titulo.replace(' ', '_').replace('/', '_').replace('\\', '_')
+    titulo_limpio = ''.join(c for c in titulo_limpio if c.isalnum() or c in ['_', '-'])
+    return f"CuentIA_{titulo_limpio}.pdf"
+
+
+def respuesta_pdf(request, cuento):
+    """FileResponse del PDF en caché con ETag fuerte; 304 si el cliente ya lo tiene"""
+    huella = huella_pdf(cuento)
+    etag = f'"{huella}"'
+
+    no_modificado = get_conditional_response(request, etag=etag)
+    if no_modificado is not None:
+        no_modificado['ETag'] = etag
+        return no_modificado
+
+    response = FileResponse(
+        open(obtener_pdf(cuento, huella), 'rb'),
+        as_attachment=True,
+        filename=nombre_archivo_pdf(cuento),
+        content_type='application/pdf',
+    )
+    response['ETag'] = etag
+    # Privado pero revalidable: permite descargas condicionales baratas
+    response['Cache-Control'] = 'private, no-cache'
+    response['X-Content-Type-Options'] = 'nosniff'
+    return response
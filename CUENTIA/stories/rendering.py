@@ -0,0 +1,226 @@
+"""Renderizado de PDFs en un pool de procesos.
+
+ReportLab es trabajo de CPU puro: maquetación, repetición de páginas en
+NumberedCanvas, redimensionado con PIL... Hacerlo en el hilo de la petición
+bloquea un worker WSGI cientos de milisegundos por descarga. Aquí los
+documentos se envían a un ProcessPoolExecutor acotado con datos serializables
+(nunca instancias de modelos ni conexiones) y, si hay demasiados trabajos en
+vuelo, se rechazan de inmediato con RenderSaturado para responder 503.
+"""
+import logging
+import math
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeout
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.http import HttpResponse
+
+logger = logging.getLogger(__name__)
+
+
+class RenderSaturado(Exception):
+    """Hay demasiados PDFs en cola; el cliente debe reintentar más tarde"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Renderizado de PDFs saturado, reintentar en {retry_after}s")
+        self.retry_after = retry_after
+
+
+class RenderTimeout(RenderSaturado):
+    """El PDF no terminó dentro de PDF_RENDER_TIMEOUT; se responde igual que a la saturación"""
+
+
+class ArchivoEnMemoria:
+    """Sustituto serializable de un FieldFile: solo admite open('rb')"""
+
+    def __init__(self, nombre, contenido):
+        self.name = nombre
+        self.contenido = contenido
+
+    def __bool__(self):
+        return bool(self.contenido)
+
+    def open(self, mode='rb'):
+        return BytesIO(self.contenido)
+
+
+class CuentoPDF:
+    """Copia mínima del cuento con lo que usa generar_pdf_cuento"""
+
+    CAMPOS = ('id', 'titulo', 'personaje_principal', 'tema', 'edad', 'longitud',
+              'contenido', 'moraleja', 'fecha_creacion', 'tiempo_lectura_estimado')
+
+    def __init__(self, tema_display='', imagen_impresion=None, **campos):
+        for campo in self.CAMPOS:
+            setattr(self, campo, campos.get(campo))
+        self.tema_display = tema_display
+        self.imagen_impresion = imagen_impresion
+
+    @classmethod
+    def desde_cuento(cls, cuento):
+        imagen = None
+        if getattr(cuento, 'imagen_impresion', None):
+            with cuento.imagen_impresion.open('rb') as archivo:
+                imagen = ArchivoEnMemoria(cuento.imagen_impresion.name, archivo.read())
+        return cls(
+            tema_display=cuento.get_tema_display(),
+            imagen_impresion=imagen,
+            **{campo: getattr(cuento, campo) for campo in cls.CAMPOS}
+        )
+
+    def get_tema_display(self):
+        return self.tema_display
+
+
+# ===== Funciones que se ejecutan dentro de los procesos del pool =====
+
+def _inicializar_proceso():
+    """Los procesos se crean con 'spawn': hay que preparar Django antes de importar modelos"""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'CUENTIA.settings')
+    import django
+    django.setup()
+
+
+def _renderizar_cuento(cuento_pdf):
+    from .utils import generar_pdf_cuento
+    return generar_pdf_cuento(cuento_pdf).getvalue()
+
+
+def _renderizar_reporte(analytics, username, perfil_nombre, time_period):
+    from library.utils import generate_pdf_report
+    usuario = SimpleNamespace(username=username)
+    perfil = SimpleNamespace(nombre=perfil_nombre) if perfil_nombre else None
+    return generate_pdf_report(analytics, usuario, perfil, time_period)
+
+
+# ===== Pool =====
+
+_bloqueo = threading.Lock()
+_pool = None
+_cupos = None
+_en_vuelo = 0
+_procesos = 0
+
+
+def _config(nombre, default):
+    return getattr(settings, nombre, default)
+
+
+def _obtener_pool():
+    global _pool, _cupos, _procesos
+    with _bloqueo:
+        if _pool is None:
+            _procesos = _config('PDF_RENDER_PROCESSES', 2)
+            _cupos = threading.BoundedSemaphore(max(1, _config('PDF_RENDER_MAX_QUEUE', 8)))
+            if _procesos > 0:
+                _pool = ProcessPoolExecutor(
+                    max_workers=_procesos,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_inicializar_proceso,
+                )
+        return _pool
+
+
+def cerrar_pool():
+    """Detiene los procesos (benchmarks y cambio de configuración)"""
+    global _pool, _cupos
+    with _bloqueo:
+        pool, _pool, _cupos = _pool, None, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _descartar_pool(pool):
+    """Un proceso murió (OOM, kill...): la próxima petición crea un pool nuevo"""
+    global _pool
+    with _bloqueo:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def trabajos_en_vuelo():
+    return _en_vuelo
+
+
+def _retry_after():
+    """Segundos estimados hasta que se libere un cupo"""
+    base = _config('PDF_RENDER_RETRY_AFTER', 2)
+    return max(1, math.ceil(base * _en_vuelo / max(_procesos, 1)))
+
+
+def _ejecutar(funcion, *args):
+    """Envía el trabajo al pool respetando el límite de trabajos en vuelo"""
+    global _en_vuelo
+    pool = _obtener_pool()
+    if pool is None:
+        # PDF_RENDER_PROCESSES = 0: renderizado en el propio hilo
+        return funcion(*args)
+
+    cupos = _cupos
+    if not cupos.acquire(blocking=False):
+        raise RenderSaturado(_retry_after())
+
+    with _bloqueo:
+        _en_vuelo += 1
+
+    def _liberar(_):
+        global _en_vuelo
+        with _bloqueo:
+            _en_vuelo -= 1
+        cupos.release()
+
+    inicio = time.perf_counter()
+    try:
+        futuro = pool.submit(funcion, *args)
+    except BrokenProcessPool:
+        _liberar(None)
+        _descartar_pool(pool)
+        raise
+    except Exception:
+        _liberar(None)
+        raise
+    # El cupo se libera al terminar de verdad, aunque la petición haya expirado
+    futuro.add_done_callback(_liberar)
+
+    try:
+        resultado = futuro.result(timeout=_config('PDF_RENDER_TIMEOUT', 30))
+    except FuturesTimeout:
+        logger.error(f"PDF sin terminar tras {_config('PDF_RENDER_TIMEOUT', 30)}s ({funcion.__name__})")
+        raise RenderTimeout(_retry_after())
+    except BrokenProcessPool:
+        logger.error("El pool de renderizado se rompió; se recreará en la próxima petición")
+        _descartar_pool(pool)
+        raise
+
+    logger.info(f"PDF renderizado en {(time.perf_counter() - inicio) * 1000:.0f} ms ({funcion.__name__})")
+    return resultado
+
+
+def renderizar_pdf_cuento(cuento):
+    """Bytes del PDF de un cuento, generados en el pool de procesos"""
+    return _ejecutar(_renderizar_cuento, CuentoPDF.desde_cuento(cuento))
+
+
+def renderizar_reporte(analytics, user, perfil, time_period):
+    """Bytes del reporte de lectura, generados en el pool de procesos"""
+    return _ejecutar(
+        _renderizar_reporte, analytics, user.username, perfil.nombre if perfil else None, time_period
+    )
+
+
+def respuesta_saturado(error):
+    """503 con Retry-After cuando el pool no admite más trabajos"""
+    response = HttpResponse(
+        'Estamos generando muchos PDFs en este momento. Inténtalo de nuevo en unos segundos.',
+        status=503,
+        content_type='text/plain; charset=utf-8',
+    )
+    response['Retry-After'] = str(getattr(error, 'retry_after', _config('PDF_RENDER_RETRY_AFTER', 2)))
+    return response
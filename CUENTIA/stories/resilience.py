@@ -0,0 +1,255 @@
+"""Timeouts, reintentos y cortocircuito de las llamadas a OpenAI.
+
+OpenAIService pasa cada llamada por llamar() (AsyncOpenAIService por
+llamar_async(), con las mismas reglas y el mismo circuito):
+
+- Timeouts explícitos de conexión y lectura por operación (OPENAI_TIMEOUTS):
+  un cuento no puede quedarse colgado los 10 minutos por defecto del SDK.
+  En streaming el de lectura es el silencio máximo entre dos fragmentos.
+- Reintentos acotados (OPENAI_MAX_RETRIES) solo de lo que puede salir bien a
+  la segunda: errores de conexión, timeouts, 429 y 5xx. La espera es
+  exponencial con jitter completo (aleatoria entre 0 y base * 2^intento, con
+  tope OPENAI_RETRY_MAX_DELAY) para que los workers no reintenten a la vez;
+  si OpenAI manda Retry-After se respeta, y si pide más que el tope se deja
+  de insistir. El resto de 4xx falla a la primera.
+- Un circuito compartido por el proceso: tras OPENAI_BREAKER_FAILURES fallos
+  seguidos (conexión, timeout o 5xx; un 429 o un 400 no dicen nada de la
+  salud del servicio) se abre y las llamadas fallan al momento con
+  CircuitoAbierto, sin esperar ningún timeout. Pasados
+  OPENAI_BREAKER_RESET_SECONDS deja pasar una única llamada de prueba
+  (semiabierto): si sale bien se cierra y si no vuelve a abrirse.
+
+El SDK se construye con max_retries=0: los reintentos son solo los de aquí.
+Todo esto va dentro del turno del planificador (stories/scheduler.py), así que
+los reintentos también cuentan contra los presupuestos de RPM y TPM.
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import httpx
+import openai
+from django.conf import settings
+from django.utils import timezone
+
+from CUENTIA import metrics
+from .scheduler import Reloj
+
+logger = logging.getLogger(__name__)
+
+CERRADO = 'cerrado'
+ABIERTO = 'abierto'
+SEMIABIERTO = 'semiabierto'
+
+TIMEOUTS = {
+    'texto': {'connect': 5, 'read': 90},
+    'imagen': {'connect': 5, 'read': 120},
+}
+
+
+class CircuitoAbierto(Exception):
+    """OpenAI está fallando: no se llama hasta que pase el tiempo de reinicio"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Circuito de OpenAI abierto, reintentar en {retry_after}s")
+        self.retry_after = retry_after
+
+
+class Circuito:
+    """Circuito de tres estados con una sola llamada de prueba en semiabierto"""
+
+    def __init__(self, fallos_maximos=5, reinicio=30, reloj=None):
+        self.fallos_maximos = fallos_maximos
+        self.reinicio = reinicio
+        self.reloj = reloj or Reloj()
+        self.estado_actual = CERRADO
+        self.fallos = 0
+        self.abierto_desde = None
+        self.probando = False
+        self.aperturas = 0
+        self._bloqueo = threading.Lock()
+
+    def permitir(self):
+        """Reserva el paso de una llamada o lanza CircuitoAbierto"""
+        with self._bloqueo:
+            if self.estado_actual == ABIERTO:
+                restante = self.abierto_desde + self.reinicio - self.reloj.ahora()
+                if restante > 0:
+                    metrics.incrementar('openai.circuito.cortocircuitos')
+                    raise CircuitoAbierto(max(1, round(restante)))
+                self.estado_actual = SEMIABIERTO
+                logger.info("Circuito de OpenAI semiabierto: se prueba una llamada")
+            if self.estado_actual == SEMIABIERTO:
+                if self.probando:
+                    metrics.incrementar('openai.circuito.cortocircuitos')
+                    raise CircuitoAbierto(1)
+                self.probando = True
+
+    def exito(self):
+        with self._bloqueo:
+            if self.estado_actual != CERRADO:
+                logger.info("Circuito de OpenAI cerrado")
+            self.estado_actual = CERRADO
+            self.fallos = 0
+            self.probando = False
+
+    def fallo(self):
+        with self._bloqueo:
+            self.fallos += 1
+            if self.estado_actual == SEMIABIERTO or self.fallos >= self.fallos_maximos:
+                if self.estado_actual != ABIERTO:
+                    self.aperturas += 1
+                    metrics.incrementar('openai.circuito.aperturas')
+                    logger.warning(f"Circuito de OpenAI abierto tras {self.fallos} fallos seguidos")
+                self.estado_actual = ABIERTO
+                self.abierto_desde = self.reloj.ahora()
+            self.probando = False
+
+    def liberar(self):
+        """La llamada terminó sin decir nada de la salud del servicio (p. ej. un 429)"""
+        with self._bloqueo:
+            self.probando = False
+
+    def estado(self):
+        with self._bloqueo:
+            estado = {'estado': self.estado_actual, 'fallos_seguidos': self.fallos, 'aperturas': self.aperturas}
+            if self.estado_actual == ABIERTO:
+                estado['segundos_para_probar'] = max(
+                    0, round(self.abierto_desde + self.reinicio - self.reloj.ahora(), 1))
+            return estado
+
+
+_bloqueo = threading.Lock()
+_circuito = None
+
+
+def _config(nombre, default):
+    return getattr(settings, nombre, default)
+
+
+def circuito():
+    global _circuito
+    with _bloqueo:
+        if _circuito is None:
+            _circuito = Circuito(
+                fallos_maximos=_config('OPENAI_BREAKER_FAILURES', 5),
+                reinicio=_config('OPENAI_BREAKER_RESET_SECONDS', 30),
+            )
+        return _circuito
+
+
+def reiniciar():
+    """Descarta el circuito del proceso (pruebas y cambio de configuración)"""
+    global _circuito
+    with _bloqueo:
+        _circuito = None
+
+
+def timeout(operacion):
+    valores = {**TIMEOUTS[operacion], **_config('OPENAI_TIMEOUTS', {}).get(operacion, {})}
+    return httpx.Timeout(valores['read'], connect=valores['connect'])
+
+
+def es_fallo_del_servicio(error):
+    """Errores que indican que OpenAI no responde bien (cuentan para el circuito)"""
+    if isinstance(error, (openai.APIConnectionError, httpx.TransportError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+def _reintentable(error):
+    return es_fallo_del_servicio(error) or isinstance(error, openai.RateLimitError)
+
+
+def _retry_after(error):
+    """Segundos que pide el servidor en Retry-After(-ms), o None"""
+    respuesta = getattr(error, 'response', None)
+    if respuesta is None:
+        return None
+    cabeceras = respuesta.headers
+    try:
+        if cabeceras.get('retry-after-ms'):
+            return float(cabeceras['retry-after-ms']) / 1000
+        valor = cabeceras.get('retry-after')
+        if not valor:
+            return None
+        try:
+            return float(valor)
+        except ValueError:
+            return max(0.0, (parsedate_to_datetime(valor) - timezone.now()).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def espera_reintento(intento, error=None):
+    """Segundos antes del reintento número `intento` (desde 0), o None si no merece la pena"""
+    maximo = _config('OPENAI_RETRY_MAX_DELAY', 8)
+    pedido = _retry_after(error) if error is not None else None
+    if pedido is not None:
+        return pedido if pedido <= maximo else None
+    return random.uniform(0, min(maximo, _config('OPENAI_RETRY_BASE_DELAY', 0.5) * 2 ** intento))
+
+
+def _tras_error(operacion, error, intento, intentos):
+    """Anota el error en el circuito y devuelve la espera antes de reintentar, o None para rendirse"""
+    if isinstance(error, openai.APITimeoutError):
+        metrics.incrementar('openai.timeouts')
+    if es_fallo_del_servicio(error):
+        circuito().fallo()
+    elif isinstance(error, openai.APIStatusError) and not isinstance(error, openai.RateLimitError):
+        # El servicio respondió: un 4xx no es culpa suya
+        circuito().exito()
+    else:
+        circuito().liberar()
+
+    espera = espera_reintento(intento, error) if _reintentable(error) and intento + 1 < intentos else None
+    if espera is not None:
+        metrics.incrementar('openai.reintentos')
+        logger.warning(f"OpenAI {operacion}: {type(error).__name__}, reintento {intento + 1} en {espera:.2f}s")
+    return espera
+
+
+def llamar(operacion, funcion, dormir=time.sleep):
+    """Ejecuta funcion(timeout=...) con el circuito, los timeouts y los reintentos de `operacion`"""
+    intentos = _config('OPENAI_MAX_RETRIES', 2) + 1
+    for intento in range(intentos):
+        circuito().permitir()
+        try:
+            resultado = funcion(timeout=timeout(operacion))
+        except Exception as e:
+            espera = _tras_error(operacion, e, intento, intentos)
+            if espera is None:
+                raise
+            dormir(espera)
+            continue
+
+        circuito().exito()
+        return resultado
+
+
+async def llamar_async(operacion, funcion):
+    """llamar() para AsyncOpenAI: `funcion(timeout=...)` devuelve una corrutina y las esperas no bloquean"""
+    intentos = _config('OPENAI_MAX_RETRIES', 2) + 1
+    for intento in range(intentos):
+        circuito().permitir()
+        try:
+            resultado = await funcion(timeout=timeout(operacion))
+        except asyncio.CancelledError:
+            # Una prueba en semiabierto cancelada no puede dejar el circuito bloqueado
+            circuito().liberar()
+            raise
+        except Exception as e:
+            espera = _tras_error(operacion, e, intento, intentos)
+            if espera is None:
+                raise
+            await asyncio.sleep(espera)
+            continue
+
+        circuito().exito()
+        return resultado
+
+
+metrics.registrar_indicador('openai.circuito', lambda: circuito().estado())
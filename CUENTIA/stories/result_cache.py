@@ -0,0 +1,142 @@
+"""Caché de cuentos por contenido.
+
+Dos peticiones con los mismos datos del formulario (título, personaje, tema,
+edad y longitud, normalizados) en el mismo idioma tienen la misma huella.
+OpenAIService guarda bajo ella cada texto que escribe la IA y la consulta en
+dos casos:
+
+- Modo determinista (OPENAI_DETERMINISTIC): la llamada va con temperatura 0 y
+  una semilla sacada de la huella, así que repetirla daría el mismo cuento. Un
+  acierto se sirve sin pasar por el planificador ni llamar a OpenAI, y los
+  tokens que habría costado se cuentan como ahorro.
+- Respaldo: si OpenAI falla o no hay clave, un cuento ya escrito para esos
+  datos es mejor que la plantilla de _generar_cuento_fallback. La plantilla
+  no se guarda nunca.
+
+Las entradas viven STORY_RESULT_CACHE_TTL segundos en la caché `default`
+(compartida entre procesos con Redis). STORY_RESULT_CACHE = False la apaga, y
+cada usuario puede excluirse (UserSettings.reutilizar_cuentos): ni se le
+sirven cuentos guardados ni se guardan los suyos.
+"""
+import hashlib
+import json
+import logging
+import unicodedata
+
+from django.conf import settings
+from django.core.cache import caches
+
+from CUENTIA import metrics
+
+logger = logging.getLogger(__name__)
+
+# Subir al cambiar los prompts o el modelo: las entradas anteriores dejan de leerse
+VERSION = 1
+
+CAMPOS = ('titulo', 'personaje_principal', 'tema', 'edad', 'longitud')
+
+
+def _config(nombre, default):
+    return getattr(settings, nombre, default)
+
+
+def _cache():
+    return caches['default']
+
+
+def activa():
+    return _config('STORY_RESULT_CACHE', True)
+
+
+def determinista():
+    return _config('OPENAI_DETERMINISTIC', False)
+
+
+def _normalizar(valor):
+    texto = unicodedata.normalize('NFC', str(valor or ''))
+    return ' '.join(texto.split()).casefold()
+
+
+def huella(datos_formulario, idioma):
+    """sha256 de los datos normalizados, el idioma y la versión de los prompts"""
+    datos = {campo: _normalizar(datos_formulario.get(campo)) for campo in CAMPOS}
+    texto = json.dumps([VERSION, idioma, datos], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(texto.encode()).hexdigest()
+
+
+def semilla(datos_formulario, idioma):
+    """Seed de OpenAI para el modo determinista: la misma para los mismos datos"""
+    return int(huella(datos_formulario, idioma)[:8], 16)
+
+
+def admite(user):
+    """¿Se guardan y sirven cuentos por contenido para este usuario?"""
+    if not activa():
+        return False
+    if user is None or not getattr(user, 'is_authenticated', False):
+        return True
+    from user.models import UserSettings
+    preferencia = UserSettings.objects.filter(user=user).values_list('reutilizar_cuentos', flat=True).first()
+    return preferencia is not False
+
+
+def _clave(huella_datos):
+    return f"cuentia:cuento:{huella_datos}"
+
+
+def _leer(huella_datos):
+    try:
+        return _cache().get(_clave(huella_datos))
+    except Exception as e:
+        logger.warning(f"No se pudo leer el cuento {huella_datos[:12]} de la caché: {str(e)}")
+        return None
+
+
+def guardar(huella_datos, titulo, contenido, moraleja, tokens=0):
+    """Guarda un texto escrito por la IA junto con los tokens que costó"""
+    entrada = {'titulo': titulo, 'contenido': contenido, 'moraleja': moraleja, 'tokens': tokens}
+    try:
+        _cache().set(_clave(huella_datos), entrada, _config('STORY_RESULT_CACHE_TTL', 7 * 24 * 3600))
+    except Exception as e:
+        logger.warning(f"No se pudo guardar el cuento {huella_datos[:12]} en la caché: {str(e)}")
+
+
+def _texto(entrada):
+    return entrada['titulo'], entrada['contenido'], entrada['moraleja']
+
+
+def consultar(huella_datos):
+    """Modo determinista: (titulo, contenido, moraleja) si ya se escribió, contando el ahorro"""
+    entrada = _leer(huella_datos)
+    if entrada is None:
+        metrics.incrementar('cache.cuentos.fallos')
+        return None
+    metrics.incrementar('cache.cuentos.aciertos')
+    metrics.incrementar('openai.ahorro.llamadas')
+    metrics.incrementar('openai.ahorro.tokens', entrada.get('tokens') or 0)
+    logger.info(f"♻️ Cuento {huella_datos[:12]} servido desde la caché")
+    return _texto(entrada)
+
+
+def respaldo(huella_datos):
+    """Cuento ya escrito para usar en lugar de la plantilla cuando no hay IA, o None"""
+    entrada = _leer(huella_datos)
+    if entrada is None:
+        return None
+    metrics.incrementar('cuentos.respaldos_desde_cache')
+    logger.info(f"♻️ Respaldo del cuento {huella_datos[:12]} servido desde la caché")
+    return _texto(entrada)
+
+
+def ahorro():
+    """Llamadas, tokens y dólares estimados que no se gastaron en OpenAI gracias a la caché"""
+    tokens = metrics.valor('openai.ahorro.tokens')
+    return {
+        'llamadas': metrics.valor('openai.ahorro.llamadas'),
+        'tokens': tokens,
+        'usd': round(tokens / 1000 * _config('OPENAI_PRICE_PER_1K_TOKENS', 0.01), 4),
+        'respaldos': metrics.valor('cuentos.respaldos_desde_cache'),
+    }
+
+
+metrics.registrar_indicador('openai.ahorro', ahorro)
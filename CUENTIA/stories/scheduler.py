@@ -0,0 +1,463 @@
+"""Planificador de las llamadas a OpenAI.
+
+Todas las llamadas de OpenAIService piden turno aquí antes de salir:
+
+- Presupuestos globales con cubos de tokens: peticiones por minuto (RPM) y
+  tokens por minuto (TPM) para el texto, y una cuota aparte de imágenes por
+  minuto. Texto e imágenes son carriles independientes: una ilustración
+  esperando su cuota no frena ningún cuento.
+- Un máximo de llamadas en vuelo entre los dos carriles.
+- Dos clases de prioridad: INTERACTIVA (alguien mirando la pantalla de
+  "generando") pasa siempre antes que FONDO (ilustraciones, reintentos...).
+- Dentro de cada clase, cola justa ponderada por usuario (self-clocked fair
+  queuing): cada petición recibe la marca max(tiempo virtual, última marca del
+  usuario) + coste / peso y se atiende la menor. Una familia con veinte cuentos
+  en cola avanza a la par que las demás, no por delante.
+
+Si la cola está llena, o la espera supera el máximo de su clase, se lanza
+PlanificadorSaturado con los segundos recomendados para reintentar; los
+workers devuelven el trabajo a la cola sin gastar un intento y la vista de
+generación usa espera_estimada() para no admitir más de lo que cabe.
+
+Los presupuestos son de toda la aplicación: run_generation_workers da a cada
+proceso su fracción con usar_fraccion(). El reloj se inyecta para probarlo sin
+esperas reales (RelojFalso). El código async (AsyncOpenAIService) pide turno
+con turno_async(): espera en el bucle de eventos sin ocupar un hilo y se le
+despierta igual que a los hilos, al liberarse un hueco.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from django.conf import settings
+
+from CUENTIA import metrics
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVA = 'interactiva'
+FONDO = 'fondo'
+PRIORIDADES = (INTERACTIVA, FONDO)
+
+TEXTO = 'texto'
+IMAGEN = 'imagen'
+
+# Coste de una imagen en la cola justa, en "tokens" equivalentes
+COSTE_IMAGEN = 1000
+
+# Tokens que se reservan por cuento cuando no se conoce el prompt (prompt + max_tokens)
+TOKENS_CUENTO = 3500
+
+
+class PlanificadorSaturado(Exception):
+    """No hay presupuesto para atender la llamada a tiempo; reintentar más tarde"""
+
+    def __init__(self, retry_after, motivo='cola llena'):
+        super().__init__(f"OpenAI saturado ({motivo}), reintentar en {retry_after}s")
+        self.retry_after = retry_after
+        self.motivo = motivo
+
+
+class Reloj:
+    """Tiempo monotónico real"""
+
+    def ahora(self):
+        return time.monotonic()
+
+    def esperar(self, condicion, segundos):
+        condicion.wait(segundos)
+
+
+class RelojFalso(Reloj):
+    """Reloj de pruebas: esperar() avanza el tiempo en lugar de dormir"""
+
+    def __init__(self, inicio=0.0):
+        self.tiempo = inicio
+
+    def ahora(self):
+        return self.tiempo
+
+    def avanzar(self, segundos):
+        self.tiempo += segundos
+
+    def esperar(self, condicion, segundos):
+        self.avanzar(segundos)
+
+
+class CuboTokens:
+    """Cubo que se rellena a `por_minuto` unidades por minuto hasta `capacidad`.
+
+    Sin límite si `por_minuto` es 0 o None. Una petición mayor que el cubo
+    entra cuando está lleno y lo deja en negativo (deuda que se paga esperando).
+    """
+
+    def __init__(self, por_minuto, reloj, capacidad=None):
+        self.ilimitado = not por_minuto
+        self.ritmo = (por_minuto or 0) / 60
+        self.capacidad = capacidad if capacidad is not None else (por_minuto or 0)
+        self.disponible = self.capacidad
+        self.reloj = reloj
+        self.ultimo = reloj.ahora()
+
+    def _rellenar(self):
+        ahora = self.reloj.ahora()
+        self.disponible = min(self.capacidad, self.disponible + (ahora - self.ultimo) * self.ritmo)
+        self.ultimo = ahora
+
+    def espera(self, cantidad):
+        """Segundos hasta poder consumir `cantidad` (0 si ya se puede)"""
+        if self.ilimitado:
+            return 0
+        self._rellenar()
+        falta = min(cantidad, self.capacidad) - self.disponible
+        return falta / self.ritmo if falta > 0 else 0
+
+    def consumir(self, cantidad):
+        if not self.ilimitado:
+            self._rellenar()
+            self.disponible -= cantidad
+
+    def devolver(self, cantidad):
+        if not self.ilimitado:
+            self._rellenar()
+            self.disponible = min(self.capacidad, self.disponible + cantidad)
+
+
+class Turno:
+    """Una llamada esperando (o con) permiso para salir"""
+
+    def __init__(self, usuario_id, tipo, prioridad, tokens, llegada):
+        self.usuario_id = usuario_id
+        self.tipo = tipo
+        self.prioridad = prioridad
+        self.tokens = tokens
+        self.llegada = llegada
+        self.marca = 0.0
+        self.concedido = False
+        self.cancelado = False
+        self.espera = None
+        # Tokens reales según la respuesta; liberar() devuelve o cobra la diferencia
+        self.tokens_usados = None
+
+
+class _Carril:
+    """Colas por prioridad con cola justa por usuario dentro de cada una"""
+
+    def __init__(self, cubos):
+        self.cubos = cubos
+        self.colas = {prioridad: [] for prioridad in PRIORIDADES}
+        self.pendientes = {prioridad: 0 for prioridad in PRIORIDADES}
+        self.virtual = {prioridad: 0.0 for prioridad in PRIORIDADES}
+        self.ultima_marca = {prioridad: {} for prioridad in PRIORIDADES}
+
+    def encolar(self, turno, coste, peso, secuencia):
+        prioridad = turno.prioridad
+        inicio = max(self.virtual[prioridad], self.ultima_marca[prioridad].get(turno.usuario_id, 0.0))
+        turno.marca = inicio + coste / peso
+        self.ultima_marca[prioridad][turno.usuario_id] = turno.marca
+        heapq.heappush(self.colas[prioridad], (turno.marca, secuencia, turno))
+        self.pendientes[prioridad] += 1
+
+    def cabeza(self):
+        """Primer turno vivo de la clase más prioritaria con algo en cola"""
+        for prioridad in PRIORIDADES:
+            cola = self.colas[prioridad]
+            while cola and cola[0][2].cancelado:
+                heapq.heappop(cola)
+            if cola:
+                return cola[0][2]
+        return None
+
+    def sacar(self, turno):
+        prioridad = turno.prioridad
+        heapq.heappop(self.colas[prioridad])
+        self.pendientes[prioridad] -= 1
+        self.virtual[prioridad] = turno.marca
+        if not self.pendientes[prioridad]:
+            # Sin nadie esperando las marcas antiguas ya no importan
+            self.ultima_marca[prioridad].clear()
+
+    def cancelar(self, turno):
+        turno.cancelado = True
+        self.pendientes[turno.prioridad] -= 1
+
+    def necesidades(self, turno):
+        if turno.tipo == IMAGEN:
+            return [(self.cubos['imagenes'], 1)]
+        return [(self.cubos['peticiones'], 1), (self.cubos['tokens'], turno.tokens)]
+
+
+class Planificador:
+
+    def __init__(self, peticiones_por_minuto=None, tokens_por_minuto=None, imagenes_por_minuto=None,
+                 max_en_vuelo=8, max_cola=50, espera_maxima=None, pesos=None, reloj=None):
+        self.reloj = reloj or Reloj()
+        self.max_en_vuelo = max_en_vuelo
+        self.max_cola = max_cola
+        self.espera_maxima = {INTERACTIVA: 60, FONDO: 120, **(espera_maxima or {})}
+        # Peso por usuario (1 por defecto): más peso, más parte del presupuesto
+        self.pesos = pesos or {}
+        self.carriles = {
+            TEXTO: _Carril({
+                'peticiones': CuboTokens(peticiones_por_minuto, self.reloj),
+                'tokens': CuboTokens(tokens_por_minuto, self.reloj),
+            }),
+            IMAGEN: _Carril({'imagenes': CuboTokens(imagenes_por_minuto, self.reloj)}),
+        }
+        self._condicion = threading.Condition()
+        # (bucle, asyncio.Event) de las corrutinas esperando turno
+        self._esperas_async = set()
+        self._secuencia = itertools.count()
+        self.en_vuelo = 0
+        self.concedidas = 0
+        self.rechazadas = 0
+        self.espera_total = 0.0
+        self.espera_pico = 0.0
+
+    # ----- Interfaz sin bloqueo (la usan adquirir() y las pruebas) -----
+
+    def solicitar(self, usuario_id, tipo=TEXTO, tokens=0, prioridad=INTERACTIVA):
+        """Pone la llamada en cola; PlanificadorSaturado si la cola de su clase está llena"""
+        with self._condicion:
+            carril = self.carriles[tipo]
+            if carril.pendientes[prioridad] >= self.max_cola:
+                self._rechazar('cola llena')
+                raise PlanificadorSaturado(self._retry_after(carril), 'cola llena')
+            turno = Turno(usuario_id, tipo, prioridad, tokens, self.reloj.ahora())
+            coste = COSTE_IMAGEN if tipo == IMAGEN else max(tokens, 1)
+            carril.encolar(turno, coste, self.pesos.get(usuario_id, 1), next(self._secuencia))
+            metrics.incrementar(f'openai.solicitadas.{tipo}')
+            return turno
+
+    def repartir(self):
+        """Concede todos los turnos que caben ahora; devuelve los segundos hasta el próximo posible"""
+        with self._condicion:
+            proxima = None
+            concedido = True
+            while concedido and self.en_vuelo < self.max_en_vuelo:
+                concedido = False
+                for carril in self.carriles.values():
+                    if self.en_vuelo >= self.max_en_vuelo:
+                        break
+                    turno = carril.cabeza()
+                    if turno is None:
+                        continue
+                    espera = max(cubo.espera(cantidad) for cubo, cantidad in carril.necesidades(turno))
+                    if espera > 0:
+                        proxima = espera if proxima is None else min(proxima, espera)
+                        continue
+                    carril.sacar(turno)
+                    for cubo, cantidad in carril.necesidades(turno):
+                        cubo.consumir(cantidad)
+                    self._conceder(turno)
+                    concedido = True
+            if concedido:
+                self._notificar()
+            return proxima
+
+    def cancelar(self, turno):
+        with self._condicion:
+            if not turno.concedido and not turno.cancelado:
+                self.carriles[turno.tipo].cancelar(turno)
+
+    # ----- Interfaz bloqueante -----
+
+    def adquirir(self, usuario_id, tipo=TEXTO, tokens=0, prioridad=INTERACTIVA):
+        """Espera turno; PlanificadorSaturado si no llega dentro de la espera máxima de la clase"""
+        turno = self.solicitar(usuario_id, tipo, tokens, prioridad)
+        limite = turno.llegada + self.espera_maxima[prioridad]
+        with self._condicion:
+            while True:
+                proxima = self.repartir()
+                if turno.concedido:
+                    return turno
+                restante = limite - self.reloj.ahora()
+                if restante <= 0:
+                    self.carriles[tipo].cancelar(turno)
+                    self._rechazar('espera máxima')
+                    raise PlanificadorSaturado(math.ceil(proxima or 1), 'espera máxima')
+                # Despierta al liberarse un hueco o cuando el cubo tenga saldo
+                self.reloj.esperar(self._condicion, min(restante, proxima) if proxima else restante)
+
+    def liberar(self, turno):
+        with self._condicion:
+            self.en_vuelo -= 1
+            if turno.tipo == TEXTO and turno.tokens_usados is not None:
+                diferencia = turno.tokens - turno.tokens_usados
+                tokens = self.carriles[TEXTO].cubos['tokens']
+                if diferencia > 0:
+                    tokens.devolver(diferencia)
+                else:
+                    tokens.consumir(-diferencia)
+            self._notificar()
+
+    @contextmanager
+    def turno(self, usuario_id, tipo=TEXTO, tokens=0, prioridad=INTERACTIVA):
+        turno = self.adquirir(usuario_id, tipo, tokens, prioridad)
+        try:
+            yield turno
+        finally:
+            self.liberar(turno)
+
+    # ----- Interfaz async -----
+
+    async def adquirir_async(self, usuario_id, tipo=TEXTO, tokens=0, prioridad=INTERACTIVA):
+        """Como adquirir(), pero la espera cede el bucle de eventos en lugar de bloquear el hilo"""
+        turno = self.solicitar(usuario_id, tipo, tokens, prioridad)
+        limite = turno.llegada + self.espera_maxima[prioridad]
+        espera = (asyncio.get_running_loop(), asyncio.Event())
+        with self._condicion:
+            self._esperas_async.add(espera)
+        try:
+            while True:
+                proxima = self.repartir()
+                if turno.concedido:
+                    return turno
+                restante = limite - self.reloj.ahora()
+                if restante <= 0:
+                    self.cancelar(turno)
+                    with self._condicion:
+                        self._rechazar('espera máxima')
+                    raise PlanificadorSaturado(math.ceil(proxima or 1), 'espera máxima')
+                espera[1].clear()
+                try:
+                    await asyncio.wait_for(espera[1].wait(), min(restante, proxima) if proxima else restante)
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            # La tarea se canceló esperando: el turno no puede quedarse en la cola ni ocupando hueco
+            self.cancelar(turno)
+            if turno.concedido:
+                self.liberar(turno)
+            raise
+        finally:
+            with self._condicion:
+                self._esperas_async.discard(espera)
+
+    @asynccontextmanager
+    async def turno_async(self, usuario_id, tipo=TEXTO, tokens=0, prioridad=INTERACTIVA):
+        turno = await self.adquirir_async(usuario_id, tipo, tokens, prioridad)
+        try:
+            yield turno
+        finally:
+            self.liberar(turno)
+
+    def _notificar(self):
+        """Despierta a los hilos y a las corrutinas que esperan turno (con el candado tomado)"""
+        self._condicion.notify_all()
+        for bucle, evento in self._esperas_async:
+            if not bucle.is_closed():
+                bucle.call_soon_threadsafe(evento.set)
+
+    # ----- Observabilidad -----
+
+    def _conceder(self, turno):
+        turno.concedido = True
+        turno.espera = self.reloj.ahora() - turno.llegada
+        self.en_vuelo += 1
+        self.concedidas += 1
+        self.espera_total += turno.espera
+        self.espera_pico = max(self.espera_pico, turno.espera)
+        metrics.incrementar(f'openai.concedidas.{turno.tipo}')
+        metrics.incrementar('openai.espera_ms', round(turno.espera * 1000))
+
+    def _rechazar(self, motivo):
+        self.rechazadas += 1
+        metrics.incrementar('openai.rechazadas')
+        logger.warning(f"Llamada a OpenAI rechazada por el planificador: {motivo}")
+
+    def _retry_after(self, carril):
+        cabeza = carril.cabeza()
+        if cabeza is None:
+            return 1
+        espera = max(cubo.espera(cantidad) for cubo, cantidad in carril.necesidades(cabeza))
+        return max(1, math.ceil(espera))
+
+    def estado(self):
+        """Profundidad de las colas, esperas y rechazos (para logs y /metrics/)"""
+        with self._condicion:
+            return {
+                'en_vuelo': self.en_vuelo,
+                'en_cola': {
+                    tipo: dict(carril.pendientes) for tipo, carril in self.carriles.items()
+                },
+                'concedidas': self.concedidas,
+                'rechazadas': self.rechazadas,
+                'espera_media_ms': round(self.espera_total / self.concedidas * 1000) if self.concedidas else 0,
+                'espera_pico_ms': round(self.espera_pico * 1000),
+            }
+
+
+# ===== Planificador del proceso =====
+
+_bloqueo = threading.Lock()
+_planificador = None
+_fraccion = 1.0
+
+
+def _config(nombre, default):
+    return getattr(settings, nombre, default)
+
+
+def usar_fraccion(fraccion):
+    """Parte de los presupuestos globales que usa este proceso (1/N con N procesos worker)"""
+    global _fraccion, _planificador
+    with _bloqueo:
+        _fraccion = fraccion
+        _planificador = None
+
+
+def planificador():
+    global _planificador
+    with _bloqueo:
+        if _planificador is None:
+            def cuota(nombre, default):
+                valor = _config(nombre, default)
+                return max(1, int(valor * _fraccion)) if valor else None
+
+            _planificador = Planificador(
+                peticiones_por_minuto=cuota('OPENAI_REQUESTS_PER_MINUTE', 500),
+                tokens_por_minuto=cuota('OPENAI_TOKENS_PER_MINUTE', 30000),
+                imagenes_por_minuto=cuota('OPENAI_IMAGES_PER_MINUTE', 5),
+                max_en_vuelo=_config('OPENAI_MAX_IN_FLIGHT', 8),
+                max_cola=_config('OPENAI_MAX_QUEUE', 50),
+                espera_maxima={
+                    INTERACTIVA: _config('OPENAI_MAX_WAIT_INTERACTIVE', 60),
+                    FONDO: _config('OPENAI_MAX_WAIT_BACKGROUND', 120),
+                },
+            )
+        return _planificador
+
+
+def reiniciar():
+    """Descarta el planificador del proceso (pruebas y cambio de configuración)"""
+    global _planificador
+    with _bloqueo:
+        _planificador = None
+
+
+def estimar_tokens(parametros):
+    """Tokens que reserva una llamada de chat: prompt (~4 caracteres por token) + max_tokens"""
+    caracteres = sum(len(mensaje.get('content') or '') for mensaje in parametros.get('messages', []))
+    return caracteres // 4 + parametros.get('max_tokens', 0)
+
+
+def espera_estimada(cuentos_en_cola):
+    """Segundos hasta que un cuento nuevo tendría presupuesto de texto con `cuentos_en_cola` por delante.
+
+    Usa los presupuestos globales, no los del proceso: la vista no sabe en qué
+    worker acabará el trabajo.
+    """
+    tpm = _config('OPENAI_TOKENS_PER_MINUTE', 30000)
+    rpm = _config('OPENAI_REQUESTS_PER_MINUTE', 500)
+    por_tokens = cuentos_en_cola * TOKENS_CUENTO / tpm * 60 if tpm else 0
+    por_peticiones = cuentos_en_cola / rpm * 60 if rpm else 0
+    return max(por_tokens, por_peticiones)
+
+
+metrics.registrar_indicador('openai.planificador', lambda: planificador().estado())
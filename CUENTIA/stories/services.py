@@ -1,12 +1,40 @@
+import asyncio
 import logging
+import weakref
 from django.conf import settings
 from decouple import config
-from typing import Dict, Optional, Tuple
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
 import time
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
+
+from CUENTIA import conexiones
+from CUENTIA.asincronia import en_hilo
+from . import resilience, result_cache
+from .scheduler import FONDO, IMAGEN, INTERACTIVA, TEXTO, PlanificadorSaturado, estimar_tokens, planificador
 
 logger = logging.getLogger(__name__)
 
+PATRONES_TITULO = {
+    'es': ['TÍTULO:', 'TITULO:'],
+    'en': ['TITLE:', 'TÍTULO:', 'TITULO:'],
+    'de': ['TITEL:', 'TITLE:', 'TÍTULO:'],
+    'fr': ['TITRE:', 'TITLE:', 'TÍTULO:']
+}
+
+PATRONES_CUENTO = {
+    'es': ['CUENTO:', 'HISTORIA:'],
+    'en': ['STORY:', 'TALE:', 'CUENTO:'],
+    'de': ['GESCHICHTE:', 'MÄRCHEN:', 'STORY:'],
+    'fr': ['HISTOIRE:', 'CONTE:', 'STORY:']
+}
+
+PATRONES_MORALEJA = {
+    'es': ['MORALEJA:', 'ENSEÑANZA:', 'LECCIÓN:'],
+    'en': ['MORAL:', 'LESSON:', 'MORALEJA:'],
+    'de': ['MORAL:', 'LEHRE:', 'LEKTION:'],
+    'fr': ['MORALE:', 'LEÇON:', 'ENSEIGNEMENT:']
+}
+
 
 class OpenAIService:
     def __init__(self):
@@ -18,60 +46,109 @@ class OpenAIService:
             try:
                 if not self.api_key.startswith('sk-'):
                     logger.warning("OPENAI_API_KEY no tiene el formato correcto (debe comenzar con 'sk-')")
-                self.client = OpenAI(api_key=self.api_key)
+                self.client = self._crear_cliente()
                 logger.info("Cliente OpenAI inicializado correctamente")
             except Exception as e:
                 logger.error(f"Error inicializando cliente OpenAI: {str(e)}")
         else:
             logger.warning("OPENAI_API_KEY no configurada - usando modo fallback")
 
-    def generar_cuento_completo(self, datos_formulario: Dict, user=None) -> Tuple[str, str, str, str, str]:
+    def _crear_cliente(self):
+        # Los reintentos y timeouts los pone stories/resilience.py, no el SDK; las conexiones
+        # salen del pool compartido del proceso (CUENTIA/conexiones.py)
+        return OpenAI(api_key=self.api_key, max_retries=0, http_client=conexiones.cliente('openai'))
+
+    def generar_cuento_completo(self, datos_formulario: Dict, user=None,
+                                al_avanzar: Optional[Callable] = None) -> Tuple[str, str, str, str, str]:
+        """Texto e imagen en secuencia (la cola los genera como trabajos separados)"""
+        titulo, contenido, moraleja = self.generar_texto(datos_formulario, user=user, al_avanzar=al_avanzar)
+        try:
+            imagen_url, imagen_prompt = self.generar_imagen(titulo, contenido, datos_formulario.get('tema', ''),
+                                                            user=user)
+        except Exception as e:
+            logger.warning(f"Error generando imagen, usando placeholder: {str(e)}")
+            imagen_url = "/static/images/cuento-placeholder.png"
+            imagen_prompt = "Imagen placeholder para el cuento"
+        return titulo, contenido, moraleja, imagen_url, imagen_prompt
+
+    def generar_texto(self, datos_formulario: Dict, user=None,
+                      al_avanzar: Optional[Callable] = None, prioridad: str = INTERACTIVA) -> Tuple[str, str, str]:
+        """Primera fase: título, contenido y moraleja del cuento"""
+        idioma = self._obtener_idioma_usuario(user)
+        usuario_id = user.id if user else None
+        # Huella para la caché por contenido (stories/result_cache.py); None si el usuario se excluye
+        huella = result_cache.huella(datos_formulario, idioma) if result_cache.admite(user) else None
         try:
-            idioma = self._obtener_idioma_usuario(user)
             logger.info(f"🌍 Generando cuento en idioma: {idioma} para usuario: {user.username if user else 'Anónimo'}")
             logger.info(f"Iniciando generacion de cuento para: {datos_formulario.get('personaje_principal', 'N/A')}")
 
             if not self.client:
                 logger.info("Cliente OpenAI no disponible, usando fallback")
-                return self._generar_cuento_fallback(datos_formulario, idioma)
+                return self._texto_de_respaldo(datos_formulario, idioma, huella)
 
-            logger.info("Intentando generar texto del cuento con IA...")
-            try:
-                titulo, contenido, moraleja = self._generar_texto_cuento(datos_formulario, idioma)
-                logger.info("Texto del cuento generado con IA exitosamente")
-            except Exception as e:
-                logger.warning(f"Error con IA, usando fallback para texto: {str(e)}")
-                titulo, contenido, moraleja = self._generar_cuento_fallback(datos_formulario, idioma)[:3]
-
-            logger.info("Intentando generar imagen del cuento...")
-            try:
-                imagen_url, imagen_prompt = self._generar_imagen_cuento(titulo, contenido, datos_formulario['tema'],
-                                                                        idioma)
-                logger.info("Imagen generada exitosamente")
-            except Exception as e:
-                logger.warning(f"Error generando imagen, usando placeholder: {str(e)}")
-                imagen_url = "/static/images/cuento-placeholder.png"
-                imagen_prompt = "Imagen placeholder para el cuento"
-
-            logger.info(f"🎉 Cuento generado exitosamente en {idioma}: {titulo}")
-            return titulo, contenido, moraleja, imagen_url, imagen_prompt
+            guardado = self._texto_en_cache(huella)
+            if guardado:
+                return guardado
 
+            logger.info("Intentando generar texto del cuento con IA...")
+            if al_avanzar and getattr(settings, 'OPENAI_STREAMING', True):
+                titulo, contenido, moraleja = self._generar_texto_cuento_stream(
+                    datos_formulario, idioma, al_avanzar, usuario_id=usuario_id, prioridad=prioridad)
+            else:
+                titulo, contenido, moraleja = self._generar_texto_cuento(
+                    datos_formulario, idioma, usuario_id=usuario_id, prioridad=prioridad)
+            logger.info(f"🎉 Texto del cuento generado exitosamente en {idioma}: {titulo}")
+            self._guardar_en_cache(huella, datos_formulario, idioma, titulo, contenido, moraleja)
+            return titulo, contenido, moraleja
+
+        except PlanificadorSaturado:
+            # Sin presupuesto no se cae al cuento de respaldo: el trabajo vuelve a la cola
+            raise
         except Exception as e:
-            logger.error(f"Error generando cuento completo: {str(e)}")
-            idioma = self._obtener_idioma_usuario(user)
-            return self._generar_cuento_fallback(datos_formulario, idioma)
-
-    def _generar_texto_cuento(self, datos: Dict, idioma: str = 'es') -> Tuple[str, str, str]:
+            logger.warning(f"Error con IA, usando fallback para texto: {str(e)}")
+            return self._texto_de_respaldo(datos_formulario, idioma, huella)
+
+    def _texto_en_cache(self, huella: Optional[str]) -> Optional[Tuple[str, str, str]]:
+        """En modo determinista, el cuento ya escrito para estos datos (sin llamar a OpenAI)"""
+        if huella and result_cache.determinista():
+            return result_cache.consultar(huella)
+        return None
+
+    def _guardar_en_cache(self, huella: Optional[str], datos: Dict, idioma: str,
+                          titulo: str, contenido: str, moraleja: str):
+        if not huella:
+            return
+        prompt = self._obtener_system_prompt(idioma) + self._construir_prompt_cuento(datos, idioma)
+        # Tokens aproximados (~4 caracteres por token) que costaría volver a escribirlo
+        tokens = (len(prompt) + len(titulo) + len(contenido) + len(moraleja)) // 4
+        result_cache.guardar(huella, titulo, contenido, moraleja, tokens)
+
+    def _texto_de_respaldo(self, datos: Dict, idioma: str, huella: Optional[str] = None) -> Tuple[str, str, str]:
+        """Sin IA: un cuento ya escrito para estos datos si lo hay; si no, la plantilla"""
+        guardado = result_cache.respaldo(huella) if huella else None
+        return guardado or self._generar_cuento_fallback(datos, idioma)[:3]
+
+    def generar_imagen(self, titulo: str, contenido: str, tema: str, user=None,
+                       prioridad: str = FONDO) -> Tuple[str, str]:
+        """Segunda fase: ilustración del cuento; los errores se propagan para reintentar"""
         if not self.client:
-            raise Exception("Cliente OpenAI no disponible")
+            return "/static/images/cuento-placeholder.png", "Imagen placeholder para el cuento"
+
+        idioma = self._obtener_idioma_usuario(user)
+        logger.info("Intentando generar imagen del cuento...")
+        imagen_url, imagen_prompt = self._generar_imagen_cuento(
+            titulo, contenido, tema, idioma, usuario_id=user.id if user else None, prioridad=prioridad)
+        logger.info("Imagen generada exitosamente")
+        return imagen_url, imagen_prompt
 
+    def _parametros_texto(self, datos: Dict, idioma: str = 'es') -> Dict:
         prompt = self._construir_prompt_cuento(datos, idioma)
         logger.info(f"🔤 Enviando prompt a OpenAI en idioma: {idioma}")
         logger.info(f"📝 Longitud del prompt: {len(prompt)} caracteres")
 
-        response = self.client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
+        parametros = {
+            'model': "gpt-4o",
+            'messages': [
                 {
                     "role": "system",
                     "content": self._obtener_system_prompt(idioma)
@@ -81,32 +158,136 @@ class OpenAIService:
                     "content": prompt
                 }
             ],
-            max_tokens=2000,
-            temperature=0.8,
-            presence_penalty=0.2,
-            frequency_penalty=0.1
-        )
+            'max_tokens': 2000,
+            'temperature': 0.8,
+            'presence_penalty': 0.2,
+            'frequency_penalty': 0.1,
+        }
+        if result_cache.determinista():
+            # Los mismos datos dan el mismo cuento, así que puede servirse desde la caché
+            parametros.update(temperature=0, seed=result_cache.semilla(datos, idioma))
+        return parametros
+
+    def _generar_texto_cuento(self, datos: Dict, idioma: str = 'es', usuario_id=None,
+                              prioridad: str = INTERACTIVA) -> Tuple[str, str, str]:
+        if not self.client:
+            raise Exception("Cliente OpenAI no disponible")
+
+        parametros = self._parametros_texto(datos, idioma)
+        with planificador().turno(usuario_id, TEXTO, estimar_tokens(parametros), prioridad) as turno:
+            response = resilience.llamar(
+                'texto', lambda timeout: self.client.chat.completions.create(timeout=timeout, **parametros))
+            turno.tokens_usados = getattr(getattr(response, 'usage', None), 'total_tokens', None)
 
         contenido_completo = response.choices[0].message.content.strip()
         logger.info(f"📨 Respuesta recibida de OpenAI: {len(contenido_completo)} caracteres")
         titulo, contenido, moraleja = self._procesar_respuesta_cuento(contenido_completo, datos, idioma)
         return titulo, contenido, moraleja
 
-    def _generar_imagen_cuento(self, titulo: str, contenido: str, tema: str, idioma: str = 'es') -> Tuple[str, str]:
+    def _generar_texto_cuento_stream(self, datos: Dict, idioma: str = 'es',
+                                     al_avanzar: Optional[Callable] = None, usuario_id=None,
+                                     prioridad: str = INTERACTIVA) -> Tuple[str, str, str]:
+        """Igual que _generar_texto_cuento pero con stream=True, avisando cada párrafo terminado"""
+        if not self.client:
+            raise Exception("Cliente OpenAI no disponible")
+
+        parametros = self._parametros_texto(datos, idioma)
+        texto = ""
+        ultimo_avance = (None, 0)
+        # La llamada ocupa su hueco hasta que termina el stream
+        with planificador().turno(usuario_id, TEXTO, estimar_tokens(parametros), prioridad) as turno:
+            stream = resilience.llamar('texto', lambda timeout: self.client.chat.completions.create(
+                stream=True, stream_options={'include_usage': True}, timeout=timeout, **parametros))
+
+            for chunk in self._fragmentos(stream):
+                if getattr(chunk, 'usage', None):
+                    turno.tokens_usados = chunk.usage.total_tokens
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                texto += delta
+
+                # Solo se procesa cuando llega un salto de línea (párrafo o título completo)
+                if al_avanzar and '\n' in delta:
+                    titulo, parrafos = self._extraer_parcial(texto, idioma)
+                    if (titulo, len(parrafos)) != ultimo_avance:
+                        ultimo_avance = (titulo, len(parrafos))
+                        try:
+                            al_avanzar(titulo, parrafos)
+                        except Exception as e:
+                            logger.warning(f"Error guardando avance parcial: {str(e)}")
+
+        contenido_completo = texto.strip()
+        logger.info(f"📨 Respuesta en streaming completada: {len(contenido_completo)} caracteres")
+        return self._procesar_respuesta_cuento(contenido_completo, datos, idioma)
+
+    def _fragmentos(self, stream):
+        """Itera el stream; un corte a mitad cuenta como fallo para el circuito (no se reintenta)"""
+        try:
+            yield from stream
+        except Exception as e:
+            if resilience.es_fallo_del_servicio(e):
+                resilience.circuito().fallo()
+            raise
+
+    def _extraer_parcial(self, texto: str, idioma: str = 'es') -> Tuple[Optional[str], List[str]]:
+        """Título y párrafos ya terminados de una respuesta que todavía se está recibiendo"""
+        titulo = None
+        parrafos = []
+        seccion_actual = "contenido"
+        patrones_titulo = PATRONES_TITULO.get(idioma, PATRONES_TITULO['es'])
+        patrones_cuento = PATRONES_CUENTO.get(idioma, PATRONES_CUENTO['es'])
+        patrones_moraleja = PATRONES_MORALEJA.get(idioma, PATRONES_MORALEJA['es'])
+
+        # Ignorar la última línea si aún no terminó
+        for linea in texto[:texto.rfind('\n') + 1].split('\n'):
+            linea = linea.strip()
+            if not linea:
+                continue
+            mayusculas = linea.upper()
+
+            patron = next((p for p in patrones_titulo if mayusculas.startswith(p)), None)
+            if patron:
+                titulo = linea[len(patron):].strip() or None
+                seccion_actual = "titulo"
+                continue
+
+            patron = next((p for p in patrones_cuento if mayusculas.startswith(p)), None)
+            if patron:
+                seccion_actual = "contenido"
+                resto = linea[len(patron):].strip()
+                if resto:
+                    parrafos.append(resto)
+                continue
+
+            if any(mayusculas.startswith(p) for p in patrones_moraleja):
+                break
+
+            if seccion_actual == "contenido":
+                parrafos.append(linea)
+
+        return titulo, parrafos
+
+    def _generar_imagen_cuento(self, titulo: str, contenido: str, tema: str, idioma: str = 'es',
+                               usuario_id=None, prioridad: str = FONDO) -> Tuple[str, str]:
         if not self.client:
             raise Exception("Cliente OpenAI no disponible")
 
         prompt_imagen = self._construir_prompt_imagen(titulo, contenido, tema, idioma)
         logger.info("🎨 Generando imagen con DALL-E...")
 
-        response = self.client.images.generate(
-            model="dall-e-3",
-            prompt=prompt_imagen,
-            size="1024x1024",
-            quality="hd",
-            style="vivid",
-            n=1,
-        )
+        with planificador().turno(usuario_id, IMAGEN, prioridad=prioridad):
+            response = resilience.llamar('imagen', lambda timeout: self.client.images.generate(
+                model="dall-e-3",
+                prompt=prompt_imagen,
+                size="1024x1024",
+                quality="hd",
+                style="vivid",
+                n=1,
+                timeout=timeout,
+            ))
 
         imagen_url = response.data[0].url
         logger.info("✅ Imagen generada exitosamente")
@@ -394,26 +575,9 @@ The image should capture the wonder and magic of childhood stories, with beautif
         moraleja_default = moralejas_default.get(idioma, moralejas_default['es'])
 
         try:
-            patrones_titulo = {
-                'es': ['TÍTULO:', 'TITULO:'],
-                'en': ['TITLE:', 'TÍTULO:', 'TITULO:'],
-                'de': ['TITEL:', 'TITLE:', 'TÍTULO:'],
-                'fr': ['TITRE:', 'TITLE:', 'TÍTULO:']
-            }
-
-            patrones_cuento = {
-                'es': ['CUENTO:', 'HISTORIA:'],
-                'en': ['STORY:', 'TALE:', 'CUENTO:'],
-                'de': ['GESCHICHTE:', 'MÄRCHEN:', 'STORY:'],
-                'fr': ['HISTOIRE:', 'CONTE:', 'STORY:']
-            }
-
-            patrones_moraleja = {
-                'es': ['MORALEJA:', 'ENSEÑANZA:', 'LECCIÓN:'],
-                'en': ['MORAL:', 'LESSON:', 'MORALEJA:'],
-                'de': ['MORAL:', 'LEHRE:', 'LEKTION:'],
-                'fr': ['MORALE:', 'LEÇON:', 'ENSEIGNEMENT:']
-            }
+            patrones_titulo = PATRONES_TITULO
+            patrones_cuento = PATRONES_CUENTO
+            patrones_moraleja = PATRONES_MORALEJA
 
             lineas = respuesta.split('\n')
             titulo_extraido = titulo_default
@@ -769,5 +933,174 @@ Ensemble, {personaje} et son nouvel ami découvrirent qu'ils avaient beaucoup de
         return languages.get(language_code, 'Español')
 
 
+class ClientesAsync:
+    """Un AsyncOpenAI por bucle de eventos, igual que sus conexiones (CUENTIA/conexiones.py)"""
+
+    def __init__(self, api_key, **opciones):
+        self.api_key = api_key
+        self.opciones = opciones
+        self._por_bucle = weakref.WeakKeyDictionary()
+
+    def actual(self) -> AsyncOpenAI:
+        bucle = asyncio.get_running_loop()
+        cliente = self._por_bucle.get(bucle)
+        if cliente is None:
+            opciones = {'max_retries': 0, 'http_client': conexiones.cliente_async('openai'), **self.opciones}
+            cliente = self._por_bucle[bucle] = AsyncOpenAI(api_key=self.api_key, **opciones)
+        return cliente
+
+
+class AsyncOpenAIService(OpenAIService):
+    """OpenAIService sobre AsyncOpenAI para vistas ASGI y el worker async.
+
+    Mismos prompts, análisis de la respuesta, respaldo, planificador y
+    resiliencia, pero las llamadas públicas son corrutinas: la espera de turno
+    y de OpenAI no ocupa ningún hilo. Lo que toca la base de datos (idioma del
+    usuario) va al pool acotado de CUENTIA.asincronia.
+    """
+
+    def _crear_cliente(self):
+        return ClientesAsync(self.api_key)
+
+    async def generar_cuento_completo(self, datos_formulario: Dict, user=None,
+                                      al_avanzar: Optional[Callable[..., Awaitable]] = None
+                                      ) -> Tuple[str, str, str, str, str]:
+        titulo, contenido, moraleja = await self.generar_texto(datos_formulario, user=user, al_avanzar=al_avanzar)
+        try:
+            imagen_url, imagen_prompt = await self.generar_imagen(
+                titulo, contenido, datos_formulario.get('tema', ''), user=user)
+        except Exception as e:
+            logger.warning(f"Error generando imagen, usando placeholder: {str(e)}")
+            imagen_url = "/static/images/cuento-placeholder.png"
+            imagen_prompt = "Imagen placeholder para el cuento"
+        return titulo, contenido, moraleja, imagen_url, imagen_prompt
+
+    async def generar_texto(self, datos_formulario: Dict, user=None,
+                            al_avanzar: Optional[Callable[..., Awaitable]] = None,
+                            prioridad: str = INTERACTIVA) -> Tuple[str, str, str]:
+        """Como OpenAIService.generar_texto; `al_avanzar` es una corrutina"""
+        idioma = await en_hilo(self._obtener_idioma_usuario)(user)
+        usuario_id = user.id if user else None
+        admite = await en_hilo(result_cache.admite)(user)
+        huella = result_cache.huella(datos_formulario, idioma) if admite else None
+        try:
+            if not self.client:
+                logger.info("Cliente OpenAI no disponible, usando fallback")
+                return await en_hilo(self._texto_de_respaldo)(datos_formulario, idioma, huella)
+
+            guardado = await en_hilo(self._texto_en_cache)(huella)
+            if guardado:
+                return guardado
+
+            if al_avanzar and getattr(settings, 'OPENAI_STREAMING', True):
+                titulo, contenido, moraleja = await self._generar_texto_cuento_stream(
+                    datos_formulario, idioma, al_avanzar, usuario_id=usuario_id, prioridad=prioridad)
+            else:
+                titulo, contenido, moraleja = await self._generar_texto_cuento(
+                    datos_formulario, idioma, usuario_id=usuario_id, prioridad=prioridad)
+            logger.info(f"🎉 Texto del cuento generado exitosamente en {idioma}: {titulo}")
+            await en_hilo(self._guardar_en_cache)(huella, datos_formulario, idioma, titulo, contenido, moraleja)
+            return titulo, contenido, moraleja
+
+        except PlanificadorSaturado:
+            raise
+        except Exception as e:
+            logger.warning(f"Error con IA, usando fallback para texto: {str(e)}")
+            return await en_hilo(self._texto_de_respaldo)(datos_formulario, idioma, huella)
+
+    async def generar_imagen(self, titulo: str, contenido: str, tema: str, user=None,
+                             prioridad: str = FONDO) -> Tuple[str, str]:
+        if not self.client:
+            return "/static/images/cuento-placeholder.png", "Imagen placeholder para el cuento"
+
+        idioma = await en_hilo(self._obtener_idioma_usuario)(user)
+        return await self._generar_imagen_cuento(
+            titulo, contenido, tema, idioma, usuario_id=user.id if user else None, prioridad=prioridad)
+
+    async def _generar_texto_cuento(self, datos: Dict, idioma: str = 'es', usuario_id=None,
+                                    prioridad: str = INTERACTIVA) -> Tuple[str, str, str]:
+        if not self.client:
+            raise Exception("Cliente OpenAI no disponible")
+
+        cliente = self.client.actual()
+        parametros = self._parametros_texto(datos, idioma)
+        async with planificador().turno_async(usuario_id, TEXTO, estimar_tokens(parametros), prioridad) as turno:
+            response = await resilience.llamar_async(
+                'texto', lambda timeout: cliente.chat.completions.create(timeout=timeout, **parametros))
+            turno.tokens_usados = getattr(getattr(response, 'usage', None), 'total_tokens', None)
+
+        contenido_completo = response.choices[0].message.content.strip()
+        logger.info(f"📨 Respuesta recibida de OpenAI: {len(contenido_completo)} caracteres")
+        return self._procesar_respuesta_cuento(contenido_completo, datos, idioma)
+
+    async def _generar_texto_cuento_stream(self, datos: Dict, idioma: str = 'es',
+                                           al_avanzar: Optional[Callable[..., Awaitable]] = None,
+                                           usuario_id=None, prioridad: str = INTERACTIVA) -> Tuple[str, str, str]:
+        if not self.client:
+            raise Exception("Cliente OpenAI no disponible")
+
+        cliente = self.client.actual()
+        parametros = self._parametros_texto(datos, idioma)
+        texto = ""
+        ultimo_avance = (None, 0)
+        async with planificador().turno_async(usuario_id, TEXTO, estimar_tokens(parametros), prioridad) as turno:
+            stream = await resilience.llamar_async('texto', lambda timeout: cliente.chat.completions.create(
+                stream=True, stream_options={'include_usage': True}, timeout=timeout, **parametros))
+
+            async for chunk in self._fragmentos_async(stream):
+                if getattr(chunk, 'usage', None):
+                    turno.tokens_usados = chunk.usage.total_tokens
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                texto += delta
+
+                if al_avanzar and '\n' in delta:
+                    titulo, parrafos = self._extraer_parcial(texto, idioma)
+                    if (titulo, len(parrafos)) != ultimo_avance:
+                        ultimo_avance = (titulo, len(parrafos))
+                        try:
+                            await al_avanzar(titulo, parrafos)
+                        except Exception as e:
+                            logger.warning(f"Error guardando avance parcial: {str(e)}")
+
+        contenido_completo = texto.strip()
+        logger.info(f"📨 Respuesta en streaming completada: {len(contenido_completo)} caracteres")
+        return self._procesar_respuesta_cuento(contenido_completo, datos, idioma)
+
+    async def _fragmentos_async(self, stream):
+        try:
+            async for chunk in stream:
+                yield chunk
+        except Exception as e:
+            if resilience.es_fallo_del_servicio(e):
+                resilience.circuito().fallo()
+            raise
+
+    async def _generar_imagen_cuento(self, titulo: str, contenido: str, tema: str, idioma: str = 'es',
+                                     usuario_id=None, prioridad: str = FONDO) -> Tuple[str, str]:
+        if not self.client:
+            raise Exception("Cliente OpenAI no disponible")
+
+        cliente = self.client.actual()
+        prompt_imagen = self._construir_prompt_imagen(titulo, contenido, tema, idioma)
+        async with planificador().turno_async(usuario_id, IMAGEN, prioridad=prioridad):
+            response = await resilience.llamar_async('imagen', lambda timeout: cliente.images.generate(
+                model="dall-e-3",
+                prompt=prompt_imagen,
+                size="1024x1024",
+                quality="hd",
+                style="vivid",
+                n=1,
+                timeout=timeout,
+            ))
+
+        logger.info("✅ Imagen generada exitosamente")
+        return response.data[0].url, prompt_imagen
+
+
 # Instancia global del servicio
 openai_service = OpenAIService()
+async_openai_service = AsyncOpenAIService()
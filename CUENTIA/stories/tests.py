@@ -1,3 +1,1271 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from openai import OpenAI
+from PIL import Image as PILImage
+
+from CUENTIA import conexiones, metrics
+from CUENTIA.asincronia import en_hilo
+from . import checks, images, jobs, notifications, pdf_cache, rendering, resilience, result_cache, scheduler, views
+from .models import Cuento, EstadisticaLectura, TrabajoGeneracion
+from .resilience import CircuitoAbierto
+from .scheduler import FONDO, IMAGEN, INTERACTIVA, Planificador, PlanificadorSaturado, RelojFalso
+from .services import AsyncOpenAIService, ClientesAsync, OpenAIService
+from user.models import UserSettings
+
+
+class PlanificadorTests(SimpleTestCase):
+    """Cubos de tokens, prioridades y cola justa con un reloj falso"""
+
+    def setUp(self):
+        metrics.reiniciar()
+        self.reloj = RelojFalso()
+
+    def _planificador(self, **opciones):
+        return Planificador(reloj=self.reloj, **{'max_en_vuelo': 100, **opciones})
+
+    def _conceder_todo(self, planificador, turnos):
+        """Orden en que se conceden los turnos liberando cada uno en cuanto sale"""
+        orden = []
+        while len(orden) < len(turnos):
+            planificador.repartir()
+            for turno in turnos:
+                if turno.concedido and turno not in orden:
+                    orden.append(turno)
+                    planificador.liberar(turno)
+        return orden
+
+    def test_presupuesto_de_peticiones_y_tokens(self):
+        planificador = self._planificador(peticiones_por_minuto=2, tokens_por_minuto=10000)
+        turnos = [planificador.solicitar(1, tokens=100) for _ in range(3)]
+        planificador.repartir()
+        self.assertEqual([t.concedido for t in turnos], [True, True, False])
+
+        # Una petición cada 30 segundos con 2 por minuto
+        self.reloj.avanzar(29)
+        planificador.repartir()
+        self.assertFalse(turnos[2].concedido)
+        self.reloj.avanzar(1)
+        planificador.repartir()
+        self.assertTrue(turnos[2].concedido)
+        self.assertEqual(turnos[2].espera, 30)
+
+        # Un cuento grande espera a que haya tokens aunque sobren peticiones
+        planificador = self._planificador(tokens_por_minuto=6000)
+        grandes = [planificador.solicitar(1, tokens=4000) for _ in range(2)]
+        self.assertEqual(planificador.repartir(), 20)
+        self.assertEqual([t.concedido for t in grandes], [True, False])
+
+    def test_tokens_reales_se_devuelven_al_cubo(self):
+        planificador = self._planificador(tokens_por_minuto=6000)
+        primero = planificador.adquirir(1, tokens=4000)
+        primero.tokens_usados = 1500
+        planificador.liberar(primero)
+        planificador.adquirir(1, tokens=4000)
+        self.assertEqual(self.reloj.ahora(), 0)
+
+    def test_cola_justa_entre_usuarios(self):
+        planificador = self._planificador(max_en_vuelo=1)
+        # Una familia pide diez cuentos de golpe y otras dos piden uno cada una después
+        intensiva = [planificador.solicitar('intensiva', tokens=3000) for _ in range(10)]
+        otras = [planificador.solicitar(usuario, tokens=3000) for usuario in ('ana', 'leo')]
+        orden = self._conceder_todo(planificador, intensiva + otras)
+
+        posiciones = sorted(orden.index(turno) for turno in otras)
+        self.assertLessEqual(posiciones[-1], 3)
+
+        # Con peso 2 un usuario recibe el doble de turnos que uno de peso 1
+        planificador = self._planificador(max_en_vuelo=1, pesos={'doble': 2})
+        turnos = [planificador.solicitar(usuario, tokens=1000) for _ in range(6) for usuario in ('doble', 'simple')]
+        primeros = self._conceder_todo(planificador, turnos)[:6]
+        self.assertEqual(sum(turno.usuario_id == 'doble' for turno in primeros), 4)
+
+    def test_interactiva_antes_que_fondo(self):
+        planificador = self._planificador(max_en_vuelo=1)
+        fondo = [planificador.solicitar(1, tokens=100, prioridad=FONDO) for _ in range(3)]
+        planificador.repartir()
+        interactiva = planificador.solicitar(2, tokens=100, prioridad=INTERACTIVA)
+        orden = self._conceder_todo(planificador, fondo + [interactiva])
+        # El primero de fondo ya había salido; el interactivo adelanta al resto
+        self.assertEqual(orden, [fondo[0], interactiva, fondo[1], fondo[2]])
+
+    def test_imagenes_tienen_su_propia_cuota(self):
+        planificador = self._planificador(peticiones_por_minuto=100, imagenes_por_minuto=1)
+        imagenes = [planificador.solicitar(1, tipo=IMAGEN) for _ in range(2)]
+        texto = planificador.solicitar(2, tokens=100)
+        self.assertEqual(planificador.repartir(), 60)
+        self.assertEqual([imagenes[0].concedido, imagenes[1].concedido, texto.concedido], [True, False, True])
+
+    def test_rechazos_por_cola_llena_y_espera_maxima(self):
+        planificador = self._planificador(peticiones_por_minuto=1, max_cola=2, espera_maxima={INTERACTIVA: 90})
+        planificador.adquirir(1)
+        espera = planificador.solicitar(1)
+        planificador.solicitar(1)
+        with self.assertRaises(PlanificadorSaturado) as contexto:
+            planificador.solicitar(2)
+        self.assertEqual(contexto.exception.motivo, 'cola llena')
+
+        # Con una por minuto y otra suya delante no llega a tiempo; esperar() avanza el reloj falso
+        planificador.cancelar(espera)
+        with self.assertRaises(PlanificadorSaturado) as contexto:
+            planificador.adquirir(1)
+        self.assertEqual(contexto.exception.motivo, 'espera máxima')
+        self.assertEqual(self.reloj.ahora(), 90)
+
+        estado = planificador.estado()
+        self.assertEqual(estado['rechazadas'], 2)
+        self.assertEqual(estado['en_cola']['texto'][INTERACTIVA], 0)
+        self.assertEqual(estado['en_vuelo'], 2)
+        self.assertEqual(metrics.valor('openai.rechazadas'), 2)
+
+
+@override_settings(GENERATION_MAX_PENDING_PER_USER=2, OPENAI_TOKENS_PER_MINUTE=35000)
+class ContrapresionGeneracionTests(TestCase):
+    """La vista de generación y los workers respetan el planificador"""
+
+    def setUp(self):
+        scheduler.reiniciar()
+        self.usuario = User.objects.create_user('familia', password='clave-segura-123')
+        self.client.login(username='familia', password='clave-segura-123')
+        self.formulario = {'personaje': 'Luna', 'tema': 'aventura', 'edad': '4-6', 'longitud': 'corto'}
+
+    def _encolar(self, usuario, cantidad):
+        for _ in range(cantidad):
+            cuento = Cuento.objects.create(usuario=usuario, titulo='Cuento', personaje_principal='Luna',
+                                           tema='aventura', edad='4-6', longitud='corto', estado='generando')
+            jobs.encolar_generacion(cuento, {})
+
+    def test_una_familia_no_acapara_la_cola(self):
+        self._encolar(self.usuario, 2)
+        response = self.client.post(reverse('stories:generar'), self.formulario)
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Ya tienes varios cuentos generándose', str(list(response.context['messages'])[0]))
+        self.assertEqual(Cuento.objects.filter(usuario=self.usuario).count(), 2)
+
+        # Otra familia sí entra mientras el presupuesto alcance
+        User.objects.create_user('otra', password='clave-segura-123')
+        self.client.login(username='otra', password='clave-segura-123')
+        response = self.client.post(reverse('stories:generar'), self.formulario)
+        self.assertRedirects(response, reverse('stories:generando'), fetch_redirect_response=False)
+
+    def test_sin_presupuesto_se_rechaza_con_retry_after(self):
+        # 35000 tokens/minuto son 10 cuentos por minuto: con 12 delante la espera pasa de 60 s
+        for indice in range(6):
+            self._encolar(User.objects.create_user(f'familia{indice}'), 2)
+        response = self.client.post(reverse('stories:generar'), self.formulario)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '72')
+
+    def test_worker_aplaza_sin_gastar_intento(self):
+        self._encolar(self.usuario, 2)
+        for error in (PlanificadorSaturado(30, 'espera máxima'), CircuitoAbierto(20)):
+            trabajo = jobs.reclamar_trabajo('worker-prueba')
+            servicio = SimpleNamespace(generar_texto=mock.Mock(side_effect=error))
+
+            self.assertFalse(jobs.procesar_trabajo(trabajo, servicio=servicio))
+            trabajo = TrabajoGeneracion.objects.get(id=trabajo.id)
+            self.assertEqual((trabajo.estado, trabajo.intentos), ('pendiente', 0))
+            self.assertEqual(Cuento.objects.get(id=trabajo.cuento_id).estado, 'generando')
+
+
+
+def _cuento_generando(usuario, **campos):
+    return Cuento.objects.create(usuario=usuario, titulo='Cuento', personaje_principal='Luna', tema='aventura',
+                                 edad='4-6', longitud='corto', estado='generando', **campos)
+
+
+def _robar(trabajo_id, worker='otro-worker'):
+    """Simula que el lease venció y otro worker reclamó el trabajo"""
+    TrabajoGeneracion.objects.filter(id=trabajo_id).update(lease_hasta=timezone.now() - timedelta(seconds=1))
+    return jobs.reclamar_trabajo(worker)
+
+
+@override_settings(GENERATION_HEARTBEAT_SECONDS=0.05)
+class LatidoTrabajosTests(TransactionTestCase):
+    """El worker renueva el lease mientras procesa y abandona el trabajo si otro lo reclama"""
+
+    def setUp(self):
+        self.usuario = User.objects.create_user('familia')
+        self.cuento = _cuento_generando(self.usuario)
+        jobs.encolar_generacion(self.cuento, {})
+
+    @override_settings(GENERATION_LEASE_SECONDS=0.5)
+    def test_el_latido_mantiene_el_lease_en_llamadas_largas(self):
+        trabajo = jobs.reclamar_trabajo('worker-1')
+        reclamos = []
+
+        def generar_texto(*args, **kwargs):
+            # La llamada dura el doble que el lease: sin latido otro worker se la llevaría
+            for _ in range(10):
+                time.sleep(0.1)
+                reclamos.append(jobs.reclamar_trabajo('worker-2'))
+            return 'El faro', 'Había una vez un faro.', 'Brillar ayuda.'
+
+        self.assertTrue(jobs.procesar_trabajo(trabajo, servicio=SimpleNamespace(generar_texto=generar_texto)))
+        self.assertEqual(reclamos, [None] * 10)
+        self.assertEqual(Cuento.objects.get(id=self.cuento.id).titulo, 'El faro')
+
+    def test_lease_vencido_a_mitad_del_trabajo(self):
+        trabajo = jobs.reclamar_trabajo('worker-1')
+
+        def generar_texto(*args, al_avanzar=None, **kwargs):
+            _robar(trabajo.id)
+            time.sleep(0.2)  # el latido descubre que ya no es suyo
+            al_avanzar('Título parcial', ['Párrafo de un worker que ya no es dueño.'])
+            return 'Otro título', 'Contenido que no debe guardarse.', 'Moraleja'
+
+        self.assertFalse(jobs.procesar_trabajo(trabajo, servicio=SimpleNamespace(generar_texto=generar_texto)))
+        cuento = Cuento.objects.get(id=self.cuento.id)
+        self.assertEqual((cuento.estado, cuento.titulo, cuento.contenido), ('generando', 'Cuento', ''))
+        trabajo = TrabajoGeneracion.objects.get(id=trabajo.id)
+        self.assertEqual((trabajo.estado, trabajo.worker, trabajo.intentos), ('en_proceso', 'otro-worker', 2))
+        self.assertFalse(TrabajoGeneracion.objects.filter(tipo='imagen').exists())
+
+
+@override_settings(ASYNC_DB_THREADS=0, GENERATION_HEARTBEAT_SECONDS=3600)
+class DuenoDelTrabajoTests(TestCase):
+    """Un worker que perdió el trabajo no escribe en el cuento"""
+
+    def setUp(self):
+        notifications.reiniciar()
+        self.usuario = User.objects.create_user('familia')
+        self.cuento = _cuento_generando(self.usuario)
+
+    def test_texto_no_sobrescribe_si_otro_worker_lo_reclamo(self):
+        jobs.encolar_generacion(self.cuento, {})
+        trabajo = jobs.reclamar_trabajo('worker-1')
+
+        def generar_texto(*args, **kwargs):
+            _robar(trabajo.id)
+            return 'El faro', 'Había una vez un faro.', 'Brillar ayuda.'
+
+        self.assertFalse(jobs.procesar_trabajo(trabajo, servicio=SimpleNamespace(generar_texto=generar_texto)))
+        self.assertEqual(Cuento.objects.get(id=self.cuento.id).estado, 'generando')
+        self.assertFalse(TrabajoGeneracion.objects.filter(tipo='imagen').exists())
+        self.assertIsNone(notifications.estado_actual(self.cuento.id))
+
+    def test_imagen_no_se_ingiere_si_otro_worker_lo_reclamo(self):
+        Cuento.objects.filter(id=self.cuento.id).update(estado='completado', imagen_estado='pendiente')
+        jobs.encolar_imagen(self.cuento)
+        trabajo = jobs.reclamar_trabajo('worker-1')
+
+        def generar_imagen(*args, **kwargs):
+            _robar(trabajo.id)
+            return 'https://ejemplo.invalid/imagen.png', 'prompt'
+
+        with mock.patch.object(jobs.images, 'ingerir_imagen') as ingerir:
+            self.assertFalse(jobs.procesar_trabajo(trabajo, servicio=SimpleNamespace(generar_imagen=generar_imagen)))
+        ingerir.assert_not_called()
+        cuento = Cuento.objects.get(id=self.cuento.id)
+        self.assertEqual((cuento.imagen_estado, cuento.imagen_url), ('pendiente', None))
+
+    @override_settings(GENERATION_HEARTBEAT_SECONDS=0.05)
+    async def test_worker_async_cancela_al_perder_el_lease(self):
+        await en_hilo(jobs.encolar_generacion)(self.cuento, {})
+        trabajo = await en_hilo(jobs.reclamar_trabajo)('worker-1')
+        servicio = _ServicioAsyncLento(5)
+        await en_hilo(_robar)(trabajo.id)
+
+        inicio = time.monotonic()
+        self.assertFalse(await jobs.procesar_trabajo_async(trabajo, servicio=servicio))
+        self.assertLess(time.monotonic() - inicio, 1)
+        self.assertEqual((await Cuento.objects.aget(id=self.cuento.id)).estado, 'generando')
+
+
+@override_settings(GENERATION_HEARTBEAT_SECONDS=3600, GENERATION_RETRY_DELAY=5)
+class ColaTrabajosTests(TestCase):
+    """Reclamo con compare-and-swap, leases vencidos, intentos agotados y cuentos huérfanos"""
+
+    def setUp(self):
+        notifications.reiniciar()
+        self.usuario = User.objects.create_user('familia')
+        self.cuento = _cuento_generando(self.usuario)
+
+    def test_un_trabajo_solo_lo_reclama_un_worker(self):
+        jobs.encolar_generacion(self.cuento, {})
+        trabajo = jobs.reclamar_trabajo('worker-1')
+
+        self.assertEqual((trabajo.estado, trabajo.worker, trabajo.intentos), ('en_proceso', 'worker-1', 1))
+        self.assertGreater(trabajo.lease_hasta, timezone.now())
+        self.assertIsNone(jobs.reclamar_trabajo('worker-2'))
+
+    def test_el_update_condicional_pierde_si_otro_gano_antes(self):
+        jobs.encolar_generacion(self.cuento, {})
+        filtrar = TrabajoGeneracion.objects.filter
+
+        def filtrar_y_adelantarse(*args, **kwargs):
+            # Entre la lista de candidatos y el UPDATE, otro worker se queda el trabajo
+            if 'id' in kwargs:
+                filtrar(id=kwargs['id']).update(estado='en_proceso', worker='worker-2', intentos=1,
+                                                lease_hasta=timezone.now() + timedelta(minutes=5))
+            return filtrar(*args, **kwargs)
+
+        with mock.patch.object(TrabajoGeneracion.objects, 'filter', side_effect=filtrar_y_adelantarse):
+            self.assertIsNone(jobs.reclamar_trabajo('worker-1'))
+        trabajo = TrabajoGeneracion.objects.get()
+        self.assertEqual((trabajo.worker, trabajo.intentos), ('worker-2', 1))
+
+    def test_lease_vencido_se_puede_reclamar(self):
+        trabajo = jobs.encolar_generacion(self.cuento, {})
+        jobs.reclamar_trabajo('worker-1')
+        self.assertIsNone(jobs.reclamar_trabajo('worker-2'))
+
+        reclamado = _robar(trabajo.id, 'worker-2')
+        self.assertEqual((reclamado.id, reclamado.worker, reclamado.intentos), (trabajo.id, 'worker-2', 2))
+        self.assertFalse(jobs.renovar_lease(SimpleNamespace(id=trabajo.id, worker='worker-1')))
+        self.assertTrue(jobs.renovar_lease(reclamado))
+
+    def test_trabajo_aplazado_espera_su_turno(self):
+        trabajo = jobs.encolar_generacion(self.cuento, {})
+        reclamado = jobs.reclamar_trabajo('worker-1')
+
+        def generar_texto(*args, **kwargs):
+            raise RuntimeError('OpenAI respondió 500')
+
+        self.assertFalse(jobs.procesar_trabajo(reclamado, servicio=SimpleNamespace(generar_texto=generar_texto)))
+        trabajo.refresh_from_db()
+        self.assertEqual((trabajo.estado, trabajo.ultimo_error), ('pendiente', 'OpenAI respondió 500'))
+        self.assertGreater(trabajo.disponible_desde, timezone.now())
+        self.assertIsNone(jobs.reclamar_trabajo('worker-1'))
+
+        TrabajoGeneracion.objects.filter(id=trabajo.id).update(disponible_desde=timezone.now())
+        self.assertEqual(jobs.reclamar_trabajo('worker-1').intentos, 2)
+
+    def test_marcar_agotados(self):
+        trabajo = jobs.encolar_generacion(self.cuento, {})
+        TrabajoGeneracion.objects.filter(id=trabajo.id).update(
+            estado='en_proceso', intentos=3, lease_hasta=timezone.now() - timedelta(seconds=1))
+        ilustrado = _cuento_generando(self.usuario)
+        Cuento.objects.filter(id=ilustrado.id).update(estado='completado', imagen_estado='pendiente')
+        imagen = jobs.encolar_imagen(ilustrado)
+        TrabajoGeneracion.objects.filter(id=imagen.id).update(intentos=3)
+        # Con lease vigente todavía puede terminar
+        vigente = jobs.encolar_generacion(_cuento_generando(self.usuario), {})
+        TrabajoGeneracion.objects.filter(id=vigente.id).update(
+            estado='en_proceso', intentos=3, lease_hasta=timezone.now() + timedelta(minutes=5))
+
+        self.assertIsNone(jobs.reclamar_trabajo('worker-1'))
+        self.assertEqual(jobs.marcar_agotados(), 2)
+
+        self.assertEqual(TrabajoGeneracion.objects.get(id=trabajo.id).estado, 'fallido')
+        self.assertEqual(Cuento.objects.get(id=self.cuento.id).estado, 'error')
+        self.assertEqual(notifications.estado_actual(self.cuento.id)['estado'], 'error')
+        # Sin imagen el cuento sigue siendo legible
+        ilustrado.refresh_from_db()
+        self.assertEqual((ilustrado.estado, ilustrado.imagen_estado), ('completado', 'error'))
+        self.assertEqual(TrabajoGeneracion.objects.get(id=vigente.id).estado, 'en_proceso')
+        self.assertEqual(jobs.marcar_agotados(), 0)
+
+    def test_encolar_huerfanos(self):
+        con_trabajo = _cuento_generando(self.usuario)
+        jobs.encolar_generacion(con_trabajo, {})
+        sin_imagen = _cuento_generando(self.usuario)
+        Cuento.objects.filter(id=sin_imagen.id).update(estado='completado', imagen_estado='pendiente')
+
+        self.assertEqual(jobs.encolar_huerfanos(), 2)
+        texto = TrabajoGeneracion.objects.get(cuento=self.cuento)
+        self.assertEqual((texto.tipo, texto.datos_formulario['personaje_principal']), ('texto', 'Luna'))
+        self.assertEqual(TrabajoGeneracion.objects.get(cuento=sin_imagen).tipo, 'imagen')
+        self.assertEqual(TrabajoGeneracion.objects.filter(cuento=con_trabajo).count(), 1)
+        self.assertEqual(jobs.encolar_huerfanos(), 0)
+
+
+@override_settings(GENERATION_HEARTBEAT_SECONDS=3600, GENERATION_RETRY_DELAY=0)
+class FasesTextoImagenTests(TestCase):
+    """El texto se entrega en cuanto está escrito; la ilustración es un trabajo aparte"""
+
+    def setUp(self):
+        notifications.reiniciar()
+        self.usuario = User.objects.create_user('familia')
+        self.cuento = _cuento_generando(self.usuario)
+        self.generar_imagen = mock.Mock(return_value=('https://ejemplo.invalid/imagen.png', 'prompt'))
+        self.servicio = SimpleNamespace(
+            generar_texto=lambda *args, **kwargs: ('El faro', 'Había una vez un faro.\n\nFin.', 'Brillar ayuda.'),
+            generar_imagen=self.generar_imagen,
+        )
+
+    def _procesar_siguiente(self):
+        return jobs.procesar_trabajo(jobs.reclamar_trabajo('worker-1'), servicio=self.servicio)
+
+    def test_el_cuento_se_lee_antes_de_tener_imagen(self):
+        jobs.encolar_generacion(self.cuento, {})
+        with mock.patch.object(jobs.images, 'ingerir_imagen') as ingerir:
+            self.assertTrue(self._procesar_siguiente())
+
+            cuento = Cuento.objects.get(id=self.cuento.id)
+            self.assertEqual((cuento.estado, cuento.imagen_estado, cuento.titulo),
+                             ('completado', 'pendiente', 'El faro'))
+            self.generar_imagen.assert_not_called()
+            estado = notifications.estado_actual(self.cuento.id)
+            self.assertEqual(estado['parrafos'], ['Había una vez un faro.', 'Fin.'])
+            self.assertFalse(notifications.es_definitivo(estado))
+            imagen = TrabajoGeneracion.objects.get(tipo='imagen')
+            self.assertEqual((imagen.cuento_id, imagen.estado), (self.cuento.id, 'pendiente'))
+
+            self.assertTrue(self._procesar_siguiente())
+        ingerir.assert_called_once()
+        cuento.refresh_from_db()
+        self.assertEqual((cuento.imagen_estado, cuento.imagen_url), ('lista', 'https://ejemplo.invalid/imagen.png'))
+        self.assertTrue(notifications.es_definitivo(notifications.estado_actual(self.cuento.id)))
+        self.assertEqual(set(TrabajoGeneracion.objects.values_list('estado', flat=True)), {'completado'})
+
+    def test_reintento_de_imagen_reutiliza_la_ya_generada(self):
+        Cuento.objects.filter(id=self.cuento.id).update(estado='completado', imagen_estado='pendiente')
+        trabajo = jobs.encolar_imagen(self.cuento)
+
+        with mock.patch.object(jobs.images, 'ingerir_imagen', side_effect=[jobs.images.ErrorImagen('caducada'), True]):
+            self.assertFalse(self._procesar_siguiente())
+            trabajo.refresh_from_db()
+            self.assertEqual((trabajo.estado, trabajo.ultimo_error), ('pendiente', 'caducada'))
+            self.assertEqual(Cuento.objects.get(id=self.cuento.id).imagen_estado, 'pendiente')
+
+            self.assertTrue(self._procesar_siguiente())
+        # La descarga falló pero la imagen ya existía: no se paga otra a OpenAI
+        self.generar_imagen.assert_called_once()
+        self.assertEqual(Cuento.objects.get(id=self.cuento.id).imagen_estado, 'lista')
+
+
+def _png(ancho, alto):
+    salida = BytesIO()
+    PILImage.new('RGBA', (ancho, alto), (200, 120, 40, 255)).save(salida, format='PNG')
+    return salida.getvalue()
+
+
+class IngestaImagenesTests(TestCase):
+    """La ilustración se descarga una vez y se guarda con sus variantes"""
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        ajustes = self.settings(MEDIA_ROOT=media)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.cuento = _cuento_generando(User.objects.create_user('familia'),
+                                        imagen_url='https://ejemplo.invalid/imagen.png')
+
+    def test_guarda_el_original_y_las_variantes(self):
+        with mock.patch.object(images, 'descargar_imagen', return_value=_png(2000, 1000)) as descargar:
+            self.assertTrue(images.ingerir_imagen(self.cuento))
+        descargar.assert_called_once_with('https://ejemplo.invalid/imagen.png')
+
+        cuento = Cuento.objects.get(id=self.cuento.id)
+        self.assertTrue(cuento.imagen_archivo.name.endswith('-original.png'))
+        for campo, formato, tamano in (('imagen_miniatura', 'WEBP', (400, 200)),
+                                       ('imagen_lectura', 'WEBP', (768, 384)),
+                                       ('imagen_impresion', 'JPEG', (1500, 750))):
+            with getattr(cuento, campo).open('rb') as archivo, PILImage.open(archivo) as imagen:
+                self.assertEqual((imagen.format, imagen.size), (formato, tamano))
+        # Las páginas ya no apuntan a la URL de OpenAI, que caduca
+        self.assertEqual(cuento.url_imagen_lectura, cuento.imagen_lectura.url)
+        self.assertEqual(cuento.url_miniatura, cuento.imagen_miniatura.url)
+
+    def test_no_agranda_imagenes_pequenas_y_regenera_desde_el_original(self):
+        with mock.patch.object(images, 'descargar_imagen', return_value=_png(300, 300)):
+            images.ingerir_imagen(self.cuento)
+        with mock.patch.object(images, 'descargar_imagen') as descargar:
+            images.regenerar_variantes(Cuento.objects.get(id=self.cuento.id))
+        descargar.assert_not_called()
+        with Cuento.objects.get(id=self.cuento.id).imagen_impresion.open('rb') as archivo, \
+                PILImage.open(archivo) as imagen:
+            self.assertEqual(imagen.size, (300, 300))
+
+    def test_sin_url_remota_no_descarga(self):
+        with mock.patch.object(images, 'descargar_imagen') as descargar:
+            self.assertFalse(images.ingerir_imagen(self.cuento, url='/static/images/cuento-placeholder.png'))
+        descargar.assert_not_called()
+
+    @override_settings(STORY_IMAGE_MAX_BYTES=100)
+    def test_descarga_demasiado_grande_o_invalida(self):
+        respuesta = mock.MagicMock()
+        respuesta.__enter__.return_value.iter_bytes.return_value = [b'x' * 64, b'x' * 64]
+        with mock.patch.object(images.conexiones, 'cliente') as cliente:
+            cliente.return_value.stream.return_value = respuesta
+            with self.assertRaisesRegex(images.ErrorImagen, 'supera 100 bytes'):
+                images.descargar_imagen('https://ejemplo.invalid/imagen.png')
+
+        with self.assertRaises(images.ErrorImagen):
+            images.generar_variantes(b'no es una imagen')
+
+
+RESPUESTA_CUENTO = {
+    'id': 'chatcmpl-prueba', 'object': 'chat.completion', 'created': 0, 'model': 'gpt-4o',
+    'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {
+        'role': 'assistant',
+        'content': 'TÍTULO: El faro\nCUENTO: Había una vez un faro.\nMORALEJA: Brillar ayuda.',
+    }}],
+    'usage': {'prompt_tokens': 10, 'completion_tokens': 10, 'total_tokens': 20},
+}
+
+
+class _OpenAIFalso(BaseHTTPRequestHandler):
+    """Responde /v1/chat/completions con el guion del servidor: (espera, estado, cabeceras)"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.peticiones += 1
+        espera, estado, cabeceras = self.server.guion.pop(0) if self.server.guion else (0, 200, {})
+        time.sleep(espera)
+        cuerpo = json.dumps(RESPUESTA_CUENTO if estado == 200 else {'error': {'message': f'Error {estado}'}})
+        cabeceras = {'Content-Type': 'application/json', 'Content-Length': str(len(cuerpo.encode())), **cabeceras}
+        try:
+            self.send_response(estado)
+            for nombre, valor in cabeceras.items():
+                self.send_header(nombre, valor)
+            self.end_headers()
+            self.wfile.write(cuerpo.encode())
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # el cliente ya se fue por timeout
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(OPENAI_MAX_RETRIES=2, OPENAI_RETRY_BASE_DELAY=0.01, OPENAI_RETRY_MAX_DELAY=1,
+                   OPENAI_BREAKER_FAILURES=3, OPENAI_BREAKER_RESET_SECONDS=0.3,
+                   OPENAI_TIMEOUTS={'texto': {'connect': 1, 'read': 0.3}})
+class ResilienciaOpenAITests(SimpleTestCase):
+    """Timeouts, reintentos y circuito contra un servidor HTTP local que inyecta latencia y errores"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.servidor = ThreadingHTTPServer(('127.0.0.1', 0), _OpenAIFalso)
+        cls.servidor.daemon_threads = True
+        threading.Thread(target=cls.servidor.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.servidor.shutdown()
+        cls.servidor.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        metrics.reiniciar()
+        scheduler.reiniciar()
+        resilience.reiniciar()
+        caches['default'].clear()  # un cuento guardado sustituiría a la plantilla de respaldo
+        self.servidor.guion = []
+        self.servidor.peticiones = 0
+        self.servicio = OpenAIService()
+        self.servicio.client = OpenAI(
+            base_url=f"http://127.0.0.1:{self.servidor.server_port}/v1", api_key='sk-prueba', max_retries=0,
+            http_client=conexiones.crear_cliente('prueba'))
+        self.addCleanup(self.servicio.client.close)
+        self.datos = {'personaje_principal': 'Luna', 'tema': 'aventura', 'edad': '4-6', 'longitud': 'corto'}
+
+    def _generar(self, *guion):
+        self.servidor.guion = list(guion)
+        inicio = time.monotonic()
+        titulo = self.servicio.generar_texto(self.datos)[0]
+        return titulo, time.monotonic() - inicio
+
+    @override_settings(OPENAI_MAX_RETRIES=0)
+    def test_timeout_de_lectura_cae_al_respaldo(self):
+        titulo, segundos = self._generar((2, 200, {}))
+        self.assertNotEqual(titulo, 'El faro')
+        self.assertLess(segundos, 1.5)
+        self.assertEqual(metrics.valor('openai.timeouts'), 1)
+
+    def test_reintenta_429_respetando_retry_after(self):
+        titulo, segundos = self._generar((0, 429, {'Retry-After': '0.2'}), (0, 200, {}))
+        self.assertEqual(titulo, 'El faro')
+        self.assertEqual(self.servidor.peticiones, 2)
+        self.assertGreaterEqual(segundos, 0.2)
+        self.assertEqual(metrics.valor('openai.reintentos'), 1)
+
+        # Si pide esperar más que el tope no se insiste (sin el cuento guardado, que sustituiría a la plantilla)
+        self.servidor.peticiones = 0
+        caches['default'].clear()
+        titulo, _ = self._generar((0, 429, {'Retry-After': '30'}))
+        self.assertNotEqual(titulo, 'El faro')
+        self.assertEqual(self.servidor.peticiones, 1)
+
+    def test_reintenta_5xx_y_no_4xx(self):
+        titulo, _ = self._generar((0, 503, {}), (0, 200, {}))
+        self.assertEqual((titulo, self.servidor.peticiones), ('El faro', 2))
+
+        self.servidor.peticiones = 0
+        self._generar((0, 400, {}))
+        self.assertEqual(self.servidor.peticiones, 1)
+        self.assertEqual(resilience.circuito().estado()['fallos_seguidos'], 0)
+
+    @override_settings(OPENAI_MAX_RETRIES=0)
+    def test_circuito_abre_cortocircuita_y_prueba(self):
+        for _ in range(3):
+            self._generar((0, 500, {}))
+        self.assertEqual(resilience.circuito().estado()['estado'], resilience.ABIERTO)
+
+        # Abierto: ni siquiera se llama al servidor, se va directo al respaldo
+        titulo, segundos = self._generar((0, 200, {}))
+        self.assertNotEqual(titulo, 'El faro')
+        self.assertEqual(self.servidor.peticiones, 3)
+        self.assertLess(segundos, 0.2)
+
+        # Pasado el reinicio, una llamada de prueba que falla lo vuelve a abrir...
+        time.sleep(0.35)
+        self._generar((0, 500, {}))
+        self.assertEqual(resilience.circuito().estado()['estado'], resilience.ABIERTO)
+
+        # ...y una que sale bien lo cierra
+        time.sleep(0.35)
+        titulo, _ = self._generar((0, 200, {}))
+        self.assertEqual(titulo, 'El faro')
+        self.assertEqual(resilience.circuito().estado()['estado'], resilience.CERRADO)
+
+        self.assertEqual(metrics.valor('openai.circuito.aperturas'), 2)
+        self.assertEqual(metrics.valor('openai.circuito.cortocircuitos'), 1)
+        self.assertEqual(metrics.resumen()['indicadores']['openai.circuito']['aperturas'], 2)
+
+    def test_reutiliza_la_conexion(self):
+        for _ in range(3):
+            self.assertEqual(self._generar((0, 200, {}))[0], 'El faro')
+        self.assertEqual(conexiones.reutilizacion()['prueba'],
+                         {'peticiones': 3, 'conexiones': 1, 'tls': 0, 'ratio': 0.6667})
+
+    async def test_servicio_async_con_reintento(self):
+        servicio = AsyncOpenAIService()
+        http = conexiones.crear_cliente_async('prueba-async')
+        servicio.client = ClientesAsync(
+            'sk-prueba', base_url=f"http://127.0.0.1:{self.servidor.server_port}/v1", http_client=http)
+        self.servidor.guion = [(0, 429, {'Retry-After-Ms': '50'}), (0, 200, {})]
+        try:
+            titulo, contenido, moraleja = await servicio.generar_texto(self.datos)
+        finally:
+            await http.aclose()
+        self.assertEqual((titulo, moraleja), ('El faro', 'Brillar ayuda.'))
+        self.assertEqual(self.servidor.peticiones, 2)
+        self.assertEqual(scheduler.planificador().estado()['en_vuelo'], 0)
+
+    def test_una_sola_prueba_en_semiabierto(self):
+        reloj = RelojFalso()
+        circuito = resilience.Circuito(fallos_maximos=1, reinicio=10, reloj=reloj)
+        circuito.permitir()
+        circuito.fallo()
+        reloj.avanzar(10)
+        circuito.permitir()
+        with self.assertRaises(CircuitoAbierto):
+            circuito.permitir()
+        circuito.exito()
+        circuito.permitir()
+
+
+
+class ComprobacionLeaseTests(SimpleTestCase):
+    """El arranque avisa si los presupuestos de OpenAI no caben en el lease de los trabajos"""
+
+    def test_valores_por_defecto_pasan(self):
+        self.assertEqual(checks.comprobar_lease(None), [])
+
+    @override_settings(GENERATION_HEARTBEAT_SECONDS=0)
+    def test_sin_latido_el_peor_caso_tiene_que_caber_en_el_lease(self):
+        # Imagen: 120 s de turno + 3 x (5 + 120) s + 2 x 8 s de espera + 30 s de descarga
+        self.assertEqual(checks.duracion_maxima('imagen'), 541)
+        self.assertEqual([e.id for e in checks.comprobar_lease(None)], ['stories.E001', 'stories.E001'])
+        with self.settings(GENERATION_LEASE_SECONDS=600):
+            self.assertEqual(checks.comprobar_lease(None), [])
+
+    @override_settings(GENERATION_HEARTBEAT_SECONDS=200)
+    def test_latido_demasiado_lento(self):
+        self.assertEqual([e.id for e in checks.comprobar_lease(None)], ['stories.W001'])
+
+
+
+@override_settings(STORY_NOTIFICATIONS_CHECK_INTERVAL=10)
+class NotificacionesTests(SimpleTestCase):
+    """Versiones del estado publicado, esperas que despiertan al publicar y reparto de la carga"""
+
+    def setUp(self):
+        notifications.reiniciar()
+
+    def test_publicar_numera_versiones_y_conserva_los_datos(self):
+        notifications.publicar(7, 'generando', usuario_id=3, titulo='El faro', parrafos=['Uno.'])
+        estado = notifications.publicar(7, 'completado', parrafos=['Uno.', 'Dos.'], imagen_estado='pendiente')
+
+        self.assertEqual((estado['version'], estado['titulo'], estado['usuario_id']), (2, 'El faro', 3))
+        self.assertEqual(notifications.estado_actual(7)['parrafos'], ['Uno.', 'Dos.'])
+        # Otro proceso solo ve la copia de la caché compartida
+        notifications._estados.clear()
+        self.assertEqual(notifications.estado_actual(7)['version'], 2)
+
+    def test_es_definitivo(self):
+        self.assertFalse(notifications.es_definitivo({'estado': 'generando'}))
+        self.assertFalse(notifications.es_definitivo({'estado': 'completado', 'imagen_estado': 'pendiente'}))
+        self.assertTrue(notifications.es_definitivo({'estado': 'completado', 'imagen_estado': 'error'}))
+        self.assertTrue(notifications.es_definitivo({'estado': 'error', 'imagen_estado': 'pendiente'}))
+
+    def test_esperar_cambio_despierta_al_publicar(self):
+        notifications.publicar(7, 'generando', usuario_id=3)
+        threading.Timer(0.1, notifications.publicar, args=(7, 'completado')).start()
+
+        inicio = time.monotonic()
+        estado = notifications.esperar_cambio(7, version=1, timeout=5)
+        self.assertLess(time.monotonic() - inicio, 2)
+        self.assertEqual((estado['estado'], estado['version']), ('completado', 2))
+        self.assertEqual(notifications.peticiones_esperando(), 0)
+
+    def test_esperar_cambio_devuelve_lo_ultimo_al_vencer(self):
+        self.assertIsNone(notifications.esperar_cambio(7, timeout=0))
+        notifications.publicar(7, 'generando', usuario_id=3)
+
+        # Una versión anterior responde sin esperar
+        self.assertEqual(notifications.esperar_cambio(7, version=0, timeout=5)['version'], 1)
+        inicio = time.monotonic()
+        self.assertEqual(notifications.esperar_cambio(7, version=1, timeout=0.2)['version'], 1)
+        self.assertGreaterEqual(time.monotonic() - inicio, 0.2)
+
+    @override_settings(STORY_LONGPOLL_MAX_WAITERS=10, STORY_STATUS_RETRY_MS=1000, STORY_STATUS_MAX_RETRY_MS=5000)
+    def test_el_intervalo_de_reintento_crece_con_la_carga(self):
+        self.assertEqual(notifications.intervalo_reintento(), 1000)
+        with mock.patch.object(notifications, '_esperando', 5):
+            self.assertEqual(notifications.intervalo_reintento(), 3000)
+            self.assertTrue(notifications.admite_espera())
+        with mock.patch.object(notifications, '_esperando', 10):
+            self.assertEqual(notifications.intervalo_reintento(), 5000)
+            self.assertFalse(notifications.admite_espera())
+            self.assertTrue(notifications.admite_espera(asincrona=True))
+
+
+@override_settings(ASYNC_DB_THREADS=4, STORY_NOTIFICATIONS_CHECK_INTERVAL=0.05)
+class EsperaAsyncNoBloqueaTests(SimpleTestCase):
+    """Con una caché compartida lenta (Redis, archivos) el bucle de eventos sigue libre"""
+
+    def setUp(self):
+        notifications.reiniciar()
+
+    def test_lectura_lenta_de_la_cache_no_para_el_bucle(self):
+        leer = notifications._leer_remoto
+
+        def lento(cuento_id):
+            time.sleep(0.2)
+            return leer(cuento_id)
+
+        async def escenario():
+            pausas = []
+
+            async def pulso():
+                anterior = time.monotonic()
+                while True:
+                    await asyncio.sleep(0.01)
+                    ahora = time.monotonic()
+                    pausas.append(ahora - anterior)
+                    anterior = ahora
+
+            medidor = asyncio.create_task(pulso())
+            threading.Timer(0.3, notifications.publicar, args=(1, 'completado')).start()
+            estados = await asyncio.gather(*[notifications.esperar_cambio_async(1, 0, 2) for _ in range(8)])
+            medidor.cancel()
+            return estados, max(pausas)
+
+        with mock.patch.object(notifications, '_leer_remoto', side_effect=lento):
+            estados, pausa_maxima = async_to_sync(escenario)()
+
+        self.assertEqual({estado['version'] for estado in estados}, {1})
+        # Ocho esperas leyendo la caché a 0,2 s cada una bloquearían el bucle más de un segundo
+        self.assertLess(pausa_maxima, 0.1)
+
+
+class _ServicioAsyncLento:
+    """Servicio async de pruebas: cada texto tarda `latencia` sin ocupar el hilo"""
+
+    def __init__(self, latencia):
+        self.latencia = latencia
+        self.en_vuelo = self.pico = 0
+
+    async def generar_texto(self, datos_formulario, user=None, al_avanzar=None, prioridad=INTERACTIVA):
+        self.en_vuelo += 1
+        self.pico = max(self.pico, self.en_vuelo)
+        await asyncio.sleep(self.latencia)
+        self.en_vuelo -= 1
+        return 'Título async', 'Había una vez.\n\nFin.', 'Moraleja'
+
+
+@override_settings(ASYNC_DB_THREADS=0)
+class GeneracionAsyncTests(TestCase):
+    """Worker async y vistas async de estado y contenido"""
+
+    def setUp(self):
+        notifications.reiniciar()
+        self.usuario = User.objects.create_user('familia', password='clave-segura-123')
+
+    def _cuento(self, **campos):
+        return Cuento.objects.create(usuario=self.usuario, titulo='Cuento', personaje_principal='Luna',
+                                     tema='aventura', edad='4-6', longitud='corto', **campos)
+
+    def test_worker_async_lleva_varios_trabajos_a_la_vez(self):
+        for _ in range(5):
+            jobs.encolar_generacion(self._cuento(estado='generando'), {})
+        servicio = _ServicioAsyncLento(0.3)
+
+        inicio = time.monotonic()
+        procesados = async_to_sync(jobs.bucle_async)(
+            threading.Event(), tareas=10, servicio=servicio, intervalo=0.01, max_trabajos=5)
+        segundos = time.monotonic() - inicio
+
+        self.assertEqual(procesados, 5)
+        self.assertEqual(servicio.pico, 5)
+        self.assertLess(segundos, 1.0)
+        self.assertEqual(Cuento.objects.filter(estado='completado', titulo='Título async').count(), 5)
+        self.assertEqual(TrabajoGeneracion.objects.filter(tipo='imagen', estado='pendiente').count(), 5)
+
+    @override_settings(STORY_NOTIFICATIONS_CHECK_INTERVAL=10)
+    async def test_long_poll_async_despierta_al_publicar(self):
+        await self.async_client.aforce_login(self.usuario)
+        cuento = await Cuento.objects.acreate(usuario=self.usuario, titulo='Cuento', personaje_principal='Luna',
+                                              tema='aventura', edad='4-6', longitud='corto', estado='generando')
+        notifications.publicar(cuento.id, 'generando', usuario_id=self.usuario.id)
+
+        # Un worker de otro hilo publica mientras la petición espera en el bucle de eventos
+        threading.Timer(0.2, notifications.publicar, args=(cuento.id, 'generando'),
+                        kwargs={'titulo': 'El faro', 'parrafos': ['Había una vez.']}).start()
+        inicio = time.monotonic()
+        response = await self.async_client.get(
+            reverse('stories:check_status', args=[cuento.id]), {'version': 1, 'timeout': 5})
+
+        self.assertLess(time.monotonic() - inicio, 2)
+        self.assertEqual((response.json()['titulo'], response.json()['version']), ('El faro', 2))
+
+    async def test_long_poll_async_sin_cambios_y_de_otro_usuario(self):
+        await self.async_client.aforce_login(self.usuario)
+        cuento = await Cuento.objects.acreate(usuario=self.usuario, titulo='Cuento', personaje_principal='Luna',
+                                              tema='aventura', edad='4-6', longitud='corto', estado='generando')
+        notifications.publicar(cuento.id, 'generando', usuario_id=self.usuario.id)
+        url = reverse('stories:check_status', args=[cuento.id])
+
+        # Una versión anterior responde al momento; la actual espera hasta el timeout
+        self.assertEqual((await self.async_client.get(url, {'version': 0})).json()['version'], 1)
+        inicio = time.monotonic()
+        response = await self.async_client.get(url, {'version': 1, 'timeout': 1})
+        self.assertGreaterEqual(time.monotonic() - inicio, 1)
+        self.assertEqual((response.json()['estado'], response.json()['version']), ('generando', 1))
+
+        await self.async_client.aforce_login(await User.objects.acreate(username='otra'))
+        self.assertTrue((await self.async_client.get(url, {'version': 0})).json()['error'])
+
+    async def test_stream_sse_reanuda_y_termina(self):
+        await self.async_client.aforce_login(self.usuario)
+        cuento = await Cuento.objects.acreate(usuario=self.usuario, titulo='Cuento', personaje_principal='Luna',
+                                              tema='aventura', edad='4-6', longitud='corto', estado='generando')
+        notifications.publicar(cuento.id, 'generando', usuario_id=self.usuario.id,
+                               titulo='El faro', parrafos=['Uno.', 'Dos.'])
+        threading.Timer(0.2, notifications.publicar, args=(cuento.id, 'completado'),
+                        kwargs={'parrafos': ['Uno.', 'Dos.', 'Tres.'], 'imagen_estado': 'pendiente'}).start()
+
+        response = await self.async_client.get(reverse('stories:stream', args=[cuento.id]),
+                                               headers={'Last-Event-ID': '1'})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        eventos = b''.join([trozo async for trozo in response.streaming_content]).decode()
+
+        # Tras Last-Event-ID 1 no se repite el primer párrafo
+        self.assertNotIn('"texto": "Uno."', eventos)
+        self.assertLess(eventos.index('event: titulo'), eventos.index('"texto": "Dos."'))
+        self.assertLess(eventos.index('"texto": "Dos."'), eventos.index('"texto": "Tres."'))
+        self.assertIn('id: 3', eventos)
+        self.assertIn('event: estado', eventos)
+
+    def test_stream_sse_bajo_wsgi_envia_cada_evento_al_publicarse(self):
+        self.client.force_login(self.usuario)
+        cuento = self._cuento(estado='generando')
+        notifications.publicar(cuento.id, 'generando', usuario_id=self.usuario.id,
+                               titulo='El faro', parrafos=['Uno.'])
+
+        with warnings.catch_warnings():
+            # Un iterador async obligaría a Django a juntar todo el stream antes de enviarlo
+            warnings.simplefilter('error')
+            response = self.client.get(reverse('stories:stream', args=[cuento.id]))
+            eventos = iter(response.streaming_content)
+            primeros = b''.join(next(eventos) for _ in range(3)).decode()
+
+        # Llegan mientras el cuento sigue generándose
+        self.assertIn('event: titulo', primeros)
+        self.assertIn('"texto": "Uno."', primeros)
+        self.assertEqual(notifications.estado_actual(cuento.id)['estado'], 'generando')
+
+        notifications.publicar(cuento.id, 'completado', parrafos=['Uno.', 'Dos.'], imagen_estado='lista')
+        resto = b''.join(eventos).decode()
+        self.assertIn('id: 2', resto)
+        self.assertIn('event: estado', resto)
+        response.close()
+
+    async def test_contenido_async_solo_del_dueno(self):
+        cuento = await Cuento.objects.acreate(usuario=self.usuario, titulo='El faro', personaje_principal='Luna',
+                                              tema='aventura', edad='4-6', longitud='corto',
+                                              estado='completado', contenido='Había una vez un faro.')
+        await self.async_client.aforce_login(self.usuario)
+        response = await self.async_client.get(reverse('stories:obtener_contenido', args=[cuento.id]))
+        self.assertEqual(response.json()['contenido'], 'Había una vez un faro.')
+
+        otro = await User.objects.acreate(username='otra')
+        await self.async_client.aforce_login(otro)
+        response = await self.async_client.get(reverse('stories:obtener_contenido', args=[cuento.id]))
+        self.assertFalse(response.json()['success'])
+
+
+def _fragmento_stream(texto=None, tokens=None):
+    choices = [SimpleNamespace(delta=SimpleNamespace(content=texto))] if texto is not None else []
+    return SimpleNamespace(choices=choices, usage=SimpleNamespace(total_tokens=tokens) if tokens else None)
+
+
+@override_settings(ASYNC_DB_THREADS=0, OPENAI_MAX_RETRIES=0, OPENAI_STREAMING=True)
+class StreamingTextoTests(TestCase):
+    """El texto llega en streaming, se guarda por párrafos y se emite por SSE"""
+
+    def setUp(self):
+        notifications.reiniciar()
+        scheduler.reiniciar()
+        resilience.reiniciar()
+        caches['default'].clear()
+        self.usuario = User.objects.create_user('familia', password='clave-segura-123')
+
+    def test_avisa_cada_parrafo_terminado(self):
+        servicio = OpenAIService()
+        servicio.client = mock.Mock()
+        servicio.client.chat.completions.create.return_value = iter([
+            _fragmento_stream('TÍTULO: El faro\n'),
+            _fragmento_stream('CUENTO: Había una vez'),
+            _fragmento_stream(' un faro.\n\n'),
+            _fragmento_stream('Brillaba cada noche.\n'),
+            _fragmento_stream('MORALEJA: Brillar ayuda.'),
+            _fragmento_stream(tokens=42),
+        ])
+        avances = []
+
+        texto = servicio.generar_texto({'personaje_principal': 'Luna', 'tema': 'aventura'}, user=self.usuario,
+                                       al_avanzar=lambda titulo, parrafos: avances.append((titulo, parrafos)))
+
+        self.assertTrue(servicio.client.chat.completions.create.call_args.kwargs['stream'])
+        # La línea a medias no se avisa hasta que llega su salto de línea
+        self.assertEqual(avances, [
+            ('El faro', []),
+            ('El faro', ['Había una vez un faro.']),
+            ('El faro', ['Había una vez un faro.', 'Brillaba cada noche.']),
+        ])
+        self.assertEqual((texto[0], texto[2]), ('El faro', 'Brillar ayuda.'))
+
+    def test_guardar_avance_persiste_y_publica(self):
+        cuento = _cuento_generando(self.usuario)
+        al_avanzar = jobs.guardar_avance(cuento.id, self.usuario.id)
+
+        al_avanzar('El faro', ['Había una vez un faro.', 'Brillaba cada noche.'])
+        cuento.refresh_from_db()
+        self.assertEqual((cuento.titulo, cuento.contenido),
+                         ('El faro', 'Había una vez un faro.\n\nBrillaba cada noche.'))
+        self.assertTrue(cuento.vista_previa.startswith('Había una vez'))
+        estado = notifications.estado_actual(cuento.id)
+        self.assertEqual((estado['version'], estado['parrafos'][1]), (1, 'Brillaba cada noche.'))
+
+        # Un avance tardío no pisa un cuento ya terminado
+        Cuento.objects.filter(id=cuento.id).update(estado='completado')
+        al_avanzar('Otro', ['Texto viejo.'])
+        self.assertEqual(Cuento.objects.get(id=cuento.id).titulo, 'El faro')
+        self.assertEqual(notifications.estado_actual(cuento.id)['version'], 1)
+
+    async def test_sse_sin_estado_publicado_lee_la_base_de_datos(self):
+        await self.async_client.aforce_login(self.usuario)
+        cuento = await Cuento.objects.acreate(
+            usuario=self.usuario, titulo='El faro', personaje_principal='Luna', tema='aventura', edad='4-6',
+            longitud='corto', estado='completado', imagen_estado='lista',
+            contenido='Había una vez un faro.\n\nBrillaba cada noche.')
+
+        response = await self.async_client.get(reverse('stories:stream', args=[cuento.id]))
+        eventos = b''.join([trozo async for trozo in response.streaming_content]).decode()
+
+        self.assertTrue(eventos.startswith('retry: '))
+        self.assertIn('event: titulo\ndata: {"titulo": "El faro"}', eventos)
+        self.assertIn('id: 2\ndata: {"indice": 1, "texto": "Brillaba cada noche."}', eventos)
+        self.assertIn('"completado": true', eventos)
+
+        await self.async_client.aforce_login(await User.objects.acreate(username='otra'))
+        response = await self.async_client.get(reverse('stories:stream', args=[cuento.id]))
+        self.assertEqual(response.status_code, 404)
+
+
+def _respuesta_chat(contenido):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=contenido))],
+                           usage=SimpleNamespace(total_tokens=20))
+
+
+@override_settings(ASYNC_DB_THREADS=0, OPENAI_MAX_RETRIES=0)
+class IdempotenciaYCacheTests(TestCase):
+    """Reenvíos del formulario y caché de cuentos por contenido"""
+
+    def setUp(self):
+        metrics.reiniciar()
+        scheduler.reiniciar()
+        resilience.reiniciar()
+        caches['default'].clear()
+        self.usuario = User.objects.create_user('familia', password='clave-segura-123')
+        self.client.login(username='familia', password='clave-segura-123')
+        self.formulario = {'personaje': 'Luna', 'tema': 'aventura', 'edad': '4-6', 'longitud': 'corto'}
+        self.datos = {'titulo': '', 'personaje_principal': 'Luna', 'tema': 'aventura', 'edad': '4-6',
+                      'longitud': 'corto'}
+        self.servicio = OpenAIService()
+        self.servicio.client = mock.Mock()
+        self.crear = self.servicio.client.chat.completions.create
+        self.crear.return_value = _respuesta_chat(RESPUESTA_CUENTO['choices'][0]['message']['content'])
+
+    def test_reenvio_devuelve_el_mismo_cuento(self):
+        clave = self.client.get(reverse('stories:generar')).context['clave_idempotencia']
+        formulario = {**self.formulario, 'clave_idempotencia': clave}
+        for _ in range(2):
+            response = self.client.post(reverse('stories:generar'), formulario)
+            self.assertRedirects(response, reverse('stories:generando'), fetch_redirect_response=False)
+        self.assertEqual(Cuento.objects.filter(usuario=self.usuario).count(), 1)
+        self.assertEqual(self.client.session['cuento_id'], Cuento.objects.get().id)
+
+        # Volver atrás y cambiar los datos es otro cuento aunque la clave sea la misma
+        self.client.post(reverse('stories:generar'), {**formulario, 'tema': 'amistad'})
+        self.assertEqual(TrabajoGeneracion.objects.filter(usuario=self.usuario).count(), 2)
+
+        # La cabecera Idempotency-Key vale igual que el campo del formulario
+        for _ in range(2):
+            self.client.post(reverse('stories:generar'), self.formulario, headers={'Idempotency-Key': 'reintento'})
+        self.assertEqual(Cuento.objects.filter(usuario=self.usuario).count(), 3)
+
+    def test_carrera_entre_envios_simultaneos(self):
+        self.client.post(reverse('stories:generar'), {**self.formulario, 'clave_idempotencia': 'doble-clic'})
+        existente = TrabajoGeneracion.objects.get()
+
+        # El segundo envío no lo ve al comprobar, pero choca con la restricción única al crear
+        with mock.patch.object(views, 'trabajo_idempotente', side_effect=[None, existente]):
+            response = self.client.post(reverse('stories:generar'),
+                                        {**self.formulario, 'clave_idempotencia': 'doble-clic'})
+        self.assertRedirects(response, reverse('stories:generando'), fetch_redirect_response=False)
+        self.assertEqual(Cuento.objects.count(), 1)
+        self.assertEqual(self.client.session['cuento_id'], existente.cuento_id)
+
+    @override_settings(OPENAI_DETERMINISTIC=True)
+    def test_modo_determinista_sirve_desde_la_cache(self):
+        primero = self.servicio.generar_texto(self.datos, user=self.usuario)
+        # Mayúsculas y espacios no cambian la huella
+        segundo = self.servicio.generar_texto({**self.datos, 'personaje_principal': '  luna '}, user=self.usuario)
+
+        self.assertEqual(primero, segundo)
+        self.assertEqual(self.crear.call_count, 1)
+        self.assertEqual(self.crear.call_args.kwargs['temperature'], 0)
+        self.assertEqual(self.crear.call_args.kwargs['seed'], result_cache.semilla(self.datos, 'es'))
+        self.assertEqual(metrics.aciertos_cache()['cuentos'], {'aciertos': 1, 'fallos': 1, 'agrupadas': 0,
+                                                               'ratio': 0.5})
+        ahorro = metrics.resumen()['indicadores']['openai.ahorro']
+        self.assertEqual(ahorro['llamadas'], 1)
+        self.assertGreater(ahorro['tokens'], 0)
+        self.assertGreater(ahorro['usd'], 0)
+
+        # Otro idioma es otro cuento
+        UserSettings.objects.filter(user=self.usuario).update(language='en')
+        self.servicio.generar_texto(self.datos, user=self.usuario)
+        self.assertEqual(self.crear.call_count, 2)
+
+    @override_settings(OPENAI_DETERMINISTIC=True)
+    def test_usuario_que_se_excluye(self):
+        UserSettings.objects.filter(user=self.usuario).update(reutilizar_cuentos=False)
+        for _ in range(2):
+            self.servicio.generar_texto(self.datos, user=self.usuario)
+        self.assertEqual(self.crear.call_count, 2)
+        self.assertIsNone(caches['default'].get(f"cuentia:cuento:{result_cache.huella(self.datos, 'es')}"))
+
+    def test_respaldo_usa_el_cuento_guardado(self):
+        # Fuera del modo determinista se llama siempre, pero lo escrito se guarda
+        self.servicio.generar_texto(self.datos, user=self.usuario)
+        self.assertEqual(self.crear.call_args.kwargs['temperature'], 0.8)
+
+        self.crear.side_effect = RuntimeError('OpenAI caído')
+        titulo, _, moraleja = self.servicio.generar_texto(self.datos, user=self.usuario)
+        self.assertEqual((titulo, moraleja), ('El faro', 'Brillar ayuda.'))
+        self.assertEqual(metrics.valor('cuentos.respaldos_desde_cache'), 1)
+
+        # Sin cuento guardado para esos datos, la plantilla de siempre
+        titulo, _, _ = self.servicio.generar_texto({**self.datos, 'tema': 'amistad'}, user=self.usuario)
+        self.assertIn('Luna', titulo)
+        self.assertNotEqual(titulo, 'El faro')
+
+    async def test_servicio_async_sin_cliente_usa_la_cache(self):
+        result_cache.guardar(result_cache.huella(self.datos, 'es'), 'El faro', 'Había una vez un faro.', 'Brillar.')
+        servicio = AsyncOpenAIService()
+        servicio.client = None
+        titulo, _, _ = await servicio.generar_texto(self.datos, user=self.usuario)
+        self.assertEqual(titulo, 'El faro')
+
+
+@override_settings(PDF_RENDER_PROCESSES=0)
+class CachePdfTests(TestCase):
+    """PDFs de cuentos: caché en disco por contenido, ETag y descargas condicionales"""
+
+    def setUp(self):
+        rendering.cerrar_pool()
+        self.directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directorio, ignore_errors=True)
+        ajustes = self.settings(STORY_PDF_CACHE_DIR=self.directorio)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.usuario = User.objects.create_user('familia', password='clave-segura-123')
+        self.client.login(username='familia', password='clave-segura-123')
+        self.cuento = Cuento.objects.create(
+            usuario=self.usuario, titulo='El faro', personaje_principal='Luna', tema='aventura', edad='4-6',
+            longitud='corto', estado='completado', en_biblioteca=True,
+            contenido='Había una vez un faro.\n\nBrillaba cada noche.', moraleja='Brillar ayuda.')
+
+    def _descargas(self):
+        return EstadisticaLectura.objects.filter(cuento=self.cuento, tipo_lectura='descarga').count()
+
+    def test_revalidacion_304_no_cuenta_como_descarga(self):
+        for url in (reverse('stories:descargar_pdf', args=[self.cuento.id]),
+                    reverse('library:download_story', args=[self.cuento.id])):
+            antes = self._descargas()
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self._descargas(), antes + 1)
+
+            response = self.client.get(url, headers={'If-None-Match': response['ETag']})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(self._descargas(), antes + 1)
+
+    def _cuento(self, contenido):
+        return Cuento.objects.create(
+            usuario=self.usuario, titulo='Otro', personaje_principal='Luna', tema='aventura', edad='4-6',
+            longitud='corto', estado='completado', contenido=contenido)
+
+    def test_no_recorre_el_directorio_en_cada_escritura(self):
+        with mock.patch.object(pdf_cache.os, 'walk', wraps=os.walk) as recorrer:
+            for indice in range(5):
+                pdf_cache.obtener_pdf(self._cuento(f'Cuento número {indice}.'))
+        # Solo el recorrido inicial; el resto de escrituras suman al total estimado
+        self.assertEqual(recorrer.call_count, 1)
+
+        with self.settings(STORY_PDF_CACHE_RESCAN_WRITES=2), \
+                mock.patch.object(pdf_cache.os, 'walk', wraps=os.walk) as recorrer:
+            for indice in range(4):
+                pdf_cache.obtener_pdf(self._cuento(f'Otro cuento {indice}.'))
+        self.assertEqual(recorrer.call_count, 2)
+
+    def test_recorta_los_pdfs_usados_hace_mas_tiempo(self):
+        cuentos = [self._cuento(f'Cuento {letra}.') for letra in 'abc']
+        rutas = [pdf_cache.obtener_pdf(cuento) for cuento in cuentos]
+        ahora = time.time()
+        for ruta, antiguedad in zip(rutas, (30, 20, 10)):
+            os.utime(ruta, (ahora - antiguedad, ahora - antiguedad))
+
+        # Volver a pedir el primero lo marca como recién usado sin renderizarlo otra vez
+        with mock.patch.object(pdf_cache, 'renderizar_pdf_cuento') as renderizar:
+            self.assertEqual(pdf_cache.obtener_pdf(cuentos[0]), rutas[0])
+        renderizar.assert_not_called()
+
+        # Un cuarto PDF pasa del límite: se van los dos usados hace más tiempo
+        with self.settings(STORY_PDF_CACHE_MAX_BYTES=sum(os.path.getsize(ruta) for ruta in rutas) - 1):
+            nueva = pdf_cache.obtener_pdf(self._cuento('Cuento d.'))
+        self.assertEqual([os.path.exists(ruta) for ruta in rutas + [nueva]], [True, False, False, True])
+
+    def test_etag_por_contenido_y_aciertos_sin_renderizar(self):
+        url = reverse('stories:descargar_pdf', args=[self.cuento.id])
+        response = self.client.get(url)
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+        self.assertEqual(response['ETag'], f'"{pdf_cache.huella_pdf(self.cuento)}"')
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        etag = response['ETag']
+
+        with mock.patch.object(pdf_cache, 'renderizar_pdf_cuento') as renderizar:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        renderizar.assert_not_called()
+
+        # Editar el cuento cambia la huella: el ETag viejo ya no vale y se genera otro PDF
+        Cuento.objects.filter(id=self.cuento.id).update(moraleja='Compartir la luz.')
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class _PoolDeHilos(ThreadPoolExecutor):
+    """ProcessPoolExecutor de mentira para no arrancar procesos en los tests"""
+
+    def __init__(self, max_workers, mp_context=None, initializer=None):
+        super().__init__(max_workers=max_workers)
+
+
+def _esperar_evento(evento):
+    evento.wait(5)
+    return b'%PDF-1.4 bloqueado'
+
+
+@override_settings(PDF_RENDER_PROCESSES=1, PDF_RENDER_MAX_QUEUE=1, PDF_RENDER_RETRY_AFTER=3, PDF_RENDER_TIMEOUT=5)
+class PoolRenderizadoTests(TestCase):
+    """Con el pool lleno los PDFs se rechazan al momento con 503 y Retry-After"""
+
+    def setUp(self):
+        rendering.cerrar_pool()
+        self.addCleanup(rendering.cerrar_pool)
+        pool = mock.patch.object(rendering, 'ProcessPoolExecutor', _PoolDeHilos)
+        pool.start()
+        self.addCleanup(pool.stop)
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio, ignore_errors=True)
+        ajustes = self.settings(STORY_PDF_CACHE_DIR=directorio)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+        self.usuario = User.objects.create_user('familia', password='clave-segura-123')
+        self.client.login(username='familia', password='clave-segura-123')
+        self.cuento = Cuento.objects.create(
+            usuario=self.usuario, titulo='El faro', personaje_principal='Luna', tema='aventura', edad='4-6',
+            longitud='corto', estado='completado', en_biblioteca=True, contenido='Había una vez un faro.')
+
+    def _ocupar_pool(self):
+        """Lanza un render que no termina hasta activar el evento devuelto"""
+        evento = threading.Event()
+        self.addCleanup(evento.set)
+        hilo = threading.Thread(target=rendering._ejecutar, args=(_esperar_evento, evento))
+        hilo.start()
+        self.addCleanup(hilo.join)
+        for _ in range(100):
+            if rendering.trabajos_en_vuelo():
+                break
+            time.sleep(0.01)
+        return evento, hilo
+
+    def test_pool_lleno_responde_503_con_retry_after(self):
+        evento, hilo = self._ocupar_pool()
+
+        with self.assertRaises(rendering.RenderSaturado) as contexto:
+            rendering._ejecutar(_esperar_evento, evento)
+        self.assertEqual(contexto.exception.retry_after, 3)
+
+        for url in (reverse('stories:descargar_pdf', args=[self.cuento.id]),
+                    reverse('library:download_story', args=[self.cuento.id])):
+            response = self.client.get(url)
+            self.assertEqual((response.status_code, response['Retry-After']), (503, '3'))
+        self.assertFalse(EstadisticaLectura.objects.filter(cuento=self.cuento).exists())
+
+        # Al terminar el render se libera el cupo
+        evento.set()
+        hilo.join()
+        self.assertEqual(rendering.trabajos_en_vuelo(), 0)
+        self.assertEqual(rendering._ejecutar(len, b'abc'), 3)
+
+    @override_settings(PDF_RENDER_TIMEOUT=0.1)
+    def test_render_que_no_termina_a_tiempo(self):
+        evento = threading.Event()
+        self.addCleanup(evento.set)
+        with self.assertRaises(rendering.RenderTimeout):
+            rendering._ejecutar(_esperar_evento, evento)
+        # El cupo sigue ocupado hasta que el render termina de verdad
+        self.assertEqual(rendering.trabajos_en_vuelo(), 1)
+        response = rendering.respuesta_saturado(rendering.RenderSaturado(4))
+        self.assertEqual((response.status_code, response['Retry-After']), (503, '4'))
@@ -12,6 +12,7 @@ urlpatterns = [
 
     # APIs y acciones
     path('cuento/<int:cuento_id>/status/', views.check_cuento_status, name='check_status'),
+    path('cuento/<int:cuento_id>/stream/', views.stream_cuento, name='stream'),
     path('cuento/<int:cuento_id>/contenido/', views.obtener_contenido_cuento, name='obtener_contenido'),
     path('cuento/<int:cuento_id>/favorito/', views.toggle_favorito_view, name='toggle_favorito'),
     path('cuento/<int:cuento_id>/guardar/', views.guardar_biblioteca_view, name='guardar_biblioteca'),
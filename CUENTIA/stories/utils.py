@@ -7,7 +7,6 @@ from reportlab.lib.enums import TA_CENTER, TA_JUSTIFY, TA_LEFT
 from reportlab.platypus.tableofcontents import TableOfContents
 from reportlab.platypus.flowables import HRFlowable
 from io import BytesIO
-import requests
 from PIL import Image as PILImage
 import logging
 import os
@@ -151,38 +150,36 @@ def generar_pdf_cuento(cuento):
         story.append(Paragraph(meta_info, meta_style))
         story.append(Spacer(1, 30))
 
-        # Imagen del cuento (si existe)
-        if hasattr(cuento, 'imagen_url') and cuento.imagen_url and not cuento.imagen_url.startswith('/static'):
+        # Imagen del cuento (variante de impresión guardada localmente, sin red)
+        if getattr(cuento, 'imagen_impresion', None):
             try:
-                # Descargar imagen
-                response = requests.get(cuento.imagen_url, timeout=15)
-                if response.status_code == 200:
-                    img_buffer = BytesIO(response.content)
+                with cuento.imagen_impresion.open('rb') as archivo:
+                    img_buffer = BytesIO(archivo.read())
 
-                    # Procesar imagen con PIL
-                    pil_img = PILImage.open(img_buffer)
+                # Procesar imagen con PIL
+                pil_img = PILImage.open(img_buffer)
 
-                    # Calcular dimensiones manteniendo aspecto
-                    max_width = 5 * inch
-                    max_height = 4 * inch
+                # Calcular dimensiones manteniendo aspecto
+                max_width = 5 * inch
+                max_height = 4 * inch
 
-                    img_width, img_height = pil_img.size
-                    aspect_ratio = img_width / img_height
+                img_width, img_height = pil_img.size
+                aspect_ratio = img_width / img_height
 
-                    if aspect_ratio > max_width / max_height:
-                        new_width = max_width
-                        new_height = max_width / aspect_ratio
-                    else:
-                        new_height = max_height
-                        new_width = max_height * aspect_ratio
+                if aspect_ratio > max_width / max_height:
+                    new_width = max_width
+                    new_height = max_width / aspect_ratio
+                else:
+                    new_height = max_height
+                    new_width = max_height * aspect_ratio
 
-                    # Crear imagen para ReportLab
-                    img_buffer.seek(0)
-                    img = Image(img_buffer, width=new_width, height=new_height)
-                    img.hAlign = 'CENTER'
+                # Crear imagen para ReportLab
+                img_buffer.seek(0)
+                img = Image(img_buffer, width=new_width, height=new_height)
+                img.hAlign = 'CENTER'
 
-                    story.append(img)
-                    story.append(Spacer(1, 30))
+                story.append(img)
+                story.append(Spacer(1, 30))
 
             except Exception as e:
                 logger.error(f"Error agregando imagen al PDF: {str(e)}")
@@ -245,17 +242,10 @@ def generar_pdf_cuento(cuento):
             else:
                 tiempo_lectura = 'No especificado'
 
-            # Obtener veces leído de forma segura
-            if hasattr(cuento, 'veces_leido'):
-                veces_leido = cuento.veces_leido
-            else:
-                veces_leido = 0
-
             info_adicional = f"""
             <b>Estadísticas del Cuento:</b><br/>
             • Longitud: {longitud_display}<br/>
             • Tiempo estimado de lectura: {tiempo_lectura} minutos<br/>
-            • Veces leído: {veces_leido}<br/>
             • Generado con Inteligencia Artificial por CuentIA<br/><br/>
 
             <i>"Donde la imaginación cobra vida a través de la tecnología"</i>
@@ -1,18 +1,24 @@
 import json
 import logging
-from django.shortcuts import render, redirect, get_object_or_404
+import time
+import uuid
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import JsonResponse, HttpResponse
+from django.conf import settings
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse, Http404
 from django.views.decorators.http import require_POST
 from django.urls import reverse
 from django.core.exceptions import ValidationError
+from django.core.handlers.asgi import ASGIRequest
+from django.db import IntegrityError, transaction
 from .models import Cuento, EstadisticaLectura
-from .services import openai_service
-from .utils import generar_pdf_cuento
-from user.models import Perfil
-import threading
-import time
+from . import notifications
+from .jobs import comprobar_admision, encolar_generacion, huella_idempotencia, trabajo_idempotente
+from .scheduler import PlanificadorSaturado
+from .pdf_cache import respuesta_pdf
+from .rendering import RenderSaturado, respuesta_saturado
+from user.models import Perfil, UserSettings
 
 logger = logging.getLogger(__name__)
 
@@ -40,12 +46,13 @@ def generated_story_view(request, cuento_id):
 
         # SOLO registrar estadística de lectura si está en biblioteca
         if cuento.en_biblioteca:
-            EstadisticaLectura.objects.create(
-                usuario=request.user,
-                cuento=cuento,
-                perfil=cuento.perfil,
-                tipo_lectura='texto'
-            )
+            with transaction.atomic():
+                EstadisticaLectura.objects.create(
+                    usuario=request.user,
+                    cuento=cuento,
+                    perfil=cuento.perfil,
+                    tipo_lectura='texto'
+                )
 
         # Limpiar sesión
         if 'cuento_id' in request.session:
@@ -63,6 +70,26 @@ def generated_story_view(request, cuento_id):
         return redirect('stories:generar')
 
 
+def _formulario_generar(request, status=200):
+    """Formulario de generación con su clave de idempotencia.
+
+    Cada formulario mostrado lleva una clave nueva; si se vuelve a mostrar tras
+    un error se conserva la enviada, porque ese envío no creó nada.
+    """
+    return render(request, 'stories/generar.html', {
+        'perfiles': Perfil.objects.filter(usuario=request.user),
+        'clave_idempotencia': request.POST.get('clave_idempotencia') or uuid.uuid4().hex,
+    }, status=status)
+
+
+def _mostrar_trabajo(request, trabajo):
+    """Reenvío del mismo formulario (doble clic, reintento del navegador): el cuento ya encolado"""
+    logger.info(f"Reenvío del formulario: se devuelve el cuento {trabajo.cuento_id}")
+    request.session['datos_generacion'] = trabajo.datos_formulario
+    request.session['cuento_id'] = trabajo.cuento_id
+    return redirect('stories:generando')
+
+
 @login_required
 def generar_cuento_view(request):
     """Vista para el formulario de generación de cuentos"""
@@ -95,27 +122,26 @@ def generar_cuento_view(request):
             # Validaciones básicas
             if not datos_formulario['personaje_principal']:
                 messages.error(request, 'El personaje principal es requerido.')
-                return render(request, 'stories/generar.html', {
-                    'perfiles': Perfil.objects.filter(usuario=request.user)
-                })
+                return _formulario_generar(request)
 
             if not datos_formulario['tema']:
                 messages.error(request, 'Debes seleccionar un tema.')
-                return render(request, 'stories/generar.html', {
-                    'perfiles': Perfil.objects.filter(usuario=request.user)
-                })
+                return _formulario_generar(request)
 
             if not datos_formulario['edad']:
                 messages.error(request, 'Debes seleccionar la edad del niño.')
-                return render(request, 'stories/generar.html', {
-                    'perfiles': Perfil.objects.filter(usuario=request.user)
-                })
+                return _formulario_generar(request)
 
             if not datos_formulario['longitud']:
                 messages.error(request, 'Debes seleccionar la longitud del cuento.')
-                return render(request, 'stories/generar.html', {
-                    'perfiles': Perfil.objects.filter(usuario=request.user)
-                })
+                return _formulario_generar(request)
+
+            # Mismo formulario enviado otra vez: el cuento que ya se está generando
+            clave = request.POST.get('clave_idempotencia') or request.headers.get('Idempotency-Key', '')
+            huella = huella_idempotencia(clave.strip()[:100], datos_formulario, perfil_id)
+            existente = trabajo_idempotente(request.user.id, huella)
+            if existente:
+                return _mostrar_trabajo(request, existente)
 
             # Guardar nuevos datos en el perfil si está marcado
             if guardar_datos and perfil_id:
@@ -142,6 +168,20 @@ def generar_cuento_view(request):
                 except Perfil.DoesNotExist:
                     pass
 
+            # Contrapresión: no encolar lo que OpenAI no va a poder atender a tiempo
+            try:
+                comprobar_admision(request.user.id)
+            except PlanificadorSaturado as e:
+                minutos = max(1, round(e.retry_after / 60))
+                if e.motivo == 'usuario':
+                    messages.error(request, 'Ya tienes varios cuentos generándose. Espera a que terminen para crear otro.')
+                else:
+                    messages.error(request, f'Hay muchos cuentos generándose en este momento. '
+                                            f'Inténtalo en unos {minutos} minuto{"s" if minutos != 1 else ""}.')
+                response = _formulario_generar(request, status=429)
+                response['Retry-After'] = str(e.retry_after)
+                return response
+
             # Obtener el perfil si existe
             perfil = None
             if perfil_id:
@@ -150,54 +190,15 @@ def generar_cuento_view(request):
                 except Perfil.DoesNotExist:
                     perfil = None
 
-            # Crear el cuento en estado "generando" SIN guardarlo en biblioteca
-            cuento = Cuento.objects.create(
-                usuario=request.user,
-                perfil=perfil,
-                titulo=datos_formulario['titulo'] or 'Cuento Mágico',
-                personaje_principal=datos_formulario['personaje_principal'],
-                tema=datos_formulario['tema'],
-                edad=datos_formulario['edad'],
-                longitud=datos_formulario['longitud'],
-                estado='generando',
-                en_biblioteca=False  # NO guardarlo automáticamente
-            )
-
-            logger.info(f"Cuento creado con ID: {cuento.id} para usuario: {request.user.username}")
-
-            # Iniciar generación inmediatamente en background
-            def generar_en_background():
-                try:
-                    logger.info(f"Iniciando generacion de cuento ID: {cuento.id}")
-
-                    titulo, contenido, moraleja, imagen_url, imagen_prompt = openai_service.generar_cuento_completo(
-                        datos_formulario, user=request.user)
-
-                    # Actualizar el cuento
-                    cuento.titulo = titulo
-                    cuento.contenido = contenido
-                    cuento.moraleja = moraleja
-                    cuento.imagen_url = imagen_url
-                    cuento.imagen_prompt = imagen_prompt
-                    cuento.estado = 'completado'
-
-                    # Calcular tiempo estimado de lectura
-                    palabras = len(contenido.split())
-                    cuento.tiempo_lectura_estimado = max(60, (palabras / 200) * 60)
-
-                    cuento.save()
-
-                    logger.info(f"Cuento generado exitosamente: {titulo}")
-
-                except Exception as e:
-                    logger.error(f"Error generando cuento en background: {str(e)}")
-                    cuento.estado = 'error'
-                    cuento.save()
-
-            # Iniciar thread
-            thread = threading.Thread(target=generar_en_background)
-            thread.daemon = True
-            thread.start()
+            # Crear el cuento y su trabajo en la misma transacción
+            try:
+                cuento = _crear_y_encolar(request, perfil, datos_formulario, huella)
+            except IntegrityError:
+                # Otro envío con la misma clave ganó la carrera; este no deja nada creado
+                existente = trabajo_idempotente(request.user.id, huella)
+                if not existente:
+                    raise
+                return _mostrar_trabajo(request, existente)
 
             # Guardar datos en sesión y redirigir
             request.session['datos_generacion'] = datos_formulario
@@ -208,15 +209,34 @@ def generar_cuento_view(request):
         except Exception as e:
             logger.error(f"Error en generar_cuento_view: {str(e)}")
             messages.error(request, 'Ocurrió un error al procesar tu solicitud. Inténtalo de nuevo.')
-            return render(request, 'stories/generar.html', {
-                'perfiles': Perfil.objects.filter(usuario=request.user)
-            })
+            return _formulario_generar(request)
 
     # GET request - mostrar formulario
-    perfiles = Perfil.objects.filter(usuario=request.user)
-    return render(request, 'stories/generar.html', {
-        'perfiles': perfiles
-    })
+    return _formulario_generar(request)
+
+
+def _crear_y_encolar(request, perfil, datos_formulario, huella):
+    """Cuento en estado "generando" y su trabajo, en la misma transacción"""
+    with transaction.atomic():
+        # Crear el cuento en estado "generando" SIN guardarlo en biblioteca
+        cuento = Cuento.objects.create(
+            usuario=request.user,
+            perfil=perfil,
+            titulo=datos_formulario['titulo'] or 'Cuento Mágico',
+            personaje_principal=datos_formulario['personaje_principal'],
+            tema=datos_formulario['tema'],
+            edad=datos_formulario['edad'],
+            longitud=datos_formulario['longitud'],
+            idioma=UserSettings.idioma_de(request.user),
+            estado='generando',
+            en_biblioteca=False  # NO guardarlo automáticamente
+        )
+
+        logger.info(f"Cuento creado con ID: {cuento.id} para usuario: {request.user.username}")
+
+        # Encolar la generación; los workers (run_generation_workers) la procesan
+        encolar_generacion(cuento, datos_formulario, clave_idempotencia=huella)
+    return cuento
 
 
 @login_required
@@ -261,26 +281,117 @@ def generando_cuento_view(request):
         return redirect('stories:generar')
 
 
+def _entero(valor, default):
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return default
+
+
+# Estado, long-poll y SSE son vistas async: bajo ASGI cada petición esperando
+# al worker es una corrutina en lugar de un hilo ocupado. Bajo WSGI Django
+# ejecuta la vista en un hilo con async_to_sync, pero un StreamingHttpResponse
+# con un iterador async se consumiría entero antes de enviar nada, así que el
+# SSE usa allí un generador síncrono (_eventos_cuento_sync).
+
+def _consulta_estado(cuento_id, usuario_id):
+    return Cuento.objects.filter(id=cuento_id, usuario_id=usuario_id).only(
+        'estado', 'titulo', 'contenido', 'imagen_estado', 'imagen_url', 'imagen_lectura')
+
+
+def _sembrar_desde_cuento(cuento, cuento_id, usuario_id, version):
+    if cuento is None:
+        raise Http404("Cuento no encontrado")
+    estado = notifications.sembrar(
+        cuento_id, cuento.estado, usuario_id, cuento.titulo, cuento.contenido,
+        imagen_estado=cuento.imagen_estado, imagen_url=cuento.url_imagen_lectura,
+    )
+    estado['version'] = version
+    return estado
+
+
+async def _estado_desde_bd(cuento_id, usuario_id, version=0):
+    """Lectura de respaldo cuando nadie ha publicado el estado del cuento"""
+    cuento = await _consulta_estado(cuento_id, usuario_id).afirst()
+    return _sembrar_desde_cuento(cuento, cuento_id, usuario_id, version)
+
+
+def _estado_desde_bd_sync(cuento_id, usuario_id, version=0):
+    """_estado_desde_bd() para el generador SSE síncrono (WSGI)"""
+    cuento = _consulta_estado(cuento_id, usuario_id).first()
+    return _sembrar_desde_cuento(cuento, cuento_id, usuario_id, version)
+
+
+async def _estado_publicado(usuario_id, cuento_id):
+    """Estado del registro de notificaciones; solo va a la base de datos si no hay ninguno"""
+    estado = await notifications.estado_actual_async(cuento_id)
+    if estado and estado.get('usuario_id') is not None:
+        if estado['usuario_id'] != usuario_id:
+            raise Http404("Cuento no encontrado")
+        return estado
+    return await _estado_desde_bd(cuento_id, usuario_id)
+
+
+async def _esperar_estado(usuario_id, cuento_id, estado, timeout):
+    """Espera un cambio publicado; si no llega ninguno, comprueba una vez la base de datos"""
+    nuevo = await notifications.esperar_cambio_async(cuento_id, estado['version'], timeout)
+    if nuevo and nuevo['version'] > estado['version']:
+        return nuevo
+
+    # Cubre cambios hechos sin publicar (admin, caché reiniciada...)
+    return _elegir_respaldo(estado, await _estado_desde_bd(cuento_id, usuario_id, estado['version']))
+
+
+def _esperar_estado_sync(usuario_id, cuento_id, estado, timeout):
+    """_esperar_estado() bloqueando el hilo (generador SSE bajo WSGI)"""
+    nuevo = notifications.esperar_cambio(cuento_id, estado['version'], timeout)
+    if nuevo and nuevo['version'] > estado['version']:
+        return nuevo
+    return _elegir_respaldo(estado, _estado_desde_bd_sync(cuento_id, usuario_id, estado['version']))
+
+
+def _elegir_respaldo(estado, respaldo):
+    if (respaldo['estado'], respaldo['imagen_estado']) != (estado['estado'], estado.get('imagen_estado')):
+        return respaldo
+    return estado
+
+
+def _respuesta_estado(cuento_id, estado):
+    return {
+        'estado': estado['estado'],
+        'completado': estado['estado'] == 'completado',
+        'error': estado['estado'] == 'error',
+        'titulo': estado['titulo'],
+        'imagen_estado': estado.get('imagen_estado', 'lista'),
+        'imagen_url': estado.get('imagen_url'),
+        'version': estado['version'],
+        'url': reverse('stories:generated_story', args=[cuento_id]),
+        'retry_after': notifications.intervalo_reintento(),
+    }
+
+
 @login_required
-def check_cuento_status(request, cuento_id):
-    """Vista AJAX para verificar el estado del cuento"""
+async def check_cuento_status(request, cuento_id):
+    """Vista AJAX para verificar el estado del cuento.
+
+    Con `?version=N` funciona como long-poll: la respuesta se retiene hasta que
+    el worker publica un estado más nuevo que N (texto o imagen) o vence el
+    timeout. `retry_after` indica al cliente cuánto esperar antes de la siguiente
+    petición.
+    """
     try:
-        cuento = get_object_or_404(Cuento, id=cuento_id, usuario=request.user)
+        usuario = await request.auser()
+        estado = await _estado_publicado(usuario.id, cuento_id)
+        version = _entero(request.GET.get('version'), None)
+        maximo = getattr(settings, 'STORY_LONGPOLL_TIMEOUT', 25)
 
-        logger.info(f"Verificando estado del cuento {cuento_id}: {cuento.estado}")
+        if (version is not None and estado['version'] <= version
+                and not notifications.es_definitivo(estado)
+                and notifications.admite_espera(asincrona=True)):
+            timeout = max(0, min(_entero(request.GET.get('timeout'), maximo), maximo))
+            estado = await _esperar_estado(usuario.id, cuento_id, dict(estado, version=version), timeout)
 
-        return JsonResponse({
-            'estado': cuento.estado,
-            'completado': cuento.estado == 'completado',
-            'error': cuento.estado == 'error',
-            'titulo': cuento.titulo,
-            'debug_info': {
-                'cuento_id': cuento.id,
-                'usuario': cuento.usuario.username,
-                'fecha_creacion': cuento.fecha_creacion.isoformat(),
-                'contenido_length': len(cuento.contenido) if cuento.contenido else 0
-            }
-        })
+        return JsonResponse(_respuesta_estado(cuento_id, estado))
 
     except Exception as e:
         logger.error(f"Error verificando estado del cuento {cuento_id}: {str(e)}")
@@ -292,6 +403,94 @@ def check_cuento_status(request, cuento_id):
         })
 
 
+def _evento_sse(evento, datos, evento_id=None):
+    mensaje = f"event: {evento}\n"
+    if evento_id is not None:
+        mensaje += f"id: {evento_id}\n"
+    return mensaje + f"data: {json.dumps(datos)}\n\n"
+
+
+def _eventos_nuevos(cuento_id, estado, enviado):
+    """Eventos SSE de `estado` que aún no se enviaron; `enviado` lleva el título y los párrafos ya enviados"""
+    eventos = []
+    if estado['titulo'] and estado['titulo'] != enviado['titulo']:
+        enviado['titulo'] = estado['titulo']
+        eventos.append(_evento_sse('titulo', {'titulo': estado['titulo']}))
+
+    parrafos = estado['parrafos']
+    for indice in range(enviado['parrafos'], len(parrafos)):
+        eventos.append(_evento_sse('parrafo', {'indice': indice, 'texto': parrafos[indice]}, evento_id=indice + 1))
+    enviado['parrafos'] = max(enviado['parrafos'], len(parrafos))
+
+    if estado['estado'] in notifications.ESTADOS_FINALES:
+        eventos.append(_evento_sse('estado', _respuesta_estado(cuento_id, estado)))
+    return eventos
+
+
+def _plazos_stream():
+    """(límite de la conexión, tramo de cada espera)"""
+    return (time.monotonic() + getattr(settings, 'STORY_STREAM_MAX_SECONDS', 120),
+            getattr(settings, 'STORY_LONGPOLL_TIMEOUT', 25))
+
+
+async def _eventos_cuento(usuario_id, cuento_id, estado, parrafos_enviados=0):
+    """Generador SSE: envía el título y cada párrafo nuevo a medida que se publican"""
+    limite, tramo = _plazos_stream()
+    enviado = {'titulo': None, 'parrafos': parrafos_enviados}
+
+    # Intervalo de reconexión negociado con la carga actual del proceso
+    yield f"retry: {notifications.intervalo_reintento()}\n\n"
+
+    while True:
+        for evento in _eventos_nuevos(cuento_id, estado, enviado):
+            yield evento
+        if estado['estado'] in notifications.ESTADOS_FINALES:
+            return
+
+        restante = limite - time.monotonic()
+        if restante <= 0:
+            return
+        estado = await _esperar_estado(usuario_id, cuento_id, estado, min(tramo, restante))
+
+
+def _eventos_cuento_sync(usuario_id, cuento_id, estado, parrafos_enviados=0):
+    """_eventos_cuento() como generador síncrono: bajo WSGI cada evento sale en cuanto se publica"""
+    limite, tramo = _plazos_stream()
+    enviado = {'titulo': None, 'parrafos': parrafos_enviados}
+
+    yield f"retry: {notifications.intervalo_reintento()}\n\n"
+
+    while True:
+        yield from _eventos_nuevos(cuento_id, estado, enviado)
+        if estado['estado'] in notifications.ESTADOS_FINALES:
+            return
+
+        restante = limite - time.monotonic()
+        if restante <= 0:
+            return
+        estado = _esperar_estado_sync(usuario_id, cuento_id, estado, min(tramo, restante))
+
+
+@login_required
+async def stream_cuento(request, cuento_id):
+    """Server-Sent Events con el progreso del cuento mientras se genera"""
+    usuario = await request.auser()
+    estado = await _estado_publicado(usuario.id, cuento_id)
+
+    # Last-Event-ID permite reanudar sin repetir párrafos tras una reconexión
+    parrafos_enviados = _entero(request.headers.get('Last-Event-ID'), 0)
+
+    # Bajo ASGI el stream es una corrutina; bajo WSGI, un generador que ocupa el hilo de la petición
+    eventos = _eventos_cuento if isinstance(request, ASGIRequest) else _eventos_cuento_sync
+    response = StreamingHttpResponse(
+        eventos(usuario.id, cuento_id, estado, parrafos_enviados),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 @login_required
 def descargar_pdf_view(request, cuento_id):
     """Vista para descargar el cuento en PDF - VERSIÓN COMPLETAMENTE CORREGIDA"""
@@ -317,21 +516,12 @@ def descargar_pdf_view(request, cuento_id):
 
         logger.info(f"✅ Cuento válido para descarga - Contenido: {len(cuento.contenido)} caracteres")
 
-        # Generar PDF
+        # PDF desde la caché en disco (solo se genera si el cuento cambió)
         try:
-            logger.info(f"📄 Generando PDF para: {cuento.titulo}")
-            pdf_buffer = generar_pdf_cuento(cuento)
-
-            if not pdf_buffer:
-                raise Exception("PDF buffer is None")
-
-            pdf_content = pdf_buffer.getvalue()
-
-            if not pdf_content:
-                raise Exception("PDF content is empty")
-
-            logger.info(f"✅ PDF generado exitosamente, tamaño: {len(pdf_content)} bytes")
-
+            response = respuesta_pdf(request, cuento)
+        except RenderSaturado as saturado:
+            logger.warning(f"⚠️ {str(saturado)}")
+            return respuesta_saturado(saturado)
         except Exception as pdf_error:
             logger.error(f"❌ Error generando PDF: {str(pdf_error)}")
             import traceback
@@ -339,40 +529,21 @@ def descargar_pdf_view(request, cuento_id):
             messages.error(request, 'Error al generar el archivo PDF.')
             return redirect('stories:generated_story', cuento_id=cuento_id)
 
-        # Crear respuesta HTTP con headers correctos para FORZAR DESCARGA
-        response = HttpResponse(pdf_content, content_type='application/pdf')
-
-        # Nombre de archivo seguro (sin caracteres especiales)
-        titulo_limpio = cuento.titulo.replace(' ', '_').replace('/', '_').replace('\\', '_')
-        titulo_limpio = ''.join(c for c in titulo_limpio if c.isalnum() or c in ['_', '-'])
-        filename = f"CuentIA_{titulo_limpio}.pdf"
-
-        # Headers CRÍTICOS para forzar descarga
-        response['Content-Disposition'] = f'attachment; filename="{filename}"'
-        response['Content-Type'] = 'application/pdf'
-        response['Content-Length'] = len(pdf_content)
-        response['Cache-Control'] = 'no-cache, no-store, must-revalidate, private'
-        response['Pragma'] = 'no-cache'
-        response['Expires'] = '0'
-
-        # Headers adicionales para asegurar descarga
-        response['X-Content-Type-Options'] = 'nosniff'
-        response['Content-Transfer-Encoding'] = 'binary'
-
-        # Registrar estadística de descarga
-        try:
-            EstadisticaLectura.objects.create(
-                usuario=request.user,
-                cuento=cuento,
-                perfil=cuento.perfil,
-                tipo_lectura='descarga'
-            )
-            logger.info(f"📊 Estadística de descarga registrada para cuento {cuento_id}")
-        except Exception as stats_error:
-            logger.warning(f"⚠️ Error registrando estadística de descarga: {str(stats_error)}")
-
-        logger.info(f"🎉 PDF listo para descarga: {filename}")
-        logger.info(f"🎉 Headers de respuesta: {dict(response.items())}")
+        # Registrar estadística de descarga (un 304 es una revalidación, no una descarga)
+        if response.status_code == 200:
+            try:
+                with transaction.atomic():
+                    EstadisticaLectura.objects.create(
+                        usuario=request.user,
+                        cuento=cuento,
+                        perfil=cuento.perfil,
+                        tipo_lectura='descarga'
+                    )
+                logger.info(f"📊 Estadística de descarga registrada para cuento {cuento_id}")
+            except Exception as stats_error:
+                logger.warning(f"⚠️ Error registrando estadística de descarga: {str(stats_error)}")
+
+        logger.info(f"🎉 PDF listo para descarga (HTTP {response.status_code})")
 
         return response
 
@@ -421,16 +592,15 @@ def guardar_biblioteca_view(request, cuento_id):
                 'message': f'El cuento "{cuento.titulo}" ya está en tu biblioteca.'
             })
 
-        # Guardar en biblioteca
-        cuento.guardar_en_biblioteca()
-
-        # Registrar estadística
-        EstadisticaLectura.objects.create(
-            usuario=request.user,
-            cuento=cuento,
-            perfil=cuento.perfil,
-            tipo_lectura='biblioteca'
-        )
+        # Guardar en biblioteca y registrar estadística (misma transacción que el rollup diario)
+        with transaction.atomic():
+            cuento.guardar_en_biblioteca()
+            EstadisticaLectura.objects.create(
+                usuario=request.user,
+                cuento=cuento,
+                perfil=cuento.perfil,
+                tipo_lectura='biblioteca'
+            )
 
         logger.info(f"Cuento guardado en biblioteca: {cuento.titulo} por {request.user.username}")
 
@@ -473,10 +643,12 @@ def eliminar_cuento(request, cuento_id):
 
 
 @login_required
-def obtener_contenido_cuento(request, cuento_id):
+async def obtener_contenido_cuento(request, cuento_id):
     """Vista para obtener el contenido de un cuento para reproducción"""
     try:
-        cuento = get_object_or_404(Cuento, id=cuento_id, usuario=request.user)
+        usuario = await request.auser()
+        cuento = await aget_object_or_404(
+            Cuento.objects.only('titulo', 'contenido'), id=cuento_id, usuario_id=usuario.id)
 
         return JsonResponse({
             'success': True,
@@ -238,7 +238,7 @@ class ProfileUpdateForm(forms.ModelForm):
 class SettingsUpdateForm(forms.ModelForm):
     class Meta:
         model = UserSettings
-        fields = ['avatar', 'email_notifications', 'dark_mode', 'language']
+        fields = ['avatar', 'email_notifications', 'dark_mode', 'language', 'reutilizar_cuentos']
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0009_perfil_foto_perfil'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usersettings',
+            name='reutilizar_cuentos',
+            field=models.BooleanField(default=True),
+        ),
+    ]
@@ -86,12 +86,19 @@ class UserSettings(models.Model):
     email_notifications = models.BooleanField(default=True)
     dark_mode = models.BooleanField(default=False)
     language = models.CharField(max_length=2, choices=LANGUAGE_CHOICES, default='es')
+    # Con False nunca se sirven cuentos guardados por contenido ni se guardan los suyos (stories/result_cache.py)
+    reutilizar_cuentos = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"Configuraciones de {self.user.username}"
 
+    @classmethod
+    def idioma_de(cls, user):
+        """Idioma configurado por el usuario ('es' si no tiene configuración)"""
+        return cls.objects.filter(user=user).values_list('language', flat=True).first() or 'es'
+
 
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
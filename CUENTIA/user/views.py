@@ -401,6 +401,10 @@ def update_preferences(request):
                 settings_obj.dark_mode = data['dark_mode']
                 logger.info(f"🌙 Dark mode: {data['dark_mode']}")
 
+            if 'reutilizar_cuentos' in data:
+                settings_obj.reutilizar_cuentos = bool(data['reutilizar_cuentos'])
+                logger.info(f"♻️ Reutilizar cuentos: {settings_obj.reutilizar_cuentos}")
+
             if 'language' in data:
                 nuevo_idioma = data['language']
                 idiomas_validos = ['es', 'en', 'de', 'fr']